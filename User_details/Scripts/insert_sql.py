@@ -3,14 +3,48 @@
 This script can be executed as a program or imported for its `csv_to_table` mapping.
 When imported, it will NOT perform any side-effects (DB writes) due to the
 `if __name__ == '__main__'` guard below.
+
+Each CSV is read once (read_csv_source): the file is memory-mapped, hashed,
+its encoding picked from the bytes and decoded in one go, and the validation
+pass and the load share that result. Rows are streamed into the table with
+executemany() in batches of IMPORT_BATCH_SIZE; the header-to-column mapping
+(ColumnPlan), the table schemas and the last_updated stamp are worked out
+once per file / import.
+
+By default every mapped table is cleared and reloaded. With --diff (or
+EPOS_IMPORT_MODE=diff) each CSV is matched against its table on NATURAL_KEYS
+and only inserted, updated and deleted rows are written (diff_csv); a feed
+that changes nothing writes nothing and leaves the catalog version alone.
+A diff import also skips any CSV whose bytes match the last import's
+(see _load_digests), so re-sending an unchanged feed is close to free.
+
+Either way the rows are first loaded into shadow tables in a scratch database
+attached next to the till's (SHADOW_SCHEMA), checked there (check_shadow: row
+counts, REQUIRED_TABLES, SHADOW_LINKS) and only then swapped in by one short
+write transaction. Tills keep reading the old catalog and submitting orders
+while the CSVs load; they wait only for the swap, and never see a table half
+loaded or emptied.
 """
 
 import sqlite3
+import codecs
 import csv
 import dotenv
+import hashlib
+import io
+import json
+import mmap
 import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
 from datetime import datetime
+from itertools import islice
 from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, TextIO, Tuple
 
 BASE_DIR = Path(__file__).resolve().parent.parent.parent
 # Explicitly load .env from project root to work in hosted environments
@@ -56,18 +90,472 @@ csv_to_table = {
 }
 
 
-def _run_import():
-    """Execute the CSV import against SQLite with pre-validation and transactional safety."""
+# Rows sent to SQLite per executemany() call
+IMPORT_BATCH_SIZE = int(os.getenv('EPOS_IMPORT_BATCH_SIZE', '5000'))
+# Connection settings for the import: temp B-trees in memory, a 64 MB page cache and
+# fewer fsyncs. They apply to the import's own connection only, so they end with it.
+IMPORT_PRAGMAS = (('temp_store', 'MEMORY'), ('cache_size', '-65536'), ('synchronous', 'NORMAL'))
+CSV_ENCODINGS = ('utf-8-sig', 'utf-8', 'latin-1')
+# Processes parsing CSVs during validation; 0 or 1 parses in the importing process.
+# Writes always stay in the importing process.
+IMPORT_WORKERS = int(os.getenv('EPOS_IMPORT_WORKERS', '0'))
+# "replace" clears and reloads every table; "diff" applies only changed rows (diff_csv)
+IMPORT_MODES = ('replace', 'diff')
+IMPORT_MODE = os.getenv('EPOS_IMPORT_MODE', 'replace')
+# Columns identifying a row across imports, per table, for the diff import. A key that
+# turns out not to be unique in a feed makes that table fall back to a full reload.
+NATURAL_KEYS = {
+    "update_till_PDITEM": ('PRODNUMB',),
+    "update_till_COMBTB": ('COMBONUMB',),
+    "update_till_PDVATTB": ('VAT_CLASS',),
+    "update_till_ACODES": ('PRODNUMB', 'ST_CODENUM'),
+    "update_till_BCODES": ('PRODNUMB', 'ST_CODENUM'),
+    "update_till_COMPPRO": ('COMBONUMB', 'PRODNUMB'),
+    "update_till_OPTPRO": ('COMBONUMB', 'PRODNUMB'),
+    "update_till_PCHOICE": ('PRODNUMB', 'OPT_PRODNUMB'),
+    "update_till_STITEMS": ('CODEALPH', 'ST_CODENUM'),
+    "update_till_APPCOMB": ('COMBONUMB',),
+    "update_till_APPPROD": ('PRODNUMB',),
+    "update_till_GROUPTB": ('GROUP_ID',),
+    "update_till_MISCSEC": ('SEQ_ORDER',),
+    "update_till_COMBEXT": ('COMBONUMB',),
+    "update_till_PRODEXT": ('PRODNUMB',),
+    "update_till_SHOPSTB": ('SHOP_CODE',),
+    "update_till_EPOSPROD": ('PRODNUMB', 'EPOS_GROUP'),
+    "update_till_EPOSGROUP": ('EPOS_GROUP_ID',),
+    "update_till_EPOSFREEPROD": ('PRODNUMB',),
+    "update_till_EPOSCOMBFREEPROD": ('COMBONUMB',),
+    "update_till_EPOSCOMB": ('COMBONUMB', 'EPOS_GROUP'),
+    "update_till_TOPPINGDEL": ('ACODE',),
+    "update_till_EPOSADDONS": ('PRODNUMB',),
+    "update_till_PRICEBAND": ('REC_ID',),
+    "update_till_ESTOCK": ('CODEALPH', 'ST_CODENUM'),
+}
+# Schema name of the scratch database each import is loaded into before the swap
+SHADOW_SCHEMA = 'shadow'
+# Tables a till cannot sell from when empty; an import that would empty one is refused
+REQUIRED_TABLES = ('update_till_PDITEM', 'update_till_COMBTB', 'update_till_PDVATTB')
+# (table, column, referenced table, referenced column): links checked before the swap
+SHADOW_LINKS = (
+    ('update_till_COMPPRO', 'COMBONUMB', 'update_till_COMBTB', 'COMBONUMB'),
+    ('update_till_EPOSPROD', 'PRODNUMB', 'update_till_PDITEM', 'PRODNUMB'),
+)
+# Files whose trailing free-text column may contain unquoted commas: index of that column
+COMBINED_FIELD = {'PROD_EXT.CSV': 4, 'COMB_EXT.CSV': 3}
+
+
+# Where messages go: stdout unless _run_import was given a writer. A context variable
+# rather than a swapped sys.stdout, so imports run from threads keep their own logs.
+_output: ContextVar[Optional[TextIO]] = ContextVar('insert_sql_output', default=None)
+
+
+def _print(*args) -> None:
+    print(*args, file=_output.get() or sys.stdout)
+
+
+def _normalize(s) -> str:
+    return (s or '').strip().lstrip('\ufeff').lower()
+
+
+@dataclass(frozen=True)
+class ColumnPlan:
+    """How one CSV's rows map onto its table, worked out once per file."""
+    file_name: str
+    columns: tuple            # target columns in INSERT order
+    add_id: bool              # prepend a 1-based row id
+    stamp: Optional[str]      # last_updated value appended to every row (None if the CSV has it)
+    combined_at: Optional[int]
+
+    def insert_sql(self, table_name: str) -> str:
+        return f"INSERT OR REPLACE INTO {table_name} ({','.join(self.columns)}) VALUES ({','.join(['?'] * len(self.columns))})"
+
+    def rows(self, reader, mismatches: List[int]) -> Iterator[list]:
+        """Table rows for the CSV's data rows.
+
+        Length mismatches are reported, counted in mismatches[0] and left to SQLite to reject.
+        """
+        width = len(self.columns)
+        combined_at, add_id, stamp = self.combined_at, self.add_id, self.stamp
+        for row_id, row in enumerate(reader, start=1):
+            if combined_at is not None and len(row) > combined_at + 1:
+                row = row[:combined_at] + [','.join(row[combined_at:])]
+            if add_id:
+                row.insert(0, row_id)
+            if stamp is not None:
+                row.append(stamp)
+            if len(row) != width:
+                mismatches[0] += 1
+                _print(f"[ERR] {self.file_name}: row len {len(row)} != header len {width}")
+                _print(f"       Header: {list(self.columns)}")
+                _print(f"       Row: {row}")
+            yield row
+
+
+def column_plan(file_name: str, headers: Sequence[str], table_columns: Sequence[str], stamp: str) -> ColumnPlan:
+    """Align CSV headers with table columns case-insensitively; synthesize id / last_updated when absent."""
+    table_map = {_normalize(c): c for c in table_columns}
+    mapped = [table_map.get(_normalize(h), h) for h in headers]
+    add_id = 'id' in table_columns and 'id' not in mapped
+    if add_id:
+        mapped = ['id'] + mapped
+    add_last_updated = 'last_updated' in table_columns and 'last_updated' not in mapped
+    if add_last_updated:
+        mapped.append('last_updated')
+    return ColumnPlan(file_name, tuple(mapped), add_id, stamp if add_last_updated else None,
+                      COMBINED_FIELD.get(file_name))
+
+
+def _batches(rows: Iterator[list], size: int) -> Iterator[List[list]]:
+    while True:
+        batch = list(islice(rows, size))
+        if not batch:
+            return
+        yield batch
+
+
+@dataclass(frozen=True)
+class CsvSource:
+    """One CSV file read once: its encoding (from the bytes), digest, header row and text.
+
+    `parsed` holds the data rows instead of `text` when the file was parsed in a
+    worker process (read_csv_sources with workers > 1).
+    """
+    file_name: str
+    encoding: str
+    sha256: str
+    headers: Optional[tuple]  # None for an empty file
+    text: str = ''
+    parsed: Optional[list] = None
+
+    def rows(self) -> Iterator[list]:
+        """The data rows (everything after the header)."""
+        if self.parsed is not None:
+            return iter(self.parsed)
+        reader = csv.reader(io.StringIO(self.text, newline=''))
+        next(reader, None)
+        return reader
+
+
+def _decode(data) -> Tuple[str, str]:
+    """(encoding, text) for a buffer: UTF-8 with BOM, else UTF-8, else latin-1 (CSV_ENCODINGS order).
+
+    The UTF-8 check is the decode itself, so valid files are decoded exactly once.
+    """
+    if data[:3] == codecs.BOM_UTF8:
+        return 'utf-8-sig', str(data[3:], 'utf-8')
+    try:
+        return 'utf-8', str(data, 'utf-8')
+    except UnicodeDecodeError:
+        return 'latin-1', str(data, 'latin-1')
+
+
+def read_csv_source(path: Path, parse: bool = False) -> CsvSource:
+    """Memory-map `path`, hash it, detect its encoding and decode it, all in one read.
+
+    With `parse` the data rows are parsed into a list here (for worker processes:
+    the list pickles back to the importer, the text does not need to).
+    """
+    with open(path, 'rb') as fh:
+        if os.fstat(fh.fileno()).st_size == 0:
+            return CsvSource(path.name, CSV_ENCODINGS[0], hashlib.sha256().hexdigest(), None)
+        with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            digest = hashlib.sha256(view).hexdigest()
+            encoding, text = _decode(view)
+    reader = csv.reader(io.StringIO(text, newline=''))
+    headers = next(reader, None)
+    source = CsvSource(path.name, encoding, digest, tuple(headers) if headers is not None else None, text)
+    if parse:
+        source = CsvSource(source.file_name, encoding, digest, source.headers, parsed=list(reader))
+    return source
+
+
+def read_csv_sources(paths: Sequence[Path], workers: int = 0) -> List[CsvSource]:
+    """read_csv_source for every path, in order; parsed in a process pool when workers > 1."""
+    if workers <= 1 or len(paths) <= 1:
+        return [read_csv_source(p) for p in paths]
+    with ProcessPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return list(pool.map(read_csv_source, paths, [True] * len(paths)))
+
+
+def load_csv(cursor, file_path: Path, table_name: str, table_columns: Sequence[str], stamp: str,
+             batch_size: int = IMPORT_BATCH_SIZE, into: Optional[str] = None,
+             source: Optional[CsvSource] = None) -> Optional[int]:
+    """Stream one CSV into its table with executemany() in batches of `batch_size` rows.
+
+    `into` loads the rows into another table with the same columns (the diff
+    import's shadow or staging table); `source` is the file as already read by the
+    validation pass. Returns the number of rows loaded, None on failure.
+    """
+    file_name = file_path.name
+    if source is None and not file_path.exists():
+        _print(f"[MISS] {file_name} not found; skipping")
+        return None
+    if not table_columns:
+        _print(f"[WARN] {table_name} has no schema info; skipped")
+        return None
+    try:
+        source = source or read_csv_source(file_path)
+        if source.headers is None:
+            _print(f"[EMPTY] {file_name}")
+            return None
+        plan = column_plan(file_name, source.headers, table_columns, stamp)
+        insert_sql = plan.insert_sql(into or table_name)
+        row_count = 0
+        mismatches = [0]
+        for batch in _batches(plan.rows(source.rows(), mismatches), batch_size):
+            cursor.executemany(insert_sql, batch)
+            row_count += len(batch)
+    except Exception as e:
+        _print(f"[FAIL] {file_name}: {e}")
+        return None
+    _print(f"[OK] {file_name} -> {into or table_name} ({source.encoding}) rows={row_count} mismatches={mismatches[0]}")
+    return row_count
+
+
+@dataclass
+class TableChanges:
+    """What an import did to one table."""
+    inserted: int = 0
+    updated: int = 0
+    deleted: int = 0
+    moved: int = 0            # kept rows whose id (CSV row position) changed
+    unchanged: int = 0
+    reloaded: bool = False    # cleared and reinserted rather than diffed
+
+    @property
+    def changed(self) -> bool:
+        return bool(self.reloaded or self.inserted or self.updated or self.deleted or self.moved)
+
+    def summary(self) -> str:
+        mode = 'reloaded' if self.reloaded else 'diff'
+        return (f"{mode} +{self.inserted} ~{self.updated} -{self.deleted} "
+                f"moved={self.moved} unchanged={self.unchanged}")
+
+
+def _has_duplicate_keys(cursor, table: str, key: Sequence[str]) -> bool:
+    cols = ','.join(key)
+    return cursor.execute(f"SELECT 1 FROM {table} GROUP BY {cols} HAVING COUNT(*) > 1 LIMIT 1").fetchone() is not None
+
+
+def _index_staged(cursor, staging: str, table_name: str) -> None:
+    """Index a staging table (schema.name) on its table's natural key, if it has one."""
+    key = NATURAL_KEYS.get(table_name)
+    if key:
+        schema, name = staging.split('.', 1)
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.{name}__key ON {name} ({','.join(key)})")
+
+
+def apply_staged(cursor, staging: str, table_name: str, table_columns: Sequence[str], stamp: str) -> TableChanges:
+    """Bring a table in line with the rows in `staging` as inserts / updates / deletes matched on NATURAL_KEYS.
+
+    `staging` (schema.name) has the table's columns, so its values carry the same
+    column affinity. Only inserted and updated rows get the import's last_updated.
+    Ids stay equal to the CSV row position, as after a full reload, because the
+    catalog reads rows in id order: rows that merely moved are relabelled (via
+    negative ids, to keep the key unique) without touching their content. Tables
+    without a natural key, or with a key that is not unique in the staged rows
+    or the table, are reloaded instead.
+    """
+    key = NATURAL_KEYS.get(table_name)
+    data = [c for c in table_columns if c not in ('id', 'last_updated')]
+    if not key or _has_duplicate_keys(cursor, staging, key) or _has_duplicate_keys(cursor, f"main.{table_name}", key):
+        changes = TableChanges(deleted=cursor.execute(f"DELETE FROM main.{table_name}").rowcount, reloaded=True)
+        cursor.execute(f"INSERT INTO main.{table_name} SELECT * FROM {staging}")
+        changes.inserted = cursor.rowcount
+        return changes
+
+    _index_staged(cursor, staging, table_name)
+    same_key = ' AND '.join(f"t.{k} IS s.{k}" for k in key)
+    differs = ' OR '.join(f"t.{c} IS NOT s.{c}" for c in data if c not in key) or '0'
+    assignments = [f"{c} = s.{c}" for c in data]
+    params: tuple = ()
+    if 'last_updated' in table_columns:
+        assignments.append("last_updated = ?")
+        params = (stamp,)
+    changes = TableChanges()
+    changes.deleted = cursor.execute(
+        f"DELETE FROM main.{table_name} AS t WHERE NOT EXISTS (SELECT 1 FROM {staging} AS s WHERE {same_key})").rowcount
+    changes.updated = cursor.execute(
+        f"UPDATE main.{table_name} AS t SET {', '.join(assignments)} "
+        f"FROM {staging} AS s WHERE {same_key} AND ({differs})", params).rowcount
+    if 'id' in table_columns:
+        changes.moved = cursor.execute(
+            f"UPDATE main.{table_name} AS t SET id = -s.id FROM {staging} AS s WHERE {same_key} AND t.id IS NOT s.id").rowcount
+        cursor.execute(f"UPDATE main.{table_name} SET id = -id WHERE id < 0")
+    total = cursor.execute(f"SELECT COUNT(*) FROM {staging}").fetchone()[0]
+    # Staged rows whose key the table lacks are new. The matched set is joined from the
+    # table side so SQLite probes the staging index rather than scanning the table per row.
+    changes.inserted = cursor.execute(
+        f"INSERT INTO main.{table_name} SELECT * FROM {staging} WHERE rowid NOT IN "
+        f"(SELECT s.rowid FROM main.{table_name} AS t JOIN {staging} AS s ON {same_key})").rowcount
+    changes.unchanged = total - changes.inserted - changes.updated
+    return changes
+
+
+def diff_csv(cursor, file_path: Path, table_name: str, table_columns: Sequence[str], stamp: str,
+             batch_size: int = IMPORT_BATCH_SIZE, source: Optional[CsvSource] = None) -> Optional[TableChanges]:
+    """Apply one CSV to its table with apply_staged, staging it in a temp table first.
+
+    Returns None, leaving the table untouched, if the CSV cannot be read.
+    """
+    staging = f"temp.import_{table_name}"
+    cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+    cursor.execute(f"CREATE TEMP TABLE import_{table_name} AS SELECT * FROM main.{table_name} WHERE 0")
+    try:
+        if load_csv(cursor, file_path, table_name, table_columns, stamp, batch_size, into=staging,
+                    source=source) is None:
+            return None
+        return apply_staged(cursor, staging, table_name, table_columns, stamp)
+    finally:
+        cursor.execute(f"DROP TABLE IF EXISTS {staging}")
+
+
+def _attach_shadow(cursor, db_path: Path) -> Path:
+    """Attach a new, empty scratch database next to `db_path` as SHADOW_SCHEMA; returns its path.
+
+    It only ever holds a copy of this import's rows, so it runs without a journal.
+    """
+    fd, name = tempfile.mkstemp(prefix=db_path.name + '.import-shadow-', dir=db_path.parent)
+    os.close(fd)
+    cursor.execute(f"ATTACH DATABASE ? AS {SHADOW_SCHEMA}", (name,))
+    cursor.execute(f"PRAGMA {SHADOW_SCHEMA}.journal_mode = OFF")
+    cursor.execute(f"PRAGMA {SHADOW_SCHEMA}.synchronous = OFF")
+    return Path(name)
+
+
+def create_shadow(cursor, table_name: str, table_sql: str) -> str:
+    """Create an empty copy of a live table (its CREATE TABLE statement) in the shadow database."""
+    cursor.execute(f"CREATE TABLE {SHADOW_SCHEMA}.{table_name} {table_sql[table_sql.index('('):]}")
+    return f"{SHADOW_SCHEMA}.{table_name}"
+
+
+def check_shadow(cursor, staged: Dict[str, int], existing_tables) -> List[str]:
+    """Problems with the staged catalog; an import with any of them is not swapped in.
+
+    `staged` maps each shadow table to the rows its CSV loaded. Every shadow table
+    must hold all of them (a repeated id would have replaced a row), REQUIRED_TABLES
+    may not end up empty, and every SHADOW_LINKS value must exist in the table it
+    refers to - the shadow copy if one was staged, else the live table.
+    """
+    errors = []
+
+    def rows_of(table: str) -> str:
+        return f"{SHADOW_SCHEMA}.{table}" if table in staged else f"main.{table}"
+
+    for table_name, loaded in staged.items():
+        count = cursor.execute(f"SELECT COUNT(*) FROM {SHADOW_SCHEMA}.{table_name}").fetchone()[0]
+        if count != loaded:
+            errors.append(f"{table_name}: {loaded} rows read but {count} staged (repeated ids)")
+        if count == 0 and table_name in REQUIRED_TABLES:
+            errors.append(f"{table_name}: the import would leave it empty")
+    for table_name, column, ref_table, ref_column in SHADOW_LINKS:
+        if table_name not in staged and ref_table not in staged:
+            continue  # neither side changes
+        if table_name.lower() not in existing_tables or ref_table.lower() not in existing_tables:
+            continue
+        # EXCEPT sorts both sides once; neither column is indexed, so a per-row probe would scan
+        dangling = [r[0] for r in cursor.execute(
+            f"SELECT {column} FROM {rows_of(table_name)} WHERE {column} IS NOT NULL "
+            f"EXCEPT SELECT {ref_column} FROM {rows_of(ref_table)} ORDER BY 1 LIMIT 6")]
+        if dangling:
+            shown = ', '.join(str(v) for v in dangling[:5]) + (', ...' if len(dangling) > 5 else '')
+            errors.append(f"{table_name}.{column} not found in {ref_table}.{ref_column}: {shown}")
+    return errors
+
+
+def _digests_path(db_path: Path) -> Path:
+    return db_path.with_name(db_path.name + '.import-digests.json')
+
+
+def _catalog_version(cursor) -> Optional[int]:
+    """The catalog version (0 before the first bump, as update_till.catalog reads it); None without the table."""
+    try:
+        row = cursor.execute("SELECT version FROM update_till_catalogversion WHERE id = 1").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return int(row[0] or 0) if row else 0
+
+
+def _load_digests(db_path: Path, version: Optional[int]) -> dict:
+    """{file name: {'sha256', 'table', 'rows'}} from the last import, if still trustworthy.
+
+    The digests are recorded with the catalog version the import committed. Any
+    later change to the catalog (another import, an ORM edit to a model in
+    update_till.catalog.CATALOG_MODELS) bumps the version, so digests recorded
+    under an older one are ignored. Edits to the other imported tables do not
+    bump it; a replace import resynchronises those.
+    """
+    try:
+        saved = json.loads(_digests_path(db_path).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+    if version is None or saved.get('version') != version:
+        return {}
+    return saved.get('files') or {}
+
+
+def _save_digests(db_path: Path, version: Optional[int], files: dict) -> None:
+    path = _digests_path(db_path)
+    if version is None:
+        path.unlink(missing_ok=True)
+        return
+    tmp = path.with_name(path.name + '.tmp')
+    tmp.write_text(json.dumps({'version': version, 'files': files}, indent=1, sort_keys=True), encoding='utf-8')
+    os.replace(tmp, path)
+
+
+def _run_import(db_path: Optional[Path] = None, csv_dir: Optional[Path] = None, mapping: Optional[dict] = None,
+                batch_size: int = IMPORT_BATCH_SIZE, debug_dump: bool = True,
+                mode: Optional[str] = None, workers: Optional[int] = None, out: Optional[TextIO] = None,
+                progress: Optional[Callable[[dict], None]] = None) -> Optional[Dict[str, TableChanges]]:
+    """Execute the CSV import against SQLite with pre-validation and transactional safety.
+
+    Defaults to the till database, downloaded_files_dir, csv_to_table, IMPORT_MODE
+    and IMPORT_WORKERS. Each CSV is read once (read_csv_sources) by the validation
+    pass and the same decoded source is handed to the load.
+    Returns the changes per table once committed; None if nothing was applied. A diff
+    import that changes nothing leaves the catalog version alone, so running tills
+    keep their loaded catalog.
+
+    Messages go to `out` (default stdout). `progress`, if given, is called with a
+    dict per step: {'phase': 'validated', 'files': n}; per CSV as it is loaded into
+    its shadow table {'phase': 'staged', 'index', 'total', 'file', 'table',
+    'seconds', 'rows'} (rows is None for a skipped [SAME] file); {'phase':
+    'checked', 'tables': n} once the shadow tables pass check_shadow; per CSV as it
+    is swapped in {'phase': 'table', 'index', 'total', 'file', 'table', 'seconds',
+    'changes'}; then {'phase': 'committed'}. The 'table' events run while the
+    import holds the database write lock, so the callback must not write to the
+    same database.
+    """
+    token = _output.set(out) if out is not None else None
+    try:
+        return _import(db_path, csv_dir, mapping, batch_size, debug_dump, mode, workers, progress or (lambda event: None))
+    finally:
+        if token is not None:
+            _output.reset(token)
+
+
+def _import(db_path, csv_dir, mapping, batch_size, debug_dump, mode, workers,
+            progress: Callable[[dict], None]) -> Optional[Dict[str, TableChanges]]:
+    mode = mode or IMPORT_MODE
+    if mode not in IMPORT_MODES:
+        raise SystemExit(f"Unknown import mode {mode!r}; expected one of {', '.join(IMPORT_MODES)}")
+    db_path = Path(db_path or sql_db_path)
+    csv_dir = csv_dir or downloaded_files_dir
+    mapping = mapping or csv_to_table
     # Basic validation / logging
-    if not downloaded_files_dir.exists():
-        raise SystemExit(f"Downloaded files directory not found: {downloaded_files_dir}")
+    if not csv_dir.exists():
+        raise SystemExit(f"Downloaded files directory not found: {csv_dir}")
 
-    print(f"Using DB: {sql_db_path}")
-    print(f"Using shop number: {shop_number}")
-    print(f"Scanning CSV directory: {downloaded_files_dir}")
+    _print(f"Using DB: {db_path}")
+    _print(f"Using shop number: {shop_number}")
+    _print(f"Import mode: {mode}")
+    _print(f"Scanning CSV directory: {csv_dir}")
 
-    conn = sqlite3.connect(sql_db_path)
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    for name, value in IMPORT_PRAGMAS:
+        cursor.execute(f"PRAGMA {name} = {value}")
 
     # Determine existing tables for warning about missing targets
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
@@ -75,44 +563,43 @@ def _run_import():
 
     # First pass: VALIDATION ONLY (no writes)
     validation_errors: list[str] = []
+    # Column names per table, read once and reused by the load phase
+    table_columns_by_table: dict[str, list[str]] = {}
+
+    # Read every CSV whose table exists once, up front: encoding, digest and header
+    # come from one pass over the file, and the load reuses the decoded source
+    readable = [f for f, t in mapping.items() if (csv_dir / f).exists() and t.lower() in existing_tables]
+    sources: Dict[str, CsvSource] = {}
+    try:
+        sources = dict(zip(readable, read_csv_sources([csv_dir / f for f in readable],
+                                                      IMPORT_WORKERS if workers is None else workers)))
+    except Exception as e:
+        validation_errors.append(f"Cannot read CSV files: {e}")
 
     def validate_csv(file_name: str, table_name: str):
-        file_path = downloaded_files_dir / file_name
+        file_path = csv_dir / file_name
         if not file_path.exists():
             validation_errors.append(f"Missing file: {file_name}")
             return
         if table_name.lower() not in existing_tables:
             validation_errors.append(f"Missing table: {table_name}")
             return
-        # Check headers vs table columns (support BOM by trying utf-8-sig first)
-        headers = None
-        for enc in ('utf-8-sig', 'utf-8', 'latin-1'):
-            try:
-                with open(file_path, newline='', encoding=enc) as csvfile:
-                    reader = csv.reader(csvfile)
-                    try:
-                        headers = next(reader)
-                        break
-                    except StopIteration:
-                        validation_errors.append(f"Empty file: {file_name}")
-                        return
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                # For non-decode errors, report and stop
-                validation_errors.append(f"Cannot read {file_name}: {e}")
-                return
+        source = sources.get(file_name)
+        if source is None:
+            return  # read failure, reported above
+        headers = source.headers
         if headers is None:
-            validation_errors.append(f"Cannot read {file_name}: unsupported encoding")
+            validation_errors.append(f"Empty file: {file_name}")
             return
 
         cursor.execute(f"PRAGMA table_info({table_name})")
         table_columns = [col[1] for col in cursor.fetchall()]
+        table_columns_by_table[table_name] = table_columns
         if not table_columns:
             validation_errors.append(f"No schema for table: {table_name}")
             return
         # Normalize comparison by case-insensitive matching; strip spaces and BOM
-        normalize = lambda s: (s or '').strip().lstrip('\ufeff').lower()
+        normalize = _normalize
         csv_cols_norm = {normalize(h) for h in headers}
         table_cols_norm = {normalize(c) for c in table_columns}
         # If id exists in table, allow missing in CSV (we will synthesize). Likewise for last_updated.
@@ -127,128 +614,147 @@ def _run_import():
             missing_actual = [c for c in table_columns if normalize(c) in missing_required_norm]
             validation_errors.append(f"{file_name}: missing required columns {sorted(missing_actual)} for table {table_name}")
 
-    for file_name, table_name in csv_to_table.items():
+    for file_name, table_name in mapping.items():
         validate_csv(file_name, table_name)
 
     if validation_errors:
-        print("Validation failed. No changes applied.")
+        _print("Validation failed. No changes applied.")
         for err in validation_errors:
-            print(f"[VALIDATION] {err}")
+            _print(f"[VALIDATION] {err}")
         conn.close()
-        return
+        return None
+    progress({'phase': 'validated', 'files': len(mapping)})
 
-    # Transactional import: START TRANSACTION, clear tables, insert data, COMMIT if all succeed; else ROLLBACK
+    # One timestamp for every synthesized last_updated in this import
+    stamp = datetime.now().isoformat(sep=' ', timespec='seconds')
+    # Everything read from the live database before the swap is read outside any
+    # transaction: a read inside the staging transaction would keep a shared lock on
+    # it until that commits, and tills could not commit their orders meanwhile.
+    staged_version = _catalog_version(cursor)
+    known = _load_digests(db_path, staged_version) if mode == 'diff' else {}
+    table_sql = {(name or '').lower(): sql for name, sql in
+                 cursor.execute("SELECT name, sql FROM main.sqlite_master WHERE type = 'table'").fetchall()}
+    shadow_path = _attach_shadow(cursor, db_path)
     try:
+        # Stage: load every CSV into its shadow table. Only the shadow database is
+        # written, so tills keep reading the live catalog and submitting orders.
+        report: Dict[str, TableChanges] = {}
+        staged: Dict[str, int] = {}
+        digests: dict = {}
+        files: Dict[str, str] = {}
+        cursor.execute("BEGIN")
+        for index, (file_name, table_name) in enumerate(mapping.items(), start=1):
+            t0 = time.perf_counter()
+            files[table_name] = file_name
+            source = sources.pop(file_name, None)
+            digest = source.sha256 if source else None
+            step = {'phase': 'staged', 'index': index, 'total': len(mapping), 'file': file_name, 'table': table_name}
+            previous = known.get(file_name) or {}
+            if digest and previous.get('sha256') == digest and previous.get('table') == table_name:
+                report[table_name] = TableChanges(unchanged=previous.get('rows', 0))
+                digests[file_name] = previous
+                _print(f"[SAME] {file_name} unchanged since the last import; skipped")
+                progress({**step, 'seconds': round(time.perf_counter() - t0, 3), 'rows': None})
+                continue
+            shadow = create_shadow(cursor, table_name, table_sql[table_name.lower()])
+            loaded = load_csv(cursor, csv_dir / file_name, table_name, table_columns_by_table[table_name], stamp,
+                              batch_size, into=shadow, source=source)
+            if loaded is None:
+                validation_errors.append(f"{file_name}: could not be loaded")
+            else:
+                staged[table_name] = loaded
+                if mode == 'diff':
+                    _index_staged(cursor, shadow, table_name)
+                if digest:
+                    digests[file_name] = {'sha256': digest, 'table': table_name, 'rows': loaded}
+            progress({**step, 'seconds': round(time.perf_counter() - t0, 3), 'rows': loaded})
+        conn.commit()
+
+        validation_errors += check_shadow(cursor, staged, existing_tables)
+        if validation_errors:
+            _print("Validation failed. No changes applied.")
+            for err in validation_errors:
+                _print(f"[VALIDATION] {err}")
+            return None
+        progress({'phase': 'checked', 'tables': len(staged)})
+
+        # Swap: one short write transaction puts the shadow tables in place. Tills see
+        # the old catalog until it commits and the whole new one after, never a mix.
         cursor.execute("BEGIN IMMEDIATE")
-        # Clear existing data (truncate style) for mapped tables that exist
-        for table_name in set(csv_to_table.values()):
-            if table_name.lower() in existing_tables:
-                cursor.execute(f"DELETE FROM {table_name}")
-                print(f"Cleared table {table_name}")
+        if mode == 'diff' and _catalog_version(cursor) != staged_version:
+            raise RuntimeError("the catalog changed while the import was being staged; run it again")
+        for index, (table_name, file_name) in enumerate(files.items(), start=1):
+            t0 = time.perf_counter()
+            shadow = f"{SHADOW_SCHEMA}.{table_name}"
+            if table_name not in staged:
+                changes = report[table_name]  # [SAME] file
+            elif mode == 'replace':
+                changes = TableChanges(deleted=cursor.execute(f"DELETE FROM main.{table_name}").rowcount,
+                                       reloaded=True)
+                changes.inserted = cursor.execute(f"INSERT INTO main.{table_name} SELECT * FROM {shadow}").rowcount
             else:
-                print(f"[WARN] Table {table_name} does not exist; skipping clear phase")
-
-        # Helper: insert rows from one CSV
-        def load_csv(file_name: str, table_name: str):
-            file_path = downloaded_files_dir / file_name
-            if not file_path.exists():
-                print(f"[MISS] {file_name} not found; skipping")
-                return
-            # Try encodings fallback
-            for encoding in ('utf-8-sig', 'utf-8', 'latin-1'):
-                try:
-                    with open(file_path, newline='', encoding=encoding) as csvfile:
-                        reader = csv.reader(csvfile)
-                        try:
-                            headers = next(reader)
-                        except StopIteration:
-                            print(f"[EMPTY] {file_name}")
-                            return
-                        cursor.execute(f"PRAGMA table_info({table_name})")
-                        table_columns = [col[1] for col in cursor.fetchall()]
-                        if not table_columns:
-                            print(f"[WARN] {table_name} has no schema info; skipped")
-                            return
-                        # Align headers case-insensitively and synthesize optional columns
-                        normalize = lambda s: (s or '').strip().lstrip('\ufeff').lower()
-                        table_map = {normalize(c): c for c in table_columns}
-                        mapped_headers = []
-                        for h in headers:
-                            h_norm = normalize(h)
-                            mapped_headers.append(table_map.get(h_norm, h))
-                        # Inject id if necessary
-                        if 'id' in table_columns and 'id' not in mapped_headers:
-                            mapped_headers = ['id'] + mapped_headers
-                        add_last_updated = 'last_updated' in table_columns and 'last_updated' not in mapped_headers
-                        if add_last_updated:
-                            mapped_headers.append('last_updated')
-                        placeholders = ','.join(['?'] * len(mapped_headers))
-                        insert_sql = f"INSERT OR REPLACE INTO {table_name} ({','.join(mapped_headers)}) VALUES ({placeholders})"
-                        row_count = 0
-                        mismatch_count = 0
-                        id_counter = 1
-                        for row in reader:
-                            # Combined field rules
-                            if file_name == 'PROD_EXT.CSV' and len(row) > 5:
-                                row = row[:4] + [','.join(row[4:])]
-                            if file_name == 'COMB_EXT.CSV' and len(row) > 4:
-                                row = row[:3] + [','.join(row[3:])]
-                            if 'id' in table_columns:
-                                row = [id_counter] + row
-                                id_counter += 1
-                            if add_last_updated:
-                                row.append(datetime.now().isoformat(sep=' ', timespec='seconds'))
-                            if len(row) != len(mapped_headers):
-                                print(f"[ERR] {file_name}: row len {len(row)} != header len {len(mapped_headers)}")
-                                print(f"       Header: {mapped_headers}")
-                                print(f"       Row: {row}")
-                                mismatch_count += 1
-                            cursor.execute(insert_sql, row)
-                            row_count += 1
-                        print(f"[OK] {file_name} -> {table_name} ({encoding}) rows={row_count} mismatches={mismatch_count}")
-                        return  # success; break outer encoding loop
-                except UnicodeDecodeError:
-                    continue
-                except Exception as e:
-                    print(f"[FAIL] {file_name} ({encoding}): {e}")
-                    return
-            print(f"[FAIL] {file_name}: encodings failed")
-
-        # Process all mapped CSVs
-        for file_name, table_name in csv_to_table.items():
-            load_csv(file_name, table_name)
+                changes = apply_staged(cursor, shadow, table_name, table_columns_by_table[table_name], stamp)
+            report[table_name] = changes
+            _print(f"[{'SWAP' if mode == 'replace' else 'DIFF'}] {table_name}: {changes.summary()}")
+            progress({'phase': 'table', 'index': index, 'total': len(files), 'file': file_name, 'table': table_name,
+                      'seconds': round(time.perf_counter() - t0, 3), 'changes': asdict(changes)})
 
         # Debug dump for key large tables
-        debug_tables = [t for t in ('update_till_PDITEM','update_till_PRODEXT') if t in existing_tables]
+        debug_tables = [t for t in ('update_till_PDITEM','update_till_PRODEXT') if t in existing_tables] if debug_dump else []
 
         with open(script_dir / 'debug_output.txt', 'a', encoding='utf-8') as dbg:
             for t in debug_tables:
-                cursor.execute(f"SELECT COUNT(*) FROM {t}")
+                cursor.execute(f"SELECT COUNT(*) FROM main.{t}")
                 count = cursor.fetchone()[0]
                 dbg.write(f"[INFO] {t} count={count}\n")
-                cursor.execute(f"PRAGMA table_info({t})")
+                cursor.execute(f"PRAGMA main.table_info({t})")
                 for col in cursor.fetchall():
                     dbg.write(str(col) + '\n')
-                cursor.execute(f"SELECT * FROM {t} LIMIT 50")
+                cursor.execute(f"SELECT * FROM main.{t} LIMIT 50")
                 for row in cursor.fetchall():
                     dbg.write(str(row) + '\n')
 
+        # Stamp a new catalog version in the same transaction so running workers reload
+        # their in-memory catalog (update_till.catalog) once these rows are visible.
+        if not any(c.changed for c in report.values()):
+            _print("No catalog changes; catalog version unchanged")
+        elif 'update_till_catalogversion' in existing_tables:
+            cursor.execute(
+                "UPDATE update_till_catalogversion SET version = version + 1, last_updated = ? WHERE id = 1",
+                (stamp,),
+            )
+            if cursor.rowcount == 0:
+                cursor.execute(
+                    "INSERT INTO update_till_catalogversion (id, version, last_updated) VALUES (1, 1, ?)",
+                    (stamp,),
+                )
+            _print("Catalog version bumped")
+        else:
+            _print("[WARN] Table update_till_catalogversion does not exist; running tills reload on restart only")
+
+        version = _catalog_version(cursor)
         conn.commit()
-        print("Import complete.")
+        _print("Import complete.")
+        progress({'phase': 'committed'})
+        _save_digests(db_path, version, digests)
+        return report
     except Exception as e:
-        print(f"[ROLLBACK] Import failed: {e}")
+        _print(f"[ROLLBACK] Import failed: {e}")
         try:
             conn.rollback()
         except Exception:
             pass
-        print("No changes applied to the database due to errors.")
+        _print("No changes applied to the database due to errors.")
+        return None
     finally:
         conn.close()
+        shadow_path.unlink(missing_ok=True)
 
 
-def main():
-    _run_import()
+def main(mode: Optional[str] = None, out: Optional[TextIO] = None,
+         progress: Optional[Callable[[dict], None]] = None) -> Optional[Dict[str, TableChanges]]:
+    return _run_import(mode=mode, out=out, progress=progress)
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main('diff' if '--diff' in sys.argv[1:] else None)
\ No newline at end of file
@@ -232,3 +232,48 @@ EPOS_GROSS_COMBO_DISCOUNT = env_bool('EPOS_GROSS_COMBO_DISCOUNT', True)
 # When True, record meal discount (TMEAL_DISCNT) in gross terms (sum of singles gross minus sum of meal component gross)
 # Default False to preserve EX-VAT parity behavior unless explicitly enabled.
 EPOS_GROSS_MEAL_DISCOUNT = env_bool('EPOS_GROSS_MEAL_DISCOUNT', True)
+
+# Start of the trading day ("HH:MM", active timezone). Orders before this time count
+# towards the previous business day, e.g. "04:00" for a shop that closes at 4am.
+# Default midnight keeps calendar-day reporting.
+EPOS_BUSINESS_DAY_CUTOFF = os.getenv('EPOS_BUSINESS_DAY_CUTOFF', '00:00')
+
+# Outbound platform calls (Deliveroo sync_status, ...) go through the durable outbox
+# (manage_orders.services.outbox). Inline dispatch runs one dispatcher thread per web
+# process; turn it off to deliver only via `manage.py drain_outbox --loop`.
+EPOS_OUTBOX_INLINE_DISPATCH = env_bool('EPOS_OUTBOX_INLINE_DISPATCH', True)
+EPOS_OUTBOX_WORKERS = int(os.getenv('EPOS_OUTBOX_WORKERS', '4'))
+EPOS_OUTBOX_PLATFORM_CONCURRENCY = int(os.getenv('EPOS_OUTBOX_PLATFORM_CONCURRENCY', '2'))
+EPOS_OUTBOX_MAX_ATTEMPTS = int(os.getenv('EPOS_OUTBOX_MAX_ATTEMPTS', '8'))
+EPOS_OUTBOX_BACKOFF_SECONDS = float(os.getenv('EPOS_OUTBOX_BACKOFF_SECONDS', '5'))
+EPOS_OUTBOX_BACKOFF_MAX_SECONDS = float(os.getenv('EPOS_OUTBOX_BACKOFF_MAX_SECONDS', '900'))
+EPOS_OUTBOX_POLL_SECONDS = float(os.getenv('EPOS_OUTBOX_POLL_SECONDS', '30'))
+
+# Delivery-platform OAuth tokens are shared by all worker processes through a small
+# file in this directory (default: the system temp dir) and refreshed this many
+# seconds before they expire (at most half of a token's lifetime).
+EPOS_PLATFORM_TOKEN_DIR = os.getenv('EPOS_PLATFORM_TOKEN_DIR', '')
+EPOS_PLATFORM_TOKEN_REFRESH_MARGIN = float(os.getenv('EPOS_PLATFORM_TOKEN_REFRESH_MARGIN', '120'))
+
+# Inbound webhook duplicates (platform retries, repeated status updates) are
+# acknowledged without reprocessing for this long; purge with
+# `manage.py purge_webhook_events`.
+EPOS_WEBHOOK_IDEMPOTENCY_TTL_HOURS = float(os.getenv('EPOS_WEBHOOK_IDEMPOTENCY_TTL_HOURS', '48'))
+
+# Daily export ZIPs are cached here (default: epos-export-cache in the system temp
+# dir), keyed by the day's orders, the catalog version and the EPOS_* flags above.
+EPOS_EXPORT_CACHE_DIR = os.getenv('EPOS_EXPORT_CACHE_DIR', '')
+
+# The range export endpoint (reports/export-range-csvs) rebuilds days in this many
+# worker processes (default 1: inside the web worker itself); ranges span at most
+# EPOS_EXPORT_MAX_RANGE_DAYS days.
+EPOS_EXPORT_WORKERS = int(os.getenv('EPOS_EXPORT_WORKERS', '1'))
+EPOS_EXPORT_MAX_RANGE_DAYS = int(os.getenv('EPOS_EXPORT_MAX_RANGE_DAYS', '31'))
+
+# Catalog imports from the Update Till page run as background jobs (update_till.imports).
+# Inline dispatch runs them on a thread in the web process that queued them; turn it
+# off to run them only via `manage.py run_import_jobs --loop`. Live progress is kept
+# in files in this directory (default: epos-import-jobs in the system temp dir).
+EPOS_IMPORT_INLINE_DISPATCH = env_bool('EPOS_IMPORT_INLINE_DISPATCH', True)
+EPOS_IMPORT_PROGRESS_DIR = os.getenv('EPOS_IMPORT_PROGRESS_DIR', '')
+EPOS_IMPORT_JOB_STALE_SECONDS = float(os.getenv('EPOS_IMPORT_JOB_STALE_SECONDS', '3600'))
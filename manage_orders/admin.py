@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Order, OrderLine
+from .models import Order, OrderLine, OutboxMessage
 
 
 class OrderLineInline(admin.TabularInline):
@@ -16,4 +16,11 @@ class OrderAdmin(admin.ModelAdmin):
 	readonly_fields = ("created_at","completed_at")
 
 
+@admin.register(OutboxMessage)
+class OutboxMessageAdmin(admin.ModelAdmin):
+	list_display = ("id","platform","kind","status","attempts","next_attempt_at","created_at","sent_at")
+	list_filter = ("status","platform","kind")
+	readonly_fields = ("created_at","sent_at","last_error")
+
+
 # ChannelMapping has been deprecated in favour of update_till.PriceBand
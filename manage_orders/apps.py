@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class ManageOrdersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'manage_orders'
+
+    def ready(self):
+        # Re-render the cached menu payloads whenever a new catalog snapshot is swapped in
+        from update_till.catalog import catalog_rebuilt
+        from manage_orders.services import menu_cache
+        catalog_rebuilt.connect(menu_cache.on_catalog_rebuilt, dispatch_uid='menu_cache_materialize')
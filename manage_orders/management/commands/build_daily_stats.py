@@ -1,18 +1,35 @@
+import time
 from datetime import date
 
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
 
+from manage_orders.services.business_day import business_day_for
 from manage_orders.services.daily_stats import build_daily_stats
+from manage_orders.services.stats_backfill import backfill, day_range, report_line, report_summary
 
 
 class Command(BaseCommand):
-    help = "Compute and upsert daily stats (KMeal, KPro, KRev, KWkVat) for a given date"
+    help = "Compute and upsert daily stats (KMeal, KPro, KRev, KWkVat) for a given date or a --from/--to range"
 
     def add_arguments(self, parser):
-        parser.add_argument('--date', help='YYYY-MM-DD of the business day (defaults to today)', default=None)
+        parser.add_argument('--date', help='YYYY-MM-DD of the business day (defaults to the current business day)', default=None)
+        parser.add_argument('--from', dest='from', help='YYYY-MM-DD: rebuild every day from this date (with --to)', default=None)
+        parser.add_argument('--to', dest='to', help='YYYY-MM-DD: last day of a --from range (inclusive)', default=None)
+        parser.add_argument('--workers', type=int, default=None, help='Processes computing days in parallel for --from/--to (default: CPU count)')
 
     def handle(self, *args, **options):
-        export_date = date.fromisoformat(options['date']) if options['date'] else timezone.localdate()
+        if options['from'] or options['to']:
+            if not (options['from'] and options['to']):
+                raise CommandError('--from and --to must be given together')
+            try:
+                days = day_range(date.fromisoformat(options['from']), date.fromisoformat(options['to']))
+            except ValueError as e:
+                raise CommandError(str(e))
+            t0 = time.perf_counter()
+            results = backfill(days, workers=options['workers'],
+                               after_apply=lambda r: self.stdout.write(report_line(r)))
+            self.stdout.write(self.style.SUCCESS(report_summary(results, time.perf_counter() - t0, options['workers'])))
+            return
+        export_date = date.fromisoformat(options['date']) if options['date'] else business_day_for()
         stats = build_daily_stats(export_date)
         self.stdout.write(self.style.SUCCESS(f"Built daily stats for {export_date}: {len(stats.meal_counts)} meals, {len(stats.kpro_counts)} product keys"))
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from manage_orders.services import outbox
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbound platform calls (outbox); --loop keeps running as a worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep draining until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Max seconds between polls with --loop (default 5)')
+        parser.add_argument('--workers', type=int, default=None, help='Thread pool size (default EPOS_OUTBOX_WORKERS)')
+
+    def handle(self, *args, **options):
+        while True:
+            counts = outbox.drain(workers=options['workers'])
+            if any(counts.values()) or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Outbox: {counts['sent']} sent, {counts['retry']} to retry, {counts['dead']} dead-lettered"
+                ))
+            if not options['loop']:
+                return
+            due = outbox.next_due_in()
+            close_old_connections()
+            time.sleep(options['interval'] if due is None else min(max(due, 0.1), options['interval']))
@@ -1,97 +1,85 @@
+import time
 from datetime import date
 from pathlib import Path
 
-from django.core.management.base import BaseCommand
-from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
 
-from manage_orders.services.daily_stats import build_daily_stats
-from django.db import transaction
-from update_till.models import KMeal, KPro, KRev, KWkVat, PdItem, CombTb
+from manage_orders.services.business_day import business_day_for
+from manage_orders.services.daily_csv import clear_daily_stats, write_daily_csvs
+from manage_orders.services.daily_stats import build_daily_stats, ensure_daily_stats
+from manage_orders.services.export_cache import export_lock
+from manage_orders.services.range_export import write_bundle
+from manage_orders.services.stats_backfill import backfill, day_range, report_line, report_summary
 
 
 class Command(BaseCommand):
     help = "Export daily CSVs (MP<ddmmyy>.CSV, PD<ddmmyy>.CSV, RV<ddmmyy>.CSV) based on orders and K* templates"
 
     def add_arguments(self, parser):
-        parser.add_argument('--date', help='YYYY-MM-DD of the business day to export (defaults to today)', default=None)
+        parser.add_argument('--date', help='YYYY-MM-DD of the business day to export (defaults to the current business day)', default=None)
         parser.add_argument('--outdir', help='Directory to write CSVs into', default='.')
-        parser.add_argument('--clear', action='store_true', help='After successful export, clear ALL rows in KMeal, KPro, KRev and KWkVat (use with caution).')
+        parser.add_argument('--clear', action='store_true', help="After successful export, clear the day's rows in KMeal, KPro, KRev and KVatDay (kept for the current business day) and KWkVat.")
+        parser.add_argument('--rebuild', action='store_true', help='Recompute the day from its orders even if its live counters are up to date.')
+        parser.add_argument('--from', dest='from', help='YYYY-MM-DD: rebuild and export every day from this date (with --to), one folder per day under --outdir', default=None)
+        parser.add_argument('--to', dest='to', help='YYYY-MM-DD: last day of a --from range (inclusive)', default=None)
+        parser.add_argument('--workers', type=int, default=None, help='Processes computing days in parallel for --from/--to (default: CPU count)')
+        parser.add_argument('--zip', action='store_true', help='With --from/--to: write one daily_csvs_<from>-<to>.zip bundle with a manifest to --outdir instead of a folder per day')
 
     def handle(self, *args, **options):
-        export_date = date.fromisoformat(options['date']) if options['date'] else timezone.localdate()
+        if options['from'] or options['to']:
+            return self._handle_range(options)
+        export_date = date.fromisoformat(options['date']) if options['date'] else business_day_for()
         outdir = Path(options['outdir']).resolve()
         outdir.mkdir(parents=True, exist_ok=True)
 
-        # Ensure stats are built/upserted for the day
-        build_daily_stats(export_date)
+        # Live days (counters kept by each order) only need finalising; others are rebuilt from orders
+        if options.get('rebuild'):
+            build_daily_stats(export_date)
+        else:
+            ensure_daily_stats(export_date)
 
-        # Write MP<ddmmyy>.CSV from KMeal schema
-        mp_name = f"MP{export_date:%d%m%y}.CSV"
-        pd_name = f"PD{export_date:%d%m%y}.CSV"
-        rv_name = f"RV{export_date:%d%m%y}.CSV"
+        names = write_daily_csvs(export_date, outdir)
+        self.stdout.write(self.style.SUCCESS(f"Built stats and exported {', '.join(names)} to {outdir}"))
 
-        # MP: include ALL products available (from PdItem), even if zero sales; join counts from KMeal when present
-        with open(outdir / mp_name, 'w', newline='', encoding='utf-8') as f:
-            f.write('PRODNUMB,TAKEAWAY,EATIN\r\n')
-            # Cache meal counts for fast lookup
-            meal_map = {m['PRODNUMB']:(m['TAKEAWAY'], m['EATIN']) for m in KMeal.objects.filter(stat_date=export_date).values('PRODNUMB','TAKEAWAY','EATIN')}
-            for prod in PdItem.objects.all().only('PRODNUMB').order_by('PRODNUMB'):
-                tw, ei = meal_map.get(prod.PRODNUMB, (0,0))
-                f.write(f"{prod.PRODNUMB},{tw},{ei}\r\n")
-
-        # PD: include ALL products (PdItem) and ALL combos (CombTb) – even with zero sales.
-        # Join any existing KPro counts for the date.
-        with open(outdir / pd_name, 'w', newline='', encoding='utf-8') as f:
-            f.write('PRODNUMB,COMBO,TAKEAWAY,EATIN,WASTE,STAFF,OPTION\r\n')
-            kpro_rows = {
-                (r['PRODNUMB'], bool(r['COMBO'])): (
-                    r['TAKEAWAY'], r['EATIN'], r['WASTE'], r['STAFF'], r['OPTION']
-                )
-                for r in KPro.objects.filter(stat_date=export_date).values(
-                    'PRODNUMB','COMBO','TAKEAWAY','EATIN','WASTE','STAFF','OPTION'
-                )
-            }
-            # Products first (COMBO=FALSE) ordered by PRODNUMB
-            for prod in PdItem.objects.all().only('PRODNUMB').order_by('PRODNUMB'):
-                tw, ei, wa, st, op = kpro_rows.get((prod.PRODNUMB, False), (0,0,0,0,0))
-                f.write(f"{prod.PRODNUMB},FALSE,{tw},{ei},{wa},{st},{op}\r\n")
-            # Then combos (COMBO=TRUE) ordered by COMBONUMB
-            for combo in CombTb.objects.all().only('COMBONUMB').order_by('COMBONUMB'):
-                tw, ei, wa, st, op = kpro_rows.get((combo.COMBONUMB, True), (0,0,0,0,0))
-                f.write(f"{combo.COMBONUMB},TRUE,{tw},{ei},{wa},{st},{op}\r\n")
+        if options.get('clear'):
+            counts = clear_daily_stats(export_date)
+            self.stdout.write(self.style.WARNING(
+                "Cleared tables: " + ", ".join(f"{name}({n})" for name, n in counts.items()) + "."))
 
-        with open(outdir / rv_name, 'w', newline='', encoding='utf-8') as f:
-            f.write('TCASHVAL,TCHQVAL,TCARDVAL,TONACCOUNT,TSTAFFVAL,TWASTEVAL,TCOUPVAL,TPAYOUTVA,TTOKENVAL,TDISCNTVA,TTOKENNOVR,TGOLARGENU,TMEAL_DISCNT,ACTCASH,ACTCHQ,ACTCARD,VAT,XPV\r\n')
-            row = KRev.objects.filter(stat_date=export_date).values('TCASHVAL','TCHQVAL','TCARDVAL','TONACCOUNT','TSTAFFVAL','TWASTEVAL','TCOUPVAL','TPAYOUTVA','TTOKENVAL','TDISCNTVA','TTOKENNOVR','TGOLARGENU','TMEAL_DISCNT','ACTCASH','ACTCHQ','ACTCARD','VAT','XPV').first() or {}
-            keys = ['TCASHVAL','TCHQVAL','TCARDVAL','TONACCOUNT','TSTAFFVAL','TWASTEVAL','TCOUPVAL','TPAYOUTVA','TTOKENVAL','TDISCNTVA','TTOKENNOVR','TGOLARGENU','TMEAL_DISCNT','ACTCASH','ACTCHQ','ACTCARD','VAT','XPV']
-            f.write(','.join(str(row.get(k, 0)) for k in keys))
-            f.write('\r\n')
+    def _handle_range(self, options):
+        """Rebuild every day from --from to --to and write each day's CSVs to <outdir>/<YYYY-MM-DD>/."""
+        if options.get('clear'):
+            raise CommandError('--clear cannot be combined with --from/--to')
+        if not (options['from'] and options['to']):
+            raise CommandError('--from and --to must be given together')
+        try:
+            days = day_range(date.fromisoformat(options['from']), date.fromisoformat(options['to']))
+        except ValueError as e:
+            raise CommandError(str(e))
+        outdir = Path(options['outdir']).resolve()
+        if options.get('zip'):
+            return self._handle_bundle(days, outdir, options['workers'])
 
-        # Write K_WK_VAT.csv snapshot for all VAT classes
-        kwk_name = "K_WK_VAT.csv"
-        with open(outdir / kwk_name, 'w', newline='', encoding='utf-8') as f:
-            header = ['VAT_CLASS','VAT_RATE','TOT_VAT_1','TOT_VAT_2','TOT_VAT_3','TOT_VAT_4','TOT_VAT_5','TOT_VAT_6','TOT_VAT_7',
-                      'T_VAL_EXCLVAT_1','T_VAL_EXCLVAT_2','T_VAL_EXCLVAT_3','T_VAL_EXCLVAT_4','T_VAL_EXCLVAT_5','T_VAL_EXCLVAT_6','T_VAL_EXCLVAT_7']
-            f.write(','.join(header) + '\r\n')
-            for row in KWkVat.objects.all().order_by('VAT_CLASS').values():
-                vals = [
-                    row.get('VAT_CLASS', 0), row.get('VAT_RATE', 0),
-                    row.get('TOT_VAT_1', 0.0), row.get('TOT_VAT_2', 0.0), row.get('TOT_VAT_3', 0.0), row.get('TOT_VAT_4', 0.0), row.get('TOT_VAT_5', 0.0), row.get('TOT_VAT_6', 0.0), row.get('TOT_VAT_7', 0.0),
-                    row.get('T_VAL_EXCLVAT_1', 0.0), row.get('T_VAL_EXCLVAT_2', 0.0), row.get('T_VAL_EXCLVAT_3', 0.0), row.get('T_VAL_EXCLVAT_4', 0.0), row.get('T_VAL_EXCLVAT_5', 0.0), row.get('T_VAL_EXCLVAT_6', 0.0), row.get('T_VAL_EXCLVAT_7', 0.0),
-                ]
-                f.write(','.join(str(v) for v in vals) + '\r\n')
+        def export_day(result):
+            day_dir = outdir / f"{result.day:%Y-%m-%d}"
+            day_dir.mkdir(parents=True, exist_ok=True)
+            t0 = time.perf_counter()
+            write_daily_csvs(result.day, day_dir)
+            self.stdout.write(report_line(result, export_seconds=time.perf_counter() - t0))
 
-        self.stdout.write(self.style.SUCCESS(f"Built stats and exported {mp_name}, {pd_name}, {rv_name}, K_WK_VAT.csv to {outdir}"))
+        t0 = time.perf_counter()
+        results = backfill(days, workers=options['workers'], after_apply=export_day)
+        self.stdout.write(self.style.SUCCESS(
+            report_summary(results, time.perf_counter() - t0, options['workers']) + f"; CSVs in {outdir}"))
 
-        if options.get('clear'):
-            with transaction.atomic():
-                kmeal_count = KMeal.objects.count()
-                kpro_count = KPro.objects.count()
-                krev_count = KRev.objects.count()
-                kwkvat_count = KWkVat.objects.count()
-                KMeal.objects.all().delete()
-                KPro.objects.all().delete()
-                KRev.objects.all().delete()
-                KWkVat.objects.all().delete()
-            self.stdout.write(self.style.WARNING(
-                f"Cleared tables: KMeal({kmeal_count}), KPro({kpro_count}), KRev({krev_count}), KWkVat({kwkvat_count})."))
+    def _handle_bundle(self, days, outdir: Path, workers):
+        outdir.mkdir(parents=True, exist_ok=True)
+        path = outdir / f"daily_csvs_{days[0]:%Y%m%d}-{days[-1]:%Y%m%d}.zip"
+        with export_lock(), open(path, 'wb') as fh:
+            manifest = write_bundle(days, fh, workers)
+        for day in manifest['days']:
+            self.stdout.write(f"{day['date']}  {day['orders']:>6} orders  " + ', '.join(
+                f"{f['name'].split('/')[-1]} {f['rows']} rows" for f in day['files']))
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {len(manifest['days'])} day(s) with {manifest['workers']} worker(s) "
+            f"in {manifest['elapsed_seconds']:.2f}s to {path}"))
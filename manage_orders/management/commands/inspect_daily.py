@@ -1,7 +1,7 @@
 from datetime import date
 from django.core.management.base import BaseCommand
-from django.utils import timezone
 
+from manage_orders.services.business_day import business_day_for
 from update_till.models import KRev, KPro
 
 
@@ -9,11 +9,11 @@ class Command(BaseCommand):
     help = "Inspect daily aggregated stats: prints KRev row and selected KPro rows for a date"
 
     def add_arguments(self, parser):
-        parser.add_argument('--date', help='YYYY-MM-DD of the business day to inspect (defaults to today)', default=None)
+        parser.add_argument('--date', help='YYYY-MM-DD of the business day to inspect (defaults to the current business day)', default=None)
         parser.add_argument('--codes', nargs='*', type=int, help='Optional product codes to include from KPro (non-combo rows)', default=[])
 
     def handle(self, *args, **options):
-        target_date = date.fromisoformat(options['date']) if options['date'] else timezone.localdate()
+        target_date = date.fromisoformat(options['date']) if options['date'] else business_day_for()
         krev = KRev.objects.filter(stat_date=target_date).values().first()
         if not krev:
             self.stdout.write(self.style.WARNING(f"No KRev row for {target_date}"))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from manage_orders.services.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+    help = 'Delete expired webhook idempotency records (WebhookEvent)'
+
+    def handle(self, *args, **options):
+        deleted = purge_expired()
+        self.stdout.write(self.style.SUCCESS(f'Deleted {deleted} expired webhook events.'))
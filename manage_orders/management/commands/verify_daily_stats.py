@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from manage_orders.services.business_day import business_day_for
+from manage_orders.services.daily_stats import build_daily_stats, diff_daily_stats
+
+
+class Command(BaseCommand):
+    help = "Compare a day's live KMeal/KPro/KRev/KVatDay counters with a full recompute from its orders"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='YYYY-MM-DD of the business day (defaults to the current business day)', default=None)
+        parser.add_argument('--fix', action='store_true', help='Rebuild the day from its orders when they differ')
+
+    def handle(self, *args, **options):
+        export_date = date.fromisoformat(options['date']) if options['date'] else business_day_for()
+        diffs = diff_daily_stats(export_date)
+        if not diffs:
+            self.stdout.write(self.style.SUCCESS(f"Live stats for {export_date} match a full recompute."))
+            return
+        for line in diffs:
+            self.stdout.write(line)
+        if options['fix']:
+            build_daily_stats(export_date)
+            self.stdout.write(self.style.WARNING(f"{len(diffs)} difference(s); rebuilt {export_date} from orders."))
+            return
+        raise CommandError(f"{len(diffs)} difference(s) between live stats and a recompute for {export_date}")
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:53
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_orders', '0014_order_split_voucher_pence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='created_at',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('preparing', 'Preparing'), ('packed', 'Packed'), ('dispatched', 'Dispatched')], db_index=True, default='preparing', max_length=12),
+        ),
+    ]
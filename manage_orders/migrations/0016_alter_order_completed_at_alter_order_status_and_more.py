@@ -0,0 +1,31 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('manage_orders', '0015_alter_order_completed_at_alter_order_created_at_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='order',
+            name='completed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='status',
+            field=models.CharField(choices=[('preparing', 'Preparing'), ('packed', 'Packed'), ('dispatched', 'Dispatched')], default='preparing', max_length=12),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['status', 'completed_at'], name='order_status_completed_idx'),
+        ),
+    ]
@@ -3,7 +3,7 @@ from django.utils import timezone
 
 
 class Order(models.Model):
-	created_at = models.DateTimeField(default=timezone.now)
+	created_at = models.DateTimeField(db_index=True, default=timezone.now)
 	packed_at = models.DateTimeField(null=True, blank=True)
 	completed_at = models.DateTimeField(null=True, blank=True)
 	status = models.CharField(max_length=12, default='preparing', choices=[('preparing','Preparing'),('packed','Packed'),('dispatched','Dispatched')])
@@ -21,6 +21,14 @@ class Order(models.Model):
 	band_co_number = models.CharField(max_length=30, blank=True, default='', help_text="Channel/supplier name associated with the selected price band (PriceBand.SUPPLIER_NAME).")
 	notes = models.TextField(blank=True)
 
+	class Meta:
+		# Dashboard / reporting queries filter a status over a business-day range
+		# (services.business_day); these keep them index range scans.
+		indexes = [
+			models.Index(fields=['status', 'created_at'], name='order_status_created_idx'),
+			models.Index(fields=['status', 'completed_at'], name='order_status_completed_idx'),
+		]
+
 	def __str__(self):
 		return f"Order #{self.pk} ({self.created_at:%Y-%m-%d %H:%M})"
 
@@ -39,3 +47,58 @@ class OrderLine(models.Model):
 
 	def __str__(self):
 		return f"{self.name} x{self.qty} @ {self.unit_price_gross}"
+
+
+class OutboxMessage(models.Model):
+	"""Outbound platform call (e.g. Deliveroo sync_status) waiting to be delivered.
+
+	Rows are written by the request that needs the call and delivered by
+	services.outbox (in-process dispatcher or `manage.py drain_outbox`), so a slow
+	or unavailable platform never holds up the request and a recycled worker does
+	not lose the call.
+	"""
+	STATUS_PENDING = 'pending'
+	STATUS_SENDING = 'sending'
+	STATUS_SENT = 'sent'
+	STATUS_DEAD = 'dead'
+
+	platform = models.CharField(max_length=20)
+	kind = models.CharField(max_length=40, help_text="Handler name, e.g. 'sync_status'.")
+	payload = models.JSONField(default=dict, blank=True)
+	status = models.CharField(max_length=10, default=STATUS_PENDING, choices=[
+		(STATUS_PENDING, 'Pending'), (STATUS_SENDING, 'Sending'), (STATUS_SENT, 'Sent'), (STATUS_DEAD, 'Dead letter'),
+	])
+	attempts = models.PositiveIntegerField(default=0)
+	# When the row is next due: retry time while pending, lease expiry while sending
+	next_attempt_at = models.DateTimeField(default=timezone.now)
+	last_error = models.TextField(blank=True, default='')
+	created_at = models.DateTimeField(default=timezone.now)
+	sent_at = models.DateTimeField(null=True, blank=True)
+
+	class Meta:
+		indexes = [
+			models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+		]
+
+	def __str__(self):
+		return f"{self.platform}:{self.kind} #{self.pk} ({self.status})"
+
+
+class WebhookEvent(models.Model):
+	"""Idempotency record for an inbound platform webhook (see services.idempotency).
+
+	One row per (platform, key) seen within the TTL; expired rows are removed by
+	`manage.py purge_webhook_events`.
+	"""
+	platform = models.CharField(max_length=20)
+	key = models.CharField(max_length=200)
+	created_at = models.DateTimeField(default=timezone.now)
+	expires_at = models.DateTimeField(db_index=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=['platform', 'key'], name='webhook_event_platform_key_uniq'),
+		]
+
+	def __str__(self):
+		return f"{self.platform}:{self.key}"
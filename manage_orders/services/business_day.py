@@ -0,0 +1,50 @@
+"""Trading-day helpers for order queries.
+
+A business day runs from the configured cutoff (EPOS_BUSINESS_DAY_CUTOFF, "HH:MM"
+in the active timezone, default "00:00") to the same time the next day, so a shop
+that closes at 4am can count its late trade against the day it started.
+
+Order queries filter on the half-open range returned by business_day_range()
+instead of `created_at__date=` / `completed_at__date=`: comparing the raw column
+lets SQLite use the (status, created_at) / (status, completed_at) indexes rather
+than scanning every order ever taken.
+"""
+from __future__ import annotations
+
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def business_day_cutoff() -> time:
+    """Configured start-of-trading-day time; malformed values fall back to midnight."""
+    raw = str(getattr(settings, 'EPOS_BUSINESS_DAY_CUTOFF', '00:00') or '00:00').strip()
+    try:
+        hours, _, minutes = raw.partition(':')
+        return time(int(hours), int(minutes or 0))
+    except (TypeError, ValueError):
+        return time(0, 0)
+
+
+def business_day_range(day: date) -> Tuple[datetime, datetime]:
+    """Half-open [start, end) aware datetimes covering trading day `day`."""
+    cutoff = business_day_cutoff()
+    start = timezone.make_aware(datetime.combine(day, cutoff))
+    end = timezone.make_aware(datetime.combine(day + timedelta(days=1), cutoff))
+    return start, end
+
+
+def business_day_for(moment: Optional[datetime] = None) -> date:
+    """Trading day a moment belongs to (defaults to now)."""
+    local = timezone.localtime(moment or timezone.now())
+    if local.time() < business_day_cutoff():
+        return local.date() - timedelta(days=1)
+    return local.date()
+
+
+def business_day_filter(field: str, day: date) -> dict:
+    """ORM kwargs selecting `field` within trading day `day`, e.g. business_day_filter('created_at', d)."""
+    start, end = business_day_range(day)
+    return {f'{field}__gte': start, f'{field}__lt': end}
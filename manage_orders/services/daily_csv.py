@@ -0,0 +1,170 @@
+"""The daily export files (MP / PD / RV / K_WK_VAT) as row generators.
+
+Each file is a generator of CRLF-terminated lines read straight from the K
+tables, so the same rows can be written to disk by `manage.py
+export_daily_csvs` (write_daily_csvs) or zipped on the fly (iter_daily_zip,
+services.range_export) without building a file in memory. Catalog rows and
+the day's counters are both read in key order and merged as they stream, so
+memory does not grow with the catalog.
+
+Callers make sure the day's stats are current first (ensure_daily_stats /
+build_daily_stats); nothing here writes to the K tables except
+clear_daily_stats(), which drops an exported day's rows.
+"""
+from __future__ import annotations
+
+import io
+import zipfile
+from datetime import date
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from django.db import transaction
+
+from manage_orders.services.business_day import business_day_for
+from update_till.models import CombTb, KMeal, KPro, KRev, KVatDay, KWkVat, PdItem
+
+RV_FIELDS = ('TCASHVAL', 'TCHQVAL', 'TCARDVAL', 'TONACCOUNT', 'TSTAFFVAL', 'TWASTEVAL', 'TCOUPVAL', 'TPAYOUTVA',
+             'TTOKENVAL', 'TDISCNTVA', 'TTOKENNOVR', 'TGOLARGENU', 'TMEAL_DISCNT', 'ACTCASH', 'ACTCHQ', 'ACTCARD', 'VAT', 'XPV')
+KWK_VAT_FIELDS = ('VAT_CLASS', 'VAT_RATE') + tuple(f'TOT_VAT_{i}' for i in range(1, 8)) \
+    + tuple(f'T_VAL_EXCLVAT_{i}' for i in range(1, 8))
+KWK_VAT_NAME = 'K_WK_VAT.csv'
+# Rows fetched per round trip while streaming the catalog and counters
+CHUNK_SIZE = 2000
+# Compressed bytes buffered before the ZIP stream yields a chunk
+ZIP_CHUNK_BYTES = 64 * 1024
+
+
+def csv_names(export_date: date) -> Tuple[str, str, str]:
+    return f"MP{export_date:%d%m%y}.CSV", f"PD{export_date:%d%m%y}.CSV", f"RV{export_date:%d%m%y}.CSV"
+
+
+def _with_counts(keys: Iterable[int], counts: Iterable[tuple], zero: tuple) -> Iterator[Tuple[int, tuple]]:
+    """Merge ascending catalog keys with ascending (key, *counts) rows; keys without a row get `zero`."""
+    counts = iter(counts)
+    row = next(counts, None)
+    for key in keys:
+        while row is not None and row[0] < key:
+            row = next(counts, None)
+        if row is not None and row[0] == key:
+            yield key, row[1:]
+        else:
+            yield key, zero
+
+
+def _codes(qs, field: str) -> Iterator[int]:
+    return qs.order_by(field).values_list(field, flat=True).iterator(chunk_size=CHUNK_SIZE)
+
+
+def mp_lines(export_date: date) -> Iterator[str]:
+    """MP: every product (PdItem), even with zero sales, with its KMeal counts."""
+    yield 'PRODNUMB,TAKEAWAY,EATIN\r\n'
+    meals = KMeal.objects.filter(stat_date=export_date).order_by('PRODNUMB') \
+        .values_list('PRODNUMB', 'TAKEAWAY', 'EATIN').iterator(chunk_size=CHUNK_SIZE)
+    for prod, (tw, ei) in _with_counts(_codes(PdItem.objects.all(), 'PRODNUMB'), meals, (0, 0)):
+        yield f"{prod},{tw},{ei}\r\n"
+
+
+def pd_lines(export_date: date) -> Iterator[str]:
+    """PD: every product then every combo (CombTb), even with zero sales, with its KPro counts."""
+    yield 'PRODNUMB,COMBO,TAKEAWAY,EATIN,WASTE,STAFF,OPTION\r\n'
+    for combo, codes, label in ((False, _codes(PdItem.objects.all(), 'PRODNUMB'), 'FALSE'),
+                                (True, _codes(CombTb.objects.all(), 'COMBONUMB'), 'TRUE')):
+        counts = KPro.objects.filter(stat_date=export_date, COMBO=combo).order_by('PRODNUMB') \
+            .values_list('PRODNUMB', 'TAKEAWAY', 'EATIN', 'WASTE', 'STAFF', 'OPTION').iterator(chunk_size=CHUNK_SIZE)
+        for code, (tw, ei, wa, st, op) in _with_counts(codes, counts, (0, 0, 0, 0, 0)):
+            yield f"{code},{label},{tw},{ei},{wa},{st},{op}\r\n"
+
+
+def rv_lines(export_date: date) -> Iterator[str]:
+    """RV: the day's single KRev row (zeros if there is none)."""
+    yield ','.join(RV_FIELDS) + '\r\n'
+    row = KRev.objects.filter(stat_date=export_date).values(*RV_FIELDS).first() or {}
+    yield ','.join(str(row.get(k, 0)) for k in RV_FIELDS) + '\r\n'
+
+
+def kwk_vat_lines() -> Iterator[str]:
+    """K_WK_VAT: the weekly VAT snapshot for every VAT class."""
+    yield ','.join(KWK_VAT_FIELDS) + '\r\n'
+    for row in KWkVat.objects.order_by('VAT_CLASS').values_list(*KWK_VAT_FIELDS):
+        yield ','.join(str(v) for v in row) + '\r\n'
+
+
+def day_files(export_date: date) -> List[Tuple[str, Iterator[str]]]:
+    """(file name, line generator) for the day's own files (MP / PD / RV); generators query lazily."""
+    mp_name, pd_name, rv_name = csv_names(export_date)
+    return [
+        (mp_name, mp_lines(export_date)),
+        (pd_name, pd_lines(export_date)),
+        (rv_name, rv_lines(export_date)),
+    ]
+
+
+def daily_files(export_date: date) -> List[Tuple[str, Iterator[str]]]:
+    """The day's files plus the current K_WK_VAT snapshot."""
+    return day_files(export_date) + [(KWK_VAT_NAME, kwk_vat_lines())]
+
+
+def write_daily_csvs(export_date: date, outdir: Path) -> List[str]:
+    """Write the day's export files into outdir; returns their names."""
+    names = []
+    for name, lines in daily_files(export_date):
+        with open(outdir / name, 'w', newline='', encoding='utf-8') as f:
+            f.writelines(lines)
+        names.append(name)
+    return names
+
+
+class _ZipSink(io.RawIOBase):
+    """Write-only buffer for ZipFile; unseekable, so entries are streamed with data descriptors."""
+    def __init__(self):
+        self._chunks: List[bytes] = []
+        self.pending = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self.pending += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        self.pending = 0
+        return data
+
+
+def iter_zip(files: Iterable[Tuple[str, Iterable[str]]]) -> Iterator[bytes]:
+    """A deflated ZIP of `files`, yielded in chunks as their lines are produced."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, lines in files:
+            with zf.open(name, 'w') as entry:
+                for line in lines:
+                    entry.write(line.encode('utf-8'))
+                    if sink.pending >= ZIP_CHUNK_BYTES:
+                        yield sink.drain()
+            yield sink.drain()
+    yield sink.drain()
+
+
+def iter_daily_zip(export_date: date) -> Iterator[bytes]:
+    return iter_zip(daily_files(export_date))
+
+
+@transaction.atomic
+def clear_daily_stats(export_date: date) -> Dict[str, int]:
+    """Delete an exported day's KMeal / KPro / KRev / KVatDay rows and the K_WK_VAT snapshot.
+
+    The current business day's rows are never deleted: they are its live counters
+    (daily_stats.record_order) and clearing them would make the next sale replay the
+    day. Returns the counts removed per table.
+    """
+    counts = {}
+    if export_date != business_day_for():
+        for model in (KMeal, KPro, KRev, KVatDay):
+            counts[model.__name__] = model.objects.filter(stat_date=export_date).delete()[0]
+    counts[KWkVat.__name__] = KWkVat.objects.all().delete()[0]
+    return counts
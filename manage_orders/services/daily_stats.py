@@ -1,15 +1,74 @@
+"""Daily statistics (KMeal / KPro / KRev / KWkVat) from the day's orders.
+
+Every rule lives in add_order(), which folds one order into a DailyStats. The
+counters are kept two ways from it:
+
+    - live: api_submit_order and api_paid_out call record_order() in the
+      transaction that writes the order, which adds just that order to the
+      business day's KMeal / KPro / KRev / KVatDay rows. A day without counters
+      yet is seeded by a full rebuild (seed_day) once the order has committed,
+      never inside the order's transaction, so a day that has a KRev row is
+      always complete and the till's write stays short;
+    - rebuild: build_daily_stats() recomputes the day from all its orders in
+      one streamed pass (two queries however busy the day was; every catalog
+      lookup comes from the in-memory snapshot) and overwrites the rows with
+      set-based upserts. `manage.py verify_daily_stats` compares the live
+      counters with a recompute (diff_daily_stats) without writing anything.
+
+Export then only needs ensure_daily_stats(): for a live day it writes the
+weekday's K_WK_VAT columns from KVatDay and the ACT* mirrors, nothing else.
+"""
 from __future__ import annotations
 
-from dataclasses import dataclass
+import logging
+from dataclasses import dataclass, field
 from datetime import date
-from typing import Dict, Tuple, List, Optional
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
 
 from django.db import transaction
+from django.db.models import Count, F, Max
 from django.conf import settings
 from django.utils import timezone
 
-from manage_orders.models import Order
-from update_till.models import KMeal, KPro, KRev, KWkVat, PdVatTb, PdItem, CombTb, CompPro, OptPro, PChoice
+from manage_orders.models import Order, OrderLine
+from manage_orders.services import pricing
+from manage_orders.services.business_day import business_day_filter, business_day_for
+from update_till.catalog import CatalogSnapshot, get_catalog
+from update_till.models import KMeal, KPro, KRev, KVatDay, KWkVat
+
+logger = logging.getLogger(__name__)
+
+REV_FIELDS = (
+    'TCASHVAL', 'TCHQVAL', 'TCARDVAL', 'TONACCOUNT', 'TSTAFFVAL', 'TWASTEVAL', 'TCOUPVAL', 'TPAYOUTVA',
+    'TTOKENVAL', 'TDISCNTVA', 'TTOKENNOVR', 'TGOLARGENU', 'TMEAL_DISCNT', 'ACTCASH', 'ACTCHQ', 'ACTCARD', 'VAT', 'XPV',
+)
+KPRO_FIELDS = ('TAKEAWAY', 'EATIN', 'WASTE', 'STAFF', 'OPTION')
+KMEAL_FIELDS = ('TAKEAWAY', 'EATIN')
+# Orders / lines fetched per round trip when a whole day is streamed
+STREAM_CHUNK_SIZE = 2000
+# Reconciliation mirrors, written when a day is exported rather than per order
+ACT_FIELDS = {'ACTCASH': 'TCASHVAL', 'ACTCARD': 'TCARDVAL', 'ACTCHQ': 'TCHQVAL'}
+
+# Map UI payment method labels (from app_prod_order checkout buttons) to revenue accumulator fields.
+# Front-end sends the literal button text (e.g. "On Account", "Crew Food", "Waste food").
+# We normalise to lowercase and allow either spaces or underscores when mapping.
+PAY_MAP = {
+    'cash': 'TCASHVAL',            # Cash sales
+    'card': 'TCARDVAL',            # Card sales
+    'cheque': 'TCHQVAL',           # (Not currently exposed in UI, retained for completeness)
+    'on account': 'TONACCOUNT',    # UI button: On Account
+    'on_account': 'TONACCOUNT',    # underscore variant (defensive)
+    'voucher': 'TTOKENVAL',        # UI button: Voucher -> token value
+    'paid out': 'TPAYOUTVA',       # UI button: Paid Out
+    'paid_out': 'TPAYOUTVA',
+    # Crew/Waste are handled specially in VAT pass to record NET values; do not accumulate here
+    'crew food': None,             # handled in VAT pass
+    'crew_food': None,
+    'waste food': None,
+    'waste_food': None,
+    # Additional potential future mappings could include tokens or discounts if UI adds them:
+    # 'token': 'TTOKENVAL', 'discount': 'TDISCNTVA'
+}
 
 
 @dataclass
@@ -18,680 +77,327 @@ class DailyStats:
     meal_counts: Dict[int, Dict[str, int]]
     kpro_counts: Dict[Tuple[int, bool], Dict[str, int]]
     rev: Dict[str, int]
+    # VAT due / value excluding VAT (pence) by VAT class, crew food and waste excluded
+    vat_due: Dict[int, int] = field(default_factory=dict)
+    vat_net: Dict[int, int] = field(default_factory=dict)
+    order_count: int = 0
+    last_order_id: Optional[int] = None
 
 
-def _aggregate_orders(export_date: date) -> DailyStats:
-    start = timezone.make_aware(timezone.datetime.combine(export_date, timezone.datetime.min.time()))
-    end = timezone.make_aware(timezone.datetime.combine(export_date, timezone.datetime.max.time()))
-
-    orders = Order.objects.filter(created_at__range=(start, end))
-    # Helpers for meal VAT expansion
-    pditem_cache: Dict[int, PdItem] = {}
-    def _get_pditem(code: int) -> Optional[PdItem]:
-        if code in pditem_cache:
-            return pditem_cache[code]
-        obj = PdItem.objects.filter(PRODNUMB=code).only(
-            'PRODNUMB', 'EAT_VAT_CLASS', 'TAKE_VAT_CLASS',
-            'VATPR', 'DC_VATPR', 'VATPR_2', 'DC_VATPR_2', 'VATPR_3', 'DC_VATPR_3',
-            'VATPR_4', 'DC_VATPR_4', 'VATPR_5', 'DC_VATPR_5', 'VATPR_6', 'DC_VATPR_6'
-        ).first()
-        if obj:
-            pditem_cache[code] = obj
-        return obj
-
-    def _meal_effective_component_price(band: int, code: int) -> int:
-        it = _get_pditem(code)
-        if not it:
-            return 0
-        std_name = 'VATPR' if band == 1 else f'VATPR_{band}'
-        dc_name = 'DC_VATPR' if band == 1 else f'DC_VATPR_{band}'
-        std_val = getattr(it, std_name, 0) or 0
-        dc_val = getattr(it, dc_name, 0) or 0
-        return dc_val if dc_val and dc_val > 0 else std_val
-
-    # VAT rate lookup used for ex-VAT computations within aggregation stage
-    vat_rate_by_class = {p.VAT_CLASS: float(p.VAT_RATE) for p in PdVatTb.objects.all()}
-
-    meal_counts: Dict[int, Dict[str, int]] = {}
-    kpro_counts: Dict[Tuple[int, bool], Dict[str, int]] = {}
-    rev = {
-        'TCASHVAL': 0, 'TCHQVAL': 0, 'TCARDVAL': 0, 'TONACCOUNT': 0,
-        'TSTAFFVAL': 0, 'TWASTEVAL': 0, 'TCOUPVAL': 0, 'TPAYOUTVA': 0,
-        'TTOKENVAL': 0, 'TDISCNTVA': 0, 'TTOKENNOVR': 0, 'TGOLARGENU': 0,
-        'TMEAL_DISCNT': 0, 'ACTCASH': 0, 'ACTCHQ': 0, 'ACTCARD': 0, 'VAT': 0, 'XPV': 0,
-    }
-
-    # Map UI payment method labels (from app_prod_order checkout buttons) to revenue accumulator fields.
-    # Front-end sends the literal button text (e.g. "On Account", "Crew Food", "Waste food").
-    # We normalise to lowercase and allow either spaces or underscores when mapping.
-    pay_map = {
-        'cash': 'TCASHVAL',            # Cash sales
-        'card': 'TCARDVAL',            # Card sales
-        'cheque': 'TCHQVAL',           # (Not currently exposed in UI, retained for completeness)
-        'on account': 'TONACCOUNT',    # UI button: On Account
-        'on_account': 'TONACCOUNT',    # underscore variant (defensive)
-        'voucher': 'TTOKENVAL',        # UI button: Voucher -> token value
-        'paid out': 'TPAYOUTVA',       # UI button: Paid Out
-        'paid_out': 'TPAYOUTVA',
-        # Crew/Waste are handled specially in VAT pass to record NET values; do not accumulate here
-        'crew food': None,             # handled in VAT pass
-        'crew_food': None,
-        'waste food': None,
-        'waste_food': None,
-        # Additional potential future mappings could include tokens or discounts if UI adds them:
-        # 'token': 'TTOKENVAL', 'discount': 'TDISCNTVA'
-    }
-
-    # Preload product price columns needed for meal discount computation.
-    # We only need standard and discounted price in the active order's price band, but price band varies per order.
-    # Strategy: when computing a meal discount, dynamically fetch required product records (burger, fries, drink) once and cache.
-    pditem_cache: Dict[int, PdItem] = {}
-    comb_cache: Dict[int, CombTb] = {}
-
-    def _get_pditem(code: int) -> Optional[PdItem]:
-        if code in pditem_cache:
-            return pditem_cache[code]
-        obj = PdItem.objects.filter(PRODNUMB=code).first()
-        if obj:
-            pditem_cache[code] = obj
-        return obj
-
-    def _meal_component_prices(band: int, burger_code: int, fries_code: int, drink_code: int) -> tuple[int,int,int,int,int]:
-        """Return (burger_std, burger_meal, fries_std, fries_meal, drink_std, drink_meal) in pence for given price band.
-
-        Falls back meal price component to standard if discounted component (DC_*) is zero.
-        """
-        # Column name helpers (reuse logic from views without importing to avoid circulars)
-        def std_col(n: int) -> str:
-            return 'VATPR' if n == 1 else f'VATPR_{n}'
-        def dc_col(n: int) -> str:
-            return 'DC_VATPR' if n == 1 else f'DC_VATPR_{n}'
-        std = std_col(band)
-        dc = dc_col(band)
-        def comp(code: int) -> tuple[int,int]:
-            it = _get_pditem(code)
-            if not it:
-                return 0,0
-            std_val = getattr(it, std, 0) or 0
-            dc_val = getattr(it, dc, 0) or 0
-            eff_meal = dc_val if dc_val and dc_val > 0 else std_val
-            return std_val, eff_meal
-        b_std, b_meal = comp(burger_code)
-        f_std, f_meal = comp(fries_code)
-        d_std, d_meal = comp(drink_code)
-        return b_std, b_meal, f_std, f_meal, d_std, d_meal
-
-    # Preload combination component mappings (compulsory / optional) for combination discount computation.
-    comp_pro_map: Dict[int, List[int]] = {}
-    opt_pro_map: Dict[int, List[int]] = {}
-    for cp in CompPro.objects.all().only('COMBONUMB','PRODNUMB'):
-        comp_pro_map.setdefault(cp.COMBONUMB, []).append(cp.PRODNUMB)
-    for op in OptPro.objects.all().only('COMBONUMB','PRODNUMB'):
-        opt_pro_map.setdefault(op.COMBONUMB, []).append(op.PRODNUMB)
-
-    def _combo_component_codes(combo_code: int) -> tuple[List[int], List[int]]:
-        return comp_pro_map.get(combo_code, []), opt_pro_map.get(combo_code, [])
-
-    # Small cache to avoid repeated PdItem hits during VAT pass
-    pditem_cache: Dict[int, PdItem] = {}
-    def _get_pditem(code: int) -> Optional[PdItem]:
-        if code in pditem_cache:
-            return pditem_cache[code]
-        obj = PdItem.objects.filter(PRODNUMB=code).only(
-            'PRODNUMB', 'EAT_VAT_CLASS', 'TAKE_VAT_CLASS',
-            'VATPR', 'DC_VATPR', 'VATPR_2', 'DC_VATPR_2', 'VATPR_3', 'DC_VATPR_3',
-            'VATPR_4', 'DC_VATPR_4', 'VATPR_5', 'DC_VATPR_5', 'VATPR_6', 'DC_VATPR_6'
-        ).first()
-        if obj:
-            pditem_cache[code] = obj
-        return obj
-
-    def _meal_effective_component_price(band: int, code: int) -> int:
-        """Return the effective MEAL price (discounted if available) for product code in given price band (pence)."""
-        it = _get_pditem(code)
-        if not it:
-            return 0
-        std_name = 'VATPR' if band == 1 else f'VATPR_{band}'
-        dc_name = 'DC_VATPR' if band == 1 else f'DC_VATPR_{band}'
-        std_val = getattr(it, std_name, 0) or 0
-        dc_val = getattr(it, dc_name, 0) or 0
-        return dc_val if dc_val and dc_val > 0 else std_val
-
-    # Cache combo VAT classes to avoid repeated DB hits
-    combo_vat_cache: Dict[int, Tuple[Optional[int], Optional[int]]] = {}
-    for o in orders:
-        raw_method = (o.payment_method or '').strip().lower()
-        # Normalise multiple internal whitespace to single space for robust matching
-        norm_method = ' '.join(raw_method.split())
-        pay_key = pay_map.get(norm_method) or pay_map.get(norm_method.replace(' ', '_'))
-        if (norm_method == 'split'):
-            # Allocate split amounts to Cash and Card buckets
-            cash_part = int(getattr(o, 'split_cash_pence', 0) or 0)
-            card_part = int(getattr(o, 'split_card_pence', 0) or 0)
-            voucher_part = int(getattr(o, 'split_voucher_pence', 0) or 0)
-            if cash_part > 0:
-                rev['TCASHVAL'] += cash_part
-            if card_part > 0:
-                rev['TCARDVAL'] += card_part
-            if voucher_part > 0:
-                # Map voucher to token value, not coupon
-                rev['TTOKENVAL'] += voucher_part
-        elif pay_key:
-            # Only accumulate transactional tenders here (cash/card/etc). Crew/Waste handled in VAT pass as NET.
-            if pay_key in {'TCASHVAL','TCARDVAL','TCHQVAL','TONACCOUNT','TCOUPVAL','TPAYOUTVA','TTOKENVAL'}:
-                # For Paid Out, the amount is now recorded in Order.total_gross (cash leaving till).
-                # Historical records may have it in total_net, so fallback if gross is zero.
-                if pay_key == 'TPAYOUTVA':
-                    # Paid Out amount always recorded in total_gross (no legacy fallback required)
-                    amt = (o.total_gross or 0)
-                    rev['TPAYOUTVA'] += amt
-                    rev['TCASHVAL'] -= amt
-                else:
-                    rev[pay_key] += o.total_gross or 0
-        is_staff_order = norm_method in {'crew food','crew_food'}
-        is_waste_order = norm_method in {'waste food','waste_food'}
-
-        for line in o.lines.all():
-            basis = 'TAKEAWAY' if o.vat_basis == 'take' else 'EATIN'
-            # Helper to apply counting rules: staff/waste orders increment only STAFF/WASTE, not basis columns
-            def add_counts(k: Tuple[int,bool], qty: int):
-                if k not in kpro_counts:
-                    kpro_counts[k] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
-                if is_staff_order:
-                    kpro_counts[k]['STAFF'] += qty
-                elif is_waste_order:
-                    kpro_counts[k]['WASTE'] += qty
-                else:
-                    kpro_counts[k][basis] += qty
-            key = (line.item_code, line.item_type == 'combo')
-            add_counts(key, line.qty)
-            if line.is_meal:
-                m = meal_counts.setdefault(line.item_code, {'TAKEAWAY': 0, 'EATIN': 0})
-                m[basis] += line.qty
-                # Meal discount accumulation (TMEAL_DISCNT): gross or EX-VAT per feature flag
-                # EX-VAT default: (Sum singles ex-VAT) - (Sum meal components ex-VAT)
-                # GROSS when EPOS_GROSS_MEAL_DISCOUNT=True: (Sum singles gross) - (Sum meal components gross)
-                meta = line.meta or {}
-                burger_code = line.item_code
-                fries_code = meta.get('fries') or 0
-                drink_code = meta.get('drink') or 0
-                try:
-                    fries_code = int(fries_code) if fries_code else 0
-                    drink_code = int(drink_code) if drink_code else 0
-                except Exception:
-                    fries_code = 0; drink_code = 0
-                if fries_code and drink_code:
-                    b_std, b_meal, f_std, f_meal, d_std, d_meal = _meal_component_prices(o.price_band, burger_code, fries_code, drink_code)
-                    # Helper to compute ex-VAT from gross and class
-                    def ex_vat(amount_gross: int, code: int) -> int:
-                        it = _get_pditem(code)
-                        if not it or amount_gross <= 0:
-                            return 0
-                        vat_class = it.EAT_VAT_CLASS if basis == 'EATIN' else it.TAKE_VAT_CLASS
-                        rate = vat_rate_by_class.get(vat_class, 0.0)
-                        return int(round(amount_gross * 100.0 / (100.0 + rate))) if rate > 0 else amount_gross
-                    singles_total_ex = ex_vat(b_std, burger_code) + ex_vat(f_std, fries_code) + ex_vat(d_std, drink_code)
-                    meal_total_ex = ex_vat(b_meal, burger_code) + ex_vat(f_meal, fries_code) + ex_vat(d_meal, drink_code)
-                    if getattr(settings, 'EPOS_GROSS_MEAL_DISCOUNT', False):
-                        singles_total_g = (b_std or 0) + (f_std or 0) + (d_std or 0)
-                        meal_total_g = (b_meal or 0) + (f_meal or 0) + (d_meal or 0)
-                        discount = singles_total_g - meal_total_g
+def _empty_stats(export_date: date) -> DailyStats:
+    return DailyStats(export_date, {}, {}, {k: 0 for k in REV_FIELDS})
+
+
+# Combination component mappings (compulsory / optional) for combination discount computation.
+def _combo_component_codes(catalog: CatalogSnapshot, combo_code: int) -> tuple[List[int], List[int]]:
+    return list(catalog.combo_compulsory.get(combo_code, ())), list(catalog.combo_optional.get(combo_code, ()))
+
+
+def _count_order(stats: DailyStats, o: Order, lines: List, catalog: CatalogSnapshot) -> None:
+    """Product mix (KMeal / KPro), tenders and discounts for one order."""
+    meal_counts = stats.meal_counts
+    kpro_counts = stats.kpro_counts
+    rev = stats.rev
+    raw_method = (o.payment_method or '').strip().lower()
+    # Normalise multiple internal whitespace to single space for robust matching
+    norm_method = ' '.join(raw_method.split())
+    pay_key = PAY_MAP.get(norm_method) or PAY_MAP.get(norm_method.replace(' ', '_'))
+    if (norm_method == 'split'):
+        # Allocate split amounts to Cash and Card buckets
+        cash_part = int(getattr(o, 'split_cash_pence', 0) or 0)
+        card_part = int(getattr(o, 'split_card_pence', 0) or 0)
+        voucher_part = int(getattr(o, 'split_voucher_pence', 0) or 0)
+        if cash_part > 0:
+            rev['TCASHVAL'] += cash_part
+        if card_part > 0:
+            rev['TCARDVAL'] += card_part
+        if voucher_part > 0:
+            # Map voucher to token value, not coupon
+            rev['TTOKENVAL'] += voucher_part
+    elif pay_key:
+        # Only accumulate transactional tenders here (cash/card/etc). Crew/Waste handled in VAT pass as NET.
+        if pay_key in {'TCASHVAL','TCARDVAL','TCHQVAL','TONACCOUNT','TCOUPVAL','TPAYOUTVA','TTOKENVAL'}:
+            # For Paid Out, the amount is now recorded in Order.total_gross (cash leaving till).
+            # Historical records may have it in total_net, so fallback if gross is zero.
+            if pay_key == 'TPAYOUTVA':
+                # Paid Out amount always recorded in total_gross (no legacy fallback required)
+                amt = (o.total_gross or 0)
+                rev['TPAYOUTVA'] += amt
+                rev['TCASHVAL'] -= amt
+            else:
+                rev[pay_key] += o.total_gross or 0
+    is_staff_order = norm_method in {'crew food','crew_food'}
+    is_waste_order = norm_method in {'waste food','waste_food'}
+
+    for line in lines:
+        basis = 'TAKEAWAY' if o.vat_basis == 'take' else 'EATIN'
+        # Helper to apply counting rules: staff/waste orders increment only STAFF/WASTE, not basis columns
+        def add_counts(k: Tuple[int,bool], qty: int):
+            if k not in kpro_counts:
+                kpro_counts[k] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
+            if is_staff_order:
+                kpro_counts[k]['STAFF'] += qty
+            elif is_waste_order:
+                kpro_counts[k]['WASTE'] += qty
+            else:
+                kpro_counts[k][basis] += qty
+        key = (line.item_code, line.item_type == 'combo')
+        add_counts(key, line.qty)
+        if line.is_meal:
+            m = meal_counts.setdefault(line.item_code, {'TAKEAWAY': 0, 'EATIN': 0})
+            m[basis] += line.qty
+            # Meal discount accumulation (TMEAL_DISCNT): gross or EX-VAT per feature flag
+            # EX-VAT default: (Sum singles ex-VAT) - (Sum meal components ex-VAT)
+            # GROSS when EPOS_GROSS_MEAL_DISCOUNT=True: (Sum singles gross) - (Sum meal components gross)
+            meta = line.meta or {}
+            burger_code = line.item_code
+            fries_code = meta.get('fries') or 0
+            drink_code = meta.get('drink') or 0
+            try:
+                fries_code = int(fries_code) if fries_code else 0
+                drink_code = int(drink_code) if drink_code else 0
+            except Exception:
+                fries_code = 0; drink_code = 0
+            if fries_code and drink_code:
+                discount = pricing.meal_discount(
+                    o.price_band, burger_code, fries_code, drink_code, basis,
+                    gross=getattr(settings, 'EPOS_GROSS_MEAL_DISCOUNT', False), catalog=catalog,
+                )
+                if discount > 0:
+                    rev['TMEAL_DISCNT'] += discount * line.qty
+            # Go Large count (TGOLARGENU): meta.go_large flag set by frontend when applied
+            if (line.meta or {}).get('go_large'):
+                rev['TGOLARGENU'] += line.qty
+            # PD file requirement: fries & drink components of a meal must each increment their own product's TAKEAWAY/EATIN counts (COMBO = False)
+            # MP file should still only count the burger (already handled via meal_counts above) per spec.
+            for comp_code in (fries_code, drink_code):
+                if comp_code:
+                    key_comp = (comp_code, False)
+                    add_counts(key_comp, line.qty)
+            # Hing rule: for meals like "71 Six Bites", chosen optional products should increment OPTION counts
+            # If frontend recorded chosen free options under free_choices for this meal line, count them in OPTION
+            free_list_meal = meta.get('free_choices') or []
+            if isinstance(free_list_meal, list) and free_list_meal:
+                for fc in free_list_meal:
+                    try:
+                        opt_code = int(fc)
+                    except Exception:
+                        opt_code = None
+                    if not opt_code:
+                        continue
+                    # Special-case: Dip None (110) should never count as OPTION on meals; keep under basis
+                    if opt_code == 110:
+                        key_basis = (opt_code, False)
+                        add_counts(key_basis, line.qty)
+                        continue
+                    key_opt = (opt_code, False)
+                    if key_opt not in kpro_counts:
+                        kpro_counts[key_opt] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
+                    # OPTION counts are independent of service basis; increment OPTION by meal qty
+                    kpro_counts[key_opt]['OPTION'] += int(line.qty or 1)
+            else:
+                # No explicit free choices provided: apply default optional product mapping (P_CHOICE) for kids meals, etc.
+                # If a default exists (e.g., 118 -> 26 Ketchup), increment OPTION for that product.
+                default_opts = catalog.product_options.get(burger_code, ())
+                default_opt = default_opts[0] if default_opts else None
+                if default_opt:
+                    # Skip Dip None (110) from OPTION; keep under basis
+                    if int(default_opt) == 110:
+                        key_basis = (110, False)
+                        add_counts(key_basis, line.qty)
                     else:
-                        discount = singles_total_ex - meal_total_ex
-                    if discount > 0:
-                        rev['TMEAL_DISCNT'] += discount * line.qty
-                # Go Large count (TGOLARGENU): meta.go_large flag set by frontend when applied
-                if (line.meta or {}).get('go_large'):
-                    rev['TGOLARGENU'] += line.qty
-                # PD file requirement: fries & drink components of a meal must each increment their own product's TAKEAWAY/EATIN counts (COMBO = False)
-                # MP file should still only count the burger (already handled via meal_counts above) per spec.
-                for comp_code in (fries_code, drink_code):
-                    if comp_code:
-                        key_comp = (comp_code, False)
-                        add_counts(key_comp, line.qty)
-                # Hing rule: for meals like "71 Six Bites", chosen optional products should increment OPTION counts
-                # If frontend recorded chosen free options under free_choices for this meal line, count them in OPTION
-                free_list_meal = meta.get('free_choices') or []
-                if isinstance(free_list_meal, list) and free_list_meal:
-                    for fc in free_list_meal:
+                        key_opt_def = (int(default_opt), False)
+                        if key_opt_def not in kpro_counts:
+                            kpro_counts[key_opt_def] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
+                        kpro_counts[key_opt_def]['OPTION'] += int(line.qty or 1)
+        if line.item_type == 'product':
+            meta = line.meta or {}
+            # Product-level free choices: increment OPTION count for each selected free choice code.
+            # This records sauces/relishes (e.g., Xtr Mayo) in PD OPTION column against their own product codes.
+            # Avoid double-counting for meals: meal free choices are handled in the meal branch above.
+            if not line.is_meal:
+                free_list = meta.get('free_choices') or []
+                if isinstance(free_list, list) and free_list:
+                    for fc in free_list:
                         try:
                             opt_code = int(fc)
                         except Exception:
                             opt_code = None
                         if not opt_code:
                             continue
-                        # Special-case: Dip None (110) should never count as OPTION on meals; keep under basis
-                        if opt_code == 110:
-                            key_basis = (opt_code, False)
-                            add_counts(key_basis, line.qty)
-                            continue
                         key_opt = (opt_code, False)
                         if key_opt not in kpro_counts:
                             kpro_counts[key_opt] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
-                        # OPTION counts are independent of service basis; increment OPTION by meal qty
                         kpro_counts[key_opt]['OPTION'] += int(line.qty or 1)
-                else:
-                    # No explicit free choices provided: apply default optional product mapping (P_CHOICE) for kids meals, etc.
-                    # If a default exists (e.g., 118 -> 26 Ketchup), increment OPTION for that product.
+            # Extras attached as separate priced products should increment basis counts (not OPTION)
+            extras = meta.get('extras_products') or []
+            if isinstance(extras, list) and extras:
+                for ex in extras:
                     try:
-                        default_opt = PChoice.objects.filter(PRODNUMB=burger_code).values_list('OPT_PRODNUMB', flat=True).first()
+                        ex_code = int(ex.get('code'))
                     except Exception:
-                        default_opt = None
-                    if default_opt:
-                        # Skip Dip None (110) from OPTION; keep under basis
-                        if int(default_opt) == 110:
-                            key_basis = (110, False)
-                            add_counts(key_basis, line.qty)
-                        else:
-                            key_opt_def = (int(default_opt), False)
-                            if key_opt_def not in kpro_counts:
-                                kpro_counts[key_opt_def] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
-                            kpro_counts[key_opt_def]['OPTION'] += int(line.qty or 1)
-            if line.item_type == 'product':
-                meta = line.meta or {}
-                # Product-level free choices: increment OPTION count for each selected free choice code.
-                # This records sauces/relishes (e.g., Xtr Mayo) in PD OPTION column against their own product codes.
-                # Avoid double-counting for meals: meal free choices are handled in the meal branch above.
-                if not line.is_meal:
-                    free_list = meta.get('free_choices') or []
-                    if isinstance(free_list, list) and free_list:
-                        for fc in free_list:
-                            try:
-                                opt_code = int(fc)
-                            except Exception:
-                                opt_code = None
-                            if not opt_code:
-                                continue
-                            key_opt = (opt_code, False)
-                            if key_opt not in kpro_counts:
-                                kpro_counts[key_opt] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
-                            kpro_counts[key_opt]['OPTION'] += int(line.qty or 1)
-                # Extras attached as separate priced products should increment basis counts (not OPTION)
-                extras = meta.get('extras_products') or []
-                if isinstance(extras, list) and extras:
-                    for ex in extras:
-                        try:
-                            ex_code = int(ex.get('code'))
-                        except Exception:
-                            ex_code = None
-                        if not ex_code:
-                            continue
-                        key_extra = (ex_code, False)
-                        add_counts(key_extra, line.qty)
-            elif line.item_type == 'combo':
-                # Combination discount (TDISCNTVA): (Sum compulsory standard prices + sum selected optional prices considered free) - combo price.
-                # Spec: A = amount due for all compulsory + chosen optional products; B = amount due for combo product; discount = A - B.
-                # NOTE: Compute in EX-VAT terms per spec.
-                meta = line.meta or {}
-                selected_opts = []
-                raw_opts = meta.get('options') or []
-                if isinstance(raw_opts, list):
-                    for oc in raw_opts:
-                        try:
-                            selected_opts.append(int(oc))
-                        except Exception:
-                            continue
-                # Free choices in combo context (treat as selected optional components, not OPTION counts for combos)
-                meta = line.meta or {}
-                free_list_combo: List[int] = []
-                raw_free_combo = meta.get('free_choices') or []
-                if isinstance(raw_free_combo, list):
-                    for fc in raw_free_combo:
-                        try:
-                            free_list_combo.append(int(fc))
-                        except Exception:
-                            continue
-                compulsory, possible_optional = _combo_component_codes(line.item_code)
-                comp_codes = compulsory[:]  # copy
-                # Only include selected optional codes that are defined as optional for this combo
-                for oc in selected_opts:
-                    if oc in possible_optional:
-                        comp_codes.append(oc)
-                # Also include explicitly selected free choices (if provided) as components to count
-                for fc in free_list_combo:
-                    if fc not in comp_codes:
-                        comp_codes.append(fc)
-                # PD file requirement and Hing's legacy_split for combo 4 (Sharing Platter):
-                # - Two free dips: first counts under service basis; second counts under OPTION (except Dip None = 110, which stays under basis)
-                # Implement this classification while avoiding double-counting free dips in basis loop.
-                handled_free: List[int] = []
-                if line.item_code == 4 and isinstance(free_list_combo, list) and free_list_combo:
-                    # First free dip → service basis
-                    if len(free_list_combo) >= 1:
-                        first_dip = free_list_combo[0]
-                        key_first = (first_dip, False)
-                        add_counts(key_first, line.qty)
-                        handled_free.append(first_dip)
-                    # Second free dip → OPTION unless Dip None (110)
-                    if len(free_list_combo) >= 2:
-                        second_dip = free_list_combo[1]
-                        # US mode: count the second free dip under service basis (unless staff/waste re-mapping applies)
-                        # Legacy mode: second dip → OPTION unless Dip None (110)
-                        us_mode = getattr(settings, 'EPOS_US_MODE', False)
-                        if us_mode:
+                        ex_code = None
+                    if not ex_code:
+                        continue
+                    key_extra = (ex_code, False)
+                    add_counts(key_extra, line.qty)
+        elif line.item_type == 'combo':
+            # Combination discount (TDISCNTVA): (Sum compulsory standard prices + sum selected optional prices considered free) - combo price.
+            # Spec: A = amount due for all compulsory + chosen optional products; B = amount due for combo product; discount = A - B.
+            # NOTE: Compute in EX-VAT terms per spec.
+            meta = line.meta or {}
+            selected_opts = []
+            raw_opts = meta.get('options') or []
+            if isinstance(raw_opts, list):
+                for oc in raw_opts:
+                    try:
+                        selected_opts.append(int(oc))
+                    except Exception:
+                        continue
+            # Free choices in combo context (treat as selected optional components, not OPTION counts for combos)
+            meta = line.meta or {}
+            free_list_combo: List[int] = []
+            raw_free_combo = meta.get('free_choices') or []
+            if isinstance(raw_free_combo, list):
+                for fc in raw_free_combo:
+                    try:
+                        free_list_combo.append(int(fc))
+                    except Exception:
+                        continue
+            compulsory, possible_optional = _combo_component_codes(catalog, line.item_code)
+            comp_codes = compulsory[:]  # copy
+            # Only include selected optional codes that are defined as optional for this combo
+            for oc in selected_opts:
+                if oc in possible_optional:
+                    comp_codes.append(oc)
+            # Also include explicitly selected free choices (if provided) as components to count
+            for fc in free_list_combo:
+                if fc not in comp_codes:
+                    comp_codes.append(fc)
+            # PD file requirement and Hing's legacy_split for combo 4 (Sharing Platter):
+            # - Two free dips: first counts under service basis; second counts under OPTION (except Dip None = 110, which stays under basis)
+            # Implement this classification while avoiding double-counting free dips in basis loop.
+            handled_free: List[int] = []
+            if line.item_code == 4 and isinstance(free_list_combo, list) and free_list_combo:
+                # First free dip → service basis
+                if len(free_list_combo) >= 1:
+                    first_dip = free_list_combo[0]
+                    key_first = (first_dip, False)
+                    add_counts(key_first, line.qty)
+                    handled_free.append(first_dip)
+                # Second free dip → OPTION unless Dip None (110)
+                if len(free_list_combo) >= 2:
+                    second_dip = free_list_combo[1]
+                    # US mode: count the second free dip under service basis (unless staff/waste re-mapping applies)
+                    # Legacy mode: second dip → OPTION unless Dip None (110)
+                    us_mode = getattr(settings, 'EPOS_US_MODE', False)
+                    if us_mode:
+                        key_second = (second_dip, False)
+                        add_counts(key_second, line.qty)
+                    else:
+                        if second_dip == 110:
+                            # Special-case: Dip None should not be added to OPTION; keep under basis
                             key_second = (second_dip, False)
                             add_counts(key_second, line.qty)
                         else:
-                            if second_dip == 110:
-                                # Special-case: Dip None should not be added to OPTION; keep under basis
-                                key_second = (second_dip, False)
-                                add_counts(key_second, line.qty)
-                            else:
-                                key_opt2 = (second_dip, False)
-                                if key_opt2 not in kpro_counts:
-                                    kpro_counts[key_opt2] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
-                                kpro_counts[key_opt2]['OPTION'] += int(line.qty or 1)
-                        handled_free.append(second_dip)
-                    # Any additional free dips beyond the first two → OPTION (unless 110 which stays basis)
-                    if len(free_list_combo) >= 3:
-                        for extra_dip in free_list_combo[2:]:
-                            if extra_dip == 110:
-                                key_extra = (extra_dip, False)
-                                add_counts(key_extra, line.qty)
-                            else:
-                                key_opt_extra = (extra_dip, False)
-                                if key_opt_extra not in kpro_counts:
-                                    kpro_counts[key_opt_extra] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
-                                kpro_counts[key_opt_extra]['OPTION'] += int(line.qty or 1)
-                            handled_free.append(extra_dip)
-                
-                # PD file requirement: compulsory and selected optional component products (excluding handled free dips above)
-                # must increment their own TAKEAWAY/EATIN counts (COMBO = False)
-                if comp_codes:
-                    for comp_code in comp_codes:
-                        if comp_code in handled_free:
-                            continue
-                        key_comp = (comp_code, False)
-                        add_counts(key_comp, line.qty)
-                if comp_codes:
-                    # Sum standard prices (GROSS) for each component in the order's price band
-                    def std_col(n: int) -> str:
-                        return 'VATPR' if n == 1 else f'VATPR_{n}'
-                    std_name = std_col(o.price_band)
-                    def ex_vat_amt(amount_gross: int, code: int) -> int:
-                        it = _get_pditem(code)
-                        if not it or amount_gross <= 0:
-                            return 0
-                        vat_class = it.EAT_VAT_CLASS if basis == 'EATIN' else it.TAKE_VAT_CLASS
-                        rate = vat_rate_by_class.get(vat_class, 0.0)
-                        return int(round(amount_gross * 100.0 / (100.0 + rate))) if rate > 0 else amount_gross
-                    total_components_ex = 0
-                    total_components_g = 0
-                    for code in comp_codes:
-                        item_obj = _get_pditem(code)
-                        if item_obj:
-                            g = getattr(item_obj, std_name, 0) or 0
-                            total_components_g += g
-                            total_components_ex += ex_vat_amt(g, code)
-                    # Compute EX-VAT for combo line price using combo VAT class
-                    combo_price_g = int(line.unit_price_gross or 0)
-                    if line.item_code not in combo_vat_cache:
-                        ct = CombTb.objects.filter(COMBONUMB=line.item_code).only('EAT_VAT_CLASS','TAKE_VAT_CLASS').first()
-                        combo_vat_cache[line.item_code] = (ct.EAT_VAT_CLASS if ct else None, ct.TAKE_VAT_CLASS if ct else None)
-                    eat_cls, take_cls = combo_vat_cache.get(line.item_code, (None, None))
-                    combo_vat_class = take_cls if basis == 'TAKEAWAY' else eat_cls
-                    rate_combo = vat_rate_by_class.get(combo_vat_class, 0.0)
-                    combo_ex = int(round(combo_price_g * 100.0 / (100.0 + rate_combo))) if rate_combo > 0 else combo_price_g
-                    # Choose discount model based on feature flag: gross vs EX-VAT
-                    if getattr(settings, 'EPOS_GROSS_COMBO_DISCOUNT', False):
-                        discount_g = total_components_g - combo_price_g
-                        if discount_g > 0:
-                            rev['TDISCNTVA'] += discount_g * int(line.qty or 1)
-                    else:
-                        discount_ex = total_components_ex - combo_ex
-                        if discount_ex > 0:
-                            rev['TDISCNTVA'] += discount_ex * int(line.qty or 1)
-
-    return DailyStats(export_date, meal_counts, kpro_counts, rev)
-
-
-@transaction.atomic
-def build_daily_stats(export_date: date) -> DailyStats:
-    stats = _aggregate_orders(export_date)
-
-    # Upsert KMeal
-    for prod, d in stats.meal_counts.items():
-        obj, created = KMeal.objects.select_for_update().get_or_create(
-            stat_date=stats.export_date, PRODNUMB=prod,
-            defaults={'TAKEAWAY': 0, 'EATIN': 0},
-        )
-        obj.TAKEAWAY = d['TAKEAWAY']
-        obj.EATIN = d['EATIN']
-        obj.save(update_fields=['TAKEAWAY', 'EATIN', 'last_updated'])
-
-    # Upsert KPro
-    for (prod, combo), d in stats.kpro_counts.items():
-        obj, created = KPro.objects.select_for_update().get_or_create(
-            stat_date=stats.export_date, PRODNUMB=prod, COMBO=combo,
-            defaults={'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0},
-        )
-        obj.TAKEAWAY = d['TAKEAWAY']
-        obj.EATIN = d['EATIN']
-        obj.WASTE = d['WASTE']
-        obj.STAFF = d['STAFF']
-        obj.OPTION = d['OPTION']
-        obj.save(update_fields=['TAKEAWAY', 'EATIN', 'WASTE', 'STAFF', 'OPTION', 'last_updated'])
-
-    # Upsert KRev (single row for date)
-    rev = stats.rev
-    obj, created = KRev.objects.select_for_update().get_or_create(
-        stat_date=stats.export_date,
-        defaults={k: 0 for k in ['TCASHVAL','TCHQVAL','TCARDVAL','TONACCOUNT','TSTAFFVAL','TWASTEVAL','TCOUPVAL','TPAYOUTVA','TTOKENVAL','TDISCNTVA','TTOKENNOVR','TGOLARGENU','TMEAL_DISCNT','ACTCASH','ACTCHQ','ACTCARD','VAT','XPV']},
-    )
-    # At this point VAT, ACT* may still be zero; we'll set VAT after the VAT pass below.
-    for k, v in rev.items():
-        setattr(obj, k, v)
-    obj.save(update_fields=list(rev.keys()) + ['last_updated'])
-
-    # Update KWkVat for this date based on current PdVatTb, PdItem, CombTb and the day's orders
-    vat_rate_by_class = {p.VAT_CLASS: float(p.VAT_RATE) for p in PdVatTb.objects.all()}
-    pd_items = {p.PRODNUMB: (p.EAT_VAT_CLASS, p.TAKE_VAT_CLASS) for p in PdItem.objects.all().only('PRODNUMB','EAT_VAT_CLASS','TAKE_VAT_CLASS')}
-    combos = {c.COMBONUMB: (c.EAT_VAT_CLASS, c.TAKE_VAT_CLASS) for c in CombTb.objects.all().only('COMBONUMB','EAT_VAT_CLASS','TAKE_VAT_CLASS')}
-
-    # Re-aggregate VAT split quickly using the same order scan
-    start = timezone.make_aware(timezone.datetime.combine(export_date, timezone.datetime.min.time()))
-    end = timezone.make_aware(timezone.datetime.combine(export_date, timezone.datetime.max.time()))
-    orders = Order.objects.filter(created_at__range=(start, end))
-    # Local helpers for meal VAT expansion in this VAT pass
-    _pditem_vat_cache: Dict[int, PdItem] = {}
-    def _vat_get_pditem(code: int) -> Optional[PdItem]:
-        if code in _pditem_vat_cache:
-            return _pditem_vat_cache[code]
-        obj = PdItem.objects.filter(PRODNUMB=code).only(
-            'PRODNUMB', 'EAT_VAT_CLASS', 'TAKE_VAT_CLASS',
-            'VATPR', 'DC_VATPR', 'VATPR_2', 'DC_VATPR_2', 'VATPR_3', 'DC_VATPR_3',
-            'VATPR_4', 'DC_VATPR_4', 'VATPR_5', 'DC_VATPR_5', 'VATPR_6', 'DC_VATPR_6'
-        ).first()
-        if obj:
-            _pditem_vat_cache[code] = obj
-        return obj
-
-    def _vat_meal_effective_component_price(band: int, code: int) -> int:
-        it = _vat_get_pditem(code)
-        if not it:
-            return 0
-        std_name = 'VATPR' if band == 1 else f'VATPR_{band}'
-        dc_name = 'DC_VATPR' if band == 1 else f'DC_VATPR_{band}'
-        std_val = getattr(it, std_name, 0) or 0
-        dc_val = getattr(it, dc_name, 0) or 0
-        return dc_val if dc_val and dc_val > 0 else std_val
-
-    vat_due_by_class: Dict[int, int] = {}
-    excl_val_by_class: Dict[int, int] = {}
+                            key_opt2 = (second_dip, False)
+                            if key_opt2 not in kpro_counts:
+                                kpro_counts[key_opt2] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
+                            kpro_counts[key_opt2]['OPTION'] += int(line.qty or 1)
+                    handled_free.append(second_dip)
+                # Any additional free dips beyond the first two → OPTION (unless 110 which stays basis)
+                if len(free_list_combo) >= 3:
+                    for extra_dip in free_list_combo[2:]:
+                        if extra_dip == 110:
+                            key_extra = (extra_dip, False)
+                            add_counts(key_extra, line.qty)
+                        else:
+                            key_opt_extra = (extra_dip, False)
+                            if key_opt_extra not in kpro_counts:
+                                kpro_counts[key_opt_extra] = {'TAKEAWAY': 0, 'EATIN': 0, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
+                            kpro_counts[key_opt_extra]['OPTION'] += int(line.qty or 1)
+                        handled_free.append(extra_dip)
+            
+            # PD file requirement: compulsory and selected optional component products (excluding handled free dips above)
+            # must increment their own TAKEAWAY/EATIN counts (COMBO = False)
+            if comp_codes:
+                for comp_code in comp_codes:
+                    if comp_code in handled_free:
+                        continue
+                    key_comp = (comp_code, False)
+                    add_counts(key_comp, line.qty)
+            if comp_codes:
+                # Choose discount model based on feature flag: gross vs EX-VAT
+                discount = pricing.combo_discount(
+                    o.price_band, line.item_code, comp_codes, line.unit_price_gross, basis,
+                    gross=getattr(settings, 'EPOS_GROSS_COMBO_DISCOUNT', False), catalog=catalog,
+                )
+                if discount > 0:
+                    rev['TDISCNTVA'] += discount * int(line.qty or 1)
+
+
+def _vat_order(stats: DailyStats, o: Order, lines: List, catalog: CatalogSnapshot) -> None:
+    """VAT split by class for one order, plus KRev VAT and the crew food / waste NET totals."""
+    vat_rate_by_class = {k: float(v) for k, v in catalog.vat_rates.items()}
+    pd_items = pricing.product_vat_classes(catalog)
+    vat_due_by_class = stats.vat_due
+    excl_val_by_class = stats.vat_net
     total_vat_all = 0
     staff_net_total = 0
     waste_net_total = 0
-    for o in orders:
-        # Identify staff/waste orders for KWkVat exclusion; KRev VAT includes all
-        raw_method = (o.payment_method or '').strip().lower()
-        norm_method = ' '.join(raw_method.split())
-        is_staff = norm_method in {'crew food', 'crew_food'}
-        is_waste = norm_method in {'waste food', 'waste_food'}
-        for line in o.lines.all():
-            basis = 'TAKEAWAY' if o.vat_basis == 'take' else 'EATIN'
-            # If this is a meal line, split VAT across its component products using their classes and meal component prices
-            if getattr(line, 'is_meal', False):
-                meta = line.meta or {}
-                burger_code = line.item_code
-                fries_code_raw = meta.get('fries')
-                drink_code_raw = meta.get('drink')
-                try:
-                    fries_code = int(fries_code_raw) if fries_code_raw else 0
-                except Exception:
-                    fries_code = 0
-                try:
-                    drink_code = int(drink_code_raw) if drink_code_raw else 0
-                except Exception:
-                    drink_code = 0
-                comp_codes: List[int] = [c for c in [burger_code, fries_code, drink_code] if c]
-                if comp_codes:
-                    # Compute effective meal price per component in this order's price band
-                    comp_prices = {
-                        burger_code: _vat_meal_effective_component_price(o.price_band, burger_code)
-                    }
-                    if fries_code:
-                        comp_prices[fries_code] = _vat_meal_effective_component_price(o.price_band, fries_code)
-                    if drink_code:
-                        comp_prices[drink_code] = _vat_meal_effective_component_price(o.price_band, drink_code)
-                    # For each component, compute VAT using its own class for the current basis
-                    for code in comp_codes:
-                        eat_cls, take_cls = pd_items.get(code, (None, None))
-                        vat_class = take_cls if basis == 'TAKEAWAY' else eat_cls
-                        rate = vat_rate_by_class.get(vat_class)
-                        price_gross = int(comp_prices.get(code, 0)) * int(line.qty or 1)
-                        if rate is None or price_gross <= 0:
-                            continue
-                        net = int(round(price_gross * 100.0 / (100.0 + rate))) if rate > 0 else price_gross
-                        vat_amt = price_gross - net
-                        if not (is_staff or is_waste):
-                            vat_due_by_class[vat_class] = (vat_due_by_class.get(vat_class, 0) or 0) + vat_amt
-                            excl_val_by_class[vat_class] = (excl_val_by_class.get(vat_class, 0) or 0) + net
-                        else:
-                            # accumulate staff/waste NET totals for meal components
-                            if is_staff:
-                                staff_net_total += net
-                            if is_waste:
-                                waste_net_total += net
-                        total_vat_all += (0 if (is_staff or is_waste) else vat_amt)
-                # Also include any paid extras attached to the meal line (e.g., extra dip) using their own VAT classes
-                extras = meta.get('extras_products') or []
-                if isinstance(extras, list) and extras:
-                    for ex in extras:
-                        try:
-                            ex_code = int(ex.get('code'))
-                        except Exception:
-                            ex_code = None
-                        ex_price = int(ex.get('price_gross') or 0) * int(line.qty or 1)
-                        if ex_price <= 0:
-                            continue
-                        if ex_code:
-                            eat_cls_ex, take_cls_ex = pd_items.get(ex_code, (None, None))
-                            vat_class_ex = take_cls_ex if basis == 'TAKEAWAY' else eat_cls_ex
-                        else:
-                            vat_class_ex = None
-                        if vat_class_ex is None:
-                            continue
-                        rate_ex = vat_rate_by_class.get(vat_class_ex)
-                        if rate_ex is None:
-                            continue
-                        net_ex = int(round(ex_price * 100.0 / (100.0 + rate_ex))) if rate_ex > 0 else ex_price
-                        vat_ex = ex_price - net_ex
-                        if not (is_staff or is_waste):
-                            vat_due_by_class[vat_class_ex] = (vat_due_by_class.get(vat_class_ex, 0) or 0) + vat_ex
-                            excl_val_by_class[vat_class_ex] = (excl_val_by_class.get(vat_class_ex, 0) or 0) + net_ex
-                        else:
-                            if is_staff:
-                                staff_net_total += net_ex
-                            if is_waste:
-                                waste_net_total += net_ex
-                        total_vat_all += (0 if (is_staff or is_waste) else vat_ex)
-                # Done with meal expansion for this line
-                continue
-            # Non-meal lines: handle combos with VAT apportion; products may include extras needing VAT split by product
-            if line.item_type == 'combo':
-                # Expand combo into components and apportion gross price by standard component prices
-                meta = line.meta or {}
-                # Build component list
-                # Fetch compulsory and optional components for this combo
-                comp_objs = list(CompPro.objects.filter(COMBONUMB=line.item_code).only('PRODNUMB'))
-                opt_objs = list(OptPro.objects.filter(COMBONUMB=line.item_code).only('PRODNUMB'))
-                compulsory = [c.PRODNUMB for c in comp_objs]
-                possible_optional = {o.PRODNUMB for o in opt_objs}
-                selected_opts: List[int] = []
-                raw_opts = meta.get('options') or []
-                if isinstance(raw_opts, list):
-                    for oc in raw_opts:
-                        try:
-                            selected_opts.append(int(oc))
-                        except Exception:
-                            continue
-                comp_codes: List[int] = list(compulsory)
-                for oc in selected_opts:
-                    if oc in possible_optional and oc not in comp_codes:
-                        comp_codes.append(oc)
-                # Also include free choices if provided
-                raw_free_combo = meta.get('free_choices') or []
-                if isinstance(raw_free_combo, list):
-                    for fc in raw_free_combo:
-                        try:
-                            ic = int(fc)
-                        except Exception:
-                            ic = None
-                        if ic and ic not in comp_codes:
-                            comp_codes.append(ic)
-                if not comp_codes:
-                    continue
-                # Compute sum of standard prices for components
-                def std_col(n: int) -> str:
-                    return 'VATPR' if n == 1 else f'VATPR_{n}'
-                std_name = std_col(o.price_band)
-                comp_std: Dict[int, int] = {}
-                total_std = 0
+    # Identify staff/waste orders for KWkVat exclusion; KRev VAT includes all
+    raw_method = (o.payment_method or '').strip().lower()
+    norm_method = ' '.join(raw_method.split())
+    is_staff = norm_method in {'crew food', 'crew_food'}
+    is_waste = norm_method in {'waste food', 'waste_food'}
+    for line in lines:
+        basis = 'TAKEAWAY' if o.vat_basis == 'take' else 'EATIN'
+        # If this is a meal line, split VAT across its component products using their classes and meal component prices
+        if getattr(line, 'is_meal', False):
+            meta = line.meta or {}
+            burger_code = line.item_code
+            fries_code_raw = meta.get('fries')
+            drink_code_raw = meta.get('drink')
+            try:
+                fries_code = int(fries_code_raw) if fries_code_raw else 0
+            except Exception:
+                fries_code = 0
+            try:
+                drink_code = int(drink_code_raw) if drink_code_raw else 0
+            except Exception:
+                drink_code = 0
+            comp_codes: List[int] = [c for c in [burger_code, fries_code, drink_code] if c]
+            if comp_codes:
+                # Compute effective meal price per component in this order's price band
+                comp_prices = {
+                    burger_code: pricing.meal_component_price(o.price_band, burger_code, catalog=catalog)
+                }
+                if fries_code:
+                    comp_prices[fries_code] = pricing.meal_component_price(o.price_band, fries_code, catalog=catalog)
+                if drink_code:
+                    comp_prices[drink_code] = pricing.meal_component_price(o.price_band, drink_code, catalog=catalog)
+                # For each component, compute VAT using its own class for the current basis
                 for code in comp_codes:
-                    it = _vat_get_pditem(code)
-                    if it:
-                        val = getattr(it, std_name, 0) or 0
-                        comp_std[code] = val
-                        total_std += val
-                if total_std <= 0:
-                    continue
-                combo_gross = int(line.line_total_gross or 0)
-                if is_staff or is_waste:
-                    # For staff/waste, compute EX-VAT directly from combo gross using combo VAT class to avoid per-component rounding drift
-                    ct = CombTb.objects.filter(COMBONUMB=line.item_code).only('EAT_VAT_CLASS','TAKE_VAT_CLASS').first()
-                    if ct:
-                        vat_class = ct.TAKE_VAT_CLASS if basis == 'TAKEAWAY' else ct.EAT_VAT_CLASS
-                        rate = vat_rate_by_class.get(vat_class)
-                        if rate is not None:
-                            net = int(round(combo_gross * 100.0 / (100.0 + rate))) if rate > 0 else combo_gross
-                            if is_staff:
-                                staff_net_total += net
-                            if is_waste:
-                                waste_net_total += net
-                    continue
-                # Allocate gross to each component and compute VAT by its class for non staff/waste
-                for code, std_val in comp_std.items():
-                    share_gross = int(round(combo_gross * (std_val / float(total_std)) ))
                     eat_cls, take_cls = pd_items.get(code, (None, None))
                     vat_class = take_cls if basis == 'TAKEAWAY' else eat_cls
                     rate = vat_rate_by_class.get(vat_class)
-                    if rate is None:
+                    price_gross = int(comp_prices.get(code, 0)) * int(line.qty or 1)
+                    if rate is None or price_gross <= 0:
                         continue
-                    net = int(round(share_gross * 100.0 / (100.0 + rate))) if rate > 0 else share_gross
-                    vat_amt = share_gross - net
-                    vat_due_by_class[vat_class] = (vat_due_by_class.get(vat_class, 0) or 0) + vat_amt
-                    excl_val_by_class[vat_class] = (excl_val_by_class.get(vat_class, 0) or 0) + net
-                    total_vat_all += vat_amt
-                continue
-            # Product line: split extras_products (if any) by their own VAT classes
-            eat_cls, take_cls = pd_items.get(line.item_code, (None, None))
-            vat_class_main = take_cls if basis == 'TAKEAWAY' else eat_cls
-            if not line.line_total_gross:
-                continue
-            g_total = int(line.line_total_gross)
-            meta = line.meta or {}
+                    net = pricing.net_of_vat(price_gross, rate)
+                    vat_amt = price_gross - net
+                    if not (is_staff or is_waste):
+                        vat_due_by_class[vat_class] = (vat_due_by_class.get(vat_class, 0) or 0) + vat_amt
+                        excl_val_by_class[vat_class] = (excl_val_by_class.get(vat_class, 0) or 0) + net
+                    else:
+                        # accumulate staff/waste NET totals for meal components
+                        if is_staff:
+                            staff_net_total += net
+                        if is_waste:
+                            waste_net_total += net
+                    total_vat_all += (0 if (is_staff or is_waste) else vat_amt)
+            # Also include any paid extras attached to the meal line (e.g., extra dip) using their own VAT classes
             extras = meta.get('extras_products') or []
-            extras_gross_total = 0
             if isinstance(extras, list) and extras:
                 for ex in extras:
                     try:
@@ -699,72 +405,401 @@ def build_daily_stats(export_date: date) -> DailyStats:
                     except Exception:
                         ex_code = None
                     ex_price = int(ex.get('price_gross') or 0) * int(line.qty or 1)
-                    extras_gross_total += ex_price
+                    if ex_price <= 0:
+                        continue
                     if ex_code:
                         eat_cls_ex, take_cls_ex = pd_items.get(ex_code, (None, None))
                         vat_class_ex = take_cls_ex if basis == 'TAKEAWAY' else eat_cls_ex
-                        rate_ex = vat_rate_by_class.get(vat_class_ex)
-                        if rate_ex is not None and ex_price > 0:
-                            net_ex = int(round(ex_price * 100.0 / (100.0 + rate_ex))) if rate_ex > 0 else ex_price
-                            vat_ex = ex_price - net_ex
-                            if not (is_staff or is_waste):
-                                vat_due_by_class[vat_class_ex] = (vat_due_by_class.get(vat_class_ex, 0) or 0) + vat_ex
-                                excl_val_by_class[vat_class_ex] = (excl_val_by_class.get(vat_class_ex, 0) or 0) + net_ex
-                            else:
-                                if is_staff:
-                                    staff_net_total += net_ex
-                                if is_waste:
-                                    waste_net_total += net_ex
-                            total_vat_all += (0 if (is_staff or is_waste) else vat_ex)
-            # Remaining gross belongs to main product VAT class
-            main_gross = max(0, g_total - extras_gross_total)
-            if main_gross > 0 and vat_class_main is not None:
-                rate = vat_rate_by_class.get(vat_class_main)
-                if rate is not None:
-                    net = int(round(main_gross * 100.0 / (100.0 + rate))) if rate > 0 else main_gross
-                    vat_amt = main_gross - net
+                    else:
+                        vat_class_ex = None
+                    if vat_class_ex is None:
+                        continue
+                    rate_ex = vat_rate_by_class.get(vat_class_ex)
+                    if rate_ex is None:
+                        continue
+                    net_ex = pricing.net_of_vat(ex_price, rate_ex)
+                    vat_ex = ex_price - net_ex
                     if not (is_staff or is_waste):
-                        vat_due_by_class[vat_class_main] = (vat_due_by_class.get(vat_class_main, 0) or 0) + vat_amt
-                        excl_val_by_class[vat_class_main] = (excl_val_by_class.get(vat_class_main, 0) or 0) + net
+                        vat_due_by_class[vat_class_ex] = (vat_due_by_class.get(vat_class_ex, 0) or 0) + vat_ex
+                        excl_val_by_class[vat_class_ex] = (excl_val_by_class.get(vat_class_ex, 0) or 0) + net_ex
                     else:
+                        if is_staff:
+                            staff_net_total += net_ex
+                        if is_waste:
+                            waste_net_total += net_ex
+                    total_vat_all += (0 if (is_staff or is_waste) else vat_ex)
+            # Done with meal expansion for this line
+            continue
+        # Non-meal lines: handle combos with VAT apportion; products may include extras needing VAT split by product
+        if line.item_type == 'combo':
+            # Expand combo into components and apportion gross price by standard component prices
+            meta = line.meta or {}
+            # Build component list
+            # Fetch compulsory and optional components for this combo
+            compulsory = list(catalog.combo_compulsory.get(line.item_code, ()))
+            possible_optional = set(catalog.combo_optional.get(line.item_code, ()))
+            selected_opts: List[int] = []
+            raw_opts = meta.get('options') or []
+            if isinstance(raw_opts, list):
+                for oc in raw_opts:
+                    try:
+                        selected_opts.append(int(oc))
+                    except Exception:
+                        continue
+            comp_codes: List[int] = list(compulsory)
+            for oc in selected_opts:
+                if oc in possible_optional and oc not in comp_codes:
+                    comp_codes.append(oc)
+            # Also include free choices if provided
+            raw_free_combo = meta.get('free_choices') or []
+            if isinstance(raw_free_combo, list):
+                for fc in raw_free_combo:
+                    try:
+                        ic = int(fc)
+                    except Exception:
+                        ic = None
+                    if ic and ic not in comp_codes:
+                        comp_codes.append(ic)
+            if not comp_codes:
+                continue
+            # Compute sum of standard prices for components
+            comp_std: Dict[int, int] = {}
+            total_std = 0
+            for code in comp_codes:
+                if code in catalog.products:
+                    val = pricing.standard_price(o.price_band, code, catalog=catalog)
+                    comp_std[code] = val
+                    total_std += val
+            if total_std <= 0:
+                continue
+            combo_gross = int(line.line_total_gross or 0)
+            if is_staff or is_waste:
+                # For staff/waste, compute EX-VAT directly from combo gross using combo VAT class to avoid per-component rounding drift
+                ct = catalog.combos.get(line.item_code)
+                if ct:
+                    vat_class = ct.TAKE_VAT_CLASS if basis == 'TAKEAWAY' else ct.EAT_VAT_CLASS
+                    rate = vat_rate_by_class.get(vat_class)
+                    if rate is not None:
+                        net = pricing.net_of_vat(combo_gross, rate)
                         if is_staff:
                             staff_net_total += net
                         if is_waste:
                             waste_net_total += net
-                    total_vat_all += (0 if (is_staff or is_waste) else vat_amt)
+                continue
+            # Allocate gross to each component and compute VAT by its class for non staff/waste
+            for code, std_val in comp_std.items():
+                share_gross = int(round(combo_gross * (std_val / float(total_std)) ))
+                eat_cls, take_cls = pd_items.get(code, (None, None))
+                vat_class = take_cls if basis == 'TAKEAWAY' else eat_cls
+                rate = vat_rate_by_class.get(vat_class)
+                if rate is None:
+                    continue
+                net = pricing.net_of_vat(share_gross, rate)
+                vat_amt = share_gross - net
+                vat_due_by_class[vat_class] = (vat_due_by_class.get(vat_class, 0) or 0) + vat_amt
+                excl_val_by_class[vat_class] = (excl_val_by_class.get(vat_class, 0) or 0) + net
+                total_vat_all += vat_amt
+            continue
+        # Product line: split extras_products (if any) by their own VAT classes
+        eat_cls, take_cls = pd_items.get(line.item_code, (None, None))
+        vat_class_main = take_cls if basis == 'TAKEAWAY' else eat_cls
+        if not line.line_total_gross:
+            continue
+        g_total = int(line.line_total_gross)
+        meta = line.meta or {}
+        extras = meta.get('extras_products') or []
+        extras_gross_total = 0
+        if isinstance(extras, list) and extras:
+            for ex in extras:
+                try:
+                    ex_code = int(ex.get('code'))
+                except Exception:
+                    ex_code = None
+                ex_price = int(ex.get('price_gross') or 0) * int(line.qty or 1)
+                extras_gross_total += ex_price
+                if ex_code:
+                    eat_cls_ex, take_cls_ex = pd_items.get(ex_code, (None, None))
+                    vat_class_ex = take_cls_ex if basis == 'TAKEAWAY' else eat_cls_ex
+                    rate_ex = vat_rate_by_class.get(vat_class_ex)
+                    if rate_ex is not None and ex_price > 0:
+                        net_ex = pricing.net_of_vat(ex_price, rate_ex)
+                        vat_ex = ex_price - net_ex
+                        if not (is_staff or is_waste):
+                            vat_due_by_class[vat_class_ex] = (vat_due_by_class.get(vat_class_ex, 0) or 0) + vat_ex
+                            excl_val_by_class[vat_class_ex] = (excl_val_by_class.get(vat_class_ex, 0) or 0) + net_ex
+                        else:
+                            if is_staff:
+                                staff_net_total += net_ex
+                            if is_waste:
+                                waste_net_total += net_ex
+                        total_vat_all += (0 if (is_staff or is_waste) else vat_ex)
+        # Remaining gross belongs to main product VAT class
+        main_gross = max(0, g_total - extras_gross_total)
+        if main_gross > 0 and vat_class_main is not None:
+            rate = vat_rate_by_class.get(vat_class_main)
+            if rate is not None:
+                net = pricing.net_of_vat(main_gross, rate)
+                vat_amt = main_gross - net
+                if not (is_staff or is_waste):
+                    vat_due_by_class[vat_class_main] = (vat_due_by_class.get(vat_class_main, 0) or 0) + vat_amt
+                    excl_val_by_class[vat_class_main] = (excl_val_by_class.get(vat_class_main, 0) or 0) + net
+                else:
+                    if is_staff:
+                        staff_net_total += net
+                    if is_waste:
+                        waste_net_total += net
+                total_vat_all += (0 if (is_staff or is_waste) else vat_amt)
+    stats.rev['VAT'] += total_vat_all
+    stats.rev['TSTAFFVAL'] += staff_net_total
+    stats.rev['TWASTEVAL'] += waste_net_total
+
+
+def add_order(stats: DailyStats, o: Order, lines: Optional[Iterable] = None,
+              catalog: Optional[CatalogSnapshot] = None) -> DailyStats:
+    """Fold one order (and its lines, fetched if not given) into `stats`."""
+    catalog = catalog or get_catalog()
+    lines = list(o.lines.all() if lines is None else lines)
+    _count_order(stats, o, lines, catalog)
+    _vat_order(stats, o, lines, catalog)
+    stats.order_count += 1
+    if o.id is not None:
+        stats.last_order_id = max(stats.last_order_id or 0, o.id)
+    return stats
+
+
+def _iter_day_orders(export_date: date) -> Iterator[Tuple[Order, List[OrderLine]]]:
+    """(order, lines) for every order of a business day, streamed.
+
+    Two queries regardless of the day's size: the orders, and their lines joined to
+    the same order range, both in order id order and fetched in chunks; they are
+    merged here, so neither side is held in memory in full.
+    """
+    day = business_day_filter('created_at', export_date)
+    orders = Order.objects.filter(**day).order_by('id').iterator(chunk_size=STREAM_CHUNK_SIZE)
+    lines = (OrderLine.objects.filter(**{f'order__{k}': v for k, v in day.items()})
+             .order_by('order_id', 'id').iterator(chunk_size=STREAM_CHUNK_SIZE))
+    pending = next(lines, None)
+    for o in orders:
+        batch: List[OrderLine] = []
+        while pending is not None and pending.order_id <= o.id:
+            if pending.order_id == o.id:
+                batch.append(pending)
+            pending = next(lines, None)
+        yield o, batch
+
+
+def _aggregate_orders(export_date: date) -> DailyStats:
+    stats = _empty_stats(export_date)
+    # Catalog lookups (PdItem, CombTb, CompPro/OptPro, PChoice, VAT) come from the shared snapshot
+    catalog = get_catalog()
+    for o, lines in _iter_day_orders(export_date):
+        add_order(stats, o, lines, catalog=catalog)
+    return stats
+
 
+def _upsert(model, rows: List, unique_fields: Tuple[str, ...], fields: Iterable[str]) -> None:
+    """INSERT ... ON CONFLICT (unique_fields) DO UPDATE `fields`, batched by bulk_create."""
+    if rows:
+        model.objects.bulk_create(rows, update_conflicts=True, unique_fields=list(unique_fields),
+                                  update_fields=list(fields) + ['last_updated'])
+
+
+def _write_stats(stats: DailyStats) -> None:
+    """Overwrite the day's KMeal / KPro / KRev / KVatDay rows with `stats`.
+
+    A fixed number of statements however many keys the day has: each table is
+    zeroed for the day in one UPDATE (so keys that no longer occur, e.g. after an
+    order was edited, drop to zero) and the day's keys are upserted in batches.
+    """
+    day = stats.export_date
+    now = timezone.now()
+    KMeal.objects.filter(stat_date=day).update(**{f: 0 for f in KMEAL_FIELDS}, last_updated=now)
+    KPro.objects.filter(stat_date=day).update(**{f: 0 for f in KPRO_FIELDS}, last_updated=now)
+    _upsert(KMeal, [KMeal(stat_date=day, PRODNUMB=prod, **d) for prod, d in stats.meal_counts.items()],
+            ('stat_date', 'PRODNUMB'), KMEAL_FIELDS)
+    _upsert(KPro, [KPro(stat_date=day, PRODNUMB=prod, COMBO=combo, **d) for (prod, combo), d in stats.kpro_counts.items()],
+            ('stat_date', 'PRODNUMB', 'COMBO'), KPRO_FIELDS)
+
+    # Single KRev row for the date; ACT* are mirrored when the day is finalised
+    rev = {k: v for k, v in stats.rev.items() if k not in ACT_FIELDS}
+    _upsert(KRev, [KRev(stat_date=day, **{**{k: 0 for k in REV_FIELDS}, **rev})], ('stat_date',), rev)
+
+    # Per-day VAT by class, the source of the weekday's K_WK_VAT columns
+    KVatDay.objects.filter(stat_date=day).delete()
+    KVatDay.objects.bulk_create([
+        KVatDay(stat_date=day, VAT_CLASS=vat_class,
+                TOT_VAT=stats.vat_due.get(vat_class, 0), T_VAL_EXCLVAT=stats.vat_net.get(vat_class, 0))
+        for vat_class in sorted(set(stats.vat_due) | set(stats.vat_net))
+    ])
+
+
+def _finalize_day(export_date: date) -> None:
+    """Write the weekday's K_WK_VAT columns from KVatDay and mirror ACT* from the tender totals."""
+    catalog = get_catalog()
+    vat_rate_by_class = {k: float(v) for k, v in catalog.vat_rates.items()}
+    day_vat = {r.VAT_CLASS: r for r in KVatDay.objects.filter(stat_date=export_date)}
+
+    # K_WK_VAT has no unique key on VAT_CLASS to upsert on: read the few class rows
+    # once, then one bulk UPDATE for existing classes and one INSERT for new ones
     weekday = export_date.isoweekday()  # 1..7
+    now = timezone.now()
+    existing = {kw.VAT_CLASS: kw for kw in KWkVat.objects.filter(VAT_CLASS__in=list(vat_rate_by_class))}
+    updated, created = [], []
     for vat_class, rate in vat_rate_by_class.items():
-        kw, _ = KWkVat.objects.select_for_update().get_or_create(
-            VAT_CLASS=vat_class,
-            defaults={'VAT_RATE': rate, **{f'TOT_VAT_{i}': 0.0 for i in range(1,8)}, **{f'T_VAL_EXCLVAT_{i}': 0.0 for i in range(1,8)}},
-        )
-        if kw.VAT_RATE != rate:
-            kw.VAT_RATE = rate
-        vat_pounds = (vat_due_by_class.get(vat_class, 0) or 0) / 100.0
-        net_pounds = (excl_val_by_class.get(vat_class, 0) or 0) / 100.0
-        setattr(kw, f'TOT_VAT_{weekday}', float(vat_pounds))
-        setattr(kw, f'T_VAL_EXCLVAT_{weekday}', float(net_pounds))
-        kw.save(update_fields=['VAT_RATE', f'TOT_VAT_{weekday}', f'T_VAL_EXCLVAT_{weekday}', 'last_updated'])
-
-    # After KWkVat update, compute total VAT (exclude staff & waste per spec of KWkVat, but KRev wants total VAT due overall).
-    # We already computed vat_due_by_class in pence above; sum them.
-    total_vat = total_vat_all
-    # Refresh / update KRev VAT & ACT* if unset
-    krevc = KRev.objects.select_for_update().get(stat_date=export_date)
-    # Update staff/waste NET totals from VAT pass computation
-    if krevc.TSTAFFVAL != staff_net_total:
-        krevc.TSTAFFVAL = staff_net_total
-    if krevc.TWASTEVAL != waste_net_total:
-        krevc.TWASTEVAL = waste_net_total
-    if krevc.VAT != total_vat:
-        krevc.VAT = total_vat
-    # Mirror ACTCASH/ACTCARD/ACTCHQ to transactional totals if they are zero (no manual reconciliation captured).
-    if krevc.ACTCASH == 0:
-        krevc.ACTCASH = krevc.TCASHVAL
-    if krevc.ACTCARD == 0:
-        krevc.ACTCARD = krevc.TCARDVAL
-    if krevc.ACTCHQ == 0:
-        krevc.ACTCHQ = krevc.TCHQVAL
-    krevc.save(update_fields=['TSTAFFVAL','TWASTEVAL','VAT','ACTCASH','ACTCARD','ACTCHQ','last_updated'])
+        kw = existing.get(vat_class)
+        if kw is None:
+            kw = KWkVat(VAT_CLASS=vat_class, **{f'TOT_VAT_{i}': 0.0 for i in range(1,8)}, **{f'T_VAL_EXCLVAT_{i}': 0.0 for i in range(1,8)})
+            created.append(kw)
+        else:
+            updated.append(kw)
+        row = day_vat.get(vat_class)
+        kw.VAT_RATE = rate
+        setattr(kw, f'TOT_VAT_{weekday}', float((row.TOT_VAT if row else 0) / 100.0))
+        setattr(kw, f'T_VAL_EXCLVAT_{weekday}', float((row.T_VAL_EXCLVAT if row else 0) / 100.0))
+        kw.last_updated = now
+    KWkVat.objects.bulk_update(updated, ['VAT_RATE', f'TOT_VAT_{weekday}', f'T_VAL_EXCLVAT_{weekday}', 'last_updated'])
+    KWkVat.objects.bulk_create(created)
+
+    # Mirror ACTCASH/ACTCARD/ACTCHQ to transactional totals (no manual reconciliation captured).
+    KRev.objects.filter(stat_date=export_date).update(
+        **{act: F(total) for act, total in ACT_FIELDS.items()}, last_updated=timezone.now())
+
+
+def orders_watermark(export_date: date) -> Tuple[int, Optional[int]]:
+    """(count, highest id) of a business day's orders; any new order changes it."""
+    row = Order.objects.filter(**business_day_filter('created_at', export_date)).aggregate(n=Count('id'), last=Max('id'))
+    return row['n'], row['last']
+
+
+def compute_daily_stats(export_date: date) -> DailyStats:
+    """Recompute a day from its orders without writing anything (safe in worker processes)."""
+    return _aggregate_orders(export_date)
+
+
+@transaction.atomic
+def apply_daily_stats(stats: DailyStats) -> DailyStats:
+    """Write a computed day to KMeal / KPro / KRev / KVatDay / KWkVat in one short transaction.
+
+    If the day gained orders after `stats` was computed (e.g. the current day, whose
+    new orders record_order has already added to the counters), the day is
+    recomputed here, in the writing transaction, rather than overwriting the
+    counters with the older figures. Returns the stats actually written.
+    """
+    if (stats.order_count, stats.last_order_id) != orders_watermark(stats.export_date):
+        stats = _aggregate_orders(stats.export_date)
+    _write_stats(stats)
+    _finalize_day(stats.export_date)
+    for act, total in ACT_FIELDS.items():
+        stats.rev[act] = stats.rev[total]
     return stats
+
+
+@transaction.atomic
+def build_daily_stats(export_date: date) -> DailyStats:
+    """Full rebuild of a day's KMeal / KPro / KRev / KVatDay / KWkVat from its orders."""
+    return apply_daily_stats(compute_daily_stats(export_date))
+
+
+def is_live(export_date: date) -> bool:
+    """True when the day's counters are seeded and kept up to date by record_order()."""
+    return KRev.objects.filter(stat_date=export_date).exists()
+
+
+@transaction.atomic
+def ensure_daily_stats(export_date: date) -> None:
+    """Make the day's K* tables export-ready: finalise a live day, rebuild any other."""
+    if is_live(export_date):
+        _finalize_day(export_date)
+    else:
+        build_daily_stats(export_date)
+
+
+def _increment(model, key: dict, fields: Tuple[str, ...], deltas: Dict[str, int]) -> None:
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    updated = model.objects.filter(**key).update(
+        **{k: F(k) + v for k, v in deltas.items()}, last_updated=timezone.now())
+    if not updated:
+        model.objects.create(**key, **{**{f: 0 for f in fields}, **deltas})
+
+
+def _apply(stats: DailyStats) -> None:
+    """Add `stats` (one order's contribution) to the stored counters."""
+    day = stats.export_date
+    for prod, d in stats.meal_counts.items():
+        _increment(KMeal, {'stat_date': day, 'PRODNUMB': prod}, KMEAL_FIELDS, d)
+    for (prod, combo), d in stats.kpro_counts.items():
+        _increment(KPro, {'stat_date': day, 'PRODNUMB': prod, 'COMBO': combo}, KPRO_FIELDS, d)
+    _increment(KRev, {'stat_date': day}, REV_FIELDS, stats.rev)
+    for vat_class in set(stats.vat_due) | set(stats.vat_net):
+        _increment(KVatDay, {'stat_date': day, 'VAT_CLASS': vat_class}, ('TOT_VAT', 'T_VAL_EXCLVAT'),
+                   {'TOT_VAT': stats.vat_due.get(vat_class, 0), 'T_VAL_EXCLVAT': stats.vat_net.get(vat_class, 0)})
+
+
+def seed_day(export_date: date) -> bool:
+    """Rebuild a day that has no live counters yet; True if it did."""
+    with transaction.atomic():
+        if is_live(export_date):
+            return False
+        build_daily_stats(export_date)
+        return True
+
+
+def _seed_after_commit(export_date: date) -> None:
+    try:
+        seed_day(export_date)
+    except Exception:
+        logger.exception("seeding live stats for %s failed; the next order or export retries", export_date)
+
+
+def record_order(order: Order, lines: Optional[Iterable] = None) -> None:
+    """Add a just-written order to its business day's live counters.
+
+    Call inside the transaction that writes the order so counters and orders commit
+    together. A day that is not live yet is seeded after that transaction commits
+    (the rebuild then includes this order), so the replay of the day never holds
+    the write lock of a till's order. A failure here never fails the order: the
+    day's KRev row is dropped instead, so the next order (or export) rebuilds the
+    day from scratch.
+    """
+    day = business_day_for(order.created_at)
+    try:
+        with transaction.atomic():
+            if not is_live(day):
+                transaction.on_commit(lambda: _seed_after_commit(day))
+                return
+            _apply(add_order(_empty_stats(day), order, lines))
+    except Exception:
+        logger.exception("live stats update failed for order %s; %s will be rebuilt", order.pk, day)
+        KRev.objects.filter(stat_date=day).delete()
+
+
+def diff_daily_stats(export_date: date) -> List[str]:
+    """Differences between the stored counters for a day and a recompute from its orders."""
+    stats = _aggregate_orders(export_date)
+    diffs: List[str] = []
+
+    def compare(label: str, stored: Dict, expected: Dict, fields: Tuple[str, ...]):
+        for key in sorted(set(stored) | set(expected), key=str):
+            have = stored.get(key, {})
+            want = expected.get(key, {})
+            for f in fields:
+                if int(have.get(f, 0) or 0) != int(want.get(f, 0) or 0):
+                    diffs.append(f"{label} {key} {f}: stored {have.get(f, 0)}, recomputed {want.get(f, 0)}")
+
+    compare('KMeal', {r['PRODNUMB']: r for r in KMeal.objects.filter(stat_date=export_date).values()},
+            stats.meal_counts, KMEAL_FIELDS)
+    compare('KPro', {(r['PRODNUMB'], r['COMBO']): r for r in KPro.objects.filter(stat_date=export_date).values()},
+            stats.kpro_counts, KPRO_FIELDS)
+    rev = KRev.objects.filter(stat_date=export_date).values().first()
+    if rev is None:
+        diffs.append(f"KRev {export_date}: no row (day not live)")
+    else:
+        fields = tuple(f for f in REV_FIELDS if f not in ACT_FIELDS)
+        compare('KRev', {export_date: rev}, {export_date: stats.rev}, fields)
+    compare('KVatDay', {r['VAT_CLASS']: r for r in KVatDay.objects.filter(stat_date=export_date).values()},
+            {c: {'TOT_VAT': stats.vat_due.get(c, 0), 'T_VAL_EXCLVAT': stats.vat_net.get(c, 0)}
+             for c in set(stats.vat_due) | set(stats.vat_net)},
+            ('TOT_VAT', 'T_VAL_EXCLVAT'))
+    return diffs
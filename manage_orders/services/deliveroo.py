@@ -0,0 +1,246 @@
+"""Deliveroo webhook payload handling and the API calls made on its behalf.
+
+classify_webhook() reads a webhook payload once and returns everything the
+webhook decides on (statuses, candidate order ids, PLU verdict). The webhook
+only decides *what* to tell Deliveroo; queue_sync_status() turns that into an
+outbox message (services.outbox) and deliver_sync_status() is the outbox
+handler that performs the HTTP call. Calls use the process-wide session and the
+host-wide OAuth token from services.platform_http.
+"""
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from typing import FrozenSet, Optional, Tuple
+
+from django.utils import timezone
+
+from manage_orders.services.outbox import DeliveryError, enqueue
+from manage_orders.services.platform_http import TokenProvider, TokenUnavailable, session
+
+PLATFORM = 'deliveroo'
+
+# Item fields that can carry our product code, in the order they are consulted
+PLU_FIELDS = ('plu', 'sku', 'pos_code', 'external_id', 'pos_id', 'code')
+
+PLU_OK = 'ok'
+PLU_NOT_FOUND = 'pos_item_id_not_found'
+PLU_MISMATCHED = 'pos_item_id_mismatched'
+
+
+@dataclass(frozen=True)
+class WebhookOrder:
+    """What a Deliveroo webhook payload says about its order, from one pass over it."""
+    order: dict
+    order_ids: Tuple[str, ...]
+    statuses: FrozenSet[str]       # lower-cased, from status_log plus the top-level status
+    top_status: str                # top-level status, else the last status_log entry ('' if none)
+    plu_verdict: str               # PLU_OK / PLU_NOT_FOUND / PLU_MISMATCHED
+    missing_plu_items: Tuple[str, ...]
+
+    @property
+    def accepted(self) -> bool:
+        return 'accepted' in self.statuses
+
+    @property
+    def rejected(self) -> bool:
+        return 'rejected' in self.statuses
+
+    @property
+    def canceled(self) -> bool:
+        return 'canceled' in self.statuses or 'cancelled' in self.statuses
+
+    def sync_status(self) -> Tuple[str, Optional[str]]:
+        """(status, reason) to report for an accepted order."""
+        if self.plu_verdict == PLU_OK:
+            return 'succeeded', None
+        return 'failed', self.plu_verdict
+
+
+def _order_ids(payload: dict, order: dict) -> Tuple[str, ...]:
+    ids = []
+    oid = order.get('id') or payload.get('order_id') or payload.get('id')
+    if oid:
+        ids.append(oid)
+    rd = order.get('remake_details')
+    if isinstance(rd, dict):
+        for k, v in rd.items():
+            if isinstance(v, str) and ('order' in k and 'id' in k):
+                ids.append(v)
+            elif isinstance(v, dict):
+                vid = v.get('id') or v.get('order_id')
+                if vid:
+                    ids.append(vid)
+    return tuple(dict.fromkeys(ids))
+
+
+def _plu_verdict(items: list) -> Tuple[str, Tuple[str, ...]]:
+    """PLU verdict and the names of items without any code, in one pass over the items.
+
+    Failed with pos_item_id_not_found when exactly one item has no code;
+    pos_item_id_mismatched when several items have no code, or when two or more
+    items are coded (which covers one code shared by several items).
+    """
+    missing = []
+    coded = 0
+    for it in items:
+        if not isinstance(it, dict):
+            continue
+        code = None
+        for field in PLU_FIELDS:
+            c = it.get(field)
+            if c and str(c).strip():
+                code = str(c).strip()
+                break
+        if code is None:
+            missing.append(str(it.get('name') or it.get('menu_item_id') or it.get('id') or '?'))
+            continue
+        coded += 1
+    if len(missing) >= 2:
+        verdict = PLU_MISMATCHED
+    elif missing:
+        verdict = PLU_NOT_FOUND
+    elif coded >= 2:
+        verdict = PLU_MISMATCHED
+    else:
+        verdict = PLU_OK
+    return verdict, tuple(missing)
+
+
+def classify_webhook(payload: dict) -> WebhookOrder:
+    """Single pass over a webhook payload: order, candidate ids, statuses and PLU verdict."""
+    body = payload.get('body') or {}
+    order = body.get('order') or {}
+    statuses = set()
+    last_logged = ''
+    for entry in order.get('status_log') or payload.get('status_log') or []:
+        if isinstance(entry, dict):
+            st = entry.get('status') or entry.get('state')
+            if st:
+                last_logged = str(st).lower()
+                statuses.add(last_logged)
+    top = order.get('status') or order.get('state') or payload.get('status') or payload.get('state')
+    top = str(top).lower() if top else ''
+    if top:
+        statuses.add(top)
+    verdict, missing = _plu_verdict(order.get('items') or order.get('line_items') or [])
+    return WebhookOrder(
+        order=order,
+        order_ids=_order_ids(payload, order),
+        statuses=frozenset(statuses),
+        top_status=top or last_logged,
+        plu_verdict=verdict,
+        missing_plu_items=missing,
+    )
+
+
+def _deliveroo_hosts():
+    env = os.getenv('DELIVEROO_ENV', 'sandbox').strip().lower()
+    if env == 'production':
+        api = os.getenv('DELIVEROO_API_BASE_URL', 'https://api.developers.deliveroo.com')
+        auth = os.getenv('DELIVEROO_AUTH_TOKEN_URL', 'https://auth.developers.deliveroo.com/oauth2/token')
+    else:
+        api = os.getenv('DELIVEROO_API_BASE_URL', 'https://api-sandbox.developers.deliveroo.com')
+        auth = os.getenv('DELIVEROO_AUTH_TOKEN_URL', 'https://auth-sandbox.developers.deliveroo.com/oauth2/token')
+    return api, auth
+
+
+def _fetch_token():
+    _, auth = _deliveroo_hosts()
+    data = {
+        'client_id': os.getenv('DELIVEROO_CLIENT_ID', ''),
+        'client_secret': os.getenv('DELIVEROO_CLIENT_SECRET', ''),
+        'grant_type': 'client_credentials',
+    }
+    headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
+    resp = session().post(auth, data=data, headers=headers, timeout=10)
+    if resp.status_code != 200:
+        raise TokenUnavailable(f"Deliveroo auth HTTP {resp.status_code}")
+    payload = resp.json()
+    try:
+        expires_in = int(payload.get('expires_in', 300))
+    except Exception:
+        expires_in = 300
+    return payload.get('access_token'), expires_in
+
+
+tokens = TokenProvider(PLATFORM, _fetch_token)
+
+
+def _post_sync_status(order_id: str, status: str, reason: str | None = None, notes: str | None = None, occurred_at: str | None = None) -> None:
+    api, _ = _deliveroo_hosts()
+    url = f"{api}/order/v1/orders/{order_id}/sync_status"
+    body = {'status': status}
+    if reason:
+        body['reason'] = reason
+    if notes:
+        body['notes'] = notes
+    if occurred_at:
+        body['occurred_at'] = occurred_at
+    try:
+        token = tokens.token()
+    except TokenUnavailable as e:
+        raise DeliveryError(str(e))
+    headers = {'Content-Type': 'application/json', 'Authorization': f'Bearer {token}'}
+    resp = session().post(url, json=body, headers=headers, timeout=20)
+    if resp.status_code == 401:
+        # Revoked or rotated early: drop it so the retry fetches a new one
+        tokens.invalidate(token)
+        raise DeliveryError("sync_status HTTP 401")
+    if resp.status_code >= 500 or resp.status_code in (408, 429):
+        raise DeliveryError(f"sync_status HTTP {resp.status_code}")
+    if resp.status_code >= 400:
+        # The request itself is wrong (unknown order, bad reason); retrying will not help
+        raise DeliveryError(f"sync_status HTTP {resp.status_code}: {resp.text[:200]}", retryable=False)
+
+
+def sync_status_message(payload: dict, order_id: str | None, status: str = 'succeeded', reason_override: str | None = None,
+                        missing_plu_items: Tuple[str, ...] | None = None) -> dict:
+    """Build the sync_status call for an order from the webhook payload.
+
+    Pass missing_plu_items from classify_webhook() to avoid scanning the items again.
+    """
+    body = payload.get('body') or {}
+    order = body.get('order') or {}
+    oid = order_id or order.get('id')
+    market = order.get('market') or payload.get('market')
+    if oid and ':' not in str(oid) and market:
+        oid = f"{market}:{oid}"
+    occurred_at = timezone.now().isoformat(timespec='seconds')
+    reason = None
+    if status == 'failed':
+        if isinstance(reason_override, str) and reason_override.strip():
+            reason = reason_override.strip()
+        else:
+            r = order.get('reject_reason') or order.get('reason')
+            if isinstance(r, str):
+                r = r.strip()
+                if r:
+                    reason = r
+            if not reason:
+                reason = 'other'
+    notes = None
+    if missing_plu_items is None:
+        _, missing_plu_items = _plu_verdict(order.get('items') or order.get('line_items') or [])
+    mp = list(missing_plu_items)
+    if mp:
+        notes = f"missing_plu_items={','.join(mp[:10])}"
+    return {'order_id': str(oid), 'status': status, 'reason': reason, 'notes': notes, 'occurred_at': occurred_at}
+
+
+def queue_sync_status(payload: dict, order_id: str | None, status: str = 'succeeded', reason_override: str | None = None,
+                      missing_plu_items: Tuple[str, ...] | None = None):
+    """Queue a sync_status call; the webhook returns without waiting for Deliveroo."""
+    return enqueue(PLATFORM, 'sync_status',
+                   sync_status_message(payload, order_id, status, reason_override, missing_plu_items))
+
+
+def deliver_sync_status(message: dict) -> None:
+    """Outbox handler: POST one queued sync_status."""
+    _post_sync_status(
+        order_id=message['order_id'],
+        status=message.get('status') or 'succeeded',
+        reason=message.get('reason'),
+        notes=message.get('notes'),
+        occurred_at=message.get('occurred_at'),
+    )
@@ -0,0 +1,182 @@
+"""On-disk cache of the daily export ZIPs, built by one caller at a time.
+
+Artifacts are content-addressed: the file name carries a digest of everything
+the export depends on (export_key) - the business day, the day's orders
+high-watermark (count and highest id), the catalog version and the EPOS_*
+settings that change how orders are counted. A late order for the day, an
+import or a flag change therefore yields a new key, and an unchanged day is
+served straight from disk however often it is downloaded. Range bundles
+(range_zip) are keyed by the keys of all their days. A day's live counters
+only follow new orders, so building an artifact recomputes the day whenever
+the catalog version or flags differ from its last rebuild (_prepare_day).
+
+Builds are single-flight across threads and worker processes: the first caller
+takes an exclusive lock (an in-process lock plus a file lock in the cache
+directory, as services.platform_http does for OAuth tokens), rebuilds the K
+tables and writes the ZIP; later callers block on the lock and then find the
+finished file. clear_after_export() takes the same lock, so clearing the K
+tables after a download can never land in the middle of someone else's build.
+
+daily_zip() and range_zip() hand out an open file, not a path: a later build
+deletes the artifacts it supersedes, and an open handle keeps reading the old
+one to the end (POSIX).
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from datetime import date
+from pathlib import Path
+from typing import BinaryIO, Callable, Dict, List, Optional
+
+from django.conf import settings
+
+from manage_orders.services import daily_csv, range_export
+from manage_orders.services.daily_stats import build_daily_stats, ensure_daily_stats, orders_watermark
+from manage_orders.services.stats_backfill import day_range
+from update_till.catalog import catalog_version
+
+try:  # POSIX; elsewhere builds are single-flight per process only
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+# Settings that change the exported numbers for the same orders and catalog
+EXPORT_FLAGS = ('EPOS_US_MODE', 'EPOS_GROSS_COMBO_DISCOUNT', 'EPOS_GROSS_MEAL_DISCOUNT', 'EPOS_BUSINESS_DAY_CUTOFF')
+
+_lock = threading.Lock()
+
+
+def cache_dir() -> Path:
+    directory = getattr(settings, 'EPOS_EXPORT_CACHE_DIR', '') or os.path.join(tempfile.gettempdir(), 'epos-export-cache')
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _digest(inputs: Dict[str, object]) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:32]
+
+
+def _basis() -> Dict[str, object]:
+    """The export inputs every counter of a day is computed under (all but the orders themselves)."""
+    return {
+        'catalog': catalog_version(),
+        'flags': {name: getattr(settings, name, None) for name in EXPORT_FLAGS},
+    }
+
+
+def export_key(export_date: date) -> str:
+    """Digest of the inputs the day's export is derived from."""
+    return _digest({'date': export_date.isoformat(), 'orders': list(orders_watermark(export_date)), **_basis()})
+
+
+def _artifact(export_date: date, key: str) -> Path:
+    return cache_dir() / f"daily_csvs_{export_date:%Y%m%d}_{key}.zip"
+
+
+@contextmanager
+def export_lock():
+    """Held while K tables are rebuilt for an export or cleared after one."""
+    with _lock:
+        if fcntl is None:
+            yield
+            return
+        with open(cache_dir() / '.lock', 'a+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+
+def _publish(path: Path, write: Callable[[BinaryIO], object]) -> None:
+    """Write an artifact next to its final name, then swap it in and drop superseded ones."""
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp, 'wb') as fh:
+        write(fh)
+    os.replace(tmp, path)
+    # Older artifacts for the same day / range can never be served again
+    prefix = path.name.rsplit('_', 1)[0]
+    for stale in path.parent.glob(f"{prefix}_*.zip"):
+        if stale != path:
+            try:
+                stale.unlink(missing_ok=True)
+            except OSError:  # still open for a download on Windows; the next build retries
+                pass
+
+
+def _cached(artifact: Callable[[], Path], build: Callable[[Path], None]) -> BinaryIO:
+    try:
+        return open(artifact(), 'rb')
+    except FileNotFoundError:
+        pass
+    with export_lock():
+        # The key is re-read under the lock: the build we waited for may have seen a later order
+        path = artifact()
+        if not path.exists():
+            build(path)
+        # Opened before the lock is released, so no other build can remove it first
+        return open(path, 'rb')
+
+
+def _basis_path(export_date: date) -> Path:
+    return cache_dir() / f"basis_{export_date:%Y%m%d}.txt"
+
+
+def _prepare_day(export_date: date) -> None:
+    """Make the day's K tables current for its export.
+
+    Live counters follow new orders, but they were computed under the catalog and
+    flags of the moment, and ensure_daily_stats() does not recompute them. So the
+    day is rebuilt from its orders unless its last rebuild for an export ran under
+    the current catalog version and flags (recorded next to the artifacts).
+    """
+    basis = _digest(_basis())
+    path = _basis_path(export_date)
+    try:
+        current = path.read_text(encoding='ascii') == basis
+    except OSError:
+        current = False
+    if current:
+        ensure_daily_stats(export_date)
+    else:
+        build_daily_stats(export_date)
+        path.write_text(basis, encoding='ascii')
+
+
+def _write_day(export_date: date, fh: BinaryIO) -> None:
+    _prepare_day(export_date)
+    for chunk in daily_csv.iter_daily_zip(export_date):
+        fh.write(chunk)
+
+
+def daily_zip(export_date: date) -> BinaryIO:
+    """The day's export ZIP for the current inputs, opened for reading; built first if nobody has."""
+    return _cached(lambda: _artifact(export_date, export_key(export_date)),
+                   lambda path: _publish(path, lambda fh: _write_day(export_date, fh)))
+
+
+def range_key(days: List[date]) -> str:
+    return hashlib.sha256(','.join(export_key(d) for d in days).encode('ascii')).hexdigest()[:32]
+
+
+def range_zip(start: date, end: date, workers: Optional[int] = None) -> BinaryIO:
+    """The bundle for start..end (services.range_export), opened for reading; built first if nobody has.
+
+    Every day of the range is rebuilt under the export lock, so the K tables end
+    up holding the whole range and no clear can interleave with the rebuild.
+    """
+    days = day_range(start, end)
+    return _cached(lambda: cache_dir() / f"daily_csvs_{start:%Y%m%d}-{end:%Y%m%d}_{range_key(days)}.zip",
+                   lambda path: _publish(path, lambda fh: range_export.write_bundle(days, fh, workers)))
+
+
+def clear_after_export(export_date: date) -> Dict[str, int]:
+    """daily_csv.clear_daily_stats() for the exported day, never concurrently with a build."""
+    with export_lock():
+        return daily_csv.clear_daily_stats(export_date)
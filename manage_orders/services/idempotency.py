@@ -0,0 +1,57 @@
+"""Duplicate detection for inbound platform webhooks.
+
+Platforms retry a webhook until they see a 2xx and resend status updates for
+an order they have already told us about. claim_event() records a key the
+first time it is seen and reports every later sighting within the TTL
+(EPOS_WEBHOOK_IDEMPOTENCY_TTL_HOURS, default 48) as a duplicate, so the
+webhook can acknowledge it without parsing the body or queuing another
+outbound call.
+
+Keys are looked up through the unique (platform, key) index; claiming is a
+single INSERT, and a losing race surfaces as an IntegrityError rather than a
+second claim. Call it inside the transaction that does the event's work so a
+failed request releases its claim.
+"""
+from __future__ import annotations
+
+import hashlib
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from manage_orders.models import WebhookEvent
+
+
+def body_key(raw: bytes) -> str:
+    """Key for an exact redelivery of the same request body."""
+    return 'body:' + hashlib.sha256(raw).hexdigest()
+
+
+def _ttl() -> timedelta:
+    return timedelta(hours=float(getattr(settings, 'EPOS_WEBHOOK_IDEMPOTENCY_TTL_HOURS', 48)))
+
+
+def claim_event(platform: str, key: str, ttl: Optional[timedelta] = None) -> bool:
+    """True the first time (platform, key) is seen within the TTL, False for a duplicate."""
+    now = timezone.now()
+    expires_at = now + (ttl or _ttl())
+    key = key[:200]
+    try:
+        with transaction.atomic():
+            WebhookEvent.objects.create(platform=platform, key=key, created_at=now, expires_at=expires_at)
+        return True
+    except IntegrityError:
+        # Seen before; an expired record (not yet purged) counts as new again
+        revived = WebhookEvent.objects.filter(platform=platform, key=key, expires_at__lte=now).update(
+            created_at=now, expires_at=expires_at,
+        )
+        return bool(revived)
+
+
+def purge_expired(now=None) -> int:
+    """Delete expired records; returns how many were removed."""
+    deleted, _ = WebhookEvent.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
@@ -0,0 +1,181 @@
+"""Pre-rendered menu payloads for the till's category views.
+
+api_menu_categories and api_category_items return the same JSON for every till
+until the catalog changes. Instead of serializing on each click, every payload
+for all six price bands is rendered once per catalog snapshot into bytes with a
+strong ETag, and the views serve those bytes (or a 304) directly.
+
+The same step renders one gzip-compressed bundle per band (api_menu_bundle)
+holding categories, every category's items, item details and toppings, so the
+till can preload a band in a single request and open the configuration modal
+without a round trip.
+
+Materialization runs when update_till.catalog swaps in a new snapshot (after an
+import, or on the first request after a worker notices a version change).
+"""
+from __future__ import annotations
+
+import gzip
+import hashlib
+import json
+import threading
+from dataclasses import dataclass
+from typing import Dict, Mapping, Optional, Tuple
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpRequest, HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
+
+from update_till.catalog import CatalogSnapshot, get_catalog
+
+BANDS: Tuple[str, ...] = ('1', '2', '3', '4', '5', '6')
+
+
+@dataclass(frozen=True)
+class MenuPayload:
+    body: bytes
+    etag: str
+    gzipped: Optional[bytes] = None   # pre-compressed body, served when the client accepts gzip
+
+    @property
+    def gzip_etag(self) -> str:
+        # Distinct strong validator for the compressed representation
+        return self.etag[:-1] + '-gz"'
+
+
+@dataclass(frozen=True)
+class MaterializedMenu:
+    catalog: CatalogSnapshot
+    categories: Mapping[Tuple[str, bool], MenuPayload]        # (band, include_empty)
+    category_items: Mapping[Tuple[str, int], MenuPayload]     # (band, EPOS_GROUP_ID)
+    bundles: Mapping[str, MenuPayload]                         # band
+
+
+def _payload(version: int, data: dict, compress: bool = False) -> MenuPayload:
+    body = json.dumps(data, cls=DjangoJSONEncoder).encode('utf-8')
+    # Strong validator: catalog version plus a digest of the exact bytes served
+    digest = hashlib.sha256(body).hexdigest()[:20]
+    # mtime=0 keeps the compressed bytes identical across workers for the same body
+    gzipped = gzip.compress(body, compresslevel=6, mtime=0) if compress else None
+    return MenuPayload(body=body, etag=f'"menu-v{version}-{digest}"', gzipped=gzipped)
+
+
+def _bundle_data(catalog: CatalogSnapshot, band: str, categories: dict, items: Dict[int, dict]) -> dict:
+    """Everything the till needs for one band: categories, items, item details and toppings."""
+    from manage_orders.views import _item_detail_data, _product_toppings_data
+
+    details: Dict[str, dict] = {}
+    toppings: Dict[str, dict] = {}
+    for data in items.values():
+        for it in data['items']:
+            key = f"{it['type']}:{it['code']}"
+            if key in details:
+                continue
+            detail = _item_detail_data(catalog, band, it['type'], it['code'])
+            if detail is not None:
+                details[key] = detail
+            if it['type'] == 'product' and str(it['code']) not in toppings:
+                toppings[str(it['code'])] = _product_toppings_data(catalog, it['code'])
+    return {
+        'band': band,
+        'version': catalog.version,
+        'categories': categories['categories'],
+        'items': {str(group_id): data['items'] for group_id, data in items.items()},
+        'details': details,
+        'toppings': toppings,
+    }
+
+
+def materialize(catalog: CatalogSnapshot) -> MaterializedMenu:
+    """Render every category list, category item payload and band bundle for all bands."""
+    # Builders live with the serializers in views; imported here to avoid a cycle at import time
+    from manage_orders.views import _category_items_data, _menu_categories_data
+
+    categories: Dict[Tuple[str, bool], MenuPayload] = {}
+    items: Dict[Tuple[str, int], MenuPayload] = {}
+    bundles: Dict[str, MenuPayload] = {}
+    for band in BANDS:
+        band_categories = {}
+        for include_empty in (False, True):
+            band_categories[include_empty] = _menu_categories_data(catalog, band, include_empty)
+            categories[(band, include_empty)] = _payload(catalog.version, band_categories[include_empty])
+        band_items: Dict[int, dict] = {}
+        for grp in catalog.epos_groups:
+            data = _category_items_data(catalog, band, grp.EPOS_GROUP_ID)
+            if data is not None:
+                band_items[grp.EPOS_GROUP_ID] = data
+                items[(band, grp.EPOS_GROUP_ID)] = _payload(catalog.version, data)
+        # The till asks for categories with include_empty=1
+        bundles[band] = _payload(catalog.version, _bundle_data(catalog, band, band_categories[True], band_items), compress=True)
+    return MaterializedMenu(catalog=catalog, categories=categories, category_items=items, bundles=bundles)
+
+
+_lock = threading.Lock()
+_menu: Optional[MaterializedMenu] = None
+
+
+def get_menu() -> MaterializedMenu:
+    """Payloads for the current catalog snapshot, materializing them if the snapshot changed."""
+    global _menu
+    catalog = get_catalog()
+    menu = _menu
+    if menu is not None and menu.catalog is catalog:
+        return menu
+    with _lock:
+        menu = _menu
+        if menu is None or menu.catalog is not catalog:
+            menu = materialize(catalog)
+            _menu = menu
+        return menu
+
+
+def on_catalog_rebuilt(sender, snapshot: CatalogSnapshot, **kwargs):
+    """catalog_rebuilt receiver: render payloads eagerly so the first click is already a hit."""
+    global _menu
+    with _lock:
+        if _menu is None or _menu.catalog is not snapshot:
+            _menu = materialize(snapshot)
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """True when an Accept-Encoding header allows gzip (an explicit or wildcard q-value above 0)."""
+    qualities: Dict[str, float] = {}
+    for part in accept_encoding.split(','):
+        coding, *params = [p.strip() for p in part.split(';')]
+        if not coding:
+            continue
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.lower()] = q
+    return qualities.get('gzip', qualities.get('*', 0.0)) > 0
+
+
+def respond(request: HttpRequest, payload: MenuPayload) -> HttpResponse:
+    """Serve a pre-rendered payload, answering If-None-Match with 304 when it still matches.
+
+    Payloads with a pre-compressed body are sent gzip-encoded to clients that accept it.
+    """
+    use_gzip = payload.gzipped is not None and accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', ''))
+    etag = payload.gzip_etag if use_gzip else payload.etag
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        tags = parse_etags(if_none_match)
+        if '*' in tags or etag in tags:
+            resp = HttpResponseNotModified()
+            resp['ETag'] = etag
+            return resp
+    resp = HttpResponse(payload.gzipped if use_gzip else payload.body, content_type='application/json')
+    if use_gzip:
+        resp['Content-Encoding'] = 'gzip'
+    if payload.gzipped is not None:
+        resp['Vary'] = 'Accept-Encoding'
+    resp['ETag'] = etag
+    # Tills may keep a copy but must revalidate on each use so catalog imports show up immediately
+    resp['Cache-Control'] = 'no-cache'
+    return resp
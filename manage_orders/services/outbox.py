@@ -0,0 +1,244 @@
+"""Durable outbox for outbound platform calls (Deliveroo sync_status, ...).
+
+Requests never call a platform themselves: they insert an OutboxMessage with
+enqueue() and return. Delivery happens in drain():
+
+    - due rows (pending, or sending with an expired lease) are claimed with a
+      conditional UPDATE, so several web workers and `manage.py drain_outbox`
+      can drain the same table without sending a message twice;
+    - handler calls run on a fixed-size thread pool (EPOS_OUTBOX_WORKERS) with
+      at most EPOS_OUTBOX_PLATFORM_CONCURRENCY in flight per platform; a batch
+      claims no more per platform than that, so every claimed call starts at
+      once and finishes inside its lease; the pool threads only do network
+      I/O, all bookkeeping stays on the draining thread;
+    - outcomes are recorded only while the drainer still holds the claim, so
+      a late reply never overwrites a newer attempt by another drainer;
+    - failures are retried with exponential backoff (EPOS_OUTBOX_BACKOFF_SECONDS
+      doubling up to EPOS_OUTBOX_BACKOFF_MAX_SECONDS); permanent failures and
+      messages out of attempts (EPOS_OUTBOX_MAX_ATTEMPTS) become dead letters.
+
+With EPOS_OUTBOX_INLINE_DISPATCH (default on) each web process runs one daemon
+dispatcher thread that drains after every enqueue commit and again when the
+next retry falls due. `manage.py drain_outbox --loop` is the standalone worker
+for deployments that turn inline dispatch off, and picks up anything a recycled
+web worker left behind.
+
+Handlers are registered in HANDLERS as dotted paths taking the message payload;
+they raise DeliveryError to report a failure.
+"""
+from __future__ import annotations
+
+import logging
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from manage_orders.models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# (platform, kind) -> dotted path of a callable(payload: dict) -> None
+HANDLERS: Dict[tuple, str] = {
+    ('deliveroo', 'sync_status'): 'manage_orders.services.deliveroo.deliver_sync_status',
+}
+
+# A claimed message is re-offered if its sender has not reported back by then
+# (worker killed mid-call); longer than any handler's HTTP timeout. Calls start
+# as soon as they are claimed (see claim(per_platform=...)), so the lease only
+# has to cover one call.
+LEASE_SECONDS = 120
+
+
+class DeliveryError(Exception):
+    """Raised by handlers; retryable=False dead-letters the message at once (e.g. HTTP 4xx)."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Delay before retry number `attempts` (1-based): base * 2^(n-1), capped, plus up to 10% jitter."""
+    base = float(_setting('EPOS_OUTBOX_BACKOFF_SECONDS', 5))
+    cap = float(_setting('EPOS_OUTBOX_BACKOFF_MAX_SECONDS', 900))
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    return delay * (1 + random.random() * 0.1)
+
+
+def enqueue(platform: str, kind: str, payload: dict) -> OutboxMessage:
+    """Record an outbound call; it is sent after the surrounding transaction commits."""
+    msg = OutboxMessage.objects.create(platform=platform, kind=kind, payload=payload)
+    if _setting('EPOS_OUTBOX_INLINE_DISPATCH', True):
+        transaction.on_commit(wake)
+    return msg
+
+
+def _due():
+    return OutboxMessage.objects.filter(
+        status__in=[OutboxMessage.STATUS_PENDING, OutboxMessage.STATUS_SENDING],
+        next_attempt_at__lte=timezone.now(),
+    )
+
+
+def _candidates(limit: int, per_platform: Optional[int]) -> list:
+    due = _due().order_by('next_attempt_at', 'id')
+    if per_platform is None:
+        return list(due.values_list('id', flat=True)[:limit])
+    picked, taken = [], {}
+    for pk, platform in due.values_list('id', 'platform').iterator():
+        if taken.get(platform, 0) < per_platform:
+            taken[platform] = taken.get(platform, 0) + 1
+            picked.append(pk)
+            if len(picked) >= limit:
+                break
+    return picked
+
+
+def claim(limit: int, per_platform: Optional[int] = None) -> list:
+    """Claim up to `limit` due messages for this process (marks them sending, counts the attempt).
+
+    With `per_platform`, at most that many are taken for each platform.
+    """
+    now = timezone.now()
+    candidates = _candidates(limit, per_platform)
+    claimed = []
+    for pk in candidates:
+        # Conditional update: only one drainer wins each row
+        won = OutboxMessage.objects.filter(
+            pk=pk,
+            status__in=[OutboxMessage.STATUS_PENDING, OutboxMessage.STATUS_SENDING],
+            next_attempt_at__lte=now,
+        ).update(
+            status=OutboxMessage.STATUS_SENDING,
+            next_attempt_at=now + timedelta(seconds=LEASE_SECONDS),
+            attempts=F('attempts') + 1,
+        )
+        if won:
+            claimed.append(pk)
+    return list(OutboxMessage.objects.filter(pk__in=claimed).order_by('id'))
+
+
+def _call(msg: OutboxMessage, gates: Dict[str, threading.Semaphore]) -> Optional[DeliveryError]:
+    """Run the handler for one message on a pool thread; returns the failure, if any."""
+    path = HANDLERS.get((msg.platform, msg.kind))
+    if not path:
+        return DeliveryError(f"no handler for {msg.platform}:{msg.kind}", retryable=False)
+    with gates[msg.platform]:
+        try:
+            import_string(path)(msg.payload)
+        except DeliveryError as e:
+            return e
+        except Exception as e:
+            return DeliveryError(repr(e))
+    return None
+
+
+def _record(msg: OutboxMessage, error: Optional[DeliveryError]) -> Optional[str]:
+    """Store the outcome of this drainer's attempt; None if another drainer has claimed it since."""
+    now = timezone.now()
+    # Only while our claim stands: same attempt, still sending
+    mine = OutboxMessage.objects.filter(pk=msg.pk, status=OutboxMessage.STATUS_SENDING, attempts=msg.attempts)
+    if error is None:
+        outcome = 'sent'
+        updated = mine.update(status=OutboxMessage.STATUS_SENT, sent_at=now, last_error='')
+    elif not error.retryable or msg.attempts >= int(_setting('EPOS_OUTBOX_MAX_ATTEMPTS', 8)):
+        outcome = 'dead'
+        updated = mine.update(status=OutboxMessage.STATUS_DEAD, last_error=str(error)[:2000])
+        if updated:
+            logger.warning("outbox %s:%s #%s dead-lettered after %s attempt(s): %s",
+                           msg.platform, msg.kind, msg.pk, msg.attempts, error)
+    else:
+        outcome = 'retry'
+        updated = mine.update(
+            status=OutboxMessage.STATUS_PENDING,
+            next_attempt_at=now + timedelta(seconds=backoff_seconds(msg.attempts)),
+            last_error=str(error)[:2000],
+        )
+    if not updated:
+        logger.warning("outbox %s:%s #%s attempt %s finished after its lease was taken over; outcome %s dropped",
+                       msg.platform, msg.kind, msg.pk, msg.attempts, outcome)
+        return None
+    return outcome
+
+
+def drain(workers: Optional[int] = None) -> Dict[str, int]:
+    """Deliver every message that is due now; returns counts of sent / retry / dead."""
+    workers = max(1, int(workers or _setting('EPOS_OUTBOX_WORKERS', 4)))
+    per_platform = max(1, int(_setting('EPOS_OUTBOX_PLATFORM_CONCURRENCY', 2)))
+    gates: Dict[str, threading.Semaphore] = {}
+    counts = {'sent': 0, 'retry': 0, 'dead': 0}
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='outbox') as pool:
+        while True:
+            # No more per platform than can be in flight, so no claimed call waits out its lease
+            batch = claim(workers, per_platform=per_platform)
+            if not batch:
+                break
+            for msg in batch:
+                gates.setdefault(msg.platform, threading.Semaphore(per_platform))
+            futures = {pool.submit(_call, msg, gates): msg for msg in batch}
+            for fut in as_completed(futures):
+                outcome = _record(futures[fut], fut.result())
+                if outcome:
+                    counts[outcome] += 1
+    return counts
+
+
+def next_due_in() -> Optional[float]:
+    """Seconds until the earliest pending/leased message is due (0 if overdue), None if none."""
+    nxt = (OutboxMessage.objects
+           .filter(status__in=[OutboxMessage.STATUS_PENDING, OutboxMessage.STATUS_SENDING])
+           .order_by('next_attempt_at').values_list('next_attempt_at', flat=True).first())
+    if nxt is None:
+        return None
+    return max(0.0, (nxt - timezone.now()).total_seconds())
+
+
+# In-process dispatcher: one daemon thread per process, woken by enqueue()
+_wakeup = threading.Event()
+_dispatcher: Optional[threading.Thread] = None
+_dispatcher_lock = threading.Lock()
+
+
+def _dispatch_forever():
+    while True:
+        _wakeup.wait(timeout=_wait_seconds())
+        _wakeup.clear()
+        try:
+            drain()
+        except Exception:
+            logger.exception("outbox drain failed")
+        finally:
+            close_old_connections()
+
+
+def _wait_seconds() -> Optional[float]:
+    try:
+        due = next_due_in()
+    except Exception:
+        due = None
+    finally:
+        close_old_connections()
+    poll = float(_setting('EPOS_OUTBOX_POLL_SECONDS', 30))
+    return poll if due is None else min(due, poll)
+
+
+def wake() -> None:
+    """Start this process's dispatcher thread if needed and ask it to drain now."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None or not _dispatcher.is_alive():
+            _dispatcher = threading.Thread(target=_dispatch_forever, name='outbox-dispatcher', daemon=True)
+            _dispatcher.start()
+    _wakeup.set()
@@ -0,0 +1,146 @@
+"""HTTP plumbing shared by the delivery-platform clients (services.deliveroo, ...).
+
+session():
+    One keep-alive requests.Session per process, so outbox workers reuse TLS
+    connections instead of opening one per call. A forked child (gunicorn
+    worker) gets its own session on first use.
+
+TokenProvider:
+    OAuth client-credentials token shared by every worker process on the host.
+    The current token lives in a small JSON file (EPOS_PLATFORM_TOKEN_DIR,
+    default the system temp dir) guarded by an exclusive file lock, with an
+    in-memory copy per process. It is refreshed EPOS_PLATFORM_TOKEN_REFRESH_MARGIN
+    seconds before it expires (at most half its lifetime, so short-lived tokens
+    are still reused), and only one thread in one process performs a refresh at
+    a time; everyone else waits and reuses the result.
+"""
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Optional, Tuple
+
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+try:  # POSIX; elsewhere refreshes are single-flight per process only
+    import fcntl
+except ImportError:  # pragma: no cover - Windows dev machines
+    fcntl = None
+
+_session: Optional[requests.Session] = None
+_session_pid: Optional[int] = None
+_session_lock = threading.Lock()
+
+
+def session() -> requests.Session:
+    """This process's pooled keep-alive session for platform APIs."""
+    global _session, _session_pid
+    pid = os.getpid()
+    if _session is not None and _session_pid == pid:
+        return _session
+    with _session_lock:
+        if _session is None or _session_pid != pid:
+            size = max(4, int(getattr(settings, 'EPOS_OUTBOX_WORKERS', 4)))
+            s = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=size)
+            s.mount('https://', adapter)
+            s.mount('http://', adapter)
+            _session, _session_pid = s, pid
+        return _session
+
+
+class TokenUnavailable(Exception):
+    """The auth endpoint did not return a usable token."""
+
+
+class TokenProvider:
+    """Cross-process cached bearer token for one platform account.
+
+    fetch() performs the actual token request and returns (access_token, expires_in seconds).
+    """
+
+    def __init__(self, name: str, fetch: Callable[[], Tuple[str, float]]):
+        self.name = name
+        self._fetch = fetch
+        self._lock = threading.Lock()
+        self._token: Optional[str] = None
+        self._expires_at = 0.0
+
+    @property
+    def path(self) -> str:
+        directory = getattr(settings, 'EPOS_PLATFORM_TOKEN_DIR', '') or tempfile.gettempdir()
+        return os.path.join(str(directory), f'epos-token-{self.name}.json')
+
+    def _margin(self, expires_in: float) -> float:
+        margin = float(getattr(settings, 'EPOS_PLATFORM_TOKEN_REFRESH_MARGIN', 120))
+        return min(margin, expires_in / 2)
+
+    def _fresh(self, expires_at: float) -> bool:
+        # expires_at already has the refresh margin taken off
+        return time.time() < expires_at
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + '.lock', 'a+') as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _read_file(self) -> Tuple[Optional[str], float]:
+        try:
+            with open(self.path, encoding='utf-8') as fh:
+                data = json.load(fh)
+            return data.get('access_token'), float(data.get('expires_at') or 0)
+        except (OSError, ValueError, TypeError):
+            return None, 0.0
+
+    def _write_file(self, token: str, expires_at: float) -> None:
+        tmp = f'{self.path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as fh:
+            json.dump({'access_token': token, 'expires_at': expires_at}, fh)
+        os.replace(tmp, self.path)
+
+    def token(self) -> str:
+        """A token valid for at least the refresh margin, refreshing it if nobody else has."""
+        token, expires_at = self._token, self._expires_at
+        if token and self._fresh(expires_at):
+            return token
+        with self._lock:
+            if self._token and self._fresh(self._expires_at):
+                return self._token
+            with self._file_lock():
+                token, expires_at = self._read_file()
+                if not (token and self._fresh(expires_at)):
+                    token, expires_in = self._fetch()
+                    if not token:
+                        raise TokenUnavailable(f'{self.name}: empty access token')
+                    expires_in = float(expires_in)
+                    expires_at = time.time() + expires_in - self._margin(expires_in)
+                    self._write_file(token, expires_at)
+            self._token, self._expires_at = token, expires_at
+            return token
+
+    def invalidate(self, token: Optional[str] = None) -> None:
+        """Forget the token (e.g. after a 401); with `token`, only if it is still the current one."""
+        with self._lock:
+            with self._file_lock():
+                current, _ = self._read_file()
+                if token is None or current == token:
+                    try:
+                        os.remove(self.path)
+                    except OSError:
+                        pass
+            if token is None or self._token == token:
+                self._token, self._expires_at = None, 0.0
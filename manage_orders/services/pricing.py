@@ -0,0 +1,168 @@
+"""Till and nightly-export pricing rules in one place.
+
+The till (api_submit_order, the kids-meal preview in the category payloads) and
+build_daily_stats all price meals, combos and VAT the same way; these helpers are
+the single copy of those rules:
+
+    - standard_price:        band price of a product (options / extras / combo parts)
+    - meal_component_price:  discounted (DC_VATPR*) price where set (> 0), else standard
+    - meal_price:            burger + fries + drink at meal component prices, plus options at standard
+    - meal_discount:         singles total minus meal components total (ex-VAT or gross)
+    - combo_discount:        A - B, components at standard price minus the combo line price
+    - net_of_vat / net_for:  one rounding rule (update_till.price_matrix.net_pence)
+
+Per-item prices are read from the catalog snapshot's price matrix. Composite
+results are memoized by (band, codes); the memo belongs to the snapshot it was
+computed from and is dropped as soon as get_catalog() returns a different one,
+so an import (or an ORM edit, which also builds a new snapshot) never serves a
+stale price. Keys come from request data (bands, option codes), so the memo
+keeps only the MEMO_SIZE most recently used results.
+
+`band` may be given as '1'..'6' or 1..6; `basis` as 'take'/'eat' (orders) or
+'TAKEAWAY'/'EATIN' (stats tables).
+"""
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from update_till.catalog import CatalogSnapshot, get_catalog
+from update_till.price_matrix import net_pence
+
+MEMO_SIZE = 4096
+
+_lock = threading.Lock()
+_memo_catalog: Optional[CatalogSnapshot] = None
+_memo: OrderedDict = OrderedDict()
+
+
+def _memoized(catalog: CatalogSnapshot, key: tuple, compute):
+    """compute() once per key and snapshot, least recently used entries evicted past MEMO_SIZE."""
+    global _memo_catalog, _memo
+    with _lock:
+        if _memo_catalog is not catalog:
+            # New snapshot: everything memoized so far may be stale
+            _memo_catalog = catalog
+            _memo = OrderedDict()
+        memo = _memo
+        try:
+            memo.move_to_end(key)
+            return memo[key]
+        except KeyError:
+            pass
+    value = compute()
+    with _lock:
+        if memo is _memo:
+            memo[key] = value
+            if len(memo) > MEMO_SIZE:
+                memo.popitem(last=False)
+    return value
+
+
+def _basis(basis: str) -> str:
+    return 'eat' if str(basis).lower() in {'eat', 'eatin'} else 'take'
+
+
+def net_of_vat(gross: int, rate) -> int:
+    """Price excluding VAT at `rate` percent, in whole pence (see net_pence)."""
+    return net_pence(gross, rate)
+
+
+def vat_rate(code: int, basis: str, combo: bool = False, catalog: Optional[CatalogSnapshot] = None) -> float:
+    catalog = catalog or get_catalog()
+    matrix = catalog.combo_prices if combo else catalog.product_prices
+    return matrix.vat_rate(code, _basis(basis))
+
+
+def product_vat_classes(catalog: Optional[CatalogSnapshot] = None) -> dict:
+    """code -> (EAT_VAT_CLASS, TAKE_VAT_CLASS) for every product, built once per snapshot."""
+    catalog = catalog or get_catalog()
+    return _memoized(catalog, ('product_vat_classes',), lambda: {
+        code: (p.EAT_VAT_CLASS, p.TAKE_VAT_CLASS) for code, p in catalog.products.items()
+    })
+
+
+def net_for(code: int, gross: int, basis: str, combo: bool = False, catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Net of an arbitrary gross amount at the product's (or combo's) VAT rate for the basis."""
+    return net_of_vat(gross, vat_rate(code, basis, combo=combo, catalog=catalog))
+
+
+def standard_price(band, code: int, basis: str = 'gross', catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Standard band price of a product (gross, or net for 'take'/'eat'); 0 if unknown."""
+    catalog = catalog or get_catalog()
+    column = 'gross' if basis == 'gross' else _basis(basis)
+    return catalog.product_prices.price(code, band, basis=column)
+
+
+def meal_component_price(band, code: int, basis: str = 'gross', catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Price of a product inside a meal: discounted if available (> 0), else standard."""
+    catalog = catalog or get_catalog()
+    column = 'gross' if basis == 'gross' else _basis(basis)
+    return catalog.product_prices.meal_component(code, band, column)
+
+
+def meal_price(band, burger_code: int, fries_code: int, drink_code: int, option_codes: Iterable[int] = (),
+               catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Meal unit price (gross pence) for a band.
+
+    Business rule (derived from MEAL_DISCOUNT docs): meal price = sum of discounted component
+    prices (burger, fries, drink) where a discounted (DC_) price is defined (>0), otherwise
+    fall back to the component's standard price. Additional optional products always add their
+    full standard price (no meal discount applied to them).
+    """
+    catalog = catalog or get_catalog()
+    band = str(band)
+    options = tuple(option_codes or ())
+
+    def compute():
+        total = sum(meal_component_price(band, c, catalog=catalog) for c in (burger_code, fries_code, drink_code))
+        total += sum(standard_price(band, oc, catalog=catalog) for oc in options)
+        return int(total)
+    return _memoized(catalog, ('meal', band, burger_code, fries_code, drink_code, options), compute)
+
+
+def meal_discount(band, burger_code: int, fries_code: int, drink_code: int, basis: str, gross: bool = False,
+                  catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Per-meal discount: components at standard price minus the same components at meal price.
+
+    Ex-VAT (each component netted at its own class for the basis) unless gross=True.
+    """
+    catalog = catalog or get_catalog()
+    band = str(band)
+    column = 'gross' if gross else _basis(basis)
+
+    def compute():
+        codes = (burger_code, fries_code, drink_code)
+        singles = sum(standard_price(band, c, column, catalog=catalog) for c in codes)
+        meal = sum(meal_component_price(band, c, column, catalog=catalog) for c in codes)
+        return int(singles - meal)
+    return _memoized(catalog, ('meal_discount', band, burger_code, fries_code, drink_code, column), compute)
+
+
+def components_total(band, codes: Iterable[int], basis: str = 'gross',
+                     catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Sum of standard band prices (gross, or net for the basis) for component products."""
+    catalog = catalog or get_catalog()
+    band = str(band)
+    codes = tuple(codes)
+    column = 'gross' if basis == 'gross' else _basis(basis)
+    return _memoized(catalog, ('components', band, codes, column),
+                     lambda: int(sum(standard_price(band, c, column, catalog=catalog) for c in codes)))
+
+
+def combo_discount(band, combo_code: int, component_codes: Iterable[int], combo_gross: int, basis: str,
+                   gross: bool = False, catalog: Optional[CatalogSnapshot] = None) -> int:
+    """Combination discount per unit: A (components at standard price) - B (combo line price).
+
+    Ex-VAT by default: components netted at their own classes, the combo price at the
+    combo's class for the basis. With gross=True both sides are VAT-inclusive.
+    """
+    catalog = catalog or get_catalog()
+    combo_gross = int(combo_gross or 0)
+    if gross:
+        return components_total(band, component_codes, catalog=catalog) - combo_gross
+    a = components_total(band, component_codes, basis, catalog=catalog)
+    b = net_for(combo_code, combo_gross, basis, combo=True, catalog=catalog)
+    return a - b
+
@@ -0,0 +1,74 @@
+"""One ZIP holding the export files for a range of business days.
+
+write_bundle() rebuilds every day of the range through stats_backfill (days
+computed in worker processes, applied here in date order) and, as each day is
+written, adds its MP / PD / RV files under a <YYYY-MM-DD>/ folder. Once the
+last day is applied K_WK_VAT holds the range's final week and is added at the
+top level, followed by manifest.json:
+
+    {"from": ..., "to": ..., "workers": n, "elapsed_seconds": ...,
+     "days": [{"date", "orders", "compute_seconds", "write_seconds",
+               "export_seconds", "files": [{"name", "rows", "bytes", "sha256"}]}],
+     "files": [<K_WK_VAT.csv entry>]}
+
+Nothing is cleared: afterwards the K tables hold every day of the range.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import time
+import zipfile
+from datetime import date
+from typing import BinaryIO, Dict, Iterable, List, Optional
+
+from manage_orders.services import daily_csv
+from manage_orders.services.stats_backfill import DayResult, backfill, resolve_workers
+
+MANIFEST_NAME = 'manifest.json'
+
+
+def _add(zf: zipfile.ZipFile, arcname: str, lines: Iterable[str]) -> Dict[str, object]:
+    """Stream `lines` into the archive; returns the file's manifest entry (rows exclude the header)."""
+    digest = hashlib.sha256()
+    size = 0
+    rows = -1
+    with zf.open(arcname, 'w') as entry:
+        for line in lines:
+            data = line.encode('utf-8')
+            entry.write(data)
+            digest.update(data)
+            size += len(data)
+            rows += 1
+    return {'name': arcname, 'rows': max(rows, 0), 'bytes': size, 'sha256': digest.hexdigest()}
+
+
+def write_bundle(days: List[date], fh: BinaryIO, workers: Optional[int] = None) -> Dict[str, object]:
+    """Rebuild `days` and write their export bundle to `fh`; returns the manifest."""
+    days = sorted(days)
+    t0 = time.perf_counter()
+    manifest_days: List[Dict[str, object]] = []
+    with zipfile.ZipFile(fh, 'w', zipfile.ZIP_DEFLATED) as zf:
+        def add_day(result: DayResult) -> None:
+            t_export = time.perf_counter()
+            files = [_add(zf, f"{result.day:%Y-%m-%d}/{name}", lines) for name, lines in daily_csv.day_files(result.day)]
+            manifest_days.append({
+                'date': result.day.isoformat(),
+                'orders': result.orders,
+                'compute_seconds': round(result.compute_seconds, 4),
+                'write_seconds': round(result.write_seconds, 4),
+                'export_seconds': round(time.perf_counter() - t_export, 4),
+                'files': files,
+            })
+
+        backfill(days, workers=workers, after_apply=add_day)
+        manifest = {
+            'from': days[0].isoformat() if days else None,
+            'to': days[-1].isoformat() if days else None,
+            'workers': resolve_workers(workers, len(days)),
+            'days': manifest_days,
+            'files': [_add(zf, daily_csv.KWK_VAT_NAME, daily_csv.kwk_vat_lines())],
+        }
+        manifest['elapsed_seconds'] = round(time.perf_counter() - t0, 4)
+        zf.writestr(MANIFEST_NAME, json.dumps(manifest, indent=2))
+    return manifest
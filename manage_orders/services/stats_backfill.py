@@ -0,0 +1,112 @@
+"""Rebuild daily stats for a range of business days.
+
+Used by `manage.py build_daily_stats --from/--to` and `export_daily_csvs
+--from/--to` after VAT rules or EPOS_GROSS_* settings change. Days are computed
+in a process pool (compute_daily_stats only reads) whose workers are started
+fresh (forkserver, or spawn where that is unavailable) rather than forked, so
+they never inherit a lock held by one of the caller's threads (the outbox
+dispatcher, the import runner) or its database connection. The calling process is
+the single writer: it applies each day with apply_daily_stats in its own short
+transaction, so SQLite never has more than one writer waiting on the lock. A day
+that took orders after it was computed (the current one, while trading) is
+recomputed by apply_daily_stats inside that transaction instead of being
+overwritten with the older figures.
+
+Days are applied in date order even when they finish out of order, because
+K_WK_VAT keeps one column per weekday and a later week must overwrite an
+earlier one. `after_apply(result)` runs once per day right after its write
+(e.g. to export that day's CSVs while K_WK_VAT reflects the week so far).
+"""
+from __future__ import annotations
+
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from datetime import date, timedelta
+from typing import Callable, Iterator, List, Optional, Tuple
+
+import django
+from django.db import connections
+
+from manage_orders.services.daily_stats import DailyStats, apply_daily_stats, compute_daily_stats
+
+
+@dataclass(frozen=True)
+class DayResult:
+    day: date
+    orders: int
+    compute_seconds: float
+    write_seconds: float
+
+
+def day_range(start: date, end: date) -> List[date]:
+    """Every day from start to end inclusive."""
+    if end < start:
+        raise ValueError(f"end date {end} is before start date {start}")
+    return [start + timedelta(days=i) for i in range((end - start).days + 1)]
+
+
+def _mp_context():
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _compute(day: date) -> Tuple[DailyStats, float]:
+    t0 = time.perf_counter()
+    try:
+        return compute_daily_stats(day), time.perf_counter() - t0
+    finally:
+        connections.close_all()
+
+
+def _computed(days: List[date], workers: int) -> Iterator[Tuple[DailyStats, float]]:
+    """(stats, seconds) per day, in date order."""
+    if workers <= 1 or len(days) <= 1:
+        for day in days:
+            t0 = time.perf_counter()
+            yield compute_daily_stats(day), time.perf_counter() - t0
+        return
+    # Workers start from a fresh interpreter: configure Django before anything imports a model
+    # (the initializer must not live in this module, whose imports need the app registry)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=_mp_context(), initializer=django.setup) as pool:
+        # map() yields in submission order while the pool keeps computing ahead
+        yield from pool.map(_compute, days)
+
+
+def resolve_workers(workers: Optional[int], n_days: int) -> int:
+    """Worker processes actually used: the request (default CPU count), at most one per day."""
+    return max(1, min(int(workers or os.cpu_count() or 1), n_days or 1))
+
+
+def backfill(days: List[date], workers: Optional[int] = None,
+             after_apply: Optional[Callable[[DayResult], None]] = None) -> List[DayResult]:
+    """Recompute and write every day in `days`; returns per-day timings in date order."""
+    days = sorted(days)
+    workers = resolve_workers(workers, len(days))
+    results = []
+    for stats, compute_seconds in _computed(days, workers):
+        t0 = time.perf_counter()
+        stats = apply_daily_stats(stats)
+        result = DayResult(stats.export_date, stats.order_count, compute_seconds, time.perf_counter() - t0)
+        if after_apply:
+            after_apply(result)
+        results.append(result)
+    return results
+
+
+def report_line(result: DayResult, export_seconds: Optional[float] = None) -> str:
+    line = (f"{result.day:%Y-%m-%d}  {result.orders:>6} orders  "
+            f"compute {result.compute_seconds * 1000:>8.1f} ms  write {result.write_seconds * 1000:>7.1f} ms")
+    if export_seconds is not None:
+        line += f"  csv {export_seconds * 1000:>7.1f} ms"
+    return line
+
+
+def report_summary(results: List[DayResult], elapsed: float, workers: Optional[int]) -> str:
+    orders = sum(r.orders for r in results)
+    rate = (lambda n: n / elapsed if elapsed > 0 else 0.0)
+    return (f"{len(results)} day(s), {orders} orders in {elapsed:.2f}s with "
+            f"{resolve_workers(workers, len(results))} worker(s): "
+            f"{rate(len(results)):.1f} days/s, {rate(orders):.0f} orders/s")
@@ -1106,3 +1106,1375 @@ class UsInfoPackParityTests(TestCase):
         self.assertEqual(rev.TCOUPVAL, 0)
         self.assertEqual(rev.TCASHVAL, 100)
         self.assertEqual(rev.TCARDVAL, 200)
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class CatalogSnapshotTests(TestCase):
+    """Catalog reads are served from the in-process snapshot (update_till.catalog)."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+
+    def test_prices_served_without_queries_once_warm(self):
+        url = reverse('mo_api_prices') + '?band=1&prods=3,999'
+        self.client.get(url)  # warm the snapshot
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertEqual(resp.json()['prices']['3'], {'price': 485, 'dc_price': 455})
+        self.assertEqual(resp.json()['not_found'], [999])
+
+    def test_catalog_edit_invalidates_snapshot(self):
+        url = reverse('mo_api_prices') + '?band=1&prods=3'
+        self.assertEqual(self.client.get(url).json()['prices']['3']['price'], 485)
+        item = PdItem.objects.get(PRODNUMB=3)
+        item.VATPR = 499
+        item.save()
+        self.assertEqual(self.client.get(url).json()['prices']['3']['price'], 499)
+
+
+class PriceMatrixTests(TestCase):
+    """Gross/net prices come from the snapshot's precomputed matrix with one rounding rule."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        PdVatTb.objects.create(VAT_CLASS=2, VAT_RATE=17.5, VAT_DESC='Old standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        _mk_product(9, 'Odd', 9, vat_class=2)
+
+    def test_net_pence_rounds_exactly(self):
+        from update_till.price_matrix import net_pence
+        self.assertEqual(net_pence(3, 20.0), 2)      # 2.5 -> 2, half to even
+        self.assertEqual(net_pence(9, 20.0), 8)      # 7.5 -> 8
+        self.assertEqual(net_pence(315, 20.0), 262)
+        self.assertEqual(net_pence(600, 20.0), 500)
+        self.assertEqual(net_pence(47, 17.5), 40)    # 40.0 exactly at 17.5%
+        self.assertEqual(net_pence(0, 20.0), 0)
+        self.assertEqual(net_pence(250, 0), 250)
+
+    def test_matrix_row_matches_serializer(self):
+        from update_till.catalog import get_catalog
+        from manage_orders.views import _serialize_product
+        catalog = get_catalog()
+        prices = catalog.product_prices
+        self.assertEqual(prices.row(3, '2'), (485, 404, 404, 455, 379, 379))
+        self.assertEqual(prices.price(3, '1', discounted=True, basis='eat'), 379)
+        self.assertEqual(prices.meal_component(3, '1'), 455)
+        self.assertEqual(prices.vat_rate(9, 'take'), 17.5)
+        # Unknown codes / bands read as 0 rather than spilling into a neighbouring slot
+        self.assertEqual(prices.price(999, '1'), 0)
+        self.assertEqual(prices.price(3, '7'), 0)
+        data = _serialize_product(catalog.products[3], '1', catalog=catalog)
+        self.assertEqual(
+            (data['price_gross'], data['price_net_take'], data['price_net_eat'],
+             data['discounted_price_gross'], data['discounted_price_net_take'], data['discounted_price_net_eat']),
+            prices.row(3, '1'),
+        )
+
+    def test_submit_uses_matrix_rounding(self):
+        resp = self.client.post(
+            reverse('mo_api_submit_order'),
+            data=json.dumps({
+                'price_band': '1', 'vat_basis': 'take', 'show_net': False, 'crew_id': '1',
+                'lines': [{'code': 3, 'type': 'product', 'name': 'Cheeseburger', 'qty': 2, 'price_gross': 3}],
+            }),
+            content_type='application/json',
+        )
+        self.assertEqual(resp.status_code, 200)
+        order = Order.objects.get(pk=resp.json()['order_id'])
+        self.assertEqual(order.total_gross, 6)
+        self.assertEqual(order.total_net, 4)
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class PricingServiceTests(TestCase):
+    """services.pricing holds the meal / combo / VAT rules shared by the till and daily stats."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        _mk_product(30, 'Fries', 220, dc=130)
+        _mk_product(50, 'Cola', 140)
+        _mk_product(26, 'Dip Ketchup', 55)
+
+    def test_meal_price_and_discounts(self):
+        from manage_orders.services import pricing
+        # Burger and fries at DC price, drink has no DC so standard, option at standard
+        self.assertEqual(pricing.meal_price('1', 3, 30, 50, [26]), 455 + 130 + 140 + 55)
+        self.assertEqual(pricing.meal_discount(1, 3, 30, 50, 'TAKEAWAY', gross=True), 30 + 90)
+        self.assertEqual(pricing.meal_discount(1, 3, 30, 50, 'take'), (404 + 183 + 117) - (379 + 108 + 117))
+        self.assertEqual(pricing.combo_discount(1, 999, [3, 30], 600, 'take', gross=True), 105)
+        # Unknown combo: no VAT class, so the combo price is already ex-VAT
+        self.assertEqual(pricing.combo_discount(1, 999, [3, 30], 600, 'take'), 404 + 183 - 600)
+
+    def test_memo_follows_catalog_snapshot(self):
+        from manage_orders.services import pricing
+        self.assertEqual(pricing.meal_price('1', 3, 30, 50), 725)
+        item = PdItem.objects.get(PRODNUMB=50)
+        item.DC_VATPR = 100
+        item.save()
+        self.assertEqual(pricing.meal_price('1', 3, 30, 50), 685)
+
+    def test_memo_is_bounded(self):
+        from unittest import mock
+        from manage_orders.services import pricing
+        with mock.patch.object(pricing, 'MEMO_SIZE', 8):
+            # Option codes come from the request: every combination is a new key
+            for n in range(40):
+                self.assertEqual(pricing.meal_price('1', 3, 30, 50, [26] * n), 725 + 55 * n)
+            self.assertEqual(len(pricing._memo), 8)
+            # Recently used entries survive, the oldest go first
+            pricing.meal_price('1', 3, 30, 50, [26] * 33)
+            pricing.meal_price('1', 3, 30, 50, [26] * 41)
+            self.assertIn(('meal', '1', 3, 30, 50, (26,) * 33), pricing._memo)
+            self.assertNotIn(('meal', '1', 3, 30, 50, (26,) * 32), pricing._memo)
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class SubmitOrderWriteTests(TestCase):
+    """api_submit_order prices everything first, then writes the order in one short transaction."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        _mk_product(30, 'Fries', 220, dc=130)
+        _mk_product(50, 'Cola', 140, dc=100)
+
+    def _post(self, **overrides):
+        payload = {
+            'price_band': '1', 'vat_basis': 'take', 'show_net': False, 'crew_id': '1',
+            'lines': [
+                {'code': 3, 'type': 'product', 'name': 'Cheeseburger', 'qty': 2, 'price_gross': 485},
+                {'code': 3, 'type': 'product', 'name': 'Cheeseburger Meal', 'meal': True, 'qty': 1,
+                 'price_gross': 1, 'meta': {'fries': 30, 'drink': 50}},
+            ],
+        }
+        payload.update(overrides)
+        return self.client.post(reverse('mo_api_submit_order'), data=json.dumps(payload), content_type='application/json')
+
+    def test_single_order_insert_and_bulk_line_insert(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with self.captureOnCommitCallbacks(execute=True):
+            self._post()  # warm the catalog snapshot and seed the day's counters
+        with CaptureQueriesContext(connection) as ctx:
+            resp = self._post()
+        self.assertEqual(resp.status_code, 200, resp.content)
+        sql = [q['sql'].upper() for q in ctx.captured_queries]
+        sql = [q for q in sql if not q.startswith(('SAVEPOINT', 'RELEASE'))]
+        self.assertEqual([q.split()[0] for q in sql[:2]], ['INSERT', 'INSERT'])
+        # The rest only bumps the day's live stats counters; the day's orders are not re-read
+        self.assertTrue(all('"UPDATE_TILL_K' in q for q in sql[2:]), sql[2:])
+        order = Order.objects.get(pk=resp.json()['order_id'])
+        self.assertEqual(order.total_gross, 485 * 2 + 455 + 130 + 100)
+        self.assertEqual(list(order.lines.values_list('unit_price_gross', flat=True).order_by('id')), [485, 685])
+
+    def test_invalid_line_writes_nothing(self):
+        resp = self._post(lines=[
+            {'code': 3, 'type': 'product', 'name': 'Cheeseburger', 'qty': 1, 'price_gross': 485},
+            {'code': 'x', 'type': 'product', 'name': 'Broken', 'qty': 1, 'price_gross': 100},
+        ])
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(OrderLine.objects.exists())
+
+    def test_invalid_split_writes_nothing(self):
+        resp = self._post(payment_method='Split', split_cash_pence=100, split_card_pence=0, split_voucher_pence=0)
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+
+    def test_valid_split_is_stored(self):
+        total = 485 * 2 + 685
+        resp = self._post(payment_method='Split', split_cash_pence=total - 500, split_card_pence=500, split_voucher_pence=0)
+        self.assertEqual(resp.status_code, 200, resp.content)
+        order = Order.objects.get(pk=resp.json()['order_id'])
+        self.assertEqual((order.split_cash_pence, order.split_card_pence), (total - 500, 500))
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class MenuPayloadCacheTests(TestCase):
+    """Category endpoints serve pre-rendered payloads with strong ETags."""
+    def setUp(self):
+        from update_till.models import EposGroup, EposProd
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        EposGroup.objects.create(EPOS_GROUP_ID=1, EPOS_GROUP_TITLE='Burgers')
+        EposProd.objects.create(
+            PRODNUMB=3, PRODNAME='Cheeseburger', ITEM_DESC='Cheese Burger', EPOS_GROUP=1,
+            EPOS_SEQUENCE=1, COLOUR_RED=10, COLOUR_GREEN=20, COLOUR_BLUE=30,
+        )
+
+    def test_category_items_etag_and_not_modified(self):
+        url = reverse('mo_api_category_items', args=[1]) + '?band=1'
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        etag = resp['ETag']
+        self.assertTrue(etag.startswith('"menu-v'))
+        self.assertEqual(resp.json()['items'][0]['name'], 'Cheese Burger')
+        with self.assertNumQueries(0):
+            resp304 = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(resp304.status_code, 304)
+        self.assertEqual(resp304['ETag'], etag)
+        # Unknown group is still a 404
+        self.assertEqual(self.client.get(reverse('mo_api_category_items', args=[42]) + '?band=1').status_code, 404)
+
+    def test_catalog_edit_changes_payload_and_etag(self):
+        url = reverse('mo_api_menu_categories') + '?band=2'
+        first = self.client.get(url)
+        self.assertEqual(first.json()['categories'][0]['item_count'], 1)
+        from update_till.models import EposProd
+        EposProd.objects.create(
+            PRODNUMB=4, PRODNAME='Burger', ITEM_DESC='Burger', EPOS_GROUP=1,
+            EPOS_SEQUENCE=2, COLOUR_RED=0, COLOUR_GREEN=0, COLOUR_BLUE=0,
+        )
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, 200)
+        self.assertNotEqual(second['ETag'], first['ETag'])
+        self.assertEqual(second.json()['categories'][0]['item_count'], 2)
+
+    def test_menu_bundle_gzip_and_contents(self):
+        import gzip
+        from update_till.models import ACodes, ToppingDel
+        ACodes.objects.create(PRODNUMB=3, ST_CODENUM=501, QTY=1)
+        ToppingDel.objects.create(ACODE=501, DESC='Cheese slice', MENU_DESC='Cheese')
+        url = reverse('mo_api_menu_bundle') + '?band=1'
+        self.assertEqual(self.client.get(reverse('mo_api_menu_bundle') + '?band=9').status_code, 400)
+        resp = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp['Content-Encoding'], 'gzip')
+        bundle = json.loads(gzip.decompress(resp.content))
+        self.assertEqual(bundle['band'], '1')
+        self.assertEqual([c['id'] for c in bundle['categories']], [1])
+        self.assertEqual(bundle['items']['1'][0]['code'], 3)
+        # Detail matches the per-item endpoint exactly
+        detail = self.client.get(reverse('mo_api_item_detail', args=['product', 3]) + '?band=1').json()['item']
+        self.assertEqual(bundle['details']['product:3'], detail)
+        self.assertEqual(bundle['toppings']['3']['menu_desc_joined'], 'Cheese')
+        # Conditional request for the compressed representation
+        resp304 = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=resp['ETag'])
+        self.assertEqual(resp304.status_code, 304)
+        # Identity representation has its own validator
+        plain = self.client.get(url)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotEqual(plain['ETag'], resp['ETag'])
+        self.assertEqual(json.loads(plain.content), bundle)
+        # A client that refuses gzip with q=0 gets the identity body
+        for header in ('gzip;q=0', 'deflate, gzip; q=0.0', 'identity, *;q=0'):
+            refused = self.client.get(url, HTTP_ACCEPT_ENCODING=header)
+            self.assertNotIn('Content-Encoding', refused, header)
+            self.assertEqual(refused['ETag'], plain['ETag'])
+        self.assertEqual(self.client.get(url, HTTP_ACCEPT_ENCODING='br, GZIP;q=0.5')['Content-Encoding'], 'gzip')
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class MenuQueryCountTests(TestCase):
+    """Menu endpoints cost a constant number of queries regardless of item count."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+
+    def _seed(self, group_id, n):
+        """Create a group of n products and n combos with names, variants, trade-ups and colours."""
+        from update_till.models import EposGroup, EposProd, GroupTb, PChoice, CombTb, EposComb
+        EposGroup.objects.create(EPOS_GROUP_ID=group_id, EPOS_GROUP_TITLE=f'Group {group_id}')
+        GroupTb.objects.create(GROUP_ID=group_id, GROUP_NAME=f'Group {group_id}', SOURCE_TYPE='P', MEAL_GROUP=0)
+        base = group_id * 1000
+        for i in range(n):
+            code = base + i
+            _mk_product(code, f'Prod {i}', 300 + i, dc=250)
+            EposProd.objects.create(
+                PRODNUMB=code, PRODNAME=f'Prod {i}', ITEM_DESC=f'Item {i}', EPOS_GROUP=group_id,
+                EPOS_SEQUENCE=i, COLOUR_RED=1, COLOUR_GREEN=2, COLOUR_BLUE=3,
+            )
+            AppProd.objects.create(
+                PRODNUMB=code, PRODNAME=f'Prod {i}', GROUP_ID=group_id, GROUP_SUB_ID=i, MEAL_ID=0,
+                MEAL_SUB_ID=0, DOUBLE_PDNUMB=base + (i + 1) % n, TRIPLE_PDNUMB=0,
+            )
+            PChoice.objects.create(PRODNUMB=base, OPT_PRODNUMB=code)
+            CombTb.objects.create(
+                COMBONUMB=code, DESC=f'Combo {i}', EAT_VAT_CLASS=1, TAKE_VAT_CLASS=1,
+                T_COMB_NUM=base + (i + 1) % n,
+                **{f: 500 for f in ('VATPR', 'VATPR_2', 'VATPR_3', 'VATPR_4', 'VATPR_5', 'VATPR_6',
+                                    'T_VATPR', 'T_VATPR_2', 'T_VATPR_3', 'T_VATPR_4', 'T_VATPR_5', 'T_VATPR_6')},
+            )
+            EposComb.objects.create(
+                COMBONUMB=code, DESC=f'Combo {i}', ITEM_DESC=f'Combo {i}', EPOS_GROUP=group_id, EPOS_SEQUENCE=i,
+            )
+
+    def _cold_query_counts(self, group_id):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from update_till import catalog
+        code = group_id * 1000
+        urls = [
+            reverse('mo_api_menu') + '?band=1',
+            reverse('mo_api_menu_categories') + '?band=1',
+            reverse('mo_api_category_items', args=[group_id]) + '?band=1',
+            reverse('mo_api_item_detail', args=['product', code]) + '?band=1',
+            reverse('mo_api_item_detail', args=['combo', code]) + '?band=1',
+            reverse('mo_api_product_options', args=[code]) + '?band=1',
+        ]
+        counts = []
+        for url in urls:
+            catalog.invalidate()
+            with CaptureQueriesContext(connection) as ctx:
+                resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            counts.append(len(ctx))
+            # Once warm, serving the same endpoint touches the database not at all
+            with self.assertNumQueries(0):
+                self.client.get(url)
+        return counts
+
+    def test_query_count_independent_of_item_count(self):
+        self._seed(1, 3)
+        small = self._cold_query_counts(1)
+        self._seed(2, 60)
+        large = self._cold_query_counts(2)
+        # Cold requests only pay for the snapshot build, whatever the group size
+        self.assertEqual(small, large)
+        resp = self.client.get(reverse('mo_api_category_items', args=[2]) + '?band=1')
+        self.assertEqual(len(resp.json()['items']), 120)
+        detail = self.client.get(reverse('mo_api_item_detail', args=['product', 2000]) + '?band=1').json()['item']
+        self.assertEqual(detail['name'], 'Item 0')
+        self.assertEqual(len(detail['options']), 60)
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class QueryPlanTests(TestCase):
+    """EXPLAIN QUERY PLAN regression suite for hot queries in views.py and daily_stats.py.
+
+    Every SELECT/UPDATE/DELETE a hot path issues (catalog snapshot builds excluded: they
+    load whole tables by design) must be answered from an index, never a full table scan.
+    """
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        now = timezone.now()
+        self.orders = []
+        for status in ['preparing', 'packed', 'dispatched', 'dispatched']:
+            o = Order.objects.create(
+                price_band=1, vat_basis='take', show_net=False, payment_method='Cash', total_gross=485,
+                status=status, completed_at=now if status == 'dispatched' else None,
+            )
+            OrderLine.objects.create(
+                order=o, item_code=3, item_type='product', name='Cheeseburger', variant_label='',
+                is_meal=False, qty=1, unit_price_gross=485, line_total_gross=485, meta={},
+            )
+            self.orders.append(o)
+        from update_till.catalog import get_catalog
+        get_catalog()  # warm the snapshot so only the hot path's own queries are captured
+
+    def _plan(self, sql: str, params=()) -> list[str]:
+        from django.db import connection
+        with connection.cursor() as cur:
+            cur.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cur.fetchall()]
+
+    def _full_scans(self, sql: str, params=()) -> list[str]:
+        import re
+        scans = []
+        for detail in self._plan(sql, params):
+            m = re.match(r'SCAN (?:TABLE )?(\w+)', detail)
+            if m and 'USING' not in detail:
+                scans.append(detail)
+        return scans
+
+    def assertNoFullScans(self, fn):
+        """Run fn, EXPLAIN every query it issued and fail on any full table scan."""
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            fn()
+        checked = 0
+        for q in ctx.captured_queries:
+            sql = q['sql']
+            if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                continue
+            checked += 1
+            self.assertEqual(self._full_scans(sql), [], sql)
+        return checked
+
+    def test_detector_flags_unindexed_filter(self):
+        # Guard against a suite that silently passes: payment_method has no index
+        sql, params = Order.objects.filter(payment_method='Cash').query.sql_with_params()
+        self.assertTrue(self._full_scans(sql, params))
+
+    def test_catalog_lookup_columns_are_indexed(self):
+        from update_till import models as m
+        lookups = [
+            m.PdItem.objects.filter(PRODNUMB=3), m.CombTb.objects.filter(COMBONUMB=3),
+            m.EposProd.objects.filter(PRODNUMB=3), m.EposProd.objects.filter(EPOS_GROUP=1),
+            m.EposComb.objects.filter(EPOS_GROUP=1), m.PChoice.objects.filter(PRODNUMB=3),
+            m.CompPro.objects.filter(COMBONUMB=3), m.OptPro.objects.filter(COMBONUMB=3),
+            m.ACodes.objects.filter(PRODNUMB=3), m.ToppingDel.objects.filter(ACODE=3),
+            m.AppProd.objects.filter(PRODNUMB=3), m.AppComb.objects.filter(COMBONUMB=3),
+            m.EposAddOns.objects.filter(PRODNUMB=3), m.KWkVat.objects.filter(VAT_CLASS=1),
+        ]
+        from django.db import connection
+        for qs in lookups:
+            sql, params = qs.query.sql_with_params()
+            with connection.cursor() as cur:
+                cur.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                details = [row[-1] for row in cur.fetchall()]
+            self.assertTrue(any('USING INDEX' in d or 'USING COVERING INDEX' in d for d in details), (str(qs.query), details))
+
+    def test_order_dashboard_endpoints(self):
+        for name in ['mo_api_orders_summary', 'mo_api_orders_pending', 'mo_api_orders_completed',
+                     'mo_api_daily_sales', 'mo_api_daily_sales_hourly']:
+            with self.subTest(endpoint=name):
+                checked = self.assertNoFullScans(lambda: self.assertEqual(self.client.get(reverse(name)).status_code, 200))
+                self.assertGreater(checked, 0)
+
+    def test_order_range_queries_use_composite_indexes(self):
+        # The date bound must be part of the index search, not filtered row by row
+        for name, column in [('mo_api_orders_summary', 'created_at'), ('mo_api_orders_pending', 'created_at'),
+                             ('mo_api_orders_completed', 'completed_at'), ('mo_api_daily_sales', 'completed_at'),
+                             ('mo_api_daily_sales_hourly', 'completed_at')]:
+            with self.subTest(endpoint=name):
+                from django.db import connection
+                from django.test.utils import CaptureQueriesContext
+                with CaptureQueriesContext(connection) as ctx:
+                    self.client.get(reverse(name))
+                order_sql = [q['sql'] for q in ctx.captured_queries if 'FROM "manage_orders_order"' in q['sql']]
+                self.assertTrue(order_sql)
+                for sql in order_sql:
+                    plan = ' '.join(self._plan(sql))
+                    self.assertIn(f'{column}>', plan, sql)
+                    self.assertIn(f'{column}<', plan, sql)
+
+    def test_order_status_updates(self):
+        preparing = self.orders[0]
+        self.assertNoFullScans(lambda: self.assertEqual(self.client.post(reverse('mo_api_order_pack', args=[preparing.pk])).status_code, 200))
+        self.assertNoFullScans(lambda: self.assertEqual(self.client.post(reverse('mo_api_order_complete', args=[preparing.pk])).status_code, 200))
+
+    def test_submit_order(self):
+        payload = {'price_band': '1', 'vat_basis': 'take', 'lines': [
+            {'code': 3, 'type': 'product', 'name': 'Cheeseburger', 'qty': 1, 'price_gross': 485},
+        ]}
+        self.assertNoFullScans(lambda: self.assertEqual(self.client.post(
+            reverse('mo_api_submit_order'), data=json.dumps(payload), content_type='application/json').status_code, 200))
+
+    def test_build_daily_stats(self):
+        checked = self.assertNoFullScans(lambda: build_daily_stats(timezone.localdate()))
+        self.assertGreater(checked, 0)
+        # Second run updates existing K-table rows
+        self.assertNoFullScans(lambda: build_daily_stats(timezone.localdate()))
+
+
+class BusinessDayTests(TestCase):
+    """Order APIs report by business day: half-open [cutoff, next cutoff) ranges."""
+    def _order(self, when, status='dispatched', total=100):
+        return Order.objects.create(
+            price_band=1, vat_basis='take', show_net=False, payment_method='Cash', total_gross=total,
+            status=status, created_at=when, completed_at=when if status == 'dispatched' else None,
+        )
+
+    def test_range_is_half_open_at_midnight_by_default(self):
+        from manage_orders.services.business_day import business_day_range
+        day = timezone.datetime(2025, 3, 10).date()
+        start, end = business_day_range(day)
+        self.assertEqual(end - start, timedelta(days=1))
+        self._order(start)                              # first instant of the day: included
+        self._order(end - timedelta(microseconds=1))    # last instant: included
+        self._order(end)                                # next day's first instant: excluded
+        resp = self.client.get(reverse('mo_api_daily_sales') + '?date=2025-03-10')
+        self.assertEqual(resp.json()['total_gross'], 200)
+
+    @override_settings(EPOS_BUSINESS_DAY_CUTOFF='04:00')
+    def test_late_trade_counts_towards_previous_day(self):
+        from manage_orders.services.business_day import business_day_for
+        late = timezone.make_aware(timezone.datetime(2025, 3, 11, 2, 30))
+        self.assertEqual(business_day_for(late), timezone.datetime(2025, 3, 10).date())
+        self._order(timezone.make_aware(timezone.datetime(2025, 3, 10, 3, 59)), total=1)   # previous trading day
+        self._order(timezone.make_aware(timezone.datetime(2025, 3, 10, 22, 0)), total=10)
+        self._order(late, total=100)
+        self._order(timezone.make_aware(timezone.datetime(2025, 3, 11, 4, 0)), total=1000)  # next trading day
+        resp = self.client.get(reverse('mo_api_daily_sales') + '?date=2025-03-10')
+        self.assertEqual(resp.json()['total_gross'], 110)
+        hourly = self.client.get(reverse('mo_api_daily_sales_hourly') + '?date=2025-03-10').json()['hours']
+        self.assertEqual(sum(h['order_count'] for h in hourly), 2)
+        # Daily stats use the same trading day
+        from update_till.models import KRev
+        build_daily_stats(timezone.datetime(2025, 3, 10).date())
+        self.assertEqual(KRev.objects.get(stat_date=timezone.datetime(2025, 3, 10).date()).TCASHVAL, 110)
+
+    @override_settings(EPOS_BUSINESS_DAY_CUTOFF='04:00')
+    def test_commands_default_to_the_business_day(self):
+        import os
+        import tempfile
+        from io import StringIO
+        from unittest import mock
+        from django.core.management import call_command
+        from update_till.models import KRev
+        late = timezone.make_aware(timezone.datetime(2025, 3, 11, 2, 30))
+        self._order(timezone.make_aware(timezone.datetime(2025, 3, 10, 22, 0)), total=10)
+        self._order(late, total=100)
+        # A nightly run before the cutoff works on the trading day still in progress
+        with mock.patch('django.utils.timezone.now', return_value=late), tempfile.TemporaryDirectory() as tmp:
+            call_command('build_daily_stats', stdout=StringIO())
+            self.assertEqual(KRev.objects.get(stat_date=timezone.datetime(2025, 3, 10).date()).TCASHVAL, 110)
+            out = StringIO()
+            call_command('inspect_daily', stdout=out)
+            self.assertIn('KRev[2025-03-10]: TCASHVAL=110', out.getvalue())
+            out = StringIO()
+            call_command('verify_daily_stats', stdout=out)
+            self.assertIn('Live stats for 2025-03-10 match', out.getvalue())
+            call_command('export_daily_csvs', outdir=tmp, stdout=StringIO())
+            self.assertEqual(sorted(os.listdir(tmp)), ['K_WK_VAT.csv', 'MP100325.CSV', 'PD100325.CSV', 'RV100325.CSV'])
+
+
+class _StubPlatform:
+    """Local HTTP server standing in for a delivery platform (OAuth token + API endpoints)."""
+    def __init__(self, status=200, delay=0.0, token_delay=0.0, expires_in=3600):
+        import threading
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.status = status
+        self.delay = delay
+        self.token_delay = token_delay
+        self.expires_in = expires_in
+        self.requests = []
+        self.token_requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                import time
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if self.path.endswith('/oauth2/token'):
+                    with lock:
+                        stub.token_requests += 1
+                        n = stub.token_requests
+                    time.sleep(stub.token_delay)
+                    token = 'tok' if n == 1 else f'tok{n}'
+                    data = json.dumps({'access_token': token, 'expires_in': stub.expires_in}).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                    return
+                with lock:
+                    stub.in_flight += 1
+                    stub.max_in_flight = max(stub.max_in_flight, stub.in_flight)
+                time.sleep(stub.delay)
+                with lock:
+                    stub.in_flight -= 1
+                    stub.requests.append((self.path, json.loads(body or b'{}'), self.headers.get('Authorization')))
+                self.send_response(stub.status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.base = f'http://127.0.0.1:{self.server.server_address[1]}'
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        import tempfile
+        from unittest import mock
+        from manage_orders.services import deliveroo
+        self.thread.start()
+        self._env = mock.patch.dict('os.environ', {
+            'DELIVEROO_ENV': 'sandbox',
+            'DELIVEROO_API_BASE_URL': self.base,
+            'DELIVEROO_AUTH_TOKEN_URL': self.base + '/oauth2/token',
+        })
+        self._env.start()
+        # Fresh shared token store per stub so tests never see each other's tokens
+        self._token_dir = tempfile.TemporaryDirectory()
+        self._settings = override_settings(EPOS_PLATFORM_TOKEN_DIR=self._token_dir.name)
+        self._settings.enable()
+        deliveroo.tokens.invalidate()
+        return self
+
+    def __exit__(self, *exc):
+        from manage_orders.services import deliveroo
+        deliveroo.tokens.invalidate()
+        self._settings.disable()
+        self._token_dir.cleanup()
+        self._env.stop()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@override_settings(DELIVEROO_WEBHOOK_SECRET='', EPOS_OUTBOX_INLINE_DISPATCH=False,
+                   EPOS_OUTBOX_BACKOFF_SECONDS=5, EPOS_OUTBOX_MAX_ATTEMPTS=2)
+class OutboxTests(TestCase):
+    """Deliveroo sync_status calls are queued by the webhook and delivered by the outbox."""
+    def _webhook(self, order_id='123'):
+        payload = {'body': {'order': {'id': order_id, 'market': 'uk', 'status': 'accepted',
+                                      'items': [{'plu': '3', 'name': 'Burger'}]}}}
+        return self.client.post(reverse('deliveroo_webhook'), data=json.dumps(payload), content_type='application/json')
+
+    def test_webhook_returns_before_platform_is_called(self):
+        import time
+        from manage_orders.models import OutboxMessage
+        with _StubPlatform(delay=2.0) as stub:
+            t0 = time.perf_counter()
+            resp = self._webhook()
+            elapsed = time.perf_counter() - t0
+            self.assertEqual(resp.status_code, 200)
+            self.assertLess(elapsed, 1.0)
+            self.assertEqual(stub.requests, [])
+        msg = OutboxMessage.objects.get()
+        self.assertEqual((msg.platform, msg.kind, msg.status), ('deliveroo', 'sync_status', 'pending'))
+        self.assertEqual(msg.payload['order_id'], 'uk:123')
+        self.assertEqual(msg.payload['status'], 'succeeded')
+
+    def test_drain_delivers_sync_status(self):
+        from manage_orders.models import OutboxMessage
+        from manage_orders.services import outbox
+        self._webhook()
+        with _StubPlatform() as stub:
+            counts = outbox.drain()
+        self.assertEqual(counts, {'sent': 1, 'retry': 0, 'dead': 0})
+        path, body, auth = stub.requests[0]
+        self.assertEqual(path, '/order/v1/orders/uk:123/sync_status')
+        self.assertEqual(body['status'], 'succeeded')
+        self.assertEqual(auth, 'Bearer tok')
+        msg = OutboxMessage.objects.get()
+        self.assertEqual((msg.status, msg.attempts), ('sent', 1))
+        self.assertIsNotNone(msg.sent_at)
+
+    def test_server_errors_back_off_then_dead_letter(self):
+        from manage_orders.models import OutboxMessage
+        from manage_orders.services import outbox
+        self._webhook()
+        with _StubPlatform(status=503) as stub:
+            self.assertEqual(outbox.drain(), {'sent': 0, 'retry': 1, 'dead': 0})
+            msg = OutboxMessage.objects.get()
+            self.assertEqual((msg.status, msg.attempts), ('pending', 1))
+            self.assertGreaterEqual(msg.next_attempt_at, timezone.now() + timedelta(seconds=4))
+            # Not due yet: nothing is sent
+            self.assertEqual(outbox.drain(), {'sent': 0, 'retry': 0, 'dead': 0})
+            OutboxMessage.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(outbox.drain(), {'sent': 0, 'retry': 0, 'dead': 1})
+            self.assertEqual(len(stub.requests), 2)
+        msg.refresh_from_db()
+        self.assertEqual(msg.status, 'dead')
+        self.assertIn('503', msg.last_error)
+
+    def test_client_error_is_dead_lettered_at_once(self):
+        from manage_orders.models import OutboxMessage
+        from manage_orders.services import outbox
+        self._webhook()
+        with _StubPlatform(status=404):
+            self.assertEqual(outbox.drain(), {'sent': 0, 'retry': 0, 'dead': 1})
+        self.assertEqual(OutboxMessage.objects.get().status, 'dead')
+
+    @override_settings(EPOS_OUTBOX_WORKERS=6, EPOS_OUTBOX_PLATFORM_CONCURRENCY=2)
+    def test_per_platform_concurrency_cap(self):
+        from manage_orders.services import outbox
+        for i in range(6):
+            self._webhook(order_id=str(100 + i))
+        with _StubPlatform(delay=0.15) as stub:
+            self.assertEqual(outbox.drain()['sent'], 6)
+        self.assertEqual(len(stub.requests), 6)
+        self.assertEqual(stub.max_in_flight, 2)
+
+    @override_settings(EPOS_OUTBOX_WORKERS=4, EPOS_OUTBOX_PLATFORM_CONCURRENCY=2)
+    def test_claimed_calls_start_inside_their_lease(self):
+        from unittest import mock
+        from manage_orders.models import OutboxMessage
+        from manage_orders.services import outbox
+        for i in range(6):
+            self._webhook(order_id=str(200 + i))
+        started = {}
+        real_import = outbox.import_string
+
+        def timed(path):
+            handler = real_import(path)
+
+            def call(payload):
+                started[payload['order_id']] = timezone.now()
+                handler(payload)
+            return call
+        # A slow platform: only two calls at a time, each taking most of the (shortened) lease
+        with _StubPlatform(delay=0.25) as stub, mock.patch.object(outbox, 'LEASE_SECONDS', 0.5), \
+                mock.patch.object(outbox, 'import_string', timed):
+            self.assertEqual(outbox.drain()['sent'], 6)
+        self.assertEqual(len(stub.requests), 6)
+        for msg in OutboxMessage.objects.all():
+            # A sent message keeps the lease it was claimed with
+            self.assertLess(started[msg.payload['order_id']] + timedelta(seconds=0.25), msg.next_attempt_at)
+
+    def test_late_outcome_does_not_overwrite_a_newer_claim(self):
+        from manage_orders.models import OutboxMessage
+        from manage_orders.services import outbox
+        self._webhook()
+        first = outbox.claim(4)[0]
+        # The first drainer's call outlives its lease; a second drainer claims and delivers
+        OutboxMessage.objects.update(next_attempt_at=timezone.now())
+        second = outbox.claim(4)[0]
+        self.assertEqual(second.attempts, 2)
+        self.assertEqual(outbox._record(second, None), 'sent')
+        # The first drainer's failure arrives last and is dropped
+        self.assertIsNone(outbox._record(first, outbox.DeliveryError('timeout')))
+        msg = OutboxMessage.objects.get()
+        self.assertEqual((msg.status, msg.attempts, msg.last_error), ('sent', 2, ''))
+
+
+class PlatformTokenTests(TestCase):
+    """Platform OAuth tokens are shared across processes and refreshed by one caller at a time."""
+    def _provider(self):
+        from manage_orders.services import deliveroo
+        from manage_orders.services.platform_http import TokenProvider
+        # A second provider object behaves like another worker process: own memory, same token file
+        return TokenProvider('deliveroo', deliveroo._fetch_token)
+
+    def test_single_refresh_under_concurrent_load(self):
+        import threading
+        from manage_orders.services import deliveroo
+        with _StubPlatform(token_delay=0.2) as stub:
+            providers = [deliveroo.tokens, self._provider(), self._provider()]
+            results = []
+            gate = threading.Barrier(12)
+
+            def worker(p):
+                gate.wait()
+                results.append(p.token())
+            threads = [threading.Thread(target=worker, args=(providers[i % 3],)) for i in range(12)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(stub.token_requests, 1)
+            self.assertEqual(set(results), {'tok'})
+            # Yet another "process" starting later reads the shared file instead of fetching
+            self.assertEqual(self._provider().token(), 'tok')
+            self.assertEqual(stub.token_requests, 1)
+
+    @override_settings(EPOS_PLATFORM_TOKEN_REFRESH_MARGIN=120)
+    def test_refreshes_before_expiry_and_after_401(self):
+        from manage_orders.services import deliveroo
+        import time
+        from unittest import mock
+        from manage_orders.services import platform_http
+
+        def clock(at):
+            # Only the token cache sees the shifted clock
+            return mock.patch.object(platform_http, 'time', mock.Mock(time=lambda: at))
+        with _StubPlatform(expires_in=600) as stub:
+            self.assertEqual(deliveroo.tokens.token(), 'tok')
+            self.assertEqual(deliveroo.tokens.token(), 'tok')
+            # Refreshed proactively once inside the margin, before the token actually expires
+            with clock(time.time() + 600 - 119):
+                self.assertEqual(deliveroo.tokens.token(), 'tok2')
+            self.assertEqual(stub.token_requests, 2)
+        deliveroo.tokens.invalidate()
+        with _StubPlatform(expires_in=60) as stub:
+            # Shorter-lived than the margin: still reused for the first half of its life
+            self.assertEqual(deliveroo.tokens.token(), 'tok')
+            self.assertEqual(deliveroo.tokens.token(), 'tok')
+            self.assertEqual(stub.token_requests, 1)
+            with clock(time.time() + 31):
+                self.assertEqual(deliveroo.tokens.token(), 'tok2')
+            self.assertEqual(stub.token_requests, 2)
+        with _StubPlatform(status=401) as stub:
+            from manage_orders.services.outbox import DeliveryError
+            with self.assertRaises(DeliveryError):
+                deliveroo.deliver_sync_status({'order_id': 'uk:1', 'status': 'succeeded'})
+            deliveroo.tokens.token()
+            self.assertEqual(stub.token_requests, 2)
+
+    def test_session_is_shared_per_process(self):
+        from manage_orders.services.platform_http import session
+        self.assertIs(session(), session())
+
+
+@override_settings(DELIVEROO_WEBHOOK_SECRET='', EPOS_OUTBOX_INLINE_DISPATCH=False)
+class WebhookIdempotencyTests(TestCase):
+    """Repeated Deliveroo webhooks are acknowledged once and never re-queue a sync_status."""
+    def _post(self, order_id='123', status='accepted', extra=None, headers=None):
+        order = {'id': order_id, 'market': 'uk', 'status': status, 'items': [{'plu': '3', 'name': 'Burger'}]}
+        order.update(extra or {})
+        return self.client.post(reverse('deliveroo_webhook'), data=json.dumps({'body': {'order': order}}),
+                                content_type='application/json', headers=headers or {})
+
+    def test_redelivered_body_is_queued_once(self):
+        from manage_orders.models import OutboxMessage
+        self.assertEqual(self._post().json().get('status'), 'ok')
+        resp = self._post()
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json(), {'status': 'duplicate'})
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_same_order_status_with_different_body_is_duplicate(self):
+        from manage_orders.models import OutboxMessage
+        self._post()
+        # Same event, resent with a changed field (e.g. a fresh timestamp)
+        self.assertEqual(self._post(extra={'updated_at': 'later'}).json(), {'status': 'duplicate'})
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+        # A new status, or another order, is processed
+        self._post(status='rejected', extra={'status_log': [{'status': 'accepted'}, {'status': 'rejected'}]})
+        self._post(order_id='124')
+        self.assertEqual(OutboxMessage.objects.count(), 3)
+
+    def test_event_id_header_is_the_key(self):
+        from manage_orders.models import OutboxMessage
+        self._post(headers={'X-Deliveroo-Sequence-Guid': 'evt-1'})
+        self.assertEqual(self._post(extra={'updated_at': 'later'}, headers={'X-Deliveroo-Sequence-Guid': 'evt-1'}).json(),
+                         {'status': 'duplicate'})
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+    def test_expired_keys_are_reclaimed_and_purged(self):
+        from django.core.management import call_command
+        from io import StringIO
+        from manage_orders.models import OutboxMessage, WebhookEvent
+        from manage_orders.services import idempotency
+        self._post()
+        self.assertEqual(WebhookEvent.objects.count(), 2)  # body digest + order/status
+        WebhookEvent.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self._post()
+        self.assertEqual(OutboxMessage.objects.count(), 2)
+        self.assertFalse(idempotency.claim_event('deliveroo', 'x') and idempotency.claim_event('deliveroo', 'x'))
+        WebhookEvent.objects.filter(key='x').update(expires_at=timezone.now() - timedelta(seconds=1))
+        out = StringIO()
+        call_command('purge_webhook_events', stdout=out)
+        self.assertIn('Deleted 1 ', out.getvalue())
+        self.assertEqual(WebhookEvent.objects.count(), 2)
+
+
+class WebhookClassifierTests(TestCase):
+    """classify_webhook reads statuses, order ids and the PLU verdict in one pass."""
+    def _classify(self, items, **order):
+        from manage_orders.services import deliveroo
+        return deliveroo.classify_webhook({'body': {'order': dict(order, items=items)}})
+
+    def test_statuses_and_order_ids(self):
+        info = self._classify([], id='9', status='Accepted',
+                              status_log=[{'status': 'placed'}, {'state': 'CANCELLED'}],
+                              remake_details={'parent_order_id': '7', 'original': {'id': '9'}})
+        self.assertEqual(info.order_ids, ('9', '7'))
+        self.assertEqual(info.statuses, {'placed', 'cancelled', 'accepted'})
+        self.assertEqual(info.top_status, 'accepted')
+        self.assertTrue(info.accepted and info.canceled)
+        self.assertFalse(info.rejected)
+        self.assertEqual(self._classify([], id='1', status_log=[{'status': 'Rejected'}]).top_status, 'rejected')
+
+    def test_plu_verdicts(self):
+        ok = self._classify([{'plu': '3', 'name': 'Burger'}])
+        self.assertEqual(ok.sync_status(), ('succeeded', None))
+        one_missing = self._classify([{'plu': '3'}, {'plu': ' ', 'name': 'Shake'}])
+        self.assertEqual(one_missing.sync_status(), ('failed', 'pos_item_id_not_found'))
+        self.assertEqual(one_missing.missing_plu_items, ('Shake',))
+        two_missing = self._classify([{'name': 'A'}, {'menu_item_id': 'm2'}])
+        self.assertEqual(two_missing.sync_status(), ('failed', 'pos_item_id_mismatched'))
+        self.assertEqual(two_missing.missing_plu_items, ('A', 'm2'))
+        several_coded = self._classify([{'sku': '3'}, {'pos_id': '4'}])
+        self.assertEqual(several_coded.sync_status(), ('failed', 'pos_item_id_mismatched'))
+
+    @override_settings(DELIVEROO_WEBHOOK_SECRET='', EPOS_OUTBOX_INLINE_DISPATCH=False)
+    def test_payload_details_only_logged_at_debug(self):
+        payload = {'body': {'order': {'id': '5', 'status': 'accepted', 'items': [{'name': 'No code'}]}}}
+        with self.assertLogs('manage_orders.views', level='INFO') as logs:
+            self.client.post(reverse('deliveroo_webhook'), data=json.dumps(payload), content_type='application/json')
+        output = '\n'.join(logs.output)
+        self.assertNotIn('headers=', output)
+        self.assertNotIn('raw_snippet=', output)
+        self.assertIn('pos_item_id_not_found', output)
+
+
+class LiveDailyStatsTests(TestCase):
+    """Orders keep the day's KMeal / KPro / KRev counters current; a recompute must agree."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        _mk_product(30, 'Fries', 220, dc=130)
+        _mk_product(50, 'Cola', 140, dc=100)
+
+    def _submit(self, payment_method='Cash', vat_basis='take', **extra):
+        payload = {
+            'price_band': '1', 'vat_basis': vat_basis, 'show_net': False, 'crew_id': '1',
+            'payment_method': payment_method,
+            'lines': [
+                {'code': 3, 'type': 'product', 'name': 'Cheeseburger', 'qty': 2, 'price_gross': 485},
+                {'code': 3, 'type': 'product', 'name': 'Cheeseburger Meal', 'meal': True, 'qty': 1,
+                 'price_gross': 1, 'meta': {'fries': 30, 'drink': 50, 'go_large': True}},
+            ],
+        }
+        payload.update(extra)
+        # Run the day's seeding, which record_order defers until the order has committed
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse('mo_api_submit_order'), data=json.dumps(payload), content_type='application/json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+
+    def _paid_out(self, amount):
+        with self.captureOnCommitCallbacks(execute=True):
+            resp = self.client.post(reverse('mo_api_paid_out'), data=json.dumps({'price_band': '1', 'amount_pence': amount}),
+                                    content_type='application/json')
+        self.assertEqual(resp.status_code, 200, resp.content)
+
+    def _stored(self):
+        from update_till.models import KMeal, KPro, KRev
+        day = timezone.localdate()
+        return ({r.PRODNUMB: (r.TAKEAWAY, r.EATIN) for r in KMeal.objects.filter(stat_date=day)},
+                {(r.PRODNUMB, r.COMBO): (r.TAKEAWAY, r.EATIN, r.WASTE, r.STAFF, r.OPTION) for r in KPro.objects.filter(stat_date=day)},
+                KRev.objects.filter(stat_date=day).values().get())
+
+    def test_orders_update_counters_incrementally(self):
+        from manage_orders.services.daily_stats import diff_daily_stats
+        from update_till.models import KPro, KRev
+        day = timezone.localdate()
+        self._submit()
+        self._submit(payment_method='Card', vat_basis='eat')
+        self._submit(payment_method='Crew Food')
+        total = 485 * 2 + 685
+        self._submit(payment_method='Split', split_cash_pence=total - 500, split_card_pence=400, split_voucher_pence=100)
+        self._paid_out(250)
+        self.assertEqual(diff_daily_stats(day), [])
+        rev = KRev.objects.get(stat_date=day)
+        self.assertEqual(rev.TCASHVAL, total + total - 500 - 250)
+        self.assertEqual(rev.TCARDVAL, total + 400)
+        self.assertEqual((rev.TTOKENVAL, rev.TPAYOUTVA, rev.TGOLARGENU), (100, 250, 4))
+        self.assertGreater(rev.TSTAFFVAL, 0)
+        burger = KPro.objects.get(stat_date=day, PRODNUMB=3, COMBO=False)
+        self.assertEqual((burger.TAKEAWAY, burger.EATIN, burger.STAFF), (6, 3, 3))
+        # A full rebuild leaves the live counters as they were
+        live = self._stored()
+        build_daily_stats(day)
+        self.assertEqual(self._stored()[:2], live[:2])
+        self.assertEqual({k: v for k, v in self._stored()[2].items() if not k.startswith(('ACT', 'last_'))},
+                         {k: v for k, v in live[2].items() if not k.startswith(('ACT', 'last_'))})
+
+    def test_cleared_day_is_reseeded_by_next_order(self):
+        from manage_orders.services.daily_stats import diff_daily_stats
+        from update_till.models import KMeal, KPro, KRev
+        day = timezone.localdate()
+        self._submit()
+        KMeal.objects.all().delete(); KPro.objects.all().delete(); KRev.objects.all().delete()
+        self._submit(payment_method='Card')
+        self.assertEqual(diff_daily_stats(day), [])
+        self.assertEqual(KPro.objects.get(stat_date=day, PRODNUMB=3, COMBO=False).TAKEAWAY, 6)
+
+    def test_first_sale_of_an_item_on_a_live_day_adds_its_rows(self):
+        from manage_orders.services.daily_stats import diff_daily_stats
+        from update_till.models import KMeal, KRev
+        day = timezone.localdate()
+        self._submit(lines=[{'code': 30, 'type': 'product', 'name': 'Fries', 'qty': 1, 'price_gross': 220}])
+        seeded = KRev.objects.get(stat_date=day).pk
+        self._submit()
+        # Incremented in place: a failed increment would have dropped and rebuilt the day
+        self.assertEqual(KRev.objects.get(stat_date=day).pk, seeded)
+        self.assertEqual(KMeal.objects.get(stat_date=day, PRODNUMB=3).TAKEAWAY, 1)
+        self.assertEqual(diff_daily_stats(day), [])
+
+    def test_first_order_seeds_the_day_after_it_commits(self):
+        from manage_orders.services.daily_stats import diff_daily_stats
+        from update_till.models import KRev
+        day = timezone.localdate()
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.client.post(reverse('mo_api_submit_order'), content_type='application/json', data=json.dumps({
+                'price_band': '1', 'vat_basis': 'take', 'show_net': False, 'crew_id': '1', 'payment_method': 'Cash',
+                'lines': [{'code': 3, 'type': 'product', 'name': 'Cheeseburger', 'qty': 1, 'price_gross': 485}]}))
+        # Nothing was replayed inside the order's transaction
+        self.assertFalse(KRev.objects.filter(stat_date=day).exists())
+        self.assertEqual(len(callbacks), 1)
+        callbacks[0]()
+        self.assertEqual(KRev.objects.get(stat_date=day).TCASHVAL, 485)
+        self.assertEqual(diff_daily_stats(day), [])
+
+    def test_live_stats_endpoint_seeds_the_current_day(self):
+        from update_till.models import KMeal, KPro, KRev
+        self._submit()
+        KMeal.objects.all().delete(); KPro.objects.all().delete(); KRev.objects.all().delete()
+        data = self.client.get(reverse('mo_api_live_stats')).json()
+        self.assertTrue(data['live'])
+        self.assertEqual(data['tenders']['TCASHVAL'], 485 * 2 + 685)
+
+    def test_verify_command_reports_and_fixes_drift(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from io import StringIO
+        from update_till.models import KPro
+        day = timezone.localdate()
+        self._submit()
+        call_command('verify_daily_stats', date=str(day), stdout=StringIO())
+        KPro.objects.filter(stat_date=day, PRODNUMB=30).update(TAKEAWAY=99)
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_daily_stats', date=str(day), stdout=out)
+        self.assertIn('KPro (30, False) TAKEAWAY: stored 99, recomputed 1', out.getvalue())
+        call_command('verify_daily_stats', date=str(day), fix=True, stdout=StringIO())
+        self.assertEqual(KPro.objects.get(stat_date=day, PRODNUMB=30).TAKEAWAY, 1)
+
+    def test_export_of_live_day_does_not_replay_orders(self):
+        import tempfile
+        from io import StringIO
+        from django.core.management import call_command
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from update_till.models import KRev, KWkVat
+        day = timezone.localdate()
+        self._submit()
+        with tempfile.TemporaryDirectory() as tmp, CaptureQueriesContext(connection) as ctx:
+            call_command('export_daily_csvs', date=str(day), outdir=tmp, stdout=StringIO())
+        self.assertFalse([q['sql'] for q in ctx.captured_queries if 'FROM "manage_orders_order' in q['sql']])
+        rev = KRev.objects.get(stat_date=day)
+        self.assertEqual(rev.ACTCASH, rev.TCASHVAL)
+        self.assertGreater(getattr(KWkVat.objects.get(VAT_CLASS=1), f'TOT_VAT_{day.isoweekday()}'), 0)
+
+    def test_live_stats_endpoint_reads_counters(self):
+        self._submit()
+        data = self.client.get(reverse('mo_api_live_stats')).json()
+        self.assertTrue(data['live'])
+        self.assertEqual(data['tenders']['TCASHVAL'], 485 * 2 + 685)
+        self.assertEqual(data['products'][0], {'code': 3, 'combo': False, 'name': 'Cheeseburger',
+                                               'takeaway': 3, 'eatin': 0, 'staff': 0, 'waste': 0, 'option': 0})
+        self.assertEqual(data['meals'], [{'code': 3, 'name': 'Cheeseburger', 'takeaway': 1, 'eatin': 0}])
+        self.assertFalse(self.client.get(reverse('mo_api_live_stats'), {'date': '2001-01-01'}).json()['live'])
+
+
+@override_settings(EPOS_CATALOG_RECHECK_SECONDS=60)
+class DailyStatsStreamingTests(TestCase):
+    """The daily aggregate reads a day in a fixed number of queries, however many orders it has."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        _mk_product(30, 'Fries', 220, dc=130)
+        _mk_product(50, 'Cola', 140, dc=100)
+
+    def _orders(self, n):
+        for i in range(n):
+            o = Order.objects.create(price_band=1, vat_basis='take' if i % 2 else 'eat', payment_method='Cash', total_gross=1170)
+            OrderLine.objects.create(order=o, item_code=3, item_type='product', name='Cheeseburger', qty=1,
+                                     unit_price_gross=485, line_total_gross=485, meta={})
+            OrderLine.objects.create(order=o, item_code=3, item_type='product', name='Cheeseburger Meal', is_meal=True,
+                                     qty=1, unit_price_gross=685, line_total_gross=685, meta={'fries': 30, 'drink': 50})
+        Order.objects.create(price_band=1, vat_basis='eat', payment_method='Paid Out', total_gross=100)
+
+    def _queries(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from manage_orders.services.daily_stats import _aggregate_orders
+        with CaptureQueriesContext(connection) as ctx:
+            stats = _aggregate_orders(timezone.localdate())
+        return len(ctx.captured_queries), stats
+
+    def test_query_count_independent_of_order_count(self):
+        from manage_orders.services import daily_stats
+        self._orders(3)
+        self._queries()  # warm the catalog snapshot
+        few, stats = self._queries()
+        self.assertEqual(stats.kpro_counts[(3, False)], {'TAKEAWAY': 2, 'EATIN': 4, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0})
+        self._orders(40)
+        # Smaller chunks than the day: more round trips on the same two cursors, not more queries
+        daily_stats.STREAM_CHUNK_SIZE, chunk = 25, daily_stats.STREAM_CHUNK_SIZE
+        try:
+            many, stats = self._queries()
+        finally:
+            daily_stats.STREAM_CHUNK_SIZE = chunk
+        self.assertEqual(few, many)
+        self.assertEqual(stats.kpro_counts[(3, False)]['TAKEAWAY'] + stats.kpro_counts[(3, False)]['EATIN'], 86)
+        self.assertEqual(stats.rev['TPAYOUTVA'], 200)
+
+
+class KTableWriteTests(TestCase):
+    """Writing a day's stats is a fixed number of set-based statements, however many keys it has."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+
+    def _write(self, n_keys, day):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from manage_orders.services.daily_stats import _empty_stats, apply_daily_stats
+        stats = _empty_stats(day)
+        for code in range(1, n_keys + 1):
+            stats.meal_counts[code] = {'TAKEAWAY': 1, 'EATIN': 0}
+            stats.kpro_counts[(code, False)] = {'TAKEAWAY': 1, 'EATIN': 2, 'WASTE': 0, 'STAFF': 0, 'OPTION': 0}
+        stats.vat_due[1], stats.vat_net[1] = 20, 100
+        with CaptureQueriesContext(connection) as ctx:
+            apply_daily_stats(stats)
+        return len(ctx.captured_queries)
+
+    def test_statement_count_independent_of_keys(self):
+        from update_till.models import KMeal, KPro, KWkVat
+        day = timezone.localdate()
+        self._write(2, day - timedelta(days=1))  # warm the catalog snapshot
+        few = self._write(3, day)
+        # (well inside one bulk_create batch; larger days add a statement per batch, not per key)
+        self.assertEqual(self._write(60, day), few)
+        self.assertEqual(KPro.objects.filter(stat_date=day).count(), 60)
+        # A rewrite with fewer keys zeroes the ones that no longer occur
+        self._write(3, day)
+        self.assertEqual(KPro.objects.filter(stat_date=day, EATIN=2).count(), 3)
+        self.assertEqual(KMeal.objects.filter(stat_date=day, TAKEAWAY=0).count(), 57)
+        self.assertEqual(KWkVat.objects.get(VAT_CLASS=1).__dict__[f'TOT_VAT_{day.isoweekday()}'], 0.2)
+        self.assertEqual(KWkVat.objects.count(), 1)
+
+
+class DailyCsvZipTests(TestCase):
+    """The reports ZIP holds the files the export command writes, cached on disk per export key."""
+    def setUp(self):
+        import tempfile
+        from django.contrib.auth.models import User
+        cache = tempfile.TemporaryDirectory()
+        self.addCleanup(cache.cleanup)
+        self.cache_dir = cache.name
+        settings_override = override_settings(EPOS_EXPORT_CACHE_DIR=cache.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        for code in range(1, 40):
+            _mk_product(code, f'Item {code}', 100 + code)
+        self._order()
+        self.client.force_login(User.objects.create_user('manager', password='x', is_staff=True))
+
+    def _order(self):
+        from manage_orders.services import daily_stats
+        # As api_submit_order does: the order goes into the day's live counters
+        with self.captureOnCommitCallbacks(execute=True):
+            o = Order.objects.create(price_band=1, vat_basis='take', payment_method='Cash', total_gross=105)
+            line = OrderLine.objects.create(order=o, item_code=5, item_type='product', name='Item 5', qty=1,
+                                            unit_price_gross=105, line_total_gross=105, meta={})
+            daily_stats.record_order(o, [line])
+
+    def _download(self, day):
+        import io
+        import zipfile
+        resp = self.client.get(reverse('mo_export_daily_csvs_zip'), {'date': str(day)})
+        self.assertTrue(resp.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(resp.streaming_content)))
+        return {n: archive.read(n) for n in archive.namelist()}
+
+    def test_zip_matches_command_output_and_clears_tables(self):
+        import io
+        import tempfile
+        import zipfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        from manage_orders.services import daily_csv
+        from manage_orders.services.business_day import business_day_for
+        from update_till.models import KPro, KRev
+        day = business_day_for()
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command('export_daily_csvs', date=str(day), outdir=tmp, stdout=StringIO())
+            expected = {p.name: p.read_bytes() for p in Path(tmp).iterdir()}
+        # The archive is produced incrementally as the rows are read
+        daily_csv.ZIP_CHUNK_BYTES, chunk = 64, daily_csv.ZIP_CHUNK_BYTES
+        try:
+            chunks = [c for c in daily_csv.iter_daily_zip(day) if c]
+        finally:
+            daily_csv.ZIP_CHUNK_BYTES = chunk
+        self.assertGreater(len(chunks), 4)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual({n: archive.read(n) for n in archive.namelist()}, expected)
+        self.assertEqual(self._download(day), expected)
+        self.assertIn(b'5,FALSE,1,0,0,0,0\r\n', expected[f"PD{day:%d%m%y}.CSV"])
+        # The current business day keeps its live counters after a download
+        self.assertTrue(KPro.objects.filter(stat_date=day).exists() and KRev.objects.filter(stat_date=day).exists())
+
+    def test_catalog_or_flag_change_recomputes_the_day(self):
+        from manage_orders.services import daily_stats
+        from manage_orders.services.business_day import business_day_for
+        from update_till.catalog import bump_version
+        day = business_day_for()
+        rv_name = f"RV{day:%d%m%y}.CSV"
+
+        def rv():
+            header, values = self._download(day)[rv_name].decode().split('\r\n')[:2]
+            return dict(zip(header.split(','), map(int, values.split(','))))
+
+        # A meal (item 5 with fries 6 and drink 7) so the meal-discount flag matters
+        PdItem.objects.filter(PRODNUMB__in=[5, 6, 7]).update(DC_VATPR=50)
+        bump_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            o = Order.objects.create(price_band=1, vat_basis='take', payment_method='Cash', total_gross=150)
+            line = OrderLine.objects.create(order=o, item_code=5, item_type='product', name='Item 5 Meal', qty=1,
+                                            is_meal=True, unit_price_gross=150, line_total_gross=150,
+                                            meta={'fries': 6, 'drink': 7})
+            daily_stats.record_order(o, [line])
+        from django.conf import settings
+        before = rv()
+        PdVatTb.objects.filter(VAT_CLASS=1).update(VAT_RATE=5.0)
+        bump_version()
+        # The file and the stored counters follow the new VAT rate, not the one the order was counted under
+        after = rv()
+        self.assertLess(after['VAT'], before['VAT'] / 2)
+        self.assertEqual(daily_stats.diff_daily_stats(day), [])
+        with override_settings(EPOS_GROSS_MEAL_DISCOUNT=not settings.EPOS_GROSS_MEAL_DISCOUNT):
+            flipped = rv()
+        self.assertNotEqual(flipped['TMEAL_DISCNT'], rv()['TMEAL_DISCNT'])
+        self.assertEqual(daily_stats.diff_daily_stats(day), [])
+
+    def test_download_clears_only_the_exported_day(self):
+        from datetime import timedelta
+        from manage_orders.services.business_day import business_day_for
+        from manage_orders.services.daily_stats import build_daily_stats
+        from update_till.models import KPro, KRev
+        today = business_day_for()
+        yesterday = today - timedelta(days=1)
+        build_daily_stats(today)
+        build_daily_stats(yesterday)
+        self._download(yesterday)
+        self.assertFalse(KRev.objects.filter(stat_date=yesterday).exists())
+        self.assertTrue(KRev.objects.filter(stat_date=today).exists())
+        self.assertEqual(KPro.objects.get(stat_date=today, PRODNUMB=5, COMBO=False).TAKEAWAY, 1)
+
+    def test_repeat_downloads_are_served_from_cache_until_a_late_order(self):
+        import os
+        from manage_orders.services import export_cache
+        from manage_orders.services.business_day import business_day_for
+        from update_till.models import KRev
+        day = business_day_for()
+        first = self._download(day)
+        key = export_cache.export_key(day)
+        # Served from disk: beyond the export key's watermark, the day's orders are not read again
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as ctx:
+            self.assertEqual(self._download(day), first)
+        self.assertFalse([q['sql'] for q in ctx.captured_queries
+                          if 'FROM "manage_orders_order' in q['sql'] and 'COUNT(' not in q['sql']])
+        self.assertTrue(KRev.objects.filter(stat_date=day).exists())
+        self._order()
+        self.assertNotEqual(export_cache.export_key(day), key)
+        late = self._download(day)
+        self.assertIn(b'5,FALSE,2,0,0,0,0\r\n', late[f"PD{day:%d%m%y}.CSV"])
+        self.assertEqual([n for n in os.listdir(self.cache_dir) if n.endswith('.zip')],
+                         [f"daily_csvs_{day:%Y%m%d}_{export_cache.export_key(day)}.zip"])
+
+    def test_download_survives_a_newer_build_removing_its_file(self):
+        import io
+        import zipfile
+        from manage_orders.services.business_day import business_day_for
+        day = business_day_for()
+        # Response taken, body not sent yet; meanwhile a late order and a second download
+        # replace the cached artifact (and delete the one the first response is serving)
+        resp = self.client.get(reverse('mo_export_daily_csvs_zip'), {'date': str(day)})
+        self._order()
+        self.assertIn(b'5,FALSE,2,0,0,0,0\r\n', self._download(day)[f"PD{day:%d%m%y}.CSV"])
+        body = b''.join(resp.streaming_content)
+        self.assertEqual(len(body), int(resp['Content-Length']))
+        first = zipfile.ZipFile(io.BytesIO(body))
+        self.assertIn(b'5,FALSE,1,0,0,0,0\r\n', first.read(f"PD{day:%d%m%y}.CSV"))
+
+
+class StatsBackfillTests(TestCase):
+    """--from/--to rebuilds each day in date order; workers=1 keeps the test DB in-process."""
+    def setUp(self):
+        PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+        _mk_product(3, 'Cheeseburger', 485, dc=455)
+        self.first = timezone.localdate() - timedelta(days=3)
+        for offset, n in ((0, 1), (1, 0), (2, 2)):
+            from datetime import datetime, time
+            noon = timezone.make_aware(datetime.combine(self.first + timedelta(days=offset), time(12)))
+            for _ in range(n):
+                o = Order.objects.create(price_band=1, vat_basis='take', payment_method='Cash', total_gross=485)
+                Order.objects.filter(pk=o.pk).update(created_at=noon)
+                OrderLine.objects.create(order=o, item_code=3, item_type='product', name='Cheeseburger', qty=1,
+                                         unit_price_gross=485, line_total_gross=485, meta={})
+
+    def test_range_rebuild_writes_every_day(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from update_till.models import KRev
+        out = StringIO()
+        call_command('build_daily_stats', **{'from': str(self.first), 'to': str(self.first + timedelta(days=2)), 'workers': 1}, stdout=out)
+        rev = {r.stat_date: r.TCASHVAL for r in KRev.objects.all()}
+        self.assertEqual(rev, {self.first: 485, self.first + timedelta(days=1): 0, self.first + timedelta(days=2): 970})
+        self.assertIn('3 day(s), 3 orders', out.getvalue())
+
+    def test_orders_taken_after_a_day_was_computed_are_not_lost(self):
+        from manage_orders.services import daily_stats
+        from manage_orders.services.business_day import business_day_for
+        from update_till.models import KRev
+        today = business_day_for()
+
+        def sell():
+            with self.captureOnCommitCallbacks(execute=True):
+                o = Order.objects.create(price_band=1, vat_basis='take', payment_method='Cash', total_gross=485)
+                line = OrderLine.objects.create(order=o, item_code=3, item_type='product', name='Cheeseburger', qty=1,
+                                                unit_price_gross=485, line_total_gross=485, meta={})
+                daily_stats.record_order(o, [line])
+
+        sell()
+        # As in a range rebuild: computed (in a worker) before the till's next order, written after it
+        stale = daily_stats.compute_daily_stats(today)
+        sell()
+        written = daily_stats.apply_daily_stats(stale)
+        self.assertEqual(written.order_count, 2)
+        self.assertEqual(KRev.objects.get(stat_date=today).TCASHVAL, 970)
+        self.assertEqual(daily_stats.diff_daily_stats(today), [])
+
+    def test_range_export_writes_a_folder_per_day(self):
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as tmp:
+            call_command('export_daily_csvs', **{'from': str(self.first), 'to': str(self.first + timedelta(days=1)),
+                                                 'workers': 1, 'outdir': tmp}, stdout=StringIO())
+            for day in (self.first, self.first + timedelta(days=1)):
+                names = sorted(p.name for p in (Path(tmp) / f"{day:%Y-%m-%d}").iterdir())
+                self.assertEqual(names, ['K_WK_VAT.csv', f"MP{day:%d%m%y}.CSV", f"PD{day:%d%m%y}.CSV", f"RV{day:%d%m%y}.CSV"])
+
+    def test_bad_ranges_are_rejected(self):
+        from django.core.management import call_command
+        from django.core.management.base import CommandError
+        from manage_orders.services.stats_backfill import day_range
+        with self.assertRaises(ValueError):
+            day_range(self.first, self.first - timedelta(days=1))
+        with self.assertRaises(CommandError):
+            call_command('build_daily_stats', **{'from': str(self.first)})
+        with self.assertRaises(CommandError):
+            call_command('export_daily_csvs', **{'from': str(self.first), 'to': str(self.first), 'clear': True})
+
+    def _bundle(self, content):
+        import io
+        import zipfile
+        archive = zipfile.ZipFile(io.BytesIO(content))
+        return {n: archive.read(n) for n in archive.namelist()}
+
+    def test_range_bundle_endpoint_has_every_day_and_a_manifest(self):
+        import hashlib
+        import tempfile
+        from django.contrib.auth.models import User
+        from update_till.models import KRev
+        last = self.first + timedelta(days=2)
+        self.client.force_login(User.objects.create_user('office', password='x', is_staff=True))
+        with tempfile.TemporaryDirectory() as tmp, override_settings(EPOS_EXPORT_CACHE_DIR=tmp, EPOS_EXPORT_WORKERS=1):
+            resp = self.client.get(reverse('mo_export_range_csvs_zip'), {'from': str(self.first), 'to': str(last)})
+            self.assertEqual(resp.status_code, 200)
+            files = self._bundle(b''.join(resp.streaming_content))
+            self.assertEqual(self.client.get(reverse('mo_export_range_csvs_zip'), {'from': str(last), 'to': str(self.first)}).status_code, 400)
+        manifest = json.loads(files.pop('manifest.json'))
+        self.assertEqual([d['orders'] for d in manifest['days']], [1, 0, 2])
+        entries = [f for d in manifest['days'] for f in d['files']] + manifest['files']
+        self.assertEqual(sorted(f['name'] for f in entries), sorted(files))
+        for f in entries:
+            self.assertEqual(f['sha256'], hashlib.sha256(files[f['name']]).hexdigest())
+        self.assertEqual(next(f['rows'] for f in entries if f['name'] == f"{self.first:%Y-%m-%d}/PD{self.first:%d%m%y}.CSV"), 1)
+        self.assertIn(b'970', files[f"{last:%Y-%m-%d}/RV{last:%d%m%y}.CSV"])
+        # The K tables are left holding the whole range
+        self.assertEqual(KRev.objects.count(), 3)
+
+    def test_range_endpoint_stays_in_process_by_default(self):
+        import tempfile
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from manage_orders.services import stats_backfill
+        self.client.force_login(User.objects.create_user('office', password='x', is_staff=True))
+        with tempfile.TemporaryDirectory() as tmp, override_settings(EPOS_EXPORT_CACHE_DIR=tmp, EPOS_EXPORT_WORKERS=0), \
+                mock.patch.object(stats_backfill, 'ProcessPoolExecutor') as pool:
+            resp = self.client.get(reverse('mo_export_range_csvs_zip'),
+                                   {'from': str(self.first), 'to': str(self.first + timedelta(days=2))})
+            self.assertEqual(resp.status_code, 200)
+            resp.close()
+        pool.assert_not_called()
+        # Worker processes, when configured, never fork the threaded web process
+        self.assertNotEqual(stats_backfill._mp_context().get_start_method(), 'fork')
+
+    def test_range_bundle_command(self):
+        import tempfile
+        from io import StringIO
+        from pathlib import Path
+        from django.core.management import call_command
+        with tempfile.TemporaryDirectory() as tmp, override_settings(EPOS_EXPORT_CACHE_DIR=tmp):
+            call_command('export_daily_csvs', **{'from': str(self.first), 'to': str(self.first + timedelta(days=1)),
+                                                 'workers': 1, 'outdir': tmp, 'zip': True}, stdout=StringIO())
+            files = self._bundle((Path(tmp) / f"daily_csvs_{self.first:%Y%m%d}-{self.first + timedelta(days=1):%Y%m%d}.zip").read_bytes())
+        self.assertEqual(len(files), 2 * 3 + 2)
+        self.assertIn('K_WK_VAT.csv', files)
@@ -17,6 +17,8 @@ urlpatterns = [
     # Lightweight APIs to reduce payloads
     path('api/menu/categories', views.api_menu_categories, name='mo_api_menu_categories'),
     path('api/menu/category/<int:group_id>/items', views.api_category_items, name='mo_api_category_items'),
+    # Whole band in one compressed document (categories, items, details, toppings) for till preload
+    path('api/menu/bundle', views.api_menu_bundle, name='mo_api_menu_bundle'),
     # API: options for a given product (P_CHOICE relationships)
     path('api/product/<int:prod_code>/options', views.api_product_options, name='mo_api_product_options'),
     path('api/product/<int:prod_code>/toppings', views.api_product_toppings, name='mo_api_product_toppings'),
@@ -32,7 +34,9 @@ urlpatterns = [
     path('api/orders/completed', views.api_orders_completed, name='mo_api_orders_completed'),
     path('api/daily-sales', views.api_daily_sales, name='mo_api_daily_sales'),
     path('api/daily-sales-hourly', views.api_daily_sales_hourly, name='mo_api_daily_sales_hourly'),
+    path('api/daily-stats/live', views.api_live_stats, name='mo_api_live_stats'),
     path('reports/export-daily-csvs', views.export_daily_csvs_zip, name='mo_export_daily_csvs_zip'),
+    path('reports/export-range-csvs', views.export_range_csvs_zip, name='mo_export_range_csvs_zip'),
     # Webhooks: deliveroo, uber eats, etc.
     path('webhooks/deliveroo/orders', views.deliveroo_webhook, name='deliveroo_webhook'),
     path('webhook/deliveroo/order-update', views.deliveroo_webhook, name='deliveroo_webhook_compat'),
@@ -1,12 +1,9 @@
 import sys
-import threading
 import os
-import time
-import requests
 from django.conf import settings
 from django.shortcuts import render
 from django.http import JsonResponse, HttpRequest
-from django.http import HttpResponse, HttpResponseBadRequest, HttpResponseForbidden
+from django.http import FileResponse, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.db import transaction
 from django.views.decorators.http import require_GET
@@ -14,66 +11,16 @@ from django.contrib.admin.views.decorators import staff_member_required
 from django.utils import timezone
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.views.decorators.csrf import csrf_exempt 
-from update_till.models import (
-    PdItem, AppProd, GroupTb, PChoice, CombTb, AppComb, PdVatTb, CompPro, OptPro,
-    EposGroup, EposProd, EposFreeProd, EposComb, EposCombFreeProd, ToppingDel, ACodes,
-    EposAddOns, PriceBand
-)
+from update_till.models import PdItem, AppProd, CombTb, AppComb
+from update_till.catalog import CatalogSnapshot, get_catalog
+from update_till.price_matrix import net_pence
+from .services import daily_stats, deliveroo, idempotency, menu_cache, pricing
+from .services.business_day import business_day_filter, business_day_for
 from pathlib import Path
 import json, hmac, hashlib, logging
+from logging import DEBUG
 
 logging = logging.getLogger(__name__)
-_d_token = None
-_d_token_expiry = 0.0
-def _deliveroo_hosts():
-    env = os.getenv('DELIVEROO_ENV', 'sandbox').strip().lower()
-    if env == 'production':
-        api = os.getenv('DELIVEROO_API_BASE_URL', 'https://api.developers.deliveroo.com')
-        auth = os.getenv('DELIVEROO_AUTH_TOKEN_URL', 'https://auth.developers.deliveroo.com/oauth2/token')
-    else:
-        api = os.getenv('DELIVEROO_API_BASE_URL', 'https://api-sandbox.developers.deliveroo.com')
-        auth = os.getenv('DELIVEROO_AUTH_TOKEN_URL', 'https://auth-sandbox.developers.deliveroo.com/oauth2/token')
-    return api, auth
-def _deliveroo_auth_headers():
-    global _d_token, _d_token_expiry
-    now = time.time()
-    if (not _d_token) or (now >= _d_token_expiry):
-        api, auth = _deliveroo_hosts()
-        client_id = os.getenv('DELIVEROO_CLIENT_ID', '')
-        client_secret = os.getenv('DELIVEROO_CLIENT_SECRET', '')
-        data = {
-            'client_id': client_id,
-            'client_secret': client_secret,
-            'grant_type': 'client_credentials',
-        }
-        headers = {'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'}
-        resp = requests.post(auth, data=data, headers=headers, timeout=10)
-        if resp.status_code != 200:
-            return {}
-        payload = resp.json()
-        _d_token = payload.get('access_token')
-        try:
-            expires_in = int(payload.get('expires_in', 300))
-        except Exception:
-            expires_in = 300
-        _d_token_expiry = now + max(60, expires_in - 10)
-    return {'Authorization': f'Bearer {_d_token}'}
-def _post_sync_status(order_id: str, status: str, reason: str | None = None, notes: str | None = None, occurred_at: str | None = None) -> None:
-    api, _ = _deliveroo_hosts()
-    url = f"{api}/order/v1/orders/{order_id}/sync_status"
-    body = {'status': status}
-    if reason:
-        body['reason'] = reason
-    if notes:
-        body['notes'] = notes
-    if occurred_at:
-        body['occurred_at'] = occurred_at
-    headers = {'Content-Type': 'application/json'}
-    headers.update(_deliveroo_auth_headers())
-    if not headers.get('Authorization'):
-        return
-    requests.post(url, json=body, headers=headers, timeout=20)
-
 def _verify_webhook_signature(request: HttpRequest, secret: str) -> bool:
     """Verify HMAC SHA256 signature of incoming webhook request.
 
@@ -96,99 +43,35 @@ def _verify_webhook_signature(request: HttpRequest, secret: str) -> bool:
     ).hexdigest()
     return hmac.compare_digest(computed_hmac, signature)
 
-def _has_accepted_status(payload: dict) -> bool:
-    body = payload.get('body') or {}
-    order = body.get('order') or {}
-    status_log = order.get('status_log') or payload.get('status_log') or []
-    for entry in status_log:
-        s = entry.get('status') or entry.get('state')
-        if s and str(s).lower() == 'accepted':
-            return True
-    top = order.get('status') or order.get('state') or payload.get('status') or payload.get('state')
-    if top and str(top).lower() == 'accepted':
-        return True
-    return False
-
-def _has_rejected_status(payload: dict) -> bool:
-    body = payload.get('body') or {}
-    order = body.get('order') or {}
-    status_log = order.get('status_log') or payload.get('status_log') or []
-    for entry in status_log:
-        s = entry.get('status') or entry.get('state')
-        if s and str(s).lower() == 'rejected':
-            return True
-    top = order.get('status') or order.get('state') or payload.get('status') or payload.get('state')
-    if top and str(top).lower() == 'rejected':
-        return True
-    return False
-
-def _has_canceled_status(payload: dict) -> bool:
-    body = payload.get('body') or {}
-    order = body.get('order') or {}
-    status_log = order.get('status_log') or payload.get('status_log') or []
-    for entry in status_log:
-        s = entry.get('status') or entry.get('state')
-        if s and str(s).lower() in ('canceled', 'cancelled'):
-            return True
-    top = order.get('status') or order.get('state') or payload.get('status') or payload.get('state')
-    if top and str(top).lower() in ('canceled', 'cancelled'):
-        return True
-    return False
-
-def _send_sync_status(payload: dict, order_id: str | None, status: str = 'succeeded', reason_override: str | None = None) -> None:
-    try:
-        body = payload.get('body') or {}
-        order = body.get('order') or {}
-        oid = order_id or order.get('id')
-        market = order.get('market') or payload.get('market')
-        if oid and ':' not in str(oid) and market:
-            oid = f"{market}:{oid}"
-        occurred_at = timezone.now().isoformat(timespec='seconds')
-        reason = None
-        if status == 'failed':
-            if isinstance(reason_override, str) and reason_override.strip():
-                reason = reason_override.strip()
-            else:
-                r = order.get('reject_reason') or order.get('reason')
-                if isinstance(r, str):
-                    r = r.strip()
-                    if r:
-                        reason = r
-                if not reason:
-                    reason = 'other'
-        notes = None
-        items = order.get('items') or order.get('line_items') or []
-        mp = []
-        try:
-            for it in items:
-                codes = [it.get('plu'), it.get('sku'), it.get('pos_code'), it.get('external_id'), it.get('pos_id'), it.get('code')]
-                if not any(c and str(c).strip() for c in codes):
-                    name = it.get('name') or it.get('menu_item_id') or it.get('id') or '?'
-                    mp.append(str(name))
-        except Exception:
-            mp = []
-        if mp:
-            notes = f"missing_plu_items={','.join(mp[:10])}"
-        _post_sync_status(order_id=str(oid), status=status, reason=reason, notes=notes, occurred_at=occurred_at)
-    except Exception:
-        pass
+def _deliveroo_event_key(request: HttpRequest, payload: dict, info: deliveroo.WebhookOrder) -> str | None:
+    """Idempotency key for a webhook: the platform's event id if given, else order id + event + status."""
+    event_id = request.headers.get('X-Deliveroo-Sequence-Guid') or payload.get('event_id')
+    if event_id:
+        return f"event:{event_id}"
+    if not info.order_ids:
+        return None
+    event = payload.get('event') or payload.get('event_type') or ''
+    return f"order:{info.order_ids[0]}:{event}:{info.top_status}"
 
 @csrf_exempt
 @require_POST
+@transaction.atomic
 def deliveroo_webhook(request: HttpRequest) -> HttpResponse:
+    # Atomic: idempotency claims and queued sync_status calls commit together, so a
+    # request that fails part-way leaves nothing behind and the platform's retry is processed.
     secret = settings.DELIVEROO_WEBHOOK_SECRET
     if not _verify_webhook_signature(request, secret):
         return HttpResponseForbidden("Invalid signature")
     content_type = request.headers.get('content-type', '')
     raw = request.body
-    try:
-        logging.info("deliveroo webhook received")
-        logging.info("content_type=%s raw_len=%s", content_type, len(raw))
-        logging.info("headers=%s", dict(request.headers))
-        snippet = raw.decode(errors='ignore')[:500]
-        logging.info("raw_snippet=%s", snippet)
-    except Exception:
-        pass
+    # Exact redelivery of a body already handled: acknowledge without parsing it again
+    if not idempotency.claim_event('deliveroo', idempotency.body_key(raw)):
+        return JsonResponse({'status': 'duplicate'})
+    logging.info("deliveroo webhook received content_type=%s raw_len=%s", content_type, len(raw))
+    debug = logging.isEnabledFor(DEBUG)
+    if debug:
+        logging.debug("headers=%s", dict(request.headers))
+        logging.debug("raw_snippet=%s", raw[:500].decode(errors='ignore'))
     try:
         payload = json.loads(raw.decode('utf-8'))
     except Exception:
@@ -206,131 +89,36 @@ def deliveroo_webhook(request: HttpRequest) -> HttpResponse:
                 payload = json.loads(text)
         except Exception:
             return JsonResponse({'status': 'ok'})
-    body = payload.get('body') or {}
-    order = body.get('order') or {}
-    try:
-        logging.info("payload_status_log=%s", order.get('status_log') or payload.get('status_log'))
-        logging.info("payload_top_status=%s", order.get('status') or order.get('state') or payload.get('status') or payload.get('state'))
-    except Exception:
-        pass
-    discounts = (
-        order.get('discounts')
-        or order.get('promotions')
-        or order.get('basket_discount')
-        or order.get('basket_discounts')
-    )
-    if discounts:
-        try:
-            logging.info("payload_discounts=%s", discounts)
-        except Exception:
-            pass
-    payments = (
-        order.get('payments')
-        or order.get('payment_methods')
-        or order.get('payment')
-        or order.get('tenders')
-    )
-    if payments:
-        try:
-            logging.info("payload_payments=%s", payments)
-        except Exception:
-            pass
-    items = order.get('items') or order.get('line_items') or []
-    missing_plus = []
-    try:
-        for it in items:
-            codes = [
-                it.get('plu'),
-                it.get('sku'),
-                it.get('pos_code'),
-                it.get('external_id'),
-                it.get('pos_id'),
-                it.get('code'),
-            ]
-            if not any(c and str(c).strip() for c in codes):
-                missing_plus.append(it.get('name') or it.get('menu_item_id') or it.get('id') or '?')
-    except Exception:
-        missing_plus = []
-    if missing_plus:
-        try:
-            logging.info("payload_missing_plus=%s", missing_plus)
-        except Exception:
-            pass
-    def collect_order_ids(o: dict) -> list:
-        ids = []
-        oid = o.get('id') or payload.get('order_id') or payload.get('id')
-        if oid:
-            ids.append(oid)
-        rd = o.get('remake_details')
-        if isinstance(rd, dict):
-            for k, v in rd.items():
-                if isinstance(v, str) and ('order' in k and 'id' in k):
-                    ids.append(v)
-                elif isinstance(v, dict):
-                    vid = v.get('id') or v.get('order_id')
-                    if vid:
-                        ids.append(vid)
-        return list(dict.fromkeys(ids))
-    ids = collect_order_ids(order)
-    logging.info("candidate_order_ids=%s", ids)
-    if _has_accepted_status(payload):
+    info = deliveroo.classify_webhook(payload)
+    if debug:
+        order = info.order
+        logging.debug("payload_status_log=%s", order.get('status_log') or payload.get('status_log'))
+        logging.debug("payload_top_status=%s", info.top_status)
+        discounts = (order.get('discounts') or order.get('promotions')
+                     or order.get('basket_discount') or order.get('basket_discounts'))
+        if discounts:
+            logging.debug("payload_discounts=%s", discounts)
+        payments = (order.get('payments') or order.get('payment_methods')
+                    or order.get('payment') or order.get('tenders'))
+        if payments:
+            logging.debug("payload_payments=%s", payments)
+        if info.missing_plu_items:
+            logging.debug("payload_missing_plus=%s", info.missing_plu_items)
+    ids = info.order_ids
+    logging.info("candidate_order_ids=%s statuses=%s plu=%s", ids, sorted(info.statuses), info.plu_verdict)
+    # Repeated status update for an order we have already handled: do not queue another sync_status
+    event_key = _deliveroo_event_key(request, payload, info)
+    if event_key and not idempotency.claim_event('deliveroo', event_key):
+        logging.info("duplicate webhook event %s; not re-queued", event_key)
+        return JsonResponse({'status': 'duplicate'})
+    if info.accepted:
+        status, reason = info.sync_status()
         for oid in ids:
-            items = order.get('items') or order.get('line_items') or []
-            has_missing_plu = False
-            missing_count = 0
-            has_mismatched_plu = False
-            code_to_items = {}
-            try:
-                for it in items:
-                    codes = [it.get('plu'), it.get('sku'), it.get('pos_code'), it.get('external_id'), it.get('pos_id'), it.get('code')]
-                    if not any(c and str(c).strip() for c in codes):
-                        has_missing_plu = True
-                        missing_count += 1
-                    else:
-                        val = None
-                        for c in codes:
-                            if c and str(c).strip():
-                                val = str(c).strip()
-                                break
-                        if val:
-                            name = it.get('name') or it.get('menu_item_id') or it.get('id') or '?'
-                            arr = code_to_items.get(val) or []
-                            arr.append(str(name))
-                            code_to_items[val] = arr
-                for k, v in code_to_items.items():
-                    if len(v) >= 2:
-                        has_mismatched_plu = True
-                        break
-            except Exception:
-                has_missing_plu = False
-                has_mismatched_plu = False
-            try:
-                count_with_codes = sum(1 for it in items if any([it.get('plu'), it.get('sku'), it.get('pos_code'), it.get('external_id'), it.get('pos_id'), it.get('code')]))
-            except Exception:
-                count_with_codes = 0
-            has_mismatch_broad = (len(items) >= 2 and count_with_codes >= 2 and not has_missing_plu)
-            def _bg(status: str, reason: str | None = None):
-                threading.Thread(target=_send_sync_status, args=(payload, oid, status, reason), daemon=True).start()
-            if missing_count >= 2:
-                logging.info("queue sync status (failed - mismatched PLUs) for %s", oid)
-                _bg('failed', 'pos_item_id_mismatched')
-            elif has_missing_plu:
-                logging.info("queue sync status (failed - missing PLUs) for %s", oid)
-                _bg('failed', 'pos_item_id_not_found')
-            elif has_mismatched_plu or has_mismatch_broad:
-                logging.info("queue sync status (failed - mismatched PLUs) for %s", oid)
-                _bg('failed', 'pos_item_id_mismatched')
-            else:
-                logging.info("queue sync status for %s", oid)
-                _bg('succeeded')
-    elif _has_rejected_status(payload):
-        if _has_accepted_status(payload):
-            for oid in ids:
-                logging.info("queue sync status (rejected) for %s", oid)
-                threading.Thread(target=_send_sync_status, args=(payload, oid, 'failed'), daemon=True).start()
-        else:
-            logging.info("skip rejected sync: order never accepted")
-    elif _has_canceled_status(payload):
+            logging.info("queue sync status (%s%s) for %s", status, f" - {reason}" if reason else '', oid)
+            deliveroo.queue_sync_status(payload, oid, status, reason, missing_plu_items=info.missing_plu_items)
+    elif info.rejected:
+        logging.info("skip rejected sync: order never accepted")
+    elif info.canceled:
         logging.info("cancellation received; no sync status required")
     else:
         logging.info("sync status not queued")
@@ -342,57 +130,7 @@ def webhook_order_update(request: HttpRequest, platform: str) -> HttpResponse:
     if platform == 'deliveroo':
         return deliveroo_webhook(request)
     return HttpResponseBadRequest('Unsupported platform')
-"""
-@csrf_exempt  # Webhooks come from external systems, not your frontend
-@require_POST
-def delivery_webhook(request):
-    try:
-        raw = request.body  # raw bytes
-        signature_header = request.headers.get("X-Signature")  # adjust name per partner
-        secret = getattr(settings, "DELIVERY_WEBHOOK_SECRET", None)
-
-        if not _verify_signature(raw, signature_header, secret):
-            logger.warning("Invalid signature for deliveries webhook")
-            return HttpResponseForbidden("Invalid signature")
-
-        payload = json.loads(raw.decode("utf-8"))
 
-        # Optional: enforce idempotency if a unique event ID is provided
-        event_id = payload.get("event_id") or payload.get("id")
-        if event_id and _already_processed(event_id):
-            # Avoid double-processing
-            return JsonResponse({"status": "duplicate"}, status=200)
-
-        # QUICK ACK first; enqueue actual processing
-        enqueue_delivery_event(payload)
-
-        return JsonResponse({"status": "ok"}, status=200)
-
-    except json.JSONDecodeError:
-        logger.exception("Invalid JSON payload")
-        return HttpResponseBadRequest("Invalid JSON")
-    except Exception:
-        logger.exception("Unhandled error in deliveries webhook")
-        return JsonResponse({"status": "error"}, status=500)
-
-# Example placeholders (implement these in your app)
-from django.core.cache import cache
-
-def _already_processed(event_id: str) -> bool:
-    key = f"delivery_evt_{event_id}"
-    if cache.get(key):
-        return True
-    cache.set(key, True, timeout=24*3600)  # 24h idempotency window
-    return False
-
-def enqueue_delivery_event(payload: dict):
-    # Put into Celery/Django-Q/RQ; avoid heavy work in the request thread
-    # Example Celery:
-    # process_delivery_event.delay(payload)
-    pass
-
-
-"""
 
 # Load local_menu.json file and read it first
 # group the list of menu category
@@ -477,7 +215,7 @@ def api_channel_mappings(request: HttpRequest):
         { "channels": [ { id, name, band, channel_code, co_number, is_third_party_delivery,
                    accept_cash, accept_card, accept_onacc, accept_voucher, accept_crew_food, accept_cooked_waste }, ... ] }
         """
-        rows = PriceBand.objects.filter(APPLY_HERE=True).order_by('SEQ_ORDER', 'SUPPLIER_NAME')
+        rows = get_catalog().price_bands
         data = []
         for r in rows:
                 data.append({
@@ -518,7 +256,7 @@ def app_prod_order(request):
     # GroupTb is the menu category
     context = {
         # 'price_band': _price_band_map(),
-        'menu_categories': GroupTb.objects.all()
+        'menu_categories': get_catalog().groups
     }
     return render(request, 'manage_orders/app_prod_order.html', context)
 
@@ -547,36 +285,36 @@ def _price_column_name(band: str, discounted: bool) -> str:
 
 
 def _vat_rate_map():
-    return {r.VAT_CLASS: r.VAT_RATE for r in PdVatTb.objects.all()}
+    return dict(get_catalog().vat_rates)
 
 
-def _serialize_product(item: PdItem, band: str, app_meta: AppProd | None = None, vat_rates: dict | None = None) -> dict:
+def _serialize_product(item: PdItem, band: str, app_meta: AppProd | None = None, vat_rates: dict | None = None,
+                       catalog: CatalogSnapshot | None = None) -> dict:
     """Serialize a PdItem to JSON including standard & discounted price for chosen band.
 
     app_meta: corresponding AppProd row (for grouping / meal flags / variants) if available
+    catalog: snapshot supplying display names, variant rows and the price matrix; callers
+             serializing a list resolve it once and pass it to every item so no lookup hits the database
+    vat_rates: only consulted for rows missing from the snapshot's price matrix
     """
-    std_col = _price_column_name(band, discounted=False)
-    dc_col = _price_column_name(band, discounted=True)
-    std_price = getattr(item, std_col, None)
-    dc_price = getattr(item, dc_col, None)
-    std_price = int(std_price) if std_price is not None else 0
-    dc_price = int(dc_price) if dc_price is not None else 0
-    vat_rates = vat_rates or {}
-    take_vat = vat_rates.get(getattr(item, 'TAKE_VAT_CLASS', None), 0.0)
-    eat_vat = vat_rates.get(getattr(item, 'EAT_VAT_CLASS', None), 0.0)
-    def net(gross, rate):
-        try:
-            return int(round(gross / (1 + (rate/100.0)))) if gross else 0
-        except ZeroDivisionError:
-            return gross
+    catalog = catalog or get_catalog()
+    prices = catalog.product_prices
+    take_vat = prices.vat_rate(item.PRODNUMB, 'take')
+    eat_vat = prices.vat_rate(item.PRODNUMB, 'eat')
+    row = prices.row(item.PRODNUMB, band)
+    if row is None:
+        vat_rates = vat_rates or {}
+        take_vat = vat_rates.get(getattr(item, 'TAKE_VAT_CLASS', None), 0.0)
+        eat_vat = vat_rates.get(getattr(item, 'EAT_VAT_CLASS', None), 0.0)
+        std = _price_snapshot(item, band)
+        dc = _price_snapshot(item, band, discounted=True)
+        row = (std, net_pence(std, take_vat), net_pence(std, eat_vat), dc, net_pence(dc, take_vat), net_pence(dc, eat_vat))
+    std_price, std_net_take, std_net_eat, dc_price, dc_net_take, dc_net_eat = row
     # Prefer ITEM_DESC from EposProd if available; fallback to PdItem.PRODNAME
     disp_name = (item.PRODNAME or '').strip()
-    try:
-        ep = EposProd.objects.filter(PRODNUMB=item.PRODNUMB).order_by('-last_updated').first()
-        if ep and (ep.ITEM_DESC or '').strip():
-            disp_name = ep.ITEM_DESC.strip()
-    except Exception:
-        pass
+    ep = catalog.epos_product_by_code.get(item.PRODNUMB)
+    if ep and (ep.ITEM_DESC or '').strip():
+        disp_name = ep.ITEM_DESC.strip()
 
     data = {
         'type': 'product',
@@ -584,11 +322,11 @@ def _serialize_product(item: PdItem, band: str, app_meta: AppProd | None = None,
         'name': disp_name,
         'band': band,
         'price_gross': std_price,
-        'price_net_take': net(std_price, take_vat),
-        'price_net_eat': net(std_price, eat_vat),
+        'price_net_take': std_net_take,
+        'price_net_eat': std_net_eat,
         'discounted_price_gross': dc_price,
-        'discounted_price_net_take': net(dc_price, take_vat),
-        'discounted_price_net_eat': net(dc_price, eat_vat),
+        'discounted_price_net_take': dc_net_take,
+        'discounted_price_net_eat': dc_net_eat,
     'T_DRINK_CD': getattr(item, 'T_DRINK_CD', 0) or 0,
         'meal_only': bool(getattr(item, 'MEAL_ONLY', False)),
         'has_discount': (dc_price and dc_price != std_price),
@@ -610,21 +348,14 @@ def _serialize_product(item: PdItem, band: str, app_meta: AppProd | None = None,
             variant_codes.append(('double', app_meta.DOUBLE_PDNUMB))
         if app_meta.TRIPLE_PDNUMB and app_meta.TRIPLE_PDNUMB != 0:
             variant_codes.append(('triple', app_meta.TRIPLE_PDNUMB))
-        # Look up variants only once (caller may supply pre-fetched map)
         for label, vcode in variant_codes:
             # variant product may not exist in PdItem table (skip if not)
-            vitem = PdItem.objects.filter(PRODNUMB=vcode).only('PRODNUMB', 'PRODNAME', std_col, dc_col).first()
+            vitem = catalog.products.get(vcode)
             if vitem:
-                v_std = getattr(vitem, std_col, 0) or 0
-                v_dc = getattr(vitem, dc_col, 0) or 0
+                v_std = prices.price(vcode, band)
+                v_dc = prices.price(vcode, band, discounted=True)
                 # Prefer ITEM_DESC from EposProd for variant name; fallback to PdItem.PRODNAME
-                v_name = (getattr(vitem, 'PRODNAME', '') or '').strip()
-                try:
-                    v_ep = EposProd.objects.filter(PRODNUMB=vitem.PRODNUMB).order_by('-last_updated').first()
-                    if v_ep and (v_ep.ITEM_DESC or '').strip():
-                        v_name = v_ep.ITEM_DESC.strip()
-                except Exception:
-                    pass
+                v_name = catalog.product_name(vitem.PRODNUMB)
                 data['variants'].append({
                     'label': label,
                     'code': vitem.PRODNUMB,
@@ -639,26 +370,25 @@ def _serialize_product(item: PdItem, band: str, app_meta: AppProd | None = None,
     return data
 
 
-def _serialize_combo(combo: CombTb, band: str, app_meta: AppComb | None = None, vat_rates: dict | None = None) -> dict:
-    std_col = _price_column_name(band, discounted=False)
-    std_price = getattr(combo, std_col, None)
-    std_price = int(std_price) if std_price is not None else 0
-    vat_rates = vat_rates or {}
-    take_vat = vat_rates.get(getattr(combo, 'TAKE_VAT_CLASS', None), 0.0)
-    eat_vat = vat_rates.get(getattr(combo, 'EAT_VAT_CLASS', None), 0.0)
-    def net(gross, rate):
-        try:
-            return int(round(gross / (1 + (rate/100.0)))) if gross else 0
-        except ZeroDivisionError:
-            return gross
+def _serialize_combo(combo: CombTb, band: str, app_meta: AppComb | None = None, vat_rates: dict | None = None,
+                     catalog: CatalogSnapshot | None = None) -> dict:
+    catalog = catalog or get_catalog()
+    prices = catalog.combo_prices
+    take_vat = prices.vat_rate(combo.COMBONUMB, 'take')
+    eat_vat = prices.vat_rate(combo.COMBONUMB, 'eat')
+    row = prices.row(combo.COMBONUMB, band)
+    if row is None:
+        vat_rates = vat_rates or {}
+        take_vat = vat_rates.get(getattr(combo, 'TAKE_VAT_CLASS', None), 0.0)
+        eat_vat = vat_rates.get(getattr(combo, 'EAT_VAT_CLASS', None), 0.0)
+        std = _price_snapshot(combo, band)
+        row = (std, net_pence(std, take_vat), net_pence(std, eat_vat))
+    std_price, std_net_take, std_net_eat = row[:3]
     # Prefer ITEM_DESC from EposComb if available; fallback to CombTb.DESC
     combo_name = (combo.DESC or '').strip()
-    try:
-        ec = EposComb.objects.filter(COMBONUMB=combo.COMBONUMB).order_by('-last_updated').first()
-        if ec and (ec.ITEM_DESC or '').strip():
-            combo_name = ec.ITEM_DESC.strip()
-    except Exception:
-        pass
+    ec = catalog.epos_combo_by_code.get(combo.COMBONUMB)
+    if ec and (ec.ITEM_DESC or '').strip():
+        combo_name = ec.ITEM_DESC.strip()
 
     data = {
         'type': 'combo',
@@ -666,8 +396,8 @@ def _serialize_combo(combo: CombTb, band: str, app_meta: AppComb | None = None,
         'name': combo_name,
         'band': band,
         'price_gross': std_price,
-        'price_net_take': net(std_price, take_vat),
-        'price_net_eat': net(std_price, eat_vat),
+        'price_net_take': std_net_take,
+        'price_net_eat': std_net_eat,
         'take_vat_rate': take_vat,
         'eat_vat_rate': eat_vat,
         'variants': [],
@@ -676,9 +406,9 @@ def _serialize_combo(combo: CombTb, band: str, app_meta: AppComb | None = None,
     }
     # Trade-up combination (large)
     if combo.T_COMB_NUM and combo.T_COMB_NUM != 0:
-        t_combo = CombTb.objects.filter(COMBONUMB=combo.T_COMB_NUM).only('COMBONUMB', std_col).first()
+        t_combo = catalog.combos.get(combo.T_COMB_NUM)
         if t_combo:
-            t_price = getattr(t_combo, std_col, 0) or 0
+            t_price = prices.price(t_combo.COMBONUMB, band)
             data['variants'].append({
                 'label': 'trade_up',
                 'code': t_combo.COMBONUMB,
@@ -707,29 +437,26 @@ def api_menu(request: HttpRequest):
         return JsonResponse({'error': 'Invalid or missing band'}, status=400)
     include_empty = request.GET.get('include_empty', '').lower() in {'1','true','yes'}
 
-    vat_rates = _vat_rate_map()
+    catalog = get_catalog()
+    vat_rates = dict(catalog.vat_rates)
     # Products
-    app_products = list(AppProd.objects.all())
-    pd_items_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=[ap.PRODNUMB for ap in app_products])}
     products_by_group: dict[int, list] = {}
-    for ap in app_products:
-        pd_item = pd_items_map.get(ap.PRODNUMB)
+    for ap in catalog.app_products:
+        pd_item = catalog.products.get(ap.PRODNUMB)
         if not pd_item:
             continue
-        products_by_group.setdefault(ap.GROUP_ID, []).append(_serialize_product(pd_item, band, app_meta=ap, vat_rates=vat_rates))
+        products_by_group.setdefault(ap.GROUP_ID, []).append(_serialize_product(pd_item, band, app_meta=ap, vat_rates=vat_rates, catalog=catalog))
 
     # Combinations
-    app_combos = list(AppComb.objects.all())
-    comb_map = {c.COMBONUMB: c for c in CombTb.objects.filter(COMBONUMB__in=[ac.COMBONUMB for ac in app_combos])}
     combos_by_group: dict[int, list] = {}
-    for ac in app_combos:
-        comb = comb_map.get(ac.COMBONUMB)
+    for ac in catalog.app_combos:
+        comb = catalog.combos.get(ac.COMBONUMB)
         if not comb:
             continue
-        combos_by_group.setdefault(ac.GROUP_ID, []).append(_serialize_combo(comb, band, app_meta=ac, vat_rates=vat_rates))
+        combos_by_group.setdefault(ac.GROUP_ID, []).append(_serialize_combo(comb, band, app_meta=ac, vat_rates=vat_rates, catalog=catalog))
 
     categories = []
-    for grp in GroupTb.objects.all().order_by('GROUP_ID'):
+    for grp in catalog.groups:
         items = []
         # SOURCE_TYPE: 'P' products, 'C' combos (but a group might conceptually hold both; merge if present)
         items.extend(products_by_group.get(grp.GROUP_ID, []))
@@ -760,22 +487,18 @@ def api_menu_categories(request: HttpRequest):
     if band not in {'1','2','3','4','5','6'}:
         return JsonResponse({'error': 'Invalid or missing band'}, status=400)
     include_empty = request.GET.get('include_empty', '').lower() in {'1','true','yes'}
+    # Pre-rendered per catalog version (see services.menu_cache)
+    return menu_cache.respond(request, menu_cache.get_menu().categories[(band, include_empty)])
 
-    # New source: EposGroup / EposProd / EposComb mapping. Keep response shape stable.
-    # Count products per EPOS_GROUP_ID from EposProd.
-    prod_counts: dict[int, int] = {}
-    for ep in EposProd.objects.all().only('EPOS_GROUP'):
-        prod_counts[ep.EPOS_GROUP] = prod_counts.get(ep.EPOS_GROUP, 0) + 1
-    # Count combos per EPOS_GROUP from EposComb (e.g. Special Offers group 9)
-    combo_counts: dict[int, int] = {}
-    for ec in EposComb.objects.all().only('EPOS_GROUP'):
-        combo_counts[ec.EPOS_GROUP] = combo_counts.get(ec.EPOS_GROUP, 0) + 1
 
+def _menu_categories_data(catalog, band: str, include_empty: bool) -> dict:
+    """Build the api_menu_categories response body for one band from a catalog snapshot."""
+    # New source: EposGroup / EposProd / EposComb mapping. Keep response shape stable.
+    # Products per EPOS_GROUP_ID from EposProd, combos per EPOS_GROUP from EposComb (e.g. Special Offers group 9)
     categories = []
-    epos_groups = list(EposGroup.objects.all().order_by('EPOS_GROUP_ID'))
-    for grp in epos_groups:
-        prod_count = prod_counts.get(grp.EPOS_GROUP_ID, 0)
-        comb_count = combo_counts.get(grp.EPOS_GROUP_ID, 0)
+    for grp in catalog.epos_groups:
+        prod_count = len(catalog.epos_products_by_group.get(grp.EPOS_GROUP_ID, ()))
+        comb_count = len(catalog.epos_combos_by_group.get(grp.EPOS_GROUP_ID, ()))
         total = prod_count + comb_count
         if total or include_empty:
             categories.append({
@@ -788,7 +511,7 @@ def api_menu_categories(request: HttpRequest):
             })
     # Fallback: if no EPOS groups found (e.g., initial data load), use legacy GroupTb categories so the UI can render.
     if not categories:
-        for grp in GroupTb.objects.all().order_by('GROUP_ID'):
+        for grp in catalog.groups:
             if include_empty or True:
                 categories.append({
                     'id': grp.GROUP_ID,
@@ -798,7 +521,27 @@ def api_menu_categories(request: HttpRequest):
                     'item_count': 0,
                     'has_combos': False,
                 })
-    return JsonResponse({'band': band, 'categories': categories})
+    return {'band': band, 'categories': categories}
+
+
+@require_GET
+def api_menu_bundle(request: HttpRequest):
+    """Return the whole menu for one price band in a single versioned document.
+
+    Query params:
+        band: required (1..6)
+
+    Response (gzip-encoded when accepted, ETag tied to the catalog version):
+      { "band": "1", "version": <catalog version>,
+        "categories": [ ... as api_menu_categories with include_empty ... ],
+        "items": { "<group_id>": [ ... as api_category_items ... ] },
+        "details": { "<type>:<code>": { ... as api_item_detail 'item' ... } },
+        "toppings": { "<prod_code>": { ... as api_product_toppings ... } } }
+    """
+    band = request.GET.get('band')
+    if band not in {'1','2','3','4','5','6'}:
+        return JsonResponse({'error': 'Invalid or missing band'}, status=400)
+    return menu_cache.respond(request, menu_cache.get_menu().bundles[band])
 
 
 @require_GET
@@ -812,52 +555,44 @@ def api_category_items(request: HttpRequest, group_id: int):
     band = request.GET.get('band')
     if band not in {'1','2','3','4','5','6'}:
         return JsonResponse({'error': 'Invalid or missing band'}, status=400)
+    # Pre-rendered per catalog version (see services.menu_cache)
+    payload = menu_cache.get_menu().category_items.get((band, group_id))
+    if payload is None:
+        return JsonResponse({'error': 'Category not found'}, status=404)
+    return menu_cache.respond(request, payload)
 
-    vat_rates = _vat_rate_map()
 
-    grp = EposGroup.objects.filter(EPOS_GROUP_ID=group_id).first()
+def _category_items_data(catalog, band: str, group_id: int) -> dict | None:
+    """Build the api_category_items response body for one band/group; None if the group is unknown."""
+    vat_rates = dict(catalog.vat_rates)
+
+    grp = catalog.epos_group_by_id.get(group_id)
     if not grp:
-        return JsonResponse({'error': 'Category not found'}, status=404)
+        return None
 
-    # Fetch ePOS products for this group ordered by EPOS_SEQUENCE
-    epos_products = list(
-        EposProd.objects.filter(EPOS_GROUP=group_id)
-        .only('PRODNUMB', 'EPOS_GROUP', 'EPOS_SEQUENCE', 'COLOUR_RED', 'COLOUR_GREEN', 'COLOUR_BLUE', 'ITEM_DESC')
-        .order_by('EPOS_SEQUENCE')
-    )
-    prod_nums = [p.PRODNUMB for p in epos_products]
-    pd_items_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=prod_nums)}
-    app_prod_meta = {ap.PRODNUMB: ap for ap in AppProd.objects.filter(PRODNUMB__in=prod_nums)}
+    # ePOS products for this group, already ordered by EPOS_SEQUENCE in the snapshot
+    epos_products = catalog.epos_products_by_group.get(group_id, ())
+    pd_items_map = catalog.products
+    app_prod_meta = catalog.app_product_by_code
 
     items: list[dict] = []
     # Preload defaults for kids meal preview (fries and kids drinks)
-    std_col = _price_column_name(band, discounted=False)
-    dc_col = _price_column_name(band, discounted=True)
-    fries_list = list(PdItem.objects.filter(PRODNUMB__in=[30, 31]).only('PRODNUMB', std_col, dc_col, 'TAKE_VAT_CLASS', 'EAT_VAT_CLASS'))
-    kids_drink_codes = list(EposProd.objects.filter(EPOS_GROUP=99).values_list('PRODNUMB', flat=True))
-    kids_drinks_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=kids_drink_codes).only('PRODNUMB', std_col, dc_col, 'TAKE_VAT_CLASS', 'EAT_VAT_CLASS')}
+    fries_list = catalog.products_for(catalog.meal_fries)
+    kids_drinks_map = {p.PRODNUMB: p for p in catalog.products_for(catalog.kids_drinks)}
 
     def comp_price(it):
-        if not it:
-            return 0
-        dc = getattr(it, dc_col, None) or 0
-        std = getattr(it, std_col, None) or 0
-        return int(dc) if dc and int(dc) > 0 else int(std)
-
-    def comp_net(it, gross: int, basis: str) -> int:
-        if not it or not gross:
-            return 0
-        vat_class = getattr(it, 'EAT_VAT_CLASS' if basis == 'eat' else 'TAKE_VAT_CLASS', None)
-        rate = vat_rates.get(vat_class, 0.0)
-        try:
-            return int(round(gross / (1 + (rate/100.0))))
-        except ZeroDivisionError:
-            return gross
+        # Meal component price: discounted if available else standard
+        return pricing.meal_component_price(band, it.PRODNUMB, catalog=catalog) if it else 0
+
+    def comp_net(it, basis: str) -> int:
+        # Same component, priced net on the 'take' or 'eat' basis
+        return pricing.meal_component_price(band, it.PRODNUMB, basis, catalog=catalog) if it else 0
+
     for ep in epos_products:
         pd_item = pd_items_map.get(ep.PRODNUMB)
         if not pd_item:
             continue
-        prod_obj = _serialize_product(pd_item, band, app_meta=app_prod_meta.get(ep.PRODNUMB), vat_rates=vat_rates)
+        prod_obj = _serialize_product(pd_item, band, app_meta=app_prod_meta.get(ep.PRODNUMB), vat_rates=vat_rates, catalog=catalog)
         # Attach EPOS group id for frontend policy (e.g., kids = group 4)
         prod_obj['epos_group_id'] = group_id
         # If Kids Meal (meal_id==2), compute a preview meal price for display: burger + default fries + default kids drink
@@ -883,14 +618,14 @@ def api_category_items(request: HttpRequest, group_id: int):
                 eat_net = 0
                 if meal_gross:
                     take_net = (
-                        comp_net(pd_item, burger_price, 'take') +
-                        comp_net(fries_choice, fries_price, 'take') +
-                        comp_net(drink_choice, drink_price, 'take')
+                        comp_net(pd_item, 'take') +
+                        comp_net(fries_choice, 'take') +
+                        comp_net(drink_choice, 'take')
                     )
                     eat_net = (
-                        comp_net(pd_item, burger_price, 'eat') +
-                        comp_net(fries_choice, fries_price, 'eat') +
-                        comp_net(drink_choice, drink_price, 'eat')
+                        comp_net(pd_item, 'eat') +
+                        comp_net(fries_choice, 'eat') +
+                        comp_net(drink_choice, 'eat')
                     )
                 prod_obj['kids_meal_price_gross'] = meal_gross
                 prod_obj['kids_meal_price_net_take'] = int(take_net)
@@ -912,14 +647,14 @@ def api_category_items(request: HttpRequest, group_id: int):
         items.append(prod_obj)
 
     # Add combination products from EposComb for this group (e.g., Special Offers / group 9)
-    epos_combos = list(EposComb.objects.filter(EPOS_GROUP=group_id).order_by('EPOS_SEQUENCE'))
+    epos_combos = catalog.epos_combos_by_group.get(group_id, ())
     if epos_combos:
         # Map COMBONUMB to CombTb to pull pricing/VAT where available
-        comb_details = {c.COMBONUMB: c for c in CombTb.objects.filter(COMBONUMB__in=[ec.COMBONUMB for ec in epos_combos])}
+        comb_details = catalog.combos
         for ec in epos_combos:
             detail = comb_details.get(ec.COMBONUMB)
             if detail:
-                combo_obj = _serialize_combo(detail, band, vat_rates=vat_rates)
+                combo_obj = _serialize_combo(detail, band, vat_rates=vat_rates, catalog=catalog)
                 combo_obj['epos_group_id'] = group_id
                 items.append(combo_obj)
             else:
@@ -940,11 +675,11 @@ def api_category_items(request: HttpRequest, group_id: int):
                     'epos_group_id': group_id
                 })
     # Keep insertion order: products then combos (mirrors legacy behaviour)
-    return JsonResponse({
+    return {
         'band': band,
         'category': {'id': grp.EPOS_GROUP_ID, 'name': (grp.EPOS_GROUP_TITLE or '').strip()},
         'items': items
-    })
+    }
 
 
 @require_GET
@@ -959,10 +694,9 @@ def api_product_options(request: HttpRequest, prod_code: int):
     if band not in {'1','2','3','4','5','6'}:
         return JsonResponse({'error': 'Invalid or missing band'}, status=400)
 
-    links = PChoice.objects.filter(PRODNUMB=prod_code)
-    opt_codes = [l.OPT_PRODNUMB for l in links]
-    items = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=opt_codes)}
-    options = [_serialize_product(items[c], band) for c in opt_codes if c in items]
+    catalog = get_catalog()
+    opt_codes = catalog.product_options.get(prod_code, ())
+    options = [_serialize_product(p, band, catalog=catalog) for p in catalog.products_for(opt_codes)]
     return JsonResponse({'product': prod_code, 'band': band, 'options': options})
 
 
@@ -976,13 +710,17 @@ def api_product_toppings(request: HttpRequest, prod_code: int):
         "menu_desc_joined": "A, B, C" }
     If none found returns empty list.
     """
-    # Fetch ACodes rows for the product
-    a_rows = list(ACodes.objects.filter(PRODNUMB=prod_code).only('ST_CODENUM'))
-    if not a_rows:
-        return JsonResponse({'product': prod_code, 'toppings': [], 'menu_desc_joined': ''})
-    acode_nums = [a.ST_CODENUM for a in a_rows]
-    # Get toppings metadata
-    trows = {t.ACODE: t for t in ToppingDel.objects.filter(ACODE__in=acode_nums)}
+    return JsonResponse(_product_toppings_data(get_catalog(), prod_code))
+
+
+def _product_toppings_data(catalog, prod_code: int) -> dict:
+    """Build the api_product_toppings response body from a catalog snapshot."""
+    # ACodes rows for the product
+    acode_nums = catalog.product_acodes.get(prod_code, ())
+    if not acode_nums:
+        return {'product': prod_code, 'toppings': [], 'menu_desc_joined': ''}
+    # Toppings metadata
+    trows = catalog.toppings
     toppings = []
     for st_code in acode_nums:
         t = trows.get(st_code)
@@ -994,7 +732,7 @@ def api_product_toppings(request: HttpRequest, prod_code: int):
             'menu_desc': (t.MENU_DESC or '').strip()
         })
     joined = ', '.join([tp['menu_desc'] for tp in toppings if tp['menu_desc']])
-    return JsonResponse({'product': prod_code, 'toppings': toppings, 'menu_desc_joined': joined})
+    return {'product': prod_code, 'toppings': toppings, 'menu_desc_joined': joined}
 
 
 def _variant_map_for_product(app_meta: AppProd):
@@ -1023,212 +761,100 @@ def api_item_detail(request: HttpRequest, item_type: str, code: int):
     band = request.GET.get('band')
     if band not in {'1','2','3','4','5','6'}:
         return JsonResponse({'error': 'Invalid or missing band'}, status=400)
-    vat_rates = _vat_rate_map()
+    if item_type not in {'product', 'combo'}:
+        return JsonResponse({'error': 'Invalid item_type'}, status=400)
+    detail = _item_detail_data(get_catalog(), band, item_type, code)
+    if detail is None:
+        return JsonResponse({'error': 'Not found'}, status=404)
+    return JsonResponse({'band': band, 'item': detail})
+
+
+def _item_detail_data(catalog, band: str, item_type: str, code: int) -> dict | None:
+    """Build the api_item_detail 'item' body from a catalog snapshot; None if the item is unknown."""
+    vat_rates = dict(catalog.vat_rates)
+
+    def _free_choice_groups(parsed_groups) -> list[dict]:
+        groups = []
+        for order_index, codes in parsed_groups:
+            opts = [_serialize_product(p, band, vat_rates=vat_rates, catalog=catalog) for p in catalog.products_for(codes)]
+            if opts:
+                groups.append({
+                    'group': order_index,
+                    'free_count': 1,  # exactly one free from the list
+                    'options': opts
+                })
+        return groups
+
     detail = {}
     if item_type == 'product':
-        app_meta = AppProd.objects.filter(PRODNUMB=code).first()
-        item = PdItem.objects.filter(PRODNUMB=code).first()
+        app_meta = catalog.app_product_by_code.get(code)
+        item = catalog.products.get(code)
         if not item:
-            return JsonResponse({'error': 'Not found'}, status=404)
-        base = _serialize_product(item, band, app_meta=app_meta, vat_rates=vat_rates)
+            return None
+        base = _serialize_product(item, band, app_meta=app_meta, vat_rates=vat_rates, catalog=catalog)
         # Attach EPOS group id where known (used by frontend to enforce kids meal policy)
-        try:
-            ep_meta = EposProd.objects.filter(PRODNUMB=code).only('EPOS_GROUP').first()
-            if ep_meta:
-                base['epos_group_id'] = ep_meta.EPOS_GROUP
-        except Exception:
-            pass
+        ep_meta = catalog.epos_product_by_code.get(code)
+        if ep_meta:
+            base['epos_group_id'] = ep_meta.EPOS_GROUP
         # Options from PChoice
-        opt_links = PChoice.objects.filter(PRODNUMB=code)
-        opt_codes = [o.OPT_PRODNUMB for o in opt_links]
-        opt_items = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=opt_codes)}
-        base['options'] = []
-        for c in opt_codes:
-            p = opt_items.get(c)
-            if p:
-                base['options'].append(_serialize_product(p, band, vat_rates=vat_rates))
+        base['options'] = [
+            _serialize_product(p, band, vat_rates=vat_rates, catalog=catalog)
+            for p in catalog.products_for(catalog.product_options.get(code, ()))
+        ]
         # Meal components heuristic:
         # - Fries: fixed codes [30, 31] for now
         # - Drinks: for Kids Meals, restrict to Kids Drinks list derived from EposProd where EPOS_GROUP = 99
-        #           otherwise use all drinks where MEAL_DRINK > 0
+        #           otherwise use all drinks where MEAL_DRINK > 0 (ordered by EPOS_SEQUENCE, then PRODNUMB)
         meal_components = []
         if base.get('meal_flag'):
-            fries = PdItem.objects.filter(PRODNUMB__in=[30,31])
+            fries = catalog.products_for(catalog.meal_fries)
             # Detect if this product is a Kids item via ePOS group title or name pattern
             is_kids = False
-            try:
-                ep = EposProd.objects.filter(PRODNUMB=code).only('EPOS_GROUP').first()
-                if ep:
-                    grp = EposGroup.objects.filter(EPOS_GROUP_ID=ep.EPOS_GROUP).only('EPOS_GROUP_TITLE').first()
-                    if grp and 'kid' in (grp.EPOS_GROUP_TITLE or '').lower():
-                        is_kids = True
-            except Exception:
-                pass
+            if ep_meta:
+                grp = catalog.epos_group_by_id.get(ep_meta.EPOS_GROUP)
+                if grp and 'kid' in (grp.EPOS_GROUP_TITLE or '').lower():
+                    is_kids = True
             # Additional fallback: product name contains 'kid'
             if not is_kids and 'kid' in (base.get('name','')).lower():
                 is_kids = True
-            # Build drinks ordered by EPOS_SEQUENCE from EposProd
-            drinks_items: list[PdItem] = []
-            if is_kids:
-                # Kids Drinks are ePOS products in group 99; order by EPOS_SEQUENCE
-                ordered_codes = list(
-                    EposProd.objects.filter(EPOS_GROUP=99)
-                    .order_by('EPOS_SEQUENCE')
-                    .values_list('PRODNUMB', flat=True)
-                )
-                pd_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=ordered_codes)}
-                drinks_items = [pd_map[c] for c in ordered_codes if c in pd_map]
-                # Fallback: if any kids drinks exist in PdItem but not in EposProd, append them at end by PRODNUMB
-                remaining_codes = set(PdItem.objects.filter(PRODNUMB__in=ordered_codes).values_list('PRODNUMB', flat=True)) - set(pd_map.keys())
-                if remaining_codes:
-                    extra_items = list(PdItem.objects.filter(PRODNUMB__in=list(remaining_codes)).order_by('PRODNUMB'))
-                    drinks_items.extend(extra_items)
-            else:
-                # All meal-eligible drinks (MEAL_DRINK > 0), ordered by EposProd.EPOS_SEQUENCE where available
-                drink_codes = list(PdItem.objects.filter(MEAL_DRINK__gt=0).values_list('PRODNUMB', flat=True))
-                if drink_codes:
-                    ordered_codes = list(
-                        EposProd.objects.filter(PRODNUMB__in=drink_codes)
-                        .order_by('EPOS_SEQUENCE')
-                        .values_list('PRODNUMB', flat=True)
-                    )
-                    pd_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=ordered_codes)}
-                    drinks_items = [pd_map[c] for c in ordered_codes if c in pd_map]
-                    # Append any remaining MEAL_DRINK>0 PdItems that don't have an EposProd row, sorted by PRODNUMB
-                    remaining = set(drink_codes) - set(pd_map.keys())
-                    if remaining:
-                        extra_items = list(PdItem.objects.filter(PRODNUMB__in=list(remaining)).order_by('PRODNUMB'))
-                        drinks_items.extend(extra_items)
+            drinks_items = catalog.products_for(catalog.kids_drinks if is_kids else catalog.meal_drinks)
             meal_components = {
-                'fries': [_serialize_product(f, band, vat_rates=vat_rates) for f in fries],
-                'drinks': [_serialize_product(d, band, vat_rates=vat_rates) for d in drinks_items],
+                'fries': [_serialize_product(f, band, vat_rates=vat_rates, catalog=catalog) for f in fries],
+                'drinks': [_serialize_product(d, band, vat_rates=vat_rates, catalog=catalog) for d in drinks_items],
             }
         base['meal_components'] = meal_components
         # Free choice groups (EposFreeProd): each row may define FREE_CHOICE_1 / FREE_CHOICE_2 as comma lists.
-        free_rows = list(EposFreeProd.objects.filter(PRODNUMB=code))
-        free_choice_groups = []
-        if free_rows:
-            # Collect all codes to batch load pricing names
-            all_codes: set[int] = set()
-            parsed_groups: list[tuple[int, list[int]]] = []
-            for fr in free_rows:
-                for idx, field in enumerate(['FREE_CHOICE_1','FREE_CHOICE_2'], start=1):
-                    raw = getattr(fr, field, '') or ''
-                    if not raw.strip():
-                        continue
-                    codes: list[int] = []
-                    for part in raw.split(','):
-                        part = part.strip()
-                        if not part:
-                            continue
-                        try:
-                            val = int(part)
-                        except Exception:
-                            continue
-                        codes.append(val)
-                        all_codes.add(val)
-                    if codes:
-                        parsed_groups.append((idx, codes))
-            if parsed_groups:
-                pd_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=list(all_codes))}
-                for order_index, codes in parsed_groups:
-                    opts = []
-                    for c in codes:
-                        p = pd_map.get(c)
-                        if p:
-                            opts.append(_serialize_product(p, band, vat_rates=vat_rates))
-                    if opts:
-                        free_choice_groups.append({
-                            'group': order_index,
-                            'free_count': 1,  # exactly one free from the list
-                            'options': opts
-                        })
-        base['free_choice_groups'] = free_choice_groups
-        # Add-ons (EposAddOns): parse comma-separated codes and serialize with current band pricing
-        addons_list: list[dict] = []
-        try:
-            ao = EposAddOns.objects.filter(PRODNUMB=code).order_by('-last_updated').first()
-            raw = (ao.ADD_ONS if ao and ao.ADD_ONS else '')
-            codes: list[int] = []
-            for part in str(raw).split(','):
-                part = part.strip()
-                if not part:
-                    continue
-                try:
-                    codes.append(int(part))
-                except Exception:
-                    continue
-            if codes:
-                pd_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=codes)}
-                for c in codes:
-                    p = pd_map.get(c)
-                    if p:
-                        addons_list.append(_serialize_product(p, band, vat_rates=vat_rates))
-        except Exception:
-            addons_list = []
-        base['addons'] = addons_list
+        base['free_choice_groups'] = _free_choice_groups(catalog.product_free_choices.get(code, ()))
+        # Add-ons (EposAddOns): comma-separated codes serialized with current band pricing
+        base['addons'] = [
+            _serialize_product(p, band, vat_rates=vat_rates, catalog=catalog)
+            for p in catalog.products_for(catalog.product_addons.get(code, ()))
+        ]
         detail = base
     elif item_type == 'combo':
-        appc = AppComb.objects.filter(COMBONUMB=code).first()
-        combo = CombTb.objects.filter(COMBONUMB=code).first()
+        appc = catalog.app_combo_by_code.get(code)
+        combo = catalog.combos.get(code)
         if not combo:
-            return JsonResponse({'error': 'Not found'}, status=404)
-        base = _serialize_combo(combo, band, app_meta=appc, vat_rates=vat_rates)
+            return None
+        base = _serialize_combo(combo, band, app_meta=appc, vat_rates=vat_rates, catalog=catalog)
         # Compulsory & optional components
-        comp_links = list(CompPro.objects.filter(COMBONUMB=code))
-        opt_links = list(OptPro.objects.filter(COMBONUMB=code))
-        comp_codes = [c.PRODNUMB for c in comp_links]
-        opt_codes = [o.PRODNUMB for o in opt_links]
-        comp_items = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=comp_codes)}
-        opt_items = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=opt_codes)}
-        base['compulsory'] = [_serialize_product(comp_items[c], band, vat_rates=vat_rates) for c in comp_codes if c in comp_items]
-        base['optional'] = [_serialize_product(opt_items[c], band, vat_rates=vat_rates) for c in opt_codes if c in opt_items]
+        base['compulsory'] = [
+            _serialize_product(p, band, vat_rates=vat_rates, catalog=catalog)
+            for p in catalog.products_for(catalog.combo_compulsory.get(code, ()))
+        ]
+        base['optional'] = [
+            _serialize_product(p, band, vat_rates=vat_rates, catalog=catalog)
+            for p in catalog.products_for(catalog.combo_optional.get(code, ()))
+        ]
         # Free optional allowances heuristic: look for dips keyword or infer from documentation (hard to derive generically) -> placeholder free_opt_count=2 if 'dip' in any optional name and len(optional)>1
         dip_like = [o for o in base['optional'] if 'dip' in o['name'].lower()]
         base['free_optional_count'] = 2 if dip_like else 0
         # Free choice groups for combo (EposCombFreeProd) mirroring product free choices
-        free_rows = list(EposCombFreeProd.objects.filter(COMBONUMB=code))
-        free_choice_groups = []
-        if free_rows:
-            all_codes: set[int] = set()
-            parsed_groups: list[tuple[int, list[int]]] = []
-            for fr in free_rows:
-                for idx, field in enumerate(['FREE_CHOICE_1','FREE_CHOICE_2'], start=1):
-                    raw = getattr(fr, field, '') or ''
-                    if not raw.strip():
-                        continue
-                    codes: list[int] = []
-                    for part in raw.split(','):
-                        part = part.strip()
-                        if not part:
-                            continue
-                        try:
-                            val = int(part)
-                        except Exception:
-                            continue
-                        codes.append(val)
-                        all_codes.add(val)
-                    if codes:
-                        parsed_groups.append((idx, codes))
-            if parsed_groups:
-                pd_map = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=list(all_codes))}
-                for order_index, codes in parsed_groups:
-                    opts = []
-                    for c in codes:
-                        p = pd_map.get(c)
-                        if p:
-                            opts.append(_serialize_product(p, band, vat_rates=vat_rates))
-                    if opts:
-                        free_choice_groups.append({
-                            'group': order_index,
-                            'free_count': 1,
-                            'options': opts
-                        })
-        base['free_choice_groups'] = free_choice_groups
+        base['free_choice_groups'] = _free_choice_groups(catalog.combo_free_choices.get(code, ()))
         detail = base
     else:
-        return JsonResponse({'error': 'Invalid item_type'}, status=400)
-    return JsonResponse({'band': band, 'item': detail})
+        return None
+    return detail
 
 
 @require_GET
@@ -1257,22 +883,16 @@ def api_prices(request):
     except ValueError:
         return JsonResponse({'error': 'Invalid prods list'}, status=400)
 
-    # Resolve column names for both standard and discounted for flexibility
-    std_col = _price_column_name(band, discounted=False)
-    dc_col = _price_column_name(band, discounted=True)
-
-    qs = PdItem.objects.filter(PRODNUMB__in=prod_ids).only('PRODNUMB', std_col, dc_col)
+    catalog = get_catalog()
+    qs = catalog.products_for(dict.fromkeys(prod_ids))
 
     prices = {}
     found_ids = set()
     for item in qs:
         found_ids.add(item.PRODNUMB)
-        std_price = getattr(item, std_col, None)
-        dc_price = getattr(item, dc_col, None)
-        # Normalize None to 0
         prices[str(item.PRODNUMB)] = {
-            'price': int(std_price) if std_price is not None else 0,
-            'dc_price': int(dc_price) if dc_price is not None else 0,
+            'price': catalog.product_prices.price(item.PRODNUMB, band),
+            'dc_price': catalog.product_prices.price(item.PRODNUMB, band, discounted=True),
         }
 
     not_found = [pid for pid in prod_ids if pid not in found_ids]
@@ -1303,13 +923,10 @@ def api_submit_order(request: HttpRequest):
         return JsonResponse({'error': 'Invalid price_band'}, status=400)
     band_co_number = (payload.get('band_co_number') or '').strip()[:30]
     # Lightweight validation: allow empty or must match one of known SUPPLIER_NAMEs from active PriceBand rows
+    catalog = get_catalog()
     if band_co_number:
-        allowed_names = set()
         # Dynamic names from PriceBand (APPLY_HERE only)
-        for pb in PriceBand.objects.filter(APPLY_HERE=True).only('SUPPLIER_NAME'):
-            if pb.SUPPLIER_NAME:
-                allowed_names.add(pb.SUPPLIER_NAME.strip())
-        if band_co_number not in allowed_names:
+        if band_co_number not in catalog.supplier_names:
             return JsonResponse({'error': 'Invalid band_co_number (supplier name)'}, status=400)
     vat_basis = payload.get('vat_basis')
     if vat_basis not in {'take','eat'}:
@@ -1327,171 +944,120 @@ def api_submit_order(request: HttpRequest):
     from .models import Order, OrderLine
     total_gross = 0
     total_net = 0
-    # Helper inside view so it can access band variable
-    def _compute_meal_price(burger_code: int, fries_code: int, drink_code: int, option_codes: list[int]):
-        """Compute meal unit price (gross, in pence) from its components for given price band.
-
-        Business rule (derived from MEAL_DISCOUNT docs): meal price = sum of discounted component
-        prices (burger, fries, drink) where a discounted (DC_) price is defined (>0), otherwise
-        fall back to the component's standard price. Additional optional products always add their
-        full standard price (no meal discount applied to them).
-        """
-        std_col = _price_column_name(band, discounted=False)
-        dc_col = _price_column_name(band, discounted=True)
-        codes_needed = [c for c in [burger_code, fries_code, drink_code] if c]
-        if option_codes:
-            codes_needed.extend(option_codes)
-        items = {p.PRODNUMB: p for p in PdItem.objects.filter(PRODNUMB__in=codes_needed).only('PRODNUMB', std_col, dc_col)}
-        def comp_price(code):
-            item = items.get(code)
-            if not item:
-                return 0
-            std_val = getattr(item, std_col, None) or 0
-            dc_val = getattr(item, dc_col, None) or 0
-            return dc_val if dc_val and dc_val > 0 else std_val
-        burger_price = comp_price(burger_code)
-        fries_price = comp_price(fries_code)
-        drink_price = comp_price(drink_code)
-        # Options: always standard price (no discount)
-        opt_total = 0
-        if option_codes:
-            for oc in option_codes:
-                it = items.get(oc)
-                if it:
-                    opt_total += getattr(it, std_col, None) or 0
-        return int(burger_price + fries_price + drink_price + opt_total)
+    # Validate and price every line before touching the database: the write below is
+    # then one Order insert plus one bulk insert, so SQLite's single writer lock is
+    # held for as short a time as possible and a rejected payload writes nothing.
+    order_lines = []
+    for ln in lines:
+        try:
+            code = int(ln.get('code'))
+            name = (ln.get('name') or '')[:120]
+            item_type = ln.get('type') if ln.get('type') in {'product','combo'} else 'product'
+            variant = (ln.get('variant') or '')[:40]
+            is_meal = bool(ln.get('meal'))
+            qty = int(ln.get('qty') or 1)
+            unit_price_gross = int(ln.get('price_gross'))
+        except Exception:
+            return JsonResponse({'error': 'Invalid line structure'}, status=400)
+        if qty < 1:
+            qty = 1
+        # Meal validation: if meal flag but missing fries/drink meta, reject or strip discount
+        meta_payload = ln.get('meta') or {}
+        if is_meal:
+            fries = meta_payload.get('fries')
+            drink = meta_payload.get('drink')
+            if fries in (None, '') or drink in (None, ''):
+                return JsonResponse({'error': f'Meal line for code {code} missing fries or drink selection'}, status=400)
+            # Server-side authoritative meal price computation (ignore client provided meal price)
+            try:
+                fries_code = int(fries)
+                drink_code = int(drink)
+            except Exception:
+                return JsonResponse({'error': 'Invalid fries or drink code'}, status=400)
+            option_codes = []
+            # Free/option add-ons selected as part of the meal (no extra charge)
+            raw_opts = meta_payload.get('options') or []
+            if isinstance(raw_opts, list):
+                for oc in raw_opts:
+                    try:
+                        option_codes.append(int(oc))
+                    except Exception:
+                        continue
+            # Paid extras selected by the customer (e.g., Xtr Bacon). These are provided
+            # by the frontend under 'extras_products' with objects like { code, name, price_gross }.
+            # For price authority, ignore any client-sent price and look up the standard
+            # price for the current band from PdItem, same as options.
+            raw_extras = meta_payload.get('extras_products') or []
+            if isinstance(raw_extras, list):
+                for ex in raw_extras:
+                    try:
+                        ex_code = int(ex.get('code'))
+                    except Exception:
+                        ex_code = None
+                    if ex_code:
+                        option_codes.append(ex_code)
+            recomputed = pricing.meal_price(band, code, fries_code, drink_code, option_codes, catalog=catalog)
+            unit_price_gross = recomputed  # override any client value
+        line_total = unit_price_gross * qty
+        total_gross += line_total
+        # Net at the item's VAT rate for the basis
+        net_unit = pricing.net_for(code, unit_price_gross, vat_basis, combo=(item_type == 'combo'), catalog=catalog)
+        total_net += net_unit * qty
+        # meta_payload already extracted above
+        extra = {k: v for k, v in ln.items() if k not in {'code','type','name','variant','meal','qty','price_gross','meta'}}
+        meta_combined = {**meta_payload, **extra}
+        order_lines.append(OrderLine(
+            item_code=code,
+            item_type=item_type,
+            name=name,
+            variant_label=variant,
+            is_meal=is_meal,
+            qty=qty,
+            unit_price_gross=unit_price_gross,
+            line_total_gross=line_total,
+            meta=meta_combined
+        ))
+    # Handle Split Pay breakdown if supplied
+    split_cash = split_card = split_voucher = 0
+    if payment_method.lower() == 'split':
+        try:
+            split_cash = int(payload.get('split_cash_pence') or 0)
+            split_card = int(payload.get('split_card_pence') or 0)
+            split_voucher = int(payload.get('split_voucher_pence') or 0)
+        except Exception:
+            split_cash = 0; split_card = 0; split_voucher = 0
+        # Validate non-negative and sum equals total_gross
+        if (split_cash < 0 or split_card < 0 or split_voucher < 0 or
+            (split_cash + split_card + split_voucher) != total_gross):
+            return JsonResponse({'error': 'Invalid split amounts: Cash + Card + Voucher must equal total and be non-negative'}, status=400)
 
     with transaction.atomic():
         order = Order.objects.create(
             price_band=int(band),
             vat_basis=vat_basis,
             show_net=bool(payload.get('show_net')),
+            total_gross=total_gross,
+            total_net=int(total_net),
             payment_method=payment_method,
+            split_cash_pence=split_cash,
+            split_card_pence=split_card,
+            split_voucher_pence=split_voucher,
             crew_id=crew_id,
             band_co_number=band_co_number,
             notes=notes[:1000]
         )
-        for ln in lines:
-            try:
-                code = int(ln.get('code'))
-                name = (ln.get('name') or '')[:120]
-                item_type = ln.get('type') if ln.get('type') in {'product','combo'} else 'product'
-                variant = (ln.get('variant') or '')[:40]
-                is_meal = bool(ln.get('meal'))
-                qty = int(ln.get('qty') or 1)
-                unit_price_gross = int(ln.get('price_gross'))
-            except Exception:
-                return JsonResponse({'error': 'Invalid line structure'}, status=400)
-            if qty < 1:
-                qty = 1
-            # Meal validation: if meal flag but missing fries/drink meta, reject or strip discount
-            meta_payload = ln.get('meta') or {}
-            if is_meal:
-                fries = meta_payload.get('fries')
-                drink = meta_payload.get('drink')
-                if fries in (None, '') or drink in (None, ''):
-                    return JsonResponse({'error': f'Meal line for code {code} missing fries or drink selection'}, status=400)
-                # Server-side authoritative meal price computation (ignore client provided meal price)
-                if is_meal:
-                    fries = meta_payload.get('fries')
-                    drink = meta_payload.get('drink')
-                    if fries in (None, '') or drink in (None, ''):
-                        return JsonResponse({'error': f'Meal line for code {code} missing fries or drink selection'}, status=400)
-                    try:
-                        fries_code = int(fries)
-                        drink_code = int(drink)
-                    except Exception:
-                        return JsonResponse({'error': 'Invalid fries or drink code'}, status=400)
-                    option_codes = []
-                    # Free/option add-ons selected as part of the meal (no extra charge)
-                    raw_opts = meta_payload.get('options') or []
-                    if isinstance(raw_opts, list):
-                        for oc in raw_opts:
-                            try:
-                                option_codes.append(int(oc))
-                            except Exception:
-                                continue
-                    # Paid extras selected by the customer (e.g., Xtr Bacon). These are provided
-                    # by the frontend under 'extras_products' with objects like { code, name, price_gross }.
-                    # For price authority, ignore any client-sent price and look up the standard
-                    # price for the current band from PdItem, same as options.
-                    raw_extras = meta_payload.get('extras_products') or []
-                    if isinstance(raw_extras, list):
-                        for ex in raw_extras:
-                            try:
-                                ex_code = int(ex.get('code'))
-                            except Exception:
-                                ex_code = None
-                            if ex_code:
-                                option_codes.append(ex_code)
-                    recomputed = _compute_meal_price(code, fries_code, drink_code, option_codes)
-                    unit_price_gross = recomputed  # override any client value
-            line_total = unit_price_gross * qty
-            total_gross += line_total
-            # Determine VAT rate based on basis for net calculation
-            vat_rate = 0.0
-            if item_type == 'product':
-                prod = PdItem.objects.filter(PRODNUMB=code).only('TAKE_VAT_CLASS','EAT_VAT_CLASS').first()
-                if prod:
-                    vat_class = getattr(prod, 'EAT_VAT_CLASS' if vat_basis=='eat' else 'TAKE_VAT_CLASS', None)
-                    if vat_class:
-                        vat_map = _vat_rate_map()
-                        vat_rate = vat_map.get(vat_class, 0.0)
-            else:  # combo
-                comb = CombTb.objects.filter(COMBONUMB=code).only('TAKE_VAT_CLASS','EAT_VAT_CLASS').first()
-                if comb:
-                    vat_class = getattr(comb, 'EAT_VAT_CLASS' if vat_basis=='eat' else 'TAKE_VAT_CLASS', None)
-                    if vat_class:
-                        vat_map = _vat_rate_map()
-                        vat_rate = vat_map.get(vat_class, 0.0)
-            try:
-                net_unit = int(round(unit_price_gross / (1 + (vat_rate/100.0))))
-            except ZeroDivisionError:
-                net_unit = unit_price_gross
-            total_net += net_unit * qty
-            # meta_payload already extracted above
-            extra = {k: v for k, v in ln.items() if k not in {'code','type','name','variant','meal','qty','price_gross','meta'}}
-            meta_combined = {**meta_payload, **extra}
-            OrderLine.objects.create(
-                order=order,
-                item_code=code,
-                item_type=item_type,
-                name=name,
-                variant_label=variant,
-                is_meal=is_meal,
-                qty=qty,
-                unit_price_gross=unit_price_gross,
-                line_total_gross=line_total,
-                meta=meta_combined
-            )
-        order.total_gross = total_gross
-        order.total_net = int(total_net)
-        # Handle Split Pay breakdown if supplied
-        if payment_method.lower() == 'split':
-            try:
-                split_cash = int(payload.get('split_cash_pence') or 0)
-                split_card = int(payload.get('split_card_pence') or 0)
-                split_voucher = int(payload.get('split_voucher_pence') or 0)
-            except Exception:
-                split_cash = 0; split_card = 0; split_voucher = 0
-            # Validate non-negative and sum equals total_gross
-            if (split_cash < 0 or split_card < 0 or split_voucher < 0 or
-                (split_cash + split_card + split_voucher) != total_gross):
-                return JsonResponse({'error': 'Invalid split amounts: Cash + Card + Voucher must equal total and be non-negative'}, status=400)
-            order.split_cash_pence = split_cash
-            order.split_card_pence = split_card
-            order.split_voucher_pence = split_voucher
-            order.save(update_fields=['total_gross','total_net','split_cash_pence','split_card_pence','split_voucher_pence'])
-        else:
-            order.save(update_fields=['total_gross','total_net'])
+        for line in order_lines:
+            line.order = order
+        OrderLine.objects.bulk_create(order_lines)
+        daily_stats.record_order(order, order_lines)
     return JsonResponse({'order_id': order.id, 'total_gross': total_gross})
 
 
 @require_GET
 def api_orders_summary(request: HttpRequest):
     from .models import Order
-    today = timezone.now().date()
-    qs = Order.objects.filter(created_at__date=today)
+    today = business_day_for()
+    qs = Order.objects.filter(**business_day_filter('created_at', today))
     preparing = qs.filter(status='preparing').count()
     packed = qs.filter(status='packed').count()
     # Count dispatched (strict)
@@ -1502,9 +1068,9 @@ def api_orders_summary(request: HttpRequest):
 @require_GET
 def api_orders_pending(request: HttpRequest):
     from .models import Order
-    today = timezone.now().date()
+    today = business_day_for()
     orders = []
-    for o in Order.objects.filter(status__in=['preparing','packed'], created_at__date=today).order_by('created_at').prefetch_related('lines'):
+    for o in Order.objects.filter(status__in=['preparing','packed'], **business_day_filter('created_at', today)).order_by('created_at').prefetch_related('lines'):
         orders.append({
             'id': o.id,
             'created_at': o.created_at.isoformat(),
@@ -1572,7 +1138,7 @@ def api_orders_completed(request: HttpRequest):
     """Return completed orders for a given date (default today).
 
     Query params:
-      - date: optional, ISO date YYYY-MM-DD. Defaults to today in server TZ.
+      - date: optional, ISO date YYYY-MM-DD. Defaults to the current business day (EPOS_BUSINESS_DAY_CUTOFF).
     Response: { orders: [ { id, created_at, completed_at, total_gross, payment_method, crew_id, lines:[...] }, ... ] }
     """
     from .models import Order
@@ -1583,11 +1149,11 @@ def api_orders_completed(request: HttpRequest):
         except Exception:
             return JsonResponse({'error': 'Invalid date format, expected YYYY-MM-DD'}, status=400)
     else:
-        target_date = timezone.now().date()
+        target_date = business_day_for()
 
     orders = []
     # Only dispatched orders for the date
-    qs = Order.objects.filter(status='dispatched', completed_at__date=target_date).order_by('-completed_at').prefetch_related('lines')
+    qs = Order.objects.filter(status='dispatched', **business_day_filter('completed_at', target_date)).order_by('-completed_at').prefetch_related('lines')
     for o in qs:
         orders.append({
             'id': o.id,
@@ -1619,7 +1185,7 @@ def api_daily_sales(request: HttpRequest):
     """Return total sales (gross) and breakdown by payment_method for a given date.
 
     Query params:
-      - date: optional ISO date (YYYY-MM-DD); defaults to today (server TZ)
+      - date: optional ISO date (YYYY-MM-DD); defaults to the current business day (EPOS_BUSINESS_DAY_CUTOFF)
 
     Response JSON:
       { "date": "YYYY-MM-DD", "total_gross": 12345, "currency": "GBP", "payment_methods": [ {"method": "Cash", "total_gross": 1000}, ... ] }
@@ -1634,10 +1200,10 @@ def api_daily_sales(request: HttpRequest):
         except Exception:
             return JsonResponse({'error': 'Invalid date format, expected YYYY-MM-DD'}, status=400)
     else:
-        target_date = timezone.now().date()
+        target_date = business_day_for()
 
     # Use dispatched orders completed on the target date for sales reporting
-    qs = Order.objects.filter(status='dispatched', completed_at__date=target_date)
+    qs = Order.objects.filter(status='dispatched', **business_day_filter('completed_at', target_date))
     # Aggregate totals grouped by payment_method; treat blank as 'Unspecified'
     from collections import defaultdict
     by_method: dict[str, int] = defaultdict(int)
@@ -1680,6 +1246,59 @@ def api_daily_sales(request: HttpRequest):
     })
 
 
+@require_GET
+def api_live_stats(request: HttpRequest):
+    """Live product mix and tender totals for a business day, read from the K* counters.
+
+    Query params:
+      - date: optional ISO date (YYYY-MM-DD); defaults to the current business day
+
+    Response JSON:
+      { "date": "YYYY-MM-DD", "live": true, "tenders": {"TCASHVAL": 1234, ...},
+        "products": [ {"code": 3, "combo": false, "name": "...", "takeaway": 2, "eatin": 1, "staff": 0, "waste": 0, "option": 0}, ... ],
+        "meals": [ {"code": 3, "name": "...", "takeaway": 1, "eatin": 0}, ... ] }
+
+    The counters are maintained as orders are taken, so this costs the same at 10pm as at 10am.
+    The current business day is seeded here if it has no counters yet (daily_stats.seed_day);
+    "live" is false for any other day without counters.
+    """
+    from update_till.models import KMeal, KPro, KRev
+    date_str = request.GET.get('date')
+    if date_str:
+        try:
+            target_date = timezone.datetime.strptime(date_str, '%Y-%m-%d').date()
+        except Exception:
+            return JsonResponse({'error': 'Invalid date format, expected YYYY-MM-DD'}, status=400)
+    else:
+        target_date = business_day_for()
+    if target_date == business_day_for():
+        daily_stats.seed_day(target_date)
+    catalog = get_catalog()
+
+    def _name(code: int, combo: bool) -> str:
+        row = (catalog.combos if combo else catalog.products).get(code)
+        return (getattr(row, 'DESC' if combo else 'PRODNAME', '') or '') if row else ''
+
+    rev = KRev.objects.filter(stat_date=target_date).values(*daily_stats.REV_FIELDS).first()
+    products = [
+        {'code': r.PRODNUMB, 'combo': r.COMBO, 'name': _name(r.PRODNUMB, r.COMBO),
+         'takeaway': r.TAKEAWAY, 'eatin': r.EATIN, 'staff': r.STAFF, 'waste': r.WASTE, 'option': r.OPTION}
+        for r in KPro.objects.filter(stat_date=target_date)
+    ]
+    products.sort(key=lambda p: (-(p['takeaway'] + p['eatin'] + p['staff'] + p['waste'] + p['option']), p['code']))
+    meals = [
+        {'code': r.PRODNUMB, 'name': _name(r.PRODNUMB, False), 'takeaway': r.TAKEAWAY, 'eatin': r.EATIN}
+        for r in KMeal.objects.filter(stat_date=target_date).order_by('PRODNUMB')
+    ]
+    return JsonResponse({
+        'date': str(target_date),
+        'live': rev is not None,
+        'tenders': rev or {k: 0 for k in daily_stats.REV_FIELDS},
+        'products': [p for p in products if any(p[k] for k in ('takeaway', 'eatin', 'staff', 'waste', 'option'))],
+        'meals': [m for m in meals if m['takeaway'] or m['eatin']],
+    })
+
+
 @require_GET
 def api_daily_sales_hourly(request: HttpRequest):
     """Return hourly breakdown of orders for a given date.
@@ -1696,10 +1315,10 @@ def api_daily_sales_hourly(request: HttpRequest):
         except Exception:
             return JsonResponse({'error': 'Invalid date format, expected YYYY-MM-DD'}, status=400)
     else:
-        target_date = timezone.now().date()
+        target_date = business_day_for()
     # Filter orders on that date
     # Use dispatched orders completed on the target date for hourly reporting
-    qs = Order.objects.filter(status='dispatched', completed_at__date=target_date).only('completed_at','total_gross')
+    qs = Order.objects.filter(status='dispatched', **business_day_filter('completed_at', target_date)).only('completed_at','total_gross')
     buckets = {h: {'hour': h, 'order_count': 0, 'total_gross': 0} for h in range(24)}
     for o in qs:
         h = o.completed_at.hour
@@ -1737,11 +1356,7 @@ def api_paid_out(request: HttpRequest):
     band_co_number = (payload.get('band_co_number') or '').strip()[:30]
     # Validate band CO using SUPPLIER_NAME from active PriceBand rows
     if band_co_number:
-        allowed_names = set()
-        for pb in PriceBand.objects.filter(APPLY_HERE=True).only('SUPPLIER_NAME'):
-            if pb.SUPPLIER_NAME:
-                allowed_names.add(pb.SUPPLIER_NAME.strip())
-        if band_co_number not in allowed_names:
+        if band_co_number not in get_catalog().supplier_names:
             return JsonResponse({'error': 'Invalid band_co_number (supplier name)'}, status=400)
     try:
         amount_pence = int(payload.get('amount_pence'))
@@ -1768,22 +1383,27 @@ def api_paid_out(request: HttpRequest):
             band_co_number=band_co_number,
             notes=notes[:1000]
         )
+        daily_stats.record_order(order, [])
     return JsonResponse({'status': 'ok', 'order_id': order.id})
 
 
 @require_GET
 @staff_member_required
 def export_daily_csvs_zip(request: HttpRequest):
-    """Generate daily CSVs (MP/PD/RV) via management command and return them zipped.
+    """Export the day's CSVs (MP/PD/RV/K_WK_VAT) as a ZIP.
 
     Query params:
       - date: optional ISO date (YYYY-MM-DD); defaults to today.
 
     Response: application/zip with filename daily_csvs_<yyyymmdd>.zip
-    Cleans up temporary files after streaming.
+    The ZIP comes from the on-disk export cache (services.export_cache): it is
+    rebuilt only when the day's orders, the catalog or the EPOS_* flags have
+    changed, and concurrent downloads of a new day wait for a single build.
+    As with `export_daily_csvs --clear`, the day's K rows are cleared once the
+    whole archive has been sent, unless it is the current business day, whose
+    live counters are kept.
     """
-    import io, zipfile, tempfile, os
-    from django.core import management
+    from manage_orders.services import export_cache
     date_str = request.GET.get('date')
     if date_str:
         try:
@@ -1791,24 +1411,50 @@ def export_daily_csvs_zip(request: HttpRequest):
         except Exception:
             return JsonResponse({'error': 'Invalid date format, expected YYYY-MM-DD'}, status=400)
     else:
-        target_date = timezone.now().date()
-
-    with tempfile.TemporaryDirectory() as tmpdir:
-        # Run management command to produce CSV files in tmpdir
-        management.call_command('export_daily_csvs', date=str(target_date), outdir=tmpdir, clear=True, verbosity=0)
-        # Collect expected filenames
-        mp = f"MP{target_date:%d%m%y}.CSV"
-        pd = f"PD{target_date:%d%m%y}.CSV"
-        rv = f"RV{target_date:%d%m%y}.CSV"
-        kwk = "K_WK_VAT.csv"  # weekly VAT summary snapshot
-        filenames = [mp, pd, rv, kwk]
-        memfile = io.BytesIO()
-        with zipfile.ZipFile(memfile, 'w', zipfile.ZIP_DEFLATED) as zf:
-            for name in filenames:
-                path = os.path.join(tmpdir, name)
-                if os.path.exists(path):
-                    zf.write(path, arcname=name)
-        memfile.seek(0)
-        resp = HttpResponse(memfile.read(), content_type='application/zip')
-        resp['Content-Disposition'] = f'attachment; filename="daily_csvs_{target_date:%Y%m%d}.zip"'
-        return resp
+        target_date = business_day_for()
+
+    # An open handle: a newer build may delete the cached file while it is being sent
+    archive = export_cache.daily_zip(target_date)
+
+    def stream():
+        with archive:
+            while chunk := archive.read(64 * 1024):
+                yield chunk
+        export_cache.clear_after_export(target_date)
+
+    resp = StreamingHttpResponse(stream(), content_type='application/zip')
+    resp['Content-Disposition'] = f'attachment; filename="daily_csvs_{target_date:%Y%m%d}.zip"'
+    resp['Content-Length'] = str(os.fstat(archive.fileno()).st_size)
+    return resp
+
+
+@require_GET
+@staff_member_required
+def export_range_csvs_zip(request: HttpRequest):
+    """Export MP/PD/RV for every day from `from` to `to` plus K_WK_VAT and a manifest, as one ZIP.
+
+    Query params:
+      - from, to: ISO dates (YYYY-MM-DD), inclusive, at most EPOS_EXPORT_MAX_RANGE_DAYS apart.
+
+    Response: application/zip with filename daily_csvs_<yyyymmdd>-<yyyymmdd>.zip
+    Days are rebuilt inside the request, or in EPOS_EXPORT_WORKERS processes when
+    that is set above 1 (services.range_export), and the bundle is cached like
+    the single-day export. The K tables are left
+    holding the whole range (nothing is cleared).
+    """
+    from manage_orders.services import export_cache
+    try:
+        start = timezone.datetime.strptime(request.GET.get('from') or '', '%Y-%m-%d').date()
+        end = timezone.datetime.strptime(request.GET.get('to') or '', '%Y-%m-%d').date()
+    except ValueError:
+        return JsonResponse({'error': 'from and to are required, expected YYYY-MM-DD'}, status=400)
+    max_days = int(getattr(settings, 'EPOS_EXPORT_MAX_RANGE_DAYS', 31))
+    if end < start or (end - start).days >= max_days:
+        return JsonResponse({'error': f'to must be on or after from, at most {max_days} days'}, status=400)
+
+    # In-process unless worker processes are configured explicitly
+    workers = max(1, int(getattr(settings, 'EPOS_EXPORT_WORKERS', 1) or 1))
+    archive = export_cache.range_zip(start, end, workers=workers)
+    # FileResponse streams from the open handle and takes Content-Length from it
+    return FileResponse(archive, content_type='application/zip', as_attachment=True,
+                        filename=f"daily_csvs_{start:%Y%m%d}-{end:%Y%m%d}.zip")
@@ -0,0 +1,199 @@
+"""Catalog CSV import (User_details/Scripts/insert_sql.py): per-row vs batched.
+
+Builds a scratch SQLite database from the project's migrations (db.sqlite3 is
+not touched), writes synthetic CSVs with `--rows` data rows for every table in
+csv_to_table, and times loading them all inside one transaction with:
+
+    per-row  - the loader's former approach: PRAGMA table_info per file,
+               datetime.now() and cursor.execute() per row, default pragmas;
+    batched  - insert_sql.load_csv: executemany in IMPORT_BATCH_SIZE batches,
+               one timestamp per import, import pragmas (as _run_import sets).
+
+Both must leave identical table contents (ignoring last_updated); the script
+checks that first. It then re-imports the same CSVs into the batched database
+twice with _run_import(mode='diff'), the no-change case of a differential
+import: "diff" compares every row (no file digests recorded yet), "same" skips
+files whose digest the first run recorded. Neither may change anything.
+Last, "import s" is a full _run_import(mode='replace') of the same CSVs, of
+which "locked s" is the swap, the only part holding the database write lock.
+
+    python tests/util/bench_catalog_import.py --rows 1000 10000 100000
+"""
+import argparse
+import contextlib
+import csv
+import io
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "epos.settings")
+
+SCRATCH = Path(tempfile.mkdtemp(prefix='epos-import-bench-'))
+
+import django  # noqa: E402
+from django.conf import settings  # noqa: E402
+
+settings.DATABASES['default']['NAME'] = str(SCRATCH / 'schema.sqlite3')
+django.setup()
+
+from django.core.management import call_command  # noqa: E402
+
+from User_details.Scripts import insert_sql  # noqa: E402
+
+
+def _value(col_type, i, stamp):
+    t = (col_type or '').lower()
+    if t.startswith('bool'):
+        return i % 2
+    if 'int' in t:
+        return i
+    if t.startswith(('real', 'decimal', 'float')):
+        return i * 0.5
+    if t.startswith('datetime'):
+        return stamp
+    if t.startswith('date'):
+        return '2025-01-01'
+    return f'V{i}'
+
+
+def write_csvs(db_path, csv_dir, n_rows):
+    conn = sqlite3.connect(db_path)
+    stamp = datetime.now().isoformat(sep=' ', timespec='seconds')
+    for file_name, table_name in insert_sql.csv_to_table.items():
+        cols = [(c[1], c[2]) for c in conn.execute(f"PRAGMA table_info({table_name})")
+                if c[1] not in ('id', 'last_updated')]
+        with open(csv_dir / file_name, 'w', newline='', encoding='utf-8') as f:
+            w = csv.writer(f)
+            w.writerow([c for c, _ in cols])
+            w.writerows([_value(t, i, stamp) for _, t in cols] for i in range(1, n_rows + 1))
+    conn.close()
+
+
+def per_row(cursor, csv_dir):
+    """The loader's previous inner loop, kept here as the baseline."""
+    for file_name, table_name in insert_sql.csv_to_table.items():
+        with open(csv_dir / file_name, newline='', encoding='utf-8-sig') as csvfile:
+            reader = csv.reader(csvfile)
+            headers = next(reader)
+            cursor.execute(f"PRAGMA table_info({table_name})")
+            table_columns = [col[1] for col in cursor.fetchall()]
+            normalize = lambda s: (s or '').strip().lstrip('﻿').lower()  # noqa: E731
+            table_map = {normalize(c): c for c in table_columns}
+            mapped_headers = [table_map.get(normalize(h), h) for h in headers]
+            if 'id' in table_columns and 'id' not in mapped_headers:
+                mapped_headers = ['id'] + mapped_headers
+            add_last_updated = 'last_updated' in table_columns and 'last_updated' not in mapped_headers
+            if add_last_updated:
+                mapped_headers.append('last_updated')
+            placeholders = ','.join(['?'] * len(mapped_headers))
+            insert = f"INSERT OR REPLACE INTO {table_name} ({','.join(mapped_headers)}) VALUES ({placeholders})"
+            id_counter = 1
+            for row in reader:
+                if 'id' in table_columns:
+                    row = [id_counter] + row
+                    id_counter += 1
+                if add_last_updated:
+                    row.append(datetime.now().isoformat(sep=' ', timespec='seconds'))
+                cursor.execute(insert, row)
+
+
+def batched(cursor, csv_dir):
+    stamp = datetime.now().isoformat(sep=' ', timespec='seconds')
+    for file_name, table_name in insert_sql.csv_to_table.items():
+        cols = [c[1] for c in cursor.execute(f"PRAGMA table_info({table_name})").fetchall()]
+        insert_sql.load_csv(cursor, csv_dir / file_name, table_name, cols, stamp)
+
+
+def run(loader, template, csv_dir, name, pragmas=()):
+    db = SCRATCH / f'{name}.sqlite3'
+    shutil.copy(template, db)
+    conn = sqlite3.connect(db)
+    cursor = conn.cursor()
+    t0 = time.perf_counter()
+    # synchronous cannot change inside a transaction; _run_import sets these before BEGIN too
+    for pragma, value in pragmas:
+        cursor.execute(f"PRAGMA {pragma} = {value}")
+    cursor.execute("BEGIN IMMEDIATE")
+    with contextlib.redirect_stdout(io.StringIO()):
+        loader(cursor, csv_dir)
+    conn.commit()
+    elapsed = time.perf_counter() - t0
+    conn.close()
+    return db, elapsed
+
+
+def diff_again(db, csv_dir):
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = insert_sql._run_import(db_path=db, csv_dir=csv_dir, debug_dump=False, mode='diff')
+    elapsed = time.perf_counter() - t0
+    assert report is not None and not any(c.changed for c in report.values()), "no-change diff wrote rows"
+    return elapsed
+
+
+def import_again(db, csv_dir):
+    """(total, locked) seconds of a replace import; locked runs from the shadow check to the commit."""
+    marks = {}
+
+    def progress(event):
+        marks.setdefault(event['phase'], time.perf_counter())
+
+    t0 = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        report = insert_sql._run_import(db_path=db, csv_dir=csv_dir, debug_dump=False, mode='replace',
+                                        progress=progress)
+    elapsed = time.perf_counter() - t0
+    assert report is not None, "replace import failed"
+    return elapsed, marks['committed'] - marks['checked']
+
+
+def contents(db):
+    conn = sqlite3.connect(db)
+    out = {}
+    for table_name in insert_sql.csv_to_table.values():
+        cols = [c[1] for c in conn.execute(f"PRAGMA table_info({table_name})") if c[1] != 'last_updated']
+        out[table_name] = conn.execute(f"SELECT {','.join(cols)} FROM {table_name} ORDER BY 1").fetchall()
+    conn.close()
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help='data rows per table')
+    args = parser.parse_args()
+
+    try:
+        call_command('migrate', verbosity=0)
+        template = Path(settings.DATABASES['default']['NAME'])
+        tables = len(insert_sql.csv_to_table)
+        print(f"{tables} tables")
+        print(f"{'rows/table':>10} {'per-row s':>10} {'batched s':>10} {'speed-up':>9} {'rows/s':>10} {'diff s':>8} {'same s':>8} {'import s':>9} {'locked s':>9}")
+        for n in args.rows:
+            csv_dir = SCRATCH / f'csv-{n}'
+            csv_dir.mkdir()
+            write_csvs(template, csv_dir, n)
+            a_db, a = run(per_row, template, csv_dir, 'per-row')
+            b_db, b = run(batched, template, csv_dir, 'batched', insert_sql.IMPORT_PRAGMAS)
+            assert contents(a_db) == contents(b_db), "imported contents differ"
+            before = contents(b_db)
+            d = diff_again(b_db, csv_dir)
+            same = diff_again(b_db, csv_dir)
+            assert contents(b_db) == before, "no-change diff altered contents"
+            full, locked = import_again(b_db, csv_dir)
+            assert contents(b_db) == before, "replace import altered contents"
+            print(f"{n:>10} {a:>10.2f} {b:>10.2f} {a / b:>8.1f}x {n * tables / b:>10.0f} {d:>8.2f} {same:>8.2f} "
+                  f"{full:>9.2f} {locked:>9.2f}")
+            shutil.rmtree(csv_dir)
+    finally:
+        shutil.rmtree(SCRATCH, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,153 @@
+"""Daily stats aggregation on a synthetic busy day: queries and time.
+
+Creates a throwaway test database (the project's db.sqlite3 is not touched),
+fills one business day with `--orders` orders (products, meals with options and
+a combo per order, a few crew food / waste / paid-out orders) and compares:
+
+    per-order  - the previous shape: one pass for counts and one for VAT, each
+                 iterating the orders and loading every order's lines separately
+                 (1 + N queries per pass);
+    streamed   - daily_stats._aggregate_orders: orders and lines streamed by two
+                 chunked queries and merged in order id order.
+
+Both must produce identical DailyStats; the script checks that first.
+
+    python tests/util/bench_daily_stats.py --orders 5000
+"""
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "epos.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from django.db import connection  # noqa: E402
+from django.test.utils import setup_databases, setup_test_environment, teardown_databases  # noqa: E402
+from django.utils import timezone  # noqa: E402
+
+
+def _product(code, name, std, dc=0):
+    from update_till.models import PdItem
+    prices = {}
+    for band in ('', '_2', '_3', '_4', '_5', '_6'):
+        prices[f'VATPR{band}'] = std
+        prices[f'DC_VATPR{band}'] = dc
+    return PdItem(PRODNUMB=code, PRODNAME=name, EAT_VAT_CLASS=1, TAKE_VAT_CLASS=1, READBACK_ORD=1,
+                  MEAL_ONLY=False, MEAL_CODE=0, MEAL_DRINK=0, T_DRINK_CD=0, **prices)
+
+
+def populate(n_orders):
+    from manage_orders.models import Order, OrderLine
+    from update_till.models import CombTb, CompPro, OptPro, PChoice, PdItem, PdVatTb
+    PdVatTb.objects.create(VAT_CLASS=1, VAT_RATE=20.0, VAT_DESC='Standard')
+    PdItem.objects.bulk_create([
+        _product(3, 'Cheeseburger', 485, 455), _product(30, 'Fries', 220, 130), _product(50, 'Cola', 140, 100),
+        _product(71, 'Six Bites', 530), _product(82, 'Onion Rings', 300), _product(95, 'Wings', 450),
+        _product(26, 'Dip Ketchup', 55), _product(39, 'Dip BBQ', 75), _product(118, 'Kids Meal', 350, 300),
+    ])
+    comb = {}
+    for band in ('', '_2', '_3', '_4', '_5', '_6'):
+        comb[f'VATPR{band}'] = 995
+        comb[f'T_VATPR{band}'] = 0
+    CombTb.objects.create(COMBONUMB=4, DESC='Sharing Platter', T_COMB_NUM=0, EAT_VAT_CLASS=1, TAKE_VAT_CLASS=1,
+                          **comb)
+    for code in (71, 82, 95):
+        CompPro.objects.create(COMBONUMB=4, PRODNUMB=code, T_PRODNUMB=0)
+    for code in (26, 39):
+        OptPro.objects.create(COMBONUMB=4, PRODNUMB=code, T_PRODNUMB=0)
+    PChoice.objects.create(PRODNUMB=118, OPT_PRODNUMB=26)
+
+    methods = ['Cash', 'Card', 'Cash', 'Card', 'Split', 'Crew Food', 'Waste food', 'Paid Out']
+    now = timezone.now()
+    orders = Order.objects.bulk_create([
+        Order(created_at=now, price_band=1, vat_basis='take' if i % 3 else 'eat', payment_method=methods[i % len(methods)],
+              total_gross=2675, split_cash_pence=1675 if i % len(methods) == 4 else 0,
+              split_card_pence=1000 if i % len(methods) == 4 else 0)
+        for i in range(n_orders)
+    ])
+    lines = []
+    for o in orders:
+        if o.payment_method == 'Paid Out':
+            continue
+        lines += [
+            OrderLine(order=o, item_code=3, item_type='product', name='Cheeseburger', qty=2, unit_price_gross=485,
+                      line_total_gross=970, meta={'free_choices': [26]}),
+            OrderLine(order=o, item_code=3, item_type='product', name='Cheeseburger Meal', is_meal=True, qty=1,
+                      unit_price_gross=685, line_total_gross=685, meta={'fries': 30, 'drink': 50, 'go_large': True}),
+            OrderLine(order=o, item_code=118, item_type='product', name='Kids Meal', is_meal=True, qty=1,
+                      unit_price_gross=530, line_total_gross=530, meta={'fries': 30, 'drink': 50}),
+            OrderLine(order=o, item_code=4, item_type='combo', name='Sharing Platter', qty=1, unit_price_gross=995,
+                      line_total_gross=995, meta={'options': [26], 'free_choices': [26, 39]}),
+        ]
+    OrderLine.objects.bulk_create(lines, batch_size=2000)
+    return len(orders), len(lines)
+
+
+def per_order(export_date):
+    """The previous access pattern: two passes, each loading lines order by order."""
+    from manage_orders.models import Order
+    from manage_orders.services import daily_stats
+    from manage_orders.services.business_day import business_day_filter
+    from update_till.catalog import get_catalog
+    stats = daily_stats._empty_stats(export_date)
+    catalog = get_catalog()
+    for o in Order.objects.filter(**business_day_filter('created_at', export_date)):
+        daily_stats._count_order(stats, o, list(o.lines.all()), catalog)
+    for o in Order.objects.filter(**business_day_filter('created_at', export_date)):
+        daily_stats._vat_order(stats, o, list(o.lines.all()), catalog)
+    return stats
+
+
+def streamed(export_date):
+    from manage_orders.services import daily_stats
+    return daily_stats._aggregate_orders(export_date)
+
+
+def measure(fn, export_date):
+    executed = [0]
+
+    def count(execute, sql, params, many, context):
+        executed[0] += 1
+        return execute(sql, params, many, context)
+
+    # An execute wrapper rather than connection.queries, whose log is capped at 9000 entries
+    with connection.execute_wrapper(count):
+        t0 = time.perf_counter()
+        stats = fn(export_date)
+        elapsed = (time.perf_counter() - t0) * 1000.0
+    return stats, executed[0], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--orders', type=int, default=5000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    old_config = setup_databases(verbosity=0, interactive=False)
+    try:
+        from manage_orders.services.business_day import business_day_for
+        from update_till.catalog import get_catalog
+        n_orders, n_lines = populate(args.orders)
+        export_date = business_day_for()
+        get_catalog()  # build the snapshot outside the timings
+        a, a_queries, a_ms = measure(per_order, export_date)
+        b, b_queries, b_ms = measure(streamed, export_date)
+        assert (a.meal_counts, a.kpro_counts, a.rev, a.vat_due, a.vat_net) == \
+               (b.meal_counts, b.kpro_counts, b.rev, b.vat_due, b.vat_net), "aggregates differ"
+        print(f"{n_orders} orders, {n_lines} lines")
+        print(f"{'':>10} {'queries':>8} {'ms':>9}")
+        print(f"{'per-order':>10} {a_queries:>8} {a_ms:>9.1f}")
+        print(f"{'streamed':>10} {b_queries:>8} {b_ms:>9.1f}")
+    finally:
+        teardown_databases(old_config, verbosity=0)
+
+
+if __name__ == "__main__":
+    main()
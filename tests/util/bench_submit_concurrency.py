@@ -0,0 +1,139 @@
+"""Submit-latency benchmark for several tills posting orders at once.
+
+Runs against a live server (same as the other util scripts) and WRITES ORDERS to
+its database, so run the server from a scratch copy of the project, not the
+shop's db.sqlite3:
+
+    python manage.py runserver 127.0.0.1:8090 --noreload
+    python tests/util/bench_submit_concurrency.py --tills 4 6 8 --orders 50
+
+Each till is a thread with its own session (cookies / CSRF token) that submits
+`--orders` orders of `--lines` lines back to back. For every till count it prints
+p50 / p95 / max submit latency in milliseconds, orders per second and errors.
+Orders are tagged with notes='bench_submit_concurrency' so they can be deleted
+afterwards from `manage.py shell`.
+"""
+import argparse
+import json
+import statistics
+import threading
+import time
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError
+from urllib.request import Request, build_opener, HTTPCookieProcessor
+
+BASE = "http://127.0.0.1:8090"
+
+
+class Till:
+    """One till: its own cookie jar so each thread carries a separate CSRF token."""
+
+    def __init__(self, base: str):
+        self.base = base
+        self.jar = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.jar))
+        self.opener.open(f"{base}/manage_orders/app_prod_order/", timeout=10).close()
+
+    def get(self, path: str) -> dict:
+        req = Request(f"{self.base}{path}")
+        req.add_header("Accept", "application/json")
+        with self.opener.open(req, timeout=10) as resp:
+            return json.loads(resp.read().decode("utf-8"))
+
+    def post(self, path: str, payload: dict) -> int:
+        req = Request(f"{self.base}{path}", data=json.dumps(payload).encode("utf-8"), method="POST")
+        req.add_header("Content-Type", "application/json")
+        req.add_header("Accept", "application/json")
+        for c in self.jar:
+            if c.name == 'csrftoken':
+                req.add_header('X-CSRFToken', c.value)
+                req.add_header('Referer', f"{self.base}/manage_orders/app_prod_order/")
+                break
+        try:
+            with self.opener.open(req, timeout=30) as resp:
+                resp.read()
+                return resp.status
+        except HTTPError as e:
+            return e.code
+
+
+def _sample_products(till: Till, band: str, limit: int) -> list:
+    """First `limit` priced products on the band's menu, as order lines."""
+    bundle = till.get(f"/api/menu/bundle?band={band}")
+    lines = []
+    for items in bundle.get('items', {}).values():
+        for it in items:
+            if it.get('type') == 'product' and int(it.get('price_gross') or 0) > 0:
+                lines.append({
+                    'code': it['code'], 'type': 'product', 'name': it.get('name', ''),
+                    'qty': 1, 'price_gross': int(it['price_gross']), 'meta': {},
+                })
+            if len(lines) >= limit:
+                return lines
+    return lines
+
+
+def run(base: str, tills: int, orders: int, lines: list, band: str) -> dict:
+    sessions = [Till(base) for _ in range(tills)]
+    payload = {
+        'price_band': band, 'vat_basis': 'take', 'show_net': False,
+        'payment_method': 'Cash', 'crew_id': '0', 'notes': 'bench_submit_concurrency',
+        'lines': lines,
+    }
+    latencies: list = []
+    errors = [0]
+    lock = threading.Lock()
+    start_gate = threading.Barrier(tills)
+
+    def worker(till: Till):
+        local = []
+        bad = 0
+        start_gate.wait()
+        for _ in range(orders):
+            t0 = time.perf_counter()
+            status = till.post("/api/order/submit", payload)
+            local.append((time.perf_counter() - t0) * 1000.0)
+            if status != 200:
+                bad += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += bad
+
+    threads = [threading.Thread(target=worker, args=(t,)) for t in sessions]
+    wall0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - wall0
+    latencies.sort()
+    return {
+        'tills': tills,
+        'p50': statistics.median(latencies),
+        'p95': latencies[max(0, int(len(latencies) * 0.95) - 1)],
+        'max': latencies[-1],
+        'rate': len(latencies) / wall if wall else 0.0,
+        'errors': errors[0],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base', default=BASE)
+    parser.add_argument('--tills', type=int, nargs='+', default=[4, 6, 8])
+    parser.add_argument('--orders', type=int, default=50, help='orders per till')
+    parser.add_argument('--lines', type=int, default=4, help='lines per order')
+    parser.add_argument('--band', default='1')
+    args = parser.parse_args()
+
+    lines = _sample_products(Till(args.base), args.band, args.lines)
+    if not lines:
+        raise SystemExit("No priced products on the menu for this band")
+    print(f"{'tills':>5} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8} {'orders/s':>9} {'errors':>6}")
+    for n in args.tills:
+        r = run(args.base, n, args.orders, lines, args.band)
+        print(f"{r['tills']:>5} {r['p50']:>8.1f} {r['p95']:>8.1f} {r['max']:>8.1f} {r['rate']:>9.1f} {r['errors']:>6}")
+
+
+if __name__ == "__main__":
+    main()
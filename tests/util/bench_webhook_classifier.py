@@ -0,0 +1,135 @@
+"""Deliveroo webhook payload classification: one pass vs the old repeated scans.
+
+Offline (no server, no database writes). Builds synthetic webhook payloads with
+`--items` line items and a status_log, then times:
+
+    legacy  - the handler's former approach: status_log walked once per status
+              check, items walked three times per candidate order id, payload
+              details formatted for INFO logging on every request;
+    single  - manage_orders.services.deliveroo.classify_webhook (logging off).
+
+Both must reach the same verdict for every payload; the script checks that first.
+
+    python tests/util/bench_webhook_classifier.py --items 100 250 --remakes 2
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2]))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "epos.settings")
+
+import django  # noqa: E402
+
+django.setup()
+
+from manage_orders.services.deliveroo import classify_webhook  # noqa: E402
+
+CODE_FIELDS = ('plu', 'sku', 'pos_code', 'external_id', 'pos_id', 'code')
+
+
+def _has_status(payload, wanted):
+    body = payload.get('body') or {}
+    order = body.get('order') or {}
+    for entry in order.get('status_log') or payload.get('status_log') or []:
+        s = entry.get('status') or entry.get('state')
+        if s and str(s).lower() in wanted:
+            return True
+    top = order.get('status') or order.get('state') or payload.get('status') or payload.get('state')
+    return bool(top and str(top).lower() in wanted)
+
+
+def legacy(payload, headers):
+    """The webhook's previous decision path, kept here as the baseline."""
+    _ = "headers=%s" % (dict(headers),)
+    body = payload.get('body') or {}
+    order = body.get('order') or {}
+    _ = "payload_status_log=%s" % (order.get('status_log'),)
+    items = order.get('items') or []
+    missing_plus = [it.get('name') or '?' for it in items
+                    if not any(it.get(f) and str(it.get(f)).strip() for f in CODE_FIELDS)]
+    _ = "payload_missing_plus=%s" % (missing_plus,)
+    ids = [order.get('id')] + [v for k, v in (order.get('remake_details') or {}).items() if 'order' in k]
+    verdicts = []
+    if _has_status(payload, {'accepted'}):
+        for _oid in ids:
+            missing_count = 0
+            code_to_items = {}
+            for it in items:
+                codes = [it.get(f) for f in CODE_FIELDS]
+                if not any(c and str(c).strip() for c in codes):
+                    missing_count += 1
+                else:
+                    val = next(str(c).strip() for c in codes if c and str(c).strip())
+                    code_to_items.setdefault(val, []).append(it.get('name'))
+            shared = any(len(v) >= 2 for v in code_to_items.values())
+            with_codes = sum(1 for it in items if any(it.get(f) for f in CODE_FIELDS))
+            broad = len(items) >= 2 and with_codes >= 2 and not missing_count
+            if missing_count >= 2:
+                verdicts.append('pos_item_id_mismatched')
+            elif missing_count:
+                verdicts.append('pos_item_id_not_found')
+            elif shared or broad:
+                verdicts.append('pos_item_id_mismatched')
+            else:
+                verdicts.append('ok')
+    elif _has_status(payload, {'rejected'}):
+        pass
+    elif _has_status(payload, {'canceled', 'cancelled'}):
+        pass
+    return verdicts
+
+
+def single(payload, headers):
+    info = classify_webhook(payload)
+    return [info.plu_verdict] * len(info.order_ids) if info.accepted else []
+
+
+def make_payload(n_items, remakes, missing):
+    items = [{'id': f'i{i}', 'name': f'Item {i}', 'plu': str(1000 + i), 'quantity': 1,
+              'modifiers': [{'id': f'm{i}', 'name': 'Extra'}]} for i in range(n_items)]
+    for i in range(missing):
+        items[i].pop('plu')
+    order = {
+        'id': 'gb:123', 'status': 'accepted', 'items': items,
+        'status_log': [{'status': s, 'at': '2025-01-01T12:00:00Z'} for s in ('placed', 'accepted', 'confirmed')],
+        'remake_details': {f'remake_order_id_{r}': f'gb:{200 + r}' for r in range(remakes)},
+    }
+    return {'event': 'order.status_update', 'body': {'order': order}}
+
+
+def timeit(fn, payloads, headers, rounds):
+    samples = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        for p in payloads:
+            fn(p, headers)
+        samples.append((time.perf_counter() - t0) * 1e6 / len(payloads))
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, nargs='+', default=[10, 100, 250])
+    parser.add_argument('--remakes', type=int, default=2, help='extra candidate order ids per payload')
+    parser.add_argument('--rounds', type=int, default=30)
+    args = parser.parse_args()
+
+    headers = {'Content-Type': 'application/json', 'User-Agent': 'Deliveroo-Webhook/1.0',
+               'X-Deliveroo-Hmac-Sha256': 'x' * 64}
+    print(f"{'items':>6} {'legacy us':>10} {'single us':>10} {'speed-up':>9}")
+    for n in args.items:
+        payloads = [json.loads(json.dumps(make_payload(n, args.remakes, missing))) for missing in (0, 1, 2)]
+        for p in payloads:
+            assert legacy(p, headers) == single(p, headers), "verdicts differ"
+        a = timeit(legacy, payloads, headers, args.rounds)
+        b = timeit(single, payloads, headers, args.rounds)
+        print(f"{n:>6} {a:>10.1f} {b:>10.1f} {a / b:>8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
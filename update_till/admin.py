@@ -3,10 +3,11 @@ from .models import *
 
 # Register all models with list_display for all fields
 model_list = [
-    KMeal, KPro, KRev, KWkVat, PdVatTb, PdItem, CombTb, ACodes, BCodes,
+    KMeal, KPro, KRev, KWkVat, KVatDay, PdVatTb, PdItem, CombTb, ACodes, BCodes,
     CompPro, OptPro, PChoice, StItems, AppComb, AppProd, GroupTb, MiscSec,
     CombExt, ProdExt, ShopsTb, EposProd, EposGroup, EposFreeProd,
-    EposCombFreeProd, EposComb, ToppingDel, EposAddOns, PriceBand, EStock
+    EposCombFreeProd, EposComb, ToppingDel, EposAddOns, PriceBand, EStock,
+    CatalogVersion, ImportJob
 ]
 
 for model in model_list:
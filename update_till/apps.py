@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class UpdateTillConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'update_till'
+
+    def ready(self):
+        # Keep the in-process catalog snapshot in step with ORM edits (admin, tests)
+        from update_till import catalog
+        catalog.connect_signals()
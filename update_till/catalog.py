@@ -0,0 +1,323 @@
+"""In-process, versioned snapshot of the update_till catalog tables.
+
+The menu / pricing tables (PDITEM, COMBTB, APP_PROD, EPOS_PROD, ...) only change
+when the CSV import (User_details/Scripts/insert_sql.py) runs, yet the till reads
+them on every click. This module loads them once per worker into read-only,
+indexed maps and hands the same object to every request until the catalog
+version changes.
+
+Versioning:
+    - insert_sql bumps CatalogVersion.version inside its import transaction, so
+      the new version becomes visible exactly when the new rows do.
+    - Each worker re-reads the version at most every EPOS_CATALOG_RECHECK_SECONDS
+      (default 5s); between checks get_catalog() costs zero queries.
+    - ORM edits to catalog models (admin, tests) invalidate the local snapshot at
+      once and bump the shared version on commit so other workers follow.
+
+A new snapshot is built off to the side and swapped in with a single assignment,
+so readers always see either the old catalog or the new one.
+"""
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional, Tuple
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal
+
+from update_till.models import (
+    ACodes, AppComb, AppProd, CatalogVersion, CombTb, CompPro, EposAddOns,
+    EposComb, EposCombFreeProd, EposFreeProd, EposGroup, EposProd, GroupTb,
+    OptPro, PChoice, PdItem, PdVatTb, PriceBand, ToppingDel,
+)
+from update_till.price_matrix import PriceMatrix, build_price_matrix
+
+logger = logging.getLogger(__name__)
+
+# Meal component heuristics shared by the menu views
+MEAL_FRIES_CODES: Tuple[int, ...] = (30, 31)
+KIDS_DRINKS_GROUP_ID = 99
+
+# Models whose rows are held in the snapshot; saving/deleting any of them
+# invalidates it.
+CATALOG_MODELS = (
+    PdVatTb, PdItem, CombTb, ACodes, CompPro, OptPro, PChoice, AppComb, AppProd,
+    GroupTb, EposProd, EposGroup, EposFreeProd, EposCombFreeProd, EposComb,
+    ToppingDel, EposAddOns, PriceBand,
+)
+
+FreeChoiceGroups = Tuple[Tuple[int, Tuple[int, ...]], ...]
+
+
+def parse_code_list(raw) -> Tuple[int, ...]:
+    """Parse a comma-separated list of product codes, skipping blanks and junk."""
+    codes = []
+    for part in str(raw or '').split(','):
+        part = part.strip()
+        if not part:
+            continue
+        try:
+            codes.append(int(part))
+        except Exception:
+            continue
+    return tuple(codes)
+
+
+def _parse_free_choice_rows(rows) -> FreeChoiceGroups:
+    """Turn EPOS_FREE_PROD / EPOS_COMB_FREE_PROD rows into ((group_no, codes), ...)."""
+    groups = []
+    for fr in rows:
+        for idx, field in enumerate(['FREE_CHOICE_1', 'FREE_CHOICE_2'], start=1):
+            codes = parse_code_list(getattr(fr, field, '') or '')
+            if codes:
+                groups.append((idx, codes))
+    return tuple(groups)
+
+
+def _first_by(rows: Iterable, attr: str) -> dict:
+    """Index rows by attr keeping the first row seen (matches queryset .first())."""
+    out: dict = {}
+    for r in rows:
+        out.setdefault(getattr(r, attr), r)
+    return out
+
+
+def _group_values(rows: Iterable, key_attr: str, value_attr: str) -> dict:
+    out: dict = {}
+    for r in rows:
+        out.setdefault(getattr(r, key_attr), []).append(getattr(r, value_attr))
+    return {k: tuple(v) for k, v in out.items()}
+
+
+def _latest_first(rows: list) -> list:
+    """Order rows newest last_updated first, ties by id (stable sort keeps id order)."""
+    return sorted(sorted(rows, key=lambda r: r.id), key=lambda r: r.last_updated, reverse=True)
+
+
+def _ro(d: dict) -> Mapping:
+    return MappingProxyType(d)
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Read-only view of the catalog tables at one import version.
+
+    Row objects are the usual model instances and must be treated as read-only;
+    every index is a mappingproxy / tuple so it cannot be mutated by callers.
+    """
+    version: int
+    built_at: float
+    vat_rates: Mapping[int, float]
+    products: Mapping[int, PdItem]
+    combos: Mapping[int, CombTb]
+    product_prices: PriceMatrix     # band x {std, dc} x {gross, net-take, net-eat} per product
+    combo_prices: PriceMatrix
+    app_products: Tuple[AppProd, ...]
+    app_product_by_code: Mapping[int, AppProd]
+    app_combos: Tuple[AppComb, ...]
+    app_combo_by_code: Mapping[int, AppComb]
+    groups: Tuple[GroupTb, ...]
+    epos_groups: Tuple[EposGroup, ...]
+    epos_group_by_id: Mapping[int, EposGroup]
+    epos_product_by_code: Mapping[int, EposProd]
+    epos_products_by_group: Mapping[int, Tuple[EposProd, ...]]
+    epos_combo_by_code: Mapping[int, EposComb]
+    epos_combos_by_group: Mapping[int, Tuple[EposComb, ...]]
+    product_options: Mapping[int, Tuple[int, ...]]
+    combo_compulsory: Mapping[int, Tuple[int, ...]]
+    combo_optional: Mapping[int, Tuple[int, ...]]
+    product_free_choices: Mapping[int, FreeChoiceGroups]
+    combo_free_choices: Mapping[int, FreeChoiceGroups]
+    product_addons: Mapping[int, Tuple[int, ...]]
+    product_acodes: Mapping[int, Tuple[int, ...]]
+    toppings: Mapping[int, ToppingDel]
+    price_bands: Tuple[PriceBand, ...]
+    supplier_names: frozenset
+    meal_fries: Tuple[int, ...]
+    meal_drinks: Tuple[int, ...]
+    kids_drinks: Tuple[int, ...]
+
+    def product_name(self, code: int) -> str:
+        """Display name for a product: EPOS_PROD.ITEM_DESC, else PDITEM.PRODNAME."""
+        ep = self.epos_product_by_code.get(code)
+        if ep and (ep.ITEM_DESC or '').strip():
+            return ep.ITEM_DESC.strip()
+        item = self.products.get(code)
+        return (item.PRODNAME or '').strip() if item else ''
+
+    def combo_name(self, code: int) -> str:
+        """Display name for a combo: EPOS_COMB.ITEM_DESC, else COMBTB.DESC."""
+        ec = self.epos_combo_by_code.get(code)
+        if ec and (ec.ITEM_DESC or '').strip():
+            return ec.ITEM_DESC.strip()
+        combo = self.combos.get(code)
+        return (combo.DESC or '').strip() if combo else ''
+
+    def products_for(self, codes: Iterable[int]) -> list:
+        """PdItem rows for codes, in the given order, skipping unknown codes."""
+        return [self.products[c] for c in codes if c in self.products]
+
+
+def _build_snapshot() -> CatalogSnapshot:
+    # One read transaction so the version and every table come from the same commit
+    with transaction.atomic():
+        version = _read_version()
+        vat_rates = {r.VAT_CLASS: r.VAT_RATE for r in PdVatTb.objects.all()}
+        pd_rows = list(PdItem.objects.order_by('id'))
+        # Duplicate codes: the later row wins, as with the batched PRODNUMB__in lookups the views used
+        products = {p.PRODNUMB: p for p in pd_rows}
+        comb_rows = list(CombTb.objects.order_by('id'))
+        combos = {c.COMBONUMB: c for c in comb_rows}
+        app_products = tuple(AppProd.objects.order_by('id'))
+        app_combos = tuple(AppComb.objects.order_by('id'))
+        groups = tuple(GroupTb.objects.order_by('GROUP_ID', 'id'))
+        epos_groups = tuple(EposGroup.objects.order_by('EPOS_GROUP_ID', 'id'))
+
+        # Latest EposProd/EposComb row wins for names (mirrors order_by('-last_updated').first())
+        epos_prod_rows = list(EposProd.objects.order_by('EPOS_SEQUENCE', 'id'))
+        epos_product_by_code = _first_by(_latest_first(epos_prod_rows), 'PRODNUMB')
+        epos_products_by_group: dict = {}
+        for ep in epos_prod_rows:
+            epos_products_by_group.setdefault(ep.EPOS_GROUP, []).append(ep)
+        epos_comb_rows = list(EposComb.objects.order_by('EPOS_SEQUENCE', 'id'))
+        epos_combo_by_code = _first_by(_latest_first(epos_comb_rows), 'COMBONUMB')
+        epos_combos_by_group: dict = {}
+        for ec in epos_comb_rows:
+            epos_combos_by_group.setdefault(ec.EPOS_GROUP, []).append(ec)
+
+        free_rows: dict = {}
+        for fr in EposFreeProd.objects.order_by('id'):
+            free_rows.setdefault(fr.PRODNUMB, []).append(fr)
+        comb_free_rows: dict = {}
+        for fr in EposCombFreeProd.objects.order_by('id'):
+            comb_free_rows.setdefault(fr.COMBONUMB, []).append(fr)
+        addon_rows = _first_by(EposAddOns.objects.order_by('-last_updated', 'id'), 'PRODNUMB')
+
+        price_bands = tuple(PriceBand.objects.filter(APPLY_HERE=True).order_by('SEQ_ORDER', 'SUPPLIER_NAME'))
+
+        # Meal drinks: MEAL_DRINK > 0, ordered by EPOS_SEQUENCE where an EposProd row exists, then by PRODNUMB
+        drink_codes = {p.PRODNUMB for p in pd_rows if (p.MEAL_DRINK or 0) > 0}
+        meal_drinks = [ep.PRODNUMB for ep in epos_prod_rows if ep.PRODNUMB in drink_codes]
+        meal_drinks += sorted(drink_codes - set(meal_drinks))
+        kids_drinks = [ep.PRODNUMB for ep in epos_products_by_group.get(KIDS_DRINKS_GROUP_ID, []) if ep.PRODNUMB in products]
+
+        return CatalogSnapshot(
+            version=version,
+            built_at=time.time(),
+            vat_rates=_ro(vat_rates),
+            products=_ro(products),
+            combos=_ro(combos),
+            product_prices=build_price_matrix(pd_rows, 'PRODNUMB', vat_rates),
+            combo_prices=build_price_matrix(comb_rows, 'COMBONUMB', vat_rates, discounted_prefix=None),
+            app_products=app_products,
+            app_product_by_code=_ro(_first_by(app_products, 'PRODNUMB')),
+            app_combos=app_combos,
+            app_combo_by_code=_ro(_first_by(app_combos, 'COMBONUMB')),
+            groups=groups,
+            epos_groups=epos_groups,
+            epos_group_by_id=_ro(_first_by(epos_groups, 'EPOS_GROUP_ID')),
+            epos_product_by_code=_ro(epos_product_by_code),
+            epos_products_by_group=_ro({k: tuple(v) for k, v in epos_products_by_group.items()}),
+            epos_combo_by_code=_ro(epos_combo_by_code),
+            epos_combos_by_group=_ro({k: tuple(v) for k, v in epos_combos_by_group.items()}),
+            product_options=_ro(_group_values(PChoice.objects.order_by('id'), 'PRODNUMB', 'OPT_PRODNUMB')),
+            combo_compulsory=_ro(_group_values(CompPro.objects.order_by('id'), 'COMBONUMB', 'PRODNUMB')),
+            combo_optional=_ro(_group_values(OptPro.objects.order_by('id'), 'COMBONUMB', 'PRODNUMB')),
+            product_free_choices=_ro({k: _parse_free_choice_rows(v) for k, v in free_rows.items()}),
+            combo_free_choices=_ro({k: _parse_free_choice_rows(v) for k, v in comb_free_rows.items()}),
+            product_addons=_ro({k: parse_code_list(r.ADD_ONS) for k, r in addon_rows.items()}),
+            product_acodes=_ro(_group_values(ACodes.objects.order_by('id'), 'PRODNUMB', 'ST_CODENUM')),
+            toppings=_ro(_first_by(ToppingDel.objects.order_by('id'), 'ACODE')),
+            price_bands=price_bands,
+            supplier_names=frozenset((pb.SUPPLIER_NAME or '').strip() for pb in price_bands if pb.SUPPLIER_NAME),
+            meal_fries=tuple(p.PRODNUMB for p in sorted((products[c] for c in MEAL_FRIES_CODES if c in products), key=lambda p: p.id)),
+            meal_drinks=tuple(meal_drinks),
+            kids_drinks=tuple(kids_drinks),
+        )
+
+
+def _read_version() -> int:
+    row = CatalogVersion.objects.order_by('id').values_list('version', flat=True).first()
+    return int(row or 0)
+
+
+# Sent with snapshot=<CatalogSnapshot> whenever a worker swaps in a new snapshot,
+# so derived caches (e.g. pre-rendered menu payloads) can be materialized.
+catalog_rebuilt = Signal()
+
+_lock = threading.Lock()
+_current: Optional[CatalogSnapshot] = None
+_checked_at = 0.0
+
+
+def get_catalog() -> CatalogSnapshot:
+    """Return the current catalog snapshot, building or refreshing it if needed."""
+    global _current, _checked_at
+    snap = _current
+    recheck = float(getattr(settings, 'EPOS_CATALOG_RECHECK_SECONDS', 5.0))
+    if snap is not None and (time.monotonic() - _checked_at) < recheck:
+        return snap
+    rebuilt = False
+    with _lock:
+        snap = _current
+        if snap is not None and (time.monotonic() - _checked_at) < recheck:
+            return snap
+        if snap is None or _read_version() != snap.version:
+            snap = _build_snapshot()
+            _current = snap
+            rebuilt = True
+        _checked_at = time.monotonic()
+    if rebuilt:
+        # Outside the lock: receivers may call get_catalog() themselves. A failing
+        # receiver must not break the request that happened to trigger the rebuild.
+        for receiver, result in catalog_rebuilt.send_robust(sender=CatalogSnapshot, snapshot=snap):
+            if isinstance(result, Exception):
+                logger.error("catalog_rebuilt receiver %r failed: %s", receiver, result)
+    return snap
+
+
+def catalog_version() -> int:
+    """Version of the snapshot currently served by this worker."""
+    return get_catalog().version
+
+
+def invalidate() -> None:
+    """Drop this worker's snapshot; the next get_catalog() rebuilds it."""
+    global _current
+    with _lock:
+        _current = None
+
+
+def reads_any(tables: Iterable[str]) -> bool:
+    """True if the snapshot is built from any of these database tables (case-insensitive)."""
+    names = {m._meta.db_table.lower() for m in CATALOG_MODELS}
+    return any(t.lower() in names for t in tables)
+
+
+def bump_version() -> int:
+    """Increment the shared catalog version (other workers reload on their next check)."""
+    with transaction.atomic():
+        updated = CatalogVersion.objects.filter(pk=1).update(version=F('version') + 1)
+        if not updated:
+            CatalogVersion.objects.create(pk=1, version=1)
+        version = _read_version()
+    invalidate()
+    return version
+
+
+def _on_catalog_change(sender, **kwargs):
+    invalidate()
+    transaction.on_commit(bump_version)
+
+
+def connect_signals() -> None:
+    for model in CATALOG_MODELS:
+        post_save.connect(_on_catalog_change, sender=model, dispatch_uid=f'catalog_save_{model.__name__}')
+        post_delete.connect(_on_catalog_change, sender=model, dispatch_uid=f'catalog_delete_{model.__name__}')
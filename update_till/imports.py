@@ -0,0 +1,263 @@
+"""Catalog CSV imports as background jobs.
+
+The Update Till page takes the import slot with reserve() (a 'staging' job,
+refused while another job is staging, queued or running), stages the CSVs,
+queues the job with submit() and returns; the import itself
+(User_details/Scripts/insert_sql.py) runs here:
+
+    - claim() hands the oldest queued job to one runner with a single
+      conditional UPDATE that also requires no other job to be running, so
+      imports never overlap however many web workers and
+      `manage.py run_import_jobs` are draining;
+    - run() calls insert_sql with its own output writer (no sys.stdout swapping)
+      and a progress callback, and stores the output, validation errors and
+      per-table report on the job when it ends.
+
+insert_sql loads the CSVs into shadow tables and then swaps them in while it
+holds the database write lock, so progress is not written to the job row while
+it runs: each event is appended as a JSON line to a file in
+EPOS_IMPORT_PROGRESS_DIR, which describe() (the progress endpoint) reads from
+any process. The lines are copied onto the job when it finishes.
+
+With EPOS_IMPORT_INLINE_DISPATCH (default on) submit() starts a daemon thread
+in the web process that drains the queue after the commit and then exits;
+turn it off to run imports only via `manage.py run_import_jobs --loop`.
+A job left running by a killed process is failed after
+EPOS_IMPORT_JOB_STALE_SECONDS.
+"""
+from __future__ import annotations
+
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+from dataclasses import asdict
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+from django.db.models import Exists
+from django.utils import timezone
+
+from update_till import catalog
+from update_till.models import ImportJob
+from User_details.Scripts import insert_sql
+
+logger = logging.getLogger(__name__)
+
+ACTIVE = (ImportJob.STATUS_STAGING, ImportJob.STATUS_QUEUED, ImportJob.STATUS_RUNNING)
+
+
+class ImportBusy(Exception):
+    """Another import holds the slot; `job` is the one in the way."""
+
+    def __init__(self, job: ImportJob):
+        super().__init__(f"Import #{job.pk} is still {job.status}")
+        self.job = job
+
+
+def _setting(name: str, default):
+    return getattr(settings, name, default)
+
+
+def progress_dir() -> Path:
+    directory = _setting('EPOS_IMPORT_PROGRESS_DIR', '') or os.path.join(tempfile.gettempdir(), 'epos-import-jobs')
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def _progress_path(job_id: int) -> Path:
+    return progress_dir() / f"import_{job_id}.jsonl"
+
+
+def read_progress(job_id: int) -> List[dict]:
+    """Progress events written so far by the job's runner (a half-written last line is skipped)."""
+    try:
+        lines = _progress_path(job_id).read_text(encoding='utf-8').splitlines()
+    except OSError:
+        return []
+    events = []
+    for line in lines:
+        try:
+            events.append(json.loads(line))
+        except ValueError:
+            break
+    return events
+
+
+def active() -> Optional[ImportJob]:
+    """The staging, queued or running job, if any (oldest first)."""
+    return ImportJob.objects.filter(status__in=ACTIVE).order_by('created_at', 'id').first()
+
+
+def reserve(mode: str = 'replace', requested_by: str = '') -> ImportJob:
+    """Take the import slot before staging CSVs; raises ImportBusy while another job holds it."""
+    if mode not in insert_sql.IMPORT_MODES:
+        raise ValueError(f"unknown import mode {mode!r}")
+    _fail_stale()
+    with transaction.atomic():
+        # The INSERT takes SQLite's write lock until commit, so two reservations cannot
+        # both see an empty slot: the second one waits and then finds the first
+        job = ImportJob.objects.create(status=ImportJob.STATUS_STAGING, mode=mode, requested_by=requested_by)
+        other = ImportJob.objects.filter(status__in=ACTIVE).exclude(pk=job.pk).order_by('created_at', 'id').first()
+        if other is not None:
+            raise ImportBusy(other)
+    return job
+
+
+def submit(job: ImportJob) -> ImportJob:
+    """Queue a reserved job once its CSVs are staged; it starts after the surrounding transaction commits."""
+    ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_STAGING).update(status=ImportJob.STATUS_QUEUED)
+    job.refresh_from_db()
+    if job.status == ImportJob.STATUS_QUEUED and _setting('EPOS_IMPORT_INLINE_DISPATCH', True):
+        transaction.on_commit(wake)
+    return job
+
+
+def cancel(job: ImportJob) -> None:
+    """Give the slot back when staging did not produce a complete set of CSVs."""
+    ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_STAGING).delete()
+
+
+def _fail_stale() -> None:
+    cutoff = timezone.now() - timedelta(seconds=float(_setting('EPOS_IMPORT_JOB_STALE_SECONDS', 3600)))
+    for job in ImportJob.objects.filter(status=ImportJob.STATUS_RUNNING, started_at__lt=cutoff):
+        logger.warning("import job #%s abandoned while running; marking failed", job.pk)
+        ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_RUNNING).update(
+            status=ImportJob.STATUS_FAILED, finished_at=timezone.now(),
+            progress=read_progress(job.pk), error='Runner stopped before the import finished.')
+        _progress_path(job.pk).unlink(missing_ok=True)
+    ImportJob.objects.filter(status=ImportJob.STATUS_STAGING, created_at__lt=cutoff).update(
+        status=ImportJob.STATUS_FAILED, finished_at=timezone.now(), error='Staging the CSVs did not finish.')
+
+
+def claim() -> Optional[ImportJob]:
+    """Take the oldest queued job for this runner, unless another job is running."""
+    _fail_stale()
+    job = ImportJob.objects.filter(status=ImportJob.STATUS_QUEUED).order_by('created_at', 'id').first()
+    if job is None:
+        return None
+    # One conditional UPDATE: only one runner wins the job, and only while nothing else runs
+    running = ImportJob.objects.filter(status=ImportJob.STATUS_RUNNING)
+    won = ImportJob.objects.filter(pk=job.pk, status=ImportJob.STATUS_QUEUED).exclude(Exists(running)).update(
+        status=ImportJob.STATUS_RUNNING, started_at=timezone.now())
+    if not won:
+        return None
+    job.refresh_from_db()
+    return job
+
+
+def run(job: ImportJob) -> ImportJob:
+    """Run a claimed job to completion and record the outcome on it."""
+    path = _progress_path(job.pk)
+    out = io.StringIO()
+    report = None
+    error = ''
+    with open(path, 'w', encoding='utf-8') as log:
+        def progress(event: dict) -> None:
+            log.write(json.dumps({**event, 'at': timezone.now().isoformat()}) + '\n')
+            log.flush()
+
+        try:
+            report = insert_sql.main(job.mode, out=out, progress=progress)
+        except (Exception, SystemExit) as e:  # SystemExit: insert_sql's missing CSV directory / bad mode
+            logger.exception("import job #%s failed", job.pk)
+            error = str(e) or repr(e)
+    output = out.getvalue()
+    validation_errors = [line.replace('[VALIDATION] ', '', 1) for line in output.splitlines()
+                         if line.startswith('[VALIDATION] ')]
+    if report is None and not error:
+        error = 'Validation failed; no changes applied.' if validation_errors else 'Import failed; no changes applied.'
+    job.status = ImportJob.STATUS_SUCCEEDED if report is not None else ImportJob.STATUS_FAILED
+    job.finished_at = timezone.now()
+    job.progress = read_progress(job.pk)
+    job.report = {table: asdict(changes) for table, changes in (report or {}).items()}
+    job.validation_errors = validation_errors
+    job.output = output
+    job.error = error
+    job.save(update_fields=['status', 'finished_at', 'progress', 'report', 'validation_errors', 'output', 'error'])
+    path.unlink(missing_ok=True)
+
+    # Rebuild this process's catalog snapshot (and anything derived from it) now if a
+    # table it reads changed; other workers follow the version bump
+    if catalog.reads_any(t for t, c in (report or {}).items() if c.changed):
+        catalog.invalidate()
+        catalog.get_catalog()
+    return job
+
+
+def drain() -> int:
+    """Run queued jobs one after another until none is left; returns how many ran."""
+    ran = 0
+    while True:
+        job = claim()
+        if job is None:
+            return ran
+        run(job)
+        ran += 1
+
+
+def describe(job: ImportJob) -> Dict[str, object]:
+    """JSON-ready state of a job, with live progress while it runs."""
+    progress = job.progress if job.finished else read_progress(job.pk)
+    staged = [e for e in progress if e.get('phase') == 'staged']
+    tables = [e for e in progress if e.get('phase') == 'table']
+    last = (tables or staged)[-1:]
+    return {
+        'id': job.pk,
+        'status': job.status,
+        'finished': job.finished,
+        'mode': job.mode,
+        'requested_by': job.requested_by,
+        'created_at': job.created_at.isoformat(),
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'tables_staged': len(staged),
+        'tables_done': len(tables),
+        'tables_total': last[0]['total'] if last else len(insert_sql.csv_to_table),
+        'progress': progress,
+        'report': job.report,
+        'validation_errors': job.validation_errors,
+        'output': job.output,
+        'error': job.error,
+    }
+
+
+# In-process runner: at most one daemon thread per process, started by submit()
+_runner: Optional[threading.Thread] = None
+_runner_lock = threading.Lock()
+_pending = False
+
+
+def _run_forever():
+    global _runner, _pending
+    while True:
+        try:
+            drain()
+        except Exception:
+            logger.exception("import job runner failed")
+        finally:
+            close_old_connections()
+        with _runner_lock:
+            # Exit only if nothing was enqueued while this pass was draining
+            if not _pending:
+                _runner = None
+                connections.close_all()
+                return
+            _pending = False
+
+
+def wake() -> None:
+    """Start this process's runner thread if needed and ask it to drain the queue."""
+    global _runner, _pending
+    with _runner_lock:
+        _pending = True
+        if _runner is None or not _runner.is_alive():
+            _pending = False
+            _runner = threading.Thread(target=_run_forever, name='import-runner', daemon=True)
+            _runner.start()
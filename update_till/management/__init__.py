@@ -0,0 +1 @@
+# Package init for management commands
@@ -0,0 +1,24 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from update_till import imports
+
+
+class Command(BaseCommand):
+    help = "Run queued catalog import jobs (Update Till page); --loop keeps running as a worker"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep polling for jobs until interrupted')
+        parser.add_argument('--interval', type=float, default=5.0, help='Seconds between polls with --loop (default 5)')
+
+    def handle(self, *args, **options):
+        while True:
+            ran = imports.drain()
+            if ran or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f"Import jobs: {ran} run"))
+            if not options['loop']:
+                return
+            close_old_connections()
+            time.sleep(options['interval'])
@@ -0,0 +1,21 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('update_till', '0017_priceband_deliv_supplier'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, help_text='Incremented each time a catalog import commits.')),
+                ('last_updated', models.DateTimeField(auto_now=True, help_text='Last updated timestamp.')),
+            ],
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 5.2.4 on 2026-10-18 17:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('update_till', '0018_catalogversion'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='acodes',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='appcomb',
+            name='COMBONUMB',
+            field=models.IntegerField(db_index=True, help_text='Combination product code.'),
+        ),
+        migrations.AlterField(
+            model_name='appprod',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='combtb',
+            name='COMBONUMB',
+            field=models.IntegerField(db_index=True, help_text='Combination product code.'),
+        ),
+        migrations.AlterField(
+            model_name='comppro',
+            name='COMBONUMB',
+            field=models.IntegerField(db_index=True, help_text='Combination product code.'),
+        ),
+        migrations.AlterField(
+            model_name='eposaddons',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='eposcomb',
+            name='COMBONUMB',
+            field=models.IntegerField(db_index=True, help_text='Combination product code.'),
+        ),
+        migrations.AlterField(
+            model_name='eposcomb',
+            name='EPOS_GROUP',
+            field=models.IntegerField(db_index=True, help_text='ePOS group number.'),
+        ),
+        migrations.AlterField(
+            model_name='eposcombfreeprod',
+            name='COMBONUMB',
+            field=models.IntegerField(db_index=True, help_text='Combination product code.'),
+        ),
+        migrations.AlterField(
+            model_name='eposfreeprod',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='eposgroup',
+            name='EPOS_GROUP_ID',
+            field=models.IntegerField(db_index=True, help_text='ePOS group number.'),
+        ),
+        migrations.AlterField(
+            model_name='eposprod',
+            name='EPOS_GROUP',
+            field=models.IntegerField(db_index=True, help_text='ePOS group number.'),
+        ),
+        migrations.AlterField(
+            model_name='eposprod',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='kwkvat',
+            name='VAT_CLASS',
+            field=models.PositiveSmallIntegerField(db_index=True, help_text='VAT class.'),
+        ),
+        migrations.AlterField(
+            model_name='optpro',
+            name='COMBONUMB',
+            field=models.IntegerField(db_index=True, help_text='Combination product code.'),
+        ),
+        migrations.AlterField(
+            model_name='pchoice',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='pditem',
+            name='PRODNUMB',
+            field=models.IntegerField(db_index=True, help_text='Product code.'),
+        ),
+        migrations.AlterField(
+            model_name='toppingdel',
+            name='ACODE',
+            field=models.IntegerField(db_index=True, help_text='Topping code.'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('update_till', '0019_alter_acodes_prodnumb_alter_appcomb_combonumb_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='KVatDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('stat_date', models.DateField(help_text='Statistics date (business day)')),
+                ('VAT_CLASS', models.PositiveSmallIntegerField(help_text='VAT class.')),
+                ('TOT_VAT', models.BigIntegerField(default=0, help_text='VAT due (pence), excluding crew food and waste.')),
+                ('T_VAL_EXCLVAT', models.BigIntegerField(default=0, help_text='Value excluding VAT (pence), excluding crew food and waste.')),
+                ('last_updated', models.DateTimeField(auto_now=True, help_text='Last updated timestamp.')),
+            ],
+            options={
+                'unique_together': {('stat_date', 'VAT_CLASS')},
+            },
+        ),
+    ]
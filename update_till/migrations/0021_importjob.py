@@ -0,0 +1,34 @@
+# Generated by Django 5.2.4 on 2026-10-18 18:57
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('update_till', '0020_kvatday'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('succeeded', 'Succeeded'), ('failed', 'Failed')], default='queued', max_length=10)),
+                ('mode', models.CharField(default='replace', help_text="insert_sql import mode: 'replace' or 'diff'.", max_length=10)),
+                ('requested_by', models.CharField(blank=True, default='', max_length=150)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('progress', models.JSONField(blank=True, default=list, help_text='Per-step progress events, kept once the job ends.')),
+                ('report', models.JSONField(blank=True, default=dict, help_text='Changes per table (insert_sql.TableChanges).')),
+                ('validation_errors', models.JSONField(blank=True, default=list)),
+                ('output', models.TextField(blank=True, default='', help_text='Messages printed by the import.')),
+                ('error', models.TextField(blank=True, default='')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='importjob_status_created_idx')],
+            },
+        ),
+    ]
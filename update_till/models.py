@@ -1,5 +1,6 @@
 
 from django.db import models
+from django.utils import timezone
 
 # Table 1: K_MEAL
 # Stores the number of meals sold per product per date.
@@ -85,7 +86,7 @@ class KRev(models.Model):
 # For each record in table PDVat_Tb, we add a record to table K_Wk_Vat. 
 # We update table K_Wk_Vat on each day of the week.
 class KWkVat(models.Model):
-    VAT_CLASS = models.PositiveSmallIntegerField(help_text="VAT class.")
+    VAT_CLASS = models.PositiveSmallIntegerField(db_index=True, help_text="VAT class.")
     VAT_RATE = models.FloatField(help_text="VAT rate for this class.")
     TOT_VAT_1 = models.FloatField(help_text="Total VAT due (Monday).")
     TOT_VAT_2 = models.FloatField(help_text="Total VAT due (Tuesday).")
@@ -105,6 +106,19 @@ class KWkVat(models.Model):
     def __str__(self):
         return f"VAT Class {self.VAT_CLASS} - Rate: {self.VAT_RATE}, Last Updated: {self.last_updated}"
 
+# VAT totals by class for one business day, kept up to date as orders are taken.
+# When a day is exported its values are written to that weekday's columns in K_WK_VAT.
+class KVatDay(models.Model):
+    stat_date = models.DateField(help_text="Statistics date (business day)")
+    VAT_CLASS = models.PositiveSmallIntegerField(help_text="VAT class.")
+    TOT_VAT = models.BigIntegerField(default=0, help_text="VAT due (pence), excluding crew food and waste.")
+    T_VAL_EXCLVAT = models.BigIntegerField(default=0, help_text="Value excluding VAT (pence), excluding crew food and waste.")
+    last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
+    class Meta:
+        unique_together = (('stat_date','VAT_CLASS'),)
+    def __str__(self):
+        return f"{self.stat_date} VAT Class {self.VAT_CLASS} - VAT: {self.TOT_VAT}, Excl. VAT: {self.T_VAL_EXCLVAT}"
+
 # Table 5: PDVAT_TB
 # Stores VAT class details.
 # CSV file: PDVAT_TB.CSV
@@ -121,7 +135,7 @@ class PdVatTb(models.Model):
 # CSV file: PDITEM<n>.CSV
 # <n> is the shop number (1-15)
 class PdItem(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     PRODNAME = models.CharField(max_length=16, help_text="Product name.")
     EAT_VAT_CLASS = models.PositiveSmallIntegerField(help_text="VAT class for Eatin order.")
     TAKE_VAT_CLASS = models.PositiveSmallIntegerField(help_text="VAT class for Takeaway order.")
@@ -152,7 +166,7 @@ class PdItem(models.Model):
 # CSV file: COMBTB<n>.CSV
 # <n> is the shop number (1-15)
 class CombTb(models.Model):
-    COMBONUMB = models.IntegerField(help_text="Combination product code.")
+    COMBONUMB = models.IntegerField(db_index=True, help_text="Combination product code.")
     DESC = models.CharField(max_length=16, help_text="Name of combination product.")
     T_COMB_NUM = models.IntegerField(help_text="Trade up combination product code.")
     EAT_VAT_CLASS = models.PositiveSmallIntegerField(help_text="VAT class for Eatin order.")
@@ -177,7 +191,7 @@ class CombTb(models.Model):
 # Stores 'A' code stock components for products.
 # CSV file: ACODES.CSV
 class ACodes(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     ST_CODENUM = models.IntegerField(help_text="A code stock component number.")
     QTY = models.FloatField(help_text="Quantity of this A code stock component.")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
@@ -199,7 +213,7 @@ class BCodes(models.Model):
 # Stores compulsory products for combinations.
 # CSV file: COMP_PRO.CSV
 class CompPro(models.Model):
-    COMBONUMB = models.IntegerField(help_text="Combination product code.")
+    COMBONUMB = models.IntegerField(db_index=True, help_text="Combination product code.")
     PRODNUMB = models.IntegerField(help_text="Product code of compulsory product.")
     T_PRODNUMB = models.IntegerField(help_text="Trade up product code (0 if none).")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
@@ -210,7 +224,7 @@ class CompPro(models.Model):
 # Stores optional products for combinations.
 # CSV file: OPT_PRO.CSV
 class OptPro(models.Model):
-    COMBONUMB = models.IntegerField(help_text="Combination product code.")
+    COMBONUMB = models.IntegerField(db_index=True, help_text="Combination product code.")
     PRODNUMB = models.IntegerField(help_text="Product code of optional product.")
     T_PRODNUMB = models.IntegerField(help_text="Trade up product code (0 if none).")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
@@ -221,7 +235,7 @@ class OptPro(models.Model):
 # Stores optional products for each product.
 # CSV file: P_CHOICE.CSV
 class PChoice(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     OPT_PRODNUMB = models.IntegerField(help_text="Optional product code for this product.")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
     def __str__(self):
@@ -242,7 +256,7 @@ class StItems(models.Model):
 # Stores combination products for reporting.
 # CSV file: APP_COMB.CSV
 class AppComb(models.Model):
-    COMBONUMB = models.IntegerField(help_text="Combination product code.")
+    COMBONUMB = models.IntegerField(db_index=True, help_text="Combination product code.")
     DESC = models.CharField(max_length=16, help_text="Name of combination product.")
     GROUP_ID = models.PositiveSmallIntegerField(help_text="Section number for report printing.")
     GROUP_SUB_ID = models.IntegerField(help_text="Order in section for report printing.")
@@ -254,7 +268,7 @@ class AppComb(models.Model):
 # Stores products for reporting.
 # CSV file: APP_PROD.CSV
 class AppProd(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     PRODNAME = models.CharField(max_length=16, help_text="Product name.")
     GROUP_ID = models.PositiveSmallIntegerField(help_text="Section number for report printing.")
     GROUP_SUB_ID = models.IntegerField(help_text="Order in section for report printing.")
@@ -342,10 +356,10 @@ class ShopsTb(models.Model):
 # CSV file: EPOS_PROD<n>.CSV
 # <n> is the shop number (1-15)
 class EposProd(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     PRODNAME = models.CharField(max_length=16, help_text="Product name.")
     ITEM_DESC = models.CharField(max_length=20, help_text="Description of item.")
-    EPOS_GROUP = models.IntegerField(help_text="ePOS group number.")
+    EPOS_GROUP = models.IntegerField(db_index=True, help_text="ePOS group number.")
     EPOS_SEQUENCE = models.IntegerField(help_text="ePOS sequence number.")
     COLOUR_RED = models.IntegerField(help_text="Red component of colour (0-255).")
     COLOUR_GREEN = models.IntegerField(help_text="Green component of colour (0-255).")
@@ -359,7 +373,7 @@ class EposProd(models.Model):
 # CSV file: EPOS_GROUP<n>.CSV
 # <n> is the shop number (1-15)
 class EposGroup(models.Model):
-    EPOS_GROUP_ID = models.IntegerField(help_text="ePOS group number.")
+    EPOS_GROUP_ID = models.IntegerField(db_index=True, help_text="ePOS group number.")
     EPOS_GROUP_TITLE = models.CharField(max_length=20, help_text="ePOS group title.")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
     def __str__(self):
@@ -369,7 +383,7 @@ class EposGroup(models.Model):
 # Stores ePOS free product details for each shop.(PRODNUMB,PRODNAME,FREE_CHOICE_1,FREE_CHOICE_2)
 # CSV file: EPOS_FREE_PROD.CSV
 class EposFreeProd(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     PRODNAME = models.CharField(max_length=16, help_text="Product name.")
     # FREE_CHOICE_1/2 is a list of free choice PRODNUMB separated by commas
     FREE_CHOICE_1 = models.CharField(max_length=40, help_text="First free choice item.")
@@ -382,7 +396,7 @@ class EposFreeProd(models.Model):
 # Stores ePOS free product details for combination products for each shop.(COMBONUMB,ITEM_DESC,FREE_CHOICE_1,FREE_CHOICE_2)
 # CSV file: EPOS_COMB_FREE_PROD.CSV
 class EposCombFreeProd(models.Model):
-    COMBONUMB = models.IntegerField(help_text="Combination product code.")
+    COMBONUMB = models.IntegerField(db_index=True, help_text="Combination product code.")
     ITEM_DESC = models.CharField(max_length=20, help_text="Description of combination product.")
     # FREE_CHOICE_1/2 is a list of free choice PRODNUMB separated by commas
     FREE_CHOICE_1 = models.CharField(max_length=40, help_text="First free choice item.")
@@ -396,10 +410,10 @@ class EposCombFreeProd(models.Model):
 # CSV file: EPOS_COMB<n>.CSV
 # <n> is the shop number (1-15)
 class EposComb(models.Model):
-    COMBONUMB = models.IntegerField(help_text="Combination product code.")
+    COMBONUMB = models.IntegerField(db_index=True, help_text="Combination product code.")
     DESC = models.CharField(max_length=16, help_text="Name of combination product.")
     ITEM_DESC = models.CharField(max_length=20, help_text="Description of combination product.")
-    EPOS_GROUP = models.IntegerField(help_text="ePOS group number.")
+    EPOS_GROUP = models.IntegerField(db_index=True, help_text="ePOS group number.")
     EPOS_SEQUENCE = models.IntegerField(help_text="ePOS sequence number.")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
     def __str__(self):
@@ -409,7 +423,7 @@ class EposComb(models.Model):
 # Stores ePOS product topping details (ACODE,DESC,MENU_DESC)
 # CSV file: TOPPING_DEL.CSV
 class ToppingDel(models.Model):
-    ACODE = models.IntegerField(help_text="Topping code.")
+    ACODE = models.IntegerField(db_index=True, help_text="Topping code.")
     DESC = models.CharField(max_length=20, help_text="Description of topping.")
     MENU_DESC = models.CharField(max_length=20, help_text="Menu description of topping.")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
@@ -419,7 +433,7 @@ class ToppingDel(models.Model):
 # Table 27: EPOS_ADD_ONS
 # Stores ePOS product add-on details (PRODNUMB, PRODNAME, list of add-on PRODNUMB)
 class EposAddOns(models.Model):
-    PRODNUMB = models.IntegerField(help_text="Product code.")
+    PRODNUMB = models.IntegerField(db_index=True, help_text="Product code.")
     PRODNAME = models.CharField(max_length=16, help_text="Product name.")
     ADD_ONS = models.CharField(max_length=100, help_text="Comma-separated list of add-on product codes.")
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
@@ -464,4 +478,50 @@ class EStock(models.Model):
     last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
     def __str__(self):
         return f"ePOS Stock Item {self.CODEALPH}{self.ST_CODENUM} - Description: {self.ITEM}, Last Updated: {self.last_updated}"
-    
+
+# Table 30: CATALOG_VERSION
+# Single row stamped by the catalog import (insert_sql) so every worker can tell
+# when its in-memory catalog snapshot (update_till.catalog) is out of date.
+class CatalogVersion(models.Model):
+    version = models.PositiveIntegerField(default=0, help_text="Incremented each time a catalog import commits.")
+    last_updated = models.DateTimeField(auto_now=True, help_text="Last updated timestamp.")
+    def __str__(self):
+        return f"Catalog Version {self.version}, Last Updated: {self.last_updated}"
+
+
+# Catalog import job: one row per CSV import requested from the Update Till page.
+# Run in the background by update_till.imports (in-process thread or
+# `manage.py run_import_jobs`) so the request that asked for it returns at once.
+class ImportJob(models.Model):
+    STATUS_STAGING = 'staging'
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+
+    status = models.CharField(max_length=10, default=STATUS_QUEUED, choices=[
+        (STATUS_STAGING, 'Staging'), (STATUS_QUEUED, 'Queued'), (STATUS_RUNNING, 'Running'),
+        (STATUS_SUCCEEDED, 'Succeeded'), (STATUS_FAILED, 'Failed'),
+    ])
+    mode = models.CharField(max_length=10, default='replace', help_text="insert_sql import mode: 'replace' or 'diff'.")
+    requested_by = models.CharField(max_length=150, blank=True, default='')
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    progress = models.JSONField(default=list, blank=True, help_text="Per-step progress events, kept once the job ends.")
+    report = models.JSONField(default=dict, blank=True, help_text="Changes per table (insert_sql.TableChanges).")
+    validation_errors = models.JSONField(default=list, blank=True)
+    output = models.TextField(blank=True, default='', help_text="Messages printed by the import.")
+    error = models.TextField(blank=True, default='')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'created_at'], name='importjob_status_created_idx'),
+        ]
+
+    @property
+    def finished(self):
+        return self.status in (self.STATUS_SUCCEEDED, self.STATUS_FAILED)
+
+    def __str__(self):
+        return f"Import #{self.pk} ({self.mode}, {self.status})"
@@ -0,0 +1,148 @@
+"""Precomputed gross / net price matrix for the catalog snapshot.
+
+Every PdItem / CombTb row gets one slot holding 36 integers (pence):
+
+    band 1..6  x  {standard, discounted}  x  {gross, net-take, net-eat}
+
+stored flat in an `array('q')`, so reading a price is an index calculation
+instead of getattr() on a model field plus float division per request.
+Combos have no discounted price; their discounted columns hold 0.
+
+Net prices follow one rounding rule everywhere (net_pence): the exact
+rational gross * 100 / (100 + rate), rounded half to even to whole pence.
+"""
+from __future__ import annotations
+
+from array import array
+from fractions import Fraction
+from typing import Iterable, Mapping, Optional, Tuple
+
+BANDS: Tuple[str, ...] = ('1', '2', '3', '4', '5', '6')
+BASES: Tuple[str, ...] = ('gross', 'take', 'eat')
+
+_PER_KIND = len(BASES)           # gross, net-take, net-eat
+_PER_BAND = 2 * _PER_KIND        # standard, discounted
+WIDTH = len(BANDS) * _PER_BAND   # columns per slot
+
+
+def _rate_fraction(rate) -> Fraction:
+    # str() first so 17.5 becomes exactly 35/2 rather than its binary approximation
+    try:
+        return Fraction(str(rate or 0))
+    except (TypeError, ValueError):
+        return Fraction(0)
+
+
+def net_pence(gross: int, rate) -> int:
+    """Price excluding VAT for a VAT-inclusive price, in whole pence.
+
+    Computed on the exact fraction and rounded half to even, i.e. what round()
+    gives for gross * 100 / (100 + rate) without float error; this is the rule
+    the nightly stats export has always used.
+    """
+    gross = int(gross or 0)
+    if not gross:
+        return 0
+    r = _rate_fraction(rate)
+    num = gross * 100 * r.denominator
+    den = 100 * r.denominator + r.numerator
+    if den <= 0:
+        return gross
+    sign = -1 if num < 0 else 1
+    q, rem = divmod(abs(num), den)
+    if 2 * rem > den or (2 * rem == den and q % 2):
+        q += 1
+    return sign * q
+
+
+def _band_offset(band) -> Optional[int]:
+    """Offset of a band's columns within a slot; None for anything but '1'..'6'."""
+    band = str(band)
+    return BANDS.index(band) * _PER_BAND if band in BANDS else None
+
+
+class PriceMatrix:
+    """Read-only price table for one kind of item (products or combos)."""
+
+    __slots__ = ('_slots', '_values', '_rates')
+
+    def __init__(self, slots: Mapping[int, int], values: array, rates: array):
+        self._slots = slots      # item code -> slot number
+        self._values = values    # WIDTH ints per slot
+        self._rates = rates      # (take rate, eat rate) per slot
+
+    def __contains__(self, code) -> bool:
+        return code in self._slots
+
+    def __len__(self) -> int:
+        return len(self._slots)
+
+    def price(self, code: int, band, discounted: bool = False, basis: str = 'gross') -> int:
+        """Price in pence for code / band; 0 for unknown codes or bands."""
+        slot = self._slots.get(code)
+        offset = _band_offset(band)
+        if slot is None or offset is None:
+            return 0
+        return self._values[slot * WIDTH + offset + (_PER_KIND if discounted else 0) + BASES.index(basis)]
+
+    def row(self, code: int, band) -> Optional[Tuple[int, int, int, int, int, int]]:
+        """(gross, net-take, net-eat, dc gross, dc net-take, dc net-eat) for one band, or None."""
+        slot = self._slots.get(code)
+        offset = _band_offset(band)
+        if slot is None or offset is None:
+            return None
+        start = slot * WIDTH + offset
+        return tuple(self._values[start:start + _PER_BAND])
+
+    def meal_component(self, code: int, band, basis: str = 'gross') -> int:
+        """Price of code as a meal component: discounted where one is set (> 0), else standard."""
+        slot = self._slots.get(code)
+        offset = _band_offset(band)
+        if slot is None or offset is None:
+            return 0
+        start = slot * WIDTH + offset
+        discounted = self._values[start + _PER_KIND] > 0
+        return self._values[start + (_PER_KIND if discounted else 0) + BASES.index(basis)]
+
+    def vat_rate(self, code: int, basis: str) -> float:
+        """VAT rate (percent) applied to code for 'take' or 'eat'; 0.0 for unknown codes."""
+        slot = self._slots.get(code)
+        if slot is None:
+            return 0.0
+        return self._rates[slot * 2 + (1 if basis == 'eat' else 0)]
+
+    def net(self, code: int, gross: int, basis: str) -> int:
+        """Net of an arbitrary gross amount at code's VAT rate for the basis."""
+        return net_pence(gross, self.vat_rate(code, basis))
+
+
+def build_price_matrix(rows: Iterable, code_attr: str, vat_rates: Mapping[int, float],
+                       discounted_prefix: Optional[str] = 'DC_VATPR') -> PriceMatrix:
+    """Build a PriceMatrix from PdItem (code_attr='PRODNUMB') or CombTb (discounted_prefix=None) rows.
+
+    Rows are taken in order and a later row replaces an earlier one with the same code,
+    matching the snapshot's products / combos maps.
+    """
+    by_code: dict = {}
+    for r in rows:
+        by_code[getattr(r, code_attr)] = r
+    slots: dict = {}
+    values = array('q', bytes(8 * WIDTH * len(by_code)))
+    rates = array('d', bytes(8 * 2 * len(by_code)))
+    for slot, (code, r) in enumerate(by_code.items()):
+        slots[code] = slot
+        take_rate = float(vat_rates.get(getattr(r, 'TAKE_VAT_CLASS', None), 0.0) or 0.0)
+        eat_rate = float(vat_rates.get(getattr(r, 'EAT_VAT_CLASS', None), 0.0) or 0.0)
+        rates[slot * 2] = take_rate
+        rates[slot * 2 + 1] = eat_rate
+        base = slot * WIDTH
+        for b, band in enumerate(BANDS):
+            suffix = '' if band == '1' else f'_{band}'
+            kinds = [int(getattr(r, f'VATPR{suffix}', 0) or 0)]
+            kinds.append(int(getattr(r, f'{discounted_prefix}{suffix}', 0) or 0) if discounted_prefix else 0)
+            for k, gross in enumerate(kinds):
+                at = base + b * _PER_BAND + k * _PER_KIND
+                values[at] = gross
+                values[at + 1] = net_pence(gross, take_rate)
+                values[at + 2] = net_pence(gross, eat_rate)
+    return PriceMatrix(slots, values, rates)
@@ -1,3 +1,427 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
 
-# Create your tests here.
+
+class CatalogImportLoaderTests(TestCase):
+    """insert_sql.load_csv streams a CSV through executemany batches with one mapping and timestamp."""
+    def _load(self, name, text, batch_size=2):
+        import sqlite3
+        import tempfile
+        from contextlib import redirect_stdout
+        from io import StringIO
+        from pathlib import Path
+        from User_details.Scripts import insert_sql
+        conn = sqlite3.connect(':memory:')
+        conn.execute('CREATE TABLE t (id INTEGER PRIMARY KEY, PRODNUMB INTEGER, NAME TEXT, DESC TEXT, NOTE TEXT, last_updated TEXT)')
+        statements = []
+        conn.set_trace_callback(statements.append)
+        with tempfile.TemporaryDirectory() as tmp, redirect_stdout(StringIO()) as out:
+            path = Path(tmp) / name
+            path.write_text(text, encoding='utf-8')
+            insert_sql.load_csv(conn.cursor(), path, 't', ['id', 'PRODNUMB', 'NAME', 'DESC', 'NOTE', 'last_updated'],
+                                '2025-01-01 00:00:00', batch_size=batch_size)
+        return conn.execute('SELECT * FROM t ORDER BY id').fetchall(), statements, out.getvalue()
+
+    def test_rows_are_mapped_once_and_batched(self):
+        rows, statements, out = self._load('X.CSV', 'prodnumb,Name,desc\r\n1,A,a\r\n2,B,b\r\n3,C,c\r\n')
+        stamp = '2025-01-01 00:00:00'
+        self.assertEqual(rows, [(1, 1, 'A', 'a', None, stamp), (2, 2, 'B', 'b', None, stamp), (3, 3, 'C', 'c', None, stamp)])
+        self.assertFalse([s for s in statements if 'PRAGMA' in s])
+        self.assertIn('rows=3 mismatches=0', out)
+
+    def test_combined_trailing_field_and_mismatches(self):
+        # COMB_EXT's fourth column is free text that may contain unquoted commas
+        rows, _, out = self._load('COMB_EXT.CSV', 'PRODNUMB,NAME,DESC,NOTE\r\n1,A,a,x,y,z\r\n', batch_size=10)
+        self.assertEqual(rows[0][4], 'x,y,z')
+        _, _, out = self._load('X.CSV', 'PRODNUMB,NAME,DESC\r\n1,A,a\r\n2,B\r\n', batch_size=10)
+        self.assertIn('[ERR] X.CSV: row len 4 != header len 5', out)
+        self.assertIn('[FAIL] X.CSV', out)
+
+    def test_encoding_is_detected_from_the_bytes(self):
+        import tempfile
+        from pathlib import Path
+        from User_details.Scripts import insert_sql
+        cases = {
+            'bom.csv': ('\ufeffPRODNUMB,NAME\r\n1,Café\r\n'.encode('utf-8'), 'utf-8-sig'),
+            'utf8.csv': ('PRODNUMB,NAME\r\n1,Café\r\n'.encode('utf-8'), 'utf-8'),
+            # Only the last row is not UTF-8
+            'latin1.csv': (('PRODNUMB,NAME\r\n' + '2,Plain\r\n' * 100 + '1,Café\r\n').encode('latin-1'), 'latin-1'),
+        }
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, (data, encoding) in cases.items():
+                path = Path(tmp) / name
+                path.write_bytes(data)
+                source = insert_sql.read_csv_source(path)
+                self.assertEqual(source.encoding, encoding)
+                self.assertEqual(source.headers, ('PRODNUMB', 'NAME'))
+                self.assertEqual(list(source.rows())[-1], ['1', 'Café'])
+            (Path(tmp) / 'empty.csv').write_bytes(b'')
+            self.assertIsNone(insert_sql.read_csv_source(Path(tmp) / 'empty.csv').headers)
+            # Worker processes hand back parsed rows; the result is the same
+            paths = [Path(tmp) / name for name in cases]
+            serial = insert_sql.read_csv_sources(paths)
+            pooled = insert_sql.read_csv_sources(paths, workers=2)
+            self.assertEqual([(s.encoding, s.sha256, s.headers, list(s.rows())) for s in serial],
+                             [(s.encoding, s.sha256, s.headers, list(s.rows())) for s in pooled])
+
+
+class CatalogDiffImportTests(TestCase):
+    """insert_sql diff mode writes only inserted / updated / deleted rows and keeps ids = CSV positions."""
+    HEADER = 'PRODNUMB,PRODNAME,VATPR\r\n'
+
+    def setUp(self):
+        import sqlite3
+        import tempfile
+        from pathlib import Path
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.dir = Path(self._tmp.name)
+        self.db = self.dir / 'till.sqlite3'
+        conn = sqlite3.connect(self.db)
+        conn.execute('CREATE TABLE update_till_PDITEM (id INTEGER PRIMARY KEY, PRODNUMB INTEGER, PRODNAME TEXT, '
+                     'VATPR INTEGER, last_updated TEXT)')
+        conn.execute('CREATE TABLE update_till_catalogversion (id INTEGER PRIMARY KEY, version INTEGER, last_updated TEXT)')
+        conn.commit()
+        conn.close()
+
+    def _import(self, rows, mode):
+        import sqlite3
+        from contextlib import redirect_stdout
+        from io import StringIO
+        from User_details.Scripts import insert_sql
+        (self.dir / 'PDITEM1.CSV').write_text(self.HEADER + ''.join(f'{r}\r\n' for r in rows), encoding='utf-8')
+        with redirect_stdout(StringIO()) as out:
+            report = insert_sql._run_import(db_path=self.db, csv_dir=self.dir, mapping={'PDITEM1.CSV': 'update_till_PDITEM'},
+                                            debug_dump=False, mode=mode)
+        conn = sqlite3.connect(self.db)
+        table = conn.execute('SELECT id, PRODNUMB, PRODNAME, VATPR, last_updated FROM update_till_PDITEM ORDER BY id').fetchall()
+        version = conn.execute('SELECT version FROM update_till_catalogversion').fetchone()
+        conn.close()
+        return report, table, version[0] if version else None, out.getvalue()
+
+    def _age(self):
+        import sqlite3
+        conn = sqlite3.connect(self.db)
+        conn.execute("UPDATE update_till_PDITEM SET last_updated = '2000-01-01 00:00:00'")
+        conn.commit()
+        conn.close()
+
+    def test_unchanged_feed_writes_nothing(self):
+        rows = ['1,Burger,300', '2,Fries,150', '3,Cola,120']
+        self._import(rows, 'replace')
+        self._age()
+        report, table, version, out = self._import(rows, 'diff')
+        changes = report['update_till_PDITEM']
+        self.assertFalse(changes.changed)
+        self.assertEqual(changes.unchanged, 3)
+        self.assertEqual({r[4] for r in table}, {'2000-01-01 00:00:00'})
+        self.assertEqual(version, 1)
+        self.assertIn('catalog version unchanged', out)
+        self.assertIn('[SAME] PDITEM1.CSV', out)
+
+    def test_file_digests_are_dropped_when_the_catalog_changes(self):
+        import sqlite3
+        rows = ['1,Burger,300', '2,Fries,150']
+        self._import(rows, 'replace')
+        # e.g. an admin edit: the recorded digests no longer describe the table
+        conn = sqlite3.connect(self.db)
+        conn.execute("UPDATE update_till_PDITEM SET VATPR = 999 WHERE PRODNUMB = 2")
+        conn.execute("UPDATE update_till_catalogversion SET version = version + 1")
+        conn.commit()
+        conn.close()
+        report, table, version, out = self._import(rows, 'diff')
+        self.assertNotIn('[SAME]', out)
+        self.assertEqual(report['update_till_PDITEM'].updated, 1)
+        self.assertEqual(table[1][3], 150)
+        self.assertEqual(version, 3)
+
+    def test_changes_are_applied_and_reported(self):
+        self._import(['1,Burger,300', '2,Fries,150', '3,Cola,120'], 'replace')
+        self._age()
+        # Cola moves up, Fries is repriced, Burger is dropped, Shake is new
+        report, table, version, out = self._import(['3,Cola,120', '2,Fries,175', '4,Shake,250'], 'diff')
+        changes = report['update_till_PDITEM']
+        self.assertEqual((changes.inserted, changes.updated, changes.deleted, changes.unchanged), (1, 1, 1, 1))
+        self.assertFalse(changes.reloaded)
+        self.assertEqual([r[:4] for r in table], [(1, 3, 'Cola', 120), (2, 2, 'Fries', 175), (3, 4, 'Shake', 250)])
+        self.assertEqual(table[0][4], '2000-01-01 00:00:00')
+        self.assertNotEqual(table[1][4], '2000-01-01 00:00:00')
+        self.assertEqual(version, 2)
+        self.assertIn('[DIFF] update_till_PDITEM: diff +1 ~1 -1', out)
+
+    def test_each_csv_is_read_once(self):
+        from unittest import mock
+        from User_details.Scripts import insert_sql
+        with mock.patch.object(insert_sql, 'read_csv_source', wraps=insert_sql.read_csv_source) as read:
+            report, table, _, _ = self._import(['1,Burger,300', '2,Fries,150'], 'replace')
+        self.assertEqual(read.call_count, 1)
+        self.assertEqual(report['update_till_PDITEM'].inserted, 2)
+        self.assertEqual(len(table), 2)
+
+    def test_duplicate_keys_fall_back_to_reload(self):
+        self._import(['1,Burger,300'], 'replace')
+        report, table, _, _ = self._import(['1,Burger,300', '1,Burger,310'], 'diff')
+        self.assertTrue(report['update_till_PDITEM'].reloaded)
+        self.assertEqual([r[:4] for r in table], [(1, 1, 'Burger', 300), (2, 1, 'Burger', 310)])
+
+
+class CatalogShadowImportTests(TestCase):
+    """insert_sql loads into shadow tables, checks them, and holds the write lock only for the swap."""
+    MAPPING = {'PDITEM1.CSV': 'update_till_PDITEM', 'COMBTB1.CSV': 'update_till_COMBTB', 'COMP_PRO.CSV': 'update_till_COMPPRO'}
+
+    def setUp(self):
+        import sqlite3
+        import tempfile
+        from pathlib import Path
+        self._tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self._tmp.cleanup)
+        self.dir = Path(self._tmp.name)
+        self.db = self.dir / 'till.sqlite3'
+        conn = sqlite3.connect(self.db)
+        conn.execute('CREATE TABLE update_till_PDITEM (id INTEGER PRIMARY KEY, PRODNUMB INTEGER, PRODNAME TEXT, last_updated TEXT)')
+        conn.execute('CREATE TABLE update_till_COMBTB (id INTEGER PRIMARY KEY, COMBONUMB INTEGER, DESC TEXT, last_updated TEXT)')
+        conn.execute('CREATE TABLE update_till_COMPPRO (id INTEGER PRIMARY KEY, COMBONUMB INTEGER, PRODNUMB INTEGER, last_updated TEXT)')
+        conn.execute('CREATE TABLE update_till_catalogversion (id INTEGER PRIMARY KEY, version INTEGER, last_updated TEXT)')
+        conn.execute('CREATE TABLE orders (id INTEGER PRIMARY KEY, note TEXT)')
+        conn.commit()
+        conn.close()
+        self._import({'PDITEM1.CSV': ['1,Burger', '2,Fries'], 'COMBTB1.CSV': ['10,Meal'], 'COMP_PRO.CSV': ['10,1', '10,2']})
+
+    def _import(self, files, mode='replace', progress=None):
+        import io
+        from User_details.Scripts import insert_sql
+        headers = {'PDITEM1.CSV': 'PRODNUMB,PRODNAME', 'COMBTB1.CSV': 'COMBONUMB,DESC', 'COMP_PRO.CSV': 'COMBONUMB,PRODNUMB'}
+        for name, rows in files.items():
+            (self.dir / name).write_text(headers[name] + '\r\n' + ''.join(f'{r}\r\n' for r in rows), encoding='utf-8')
+        out = io.StringIO()
+        report = insert_sql._run_import(db_path=self.db, csv_dir=self.dir, mapping=self.MAPPING, debug_dump=False,
+                                        mode=mode, out=out, progress=progress)
+        return report, out.getvalue()
+
+    def _rows(self, sql):
+        import sqlite3
+        conn = sqlite3.connect(self.db)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def test_tills_read_and_write_while_staging_and_wait_only_for_the_swap(self):
+        import sqlite3
+        seen = {}
+
+        def till(event):
+            conn = sqlite3.connect(self.db, timeout=0, isolation_level=None)
+            try:
+                if event['phase'] == 'staged' and event['table'] == 'update_till_COMPPRO':
+                    seen['menu'] = conn.execute('SELECT PRODNAME FROM update_till_PDITEM ORDER BY id').fetchall()
+                    conn.execute("INSERT INTO orders (note) VALUES ('during staging')")
+                elif event['phase'] == 'table' and 'swap' not in seen:
+                    try:
+                        conn.execute("BEGIN IMMEDIATE")
+                        seen['swap'] = 'not locked'
+                    except sqlite3.OperationalError as e:
+                        seen['swap'] = str(e)
+            finally:
+                conn.close()
+
+        report, out = self._import({'PDITEM1.CSV': ['1,Burger', '2,Fries', '3,Shake']}, progress=till)
+        self.assertIsNotNone(report, out)
+        self.assertEqual(seen['menu'], [('Burger',), ('Fries',)])
+        self.assertEqual(seen['swap'], 'database is locked')
+        self.assertEqual(self._rows('SELECT note FROM orders'), [('during staging',)])
+        self.assertEqual(len(self._rows('SELECT * FROM update_till_PDITEM')), 3)
+        self.assertEqual((report['update_till_PDITEM'].deleted, report['update_till_PDITEM'].inserted), (2, 3))
+        self.assertEqual(sorted(p.name for p in self.dir.iterdir() if 'import-shadow' in p.name), [])
+
+    def test_broken_links_leave_the_live_catalog_alone(self):
+        for mode in ('replace', 'diff'):
+            # Product 2 leaves the menu but combo 10 still lists it
+            report, out = self._import({'PDITEM1.CSV': ['1,Burger'], 'COMP_PRO.CSV': ['10,1', '10,2', '11,1']}, mode)
+            self.assertIsNone(report)
+            self.assertIn('[VALIDATION] update_till_COMPPRO.COMBONUMB not found in update_till_COMBTB.COMBONUMB: 11', out)
+            self.assertEqual(self._rows('SELECT PRODNUMB FROM update_till_PDITEM ORDER BY id'), [(1,), (2,)])
+            self.assertEqual(self._rows('SELECT COUNT(*) FROM update_till_COMPPRO'), [(2,)])
+            self.assertEqual(self._rows('SELECT version FROM update_till_catalogversion'), [(1,)])
+
+    def test_an_empty_required_table_is_refused(self):
+        report, out = self._import({'PDITEM1.CSV': [], 'COMP_PRO.CSV': []})
+        self.assertIsNone(report)
+        self.assertIn('[VALIDATION] update_till_PDITEM: the import would leave it empty', out)
+        self.assertEqual(len(self._rows('SELECT * FROM update_till_PDITEM')), 2)
+
+    def test_diff_swaps_only_changed_rows(self):
+        report, out = self._import({'PDITEM1.CSV': ['1,Burger', '2,Large Fries'], 'COMP_PRO.CSV': ['10,1', '10,2']},
+                                   'diff')
+        self.assertEqual(report['update_till_PDITEM'].updated, 1)
+        self.assertFalse(report['update_till_COMBTB'].changed)
+        self.assertIn('[SAME] COMBTB1.CSV', out)
+        self.assertEqual(self._rows('SELECT PRODNAME FROM update_till_PDITEM ORDER BY id'), [('Burger',), ('Large Fries',)])
+
+
+class ImportJobTests(TestCase):
+    """Catalog imports run as ImportJob rows (update_till.imports) instead of inside the request."""
+
+    def setUp(self):
+        import sqlite3
+        import tempfile
+        from pathlib import Path
+        from unittest import mock
+        from django.contrib.auth.models import User
+        from User_details.Scripts import insert_sql
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = Path(tmp.name)
+        self.db = self.dir / 'till.sqlite3'
+        conn = sqlite3.connect(self.db)
+        conn.execute('CREATE TABLE update_till_PDITEM (id INTEGER PRIMARY KEY, PRODNUMB INTEGER, PRODNAME TEXT, '
+                     'VATPR INTEGER, last_updated TEXT)')
+        conn.commit()
+        conn.close()
+        (self.dir / 'csv').mkdir()
+        (self.dir / 'staged').mkdir()
+        from update_till import views
+        # insert_sql (and the view's imported copies) read these globals when they run;
+        # point them at scratch files so nothing touches the real database or CSVs
+        mapping = {'PDITEM1.CSV': 'update_till_PDITEM'}
+        self.staged = self.dir / 'staged'
+        for module, name, value in ((insert_sql, 'sql_db_path', self.db), (insert_sql, 'downloaded_files_dir', self.staged),
+                                    (insert_sql, 'csv_to_table', mapping), (insert_sql, 'script_dir', self.dir),
+                                    (views, 'downloaded_files_dir', self.staged), (views, 'csv_to_table', mapping)):
+            patcher = mock.patch.object(module, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        settings_override = override_settings(EPOS_IMPORT_PROGRESS_DIR=str(self.dir / 'progress'))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client.force_login(User.objects.create_user('office', password='x', is_staff=True))
+
+    def _stage(self, rows, directory=None):
+        directory = directory or self.staged
+        directory.mkdir(exist_ok=True)
+        (directory / 'PDITEM1.CSV').write_text('PRODNUMB,PRODNAME,VATPR\r\n' + ''.join(f'{r}\r\n' for r in rows),
+                                                      encoding='utf-8')
+
+    def test_job_runs_and_records_progress_and_report(self):
+        from update_till import imports
+        from update_till.models import ImportJob
+        self._stage(['1,Burger,300', '2,Fries,150'])
+        job = imports.submit(imports.reserve('replace', requested_by='office'))
+        self.assertEqual(job.status, ImportJob.STATUS_QUEUED)
+        self.assertEqual(imports.drain(), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_SUCCEEDED)
+        self.assertEqual(job.report['update_till_PDITEM']['inserted'], 2)
+        self.assertEqual([e['phase'] for e in job.progress], ['validated', 'staged', 'checked', 'table', 'committed'])
+        self.assertEqual((job.progress[1]['rows'], job.progress[3]['table']), (2, 'update_till_PDITEM'))
+        self.assertIn('[OK] PDITEM1.CSV', job.output)
+        self.assertFalse(list((self.dir / 'progress').iterdir()))
+
+        data = self.client.get(reverse('update_till_import_job', args=[job.pk])).json()
+        self.assertEqual((data['status'], data['finished'], data['tables_staged'], data['tables_done'], data['tables_total']),
+                         ('succeeded', True, 1, 1, 1))
+
+    def test_validation_failure_fails_the_job(self):
+        from update_till import imports
+        from update_till.models import ImportJob
+        job = imports.submit(imports.reserve('diff'))
+        imports.drain()
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.STATUS_FAILED)
+        self.assertEqual(job.validation_errors, ['Missing file: PDITEM1.CSV'])
+        self.assertEqual(job.report, {})
+
+    def test_post_queues_a_job_and_returns_at_once(self):
+        from update_till.models import ImportJob
+        self._stage(['1,Burger,300'], self.dir / 'csv')
+        with override_settings(EPOS_IMPORT_INLINE_DISPATCH=False):
+            r = self.client.post(reverse('update_till_import'), {'csv_dir': str(self.dir / 'csv'), 'diff': '1'})
+        job = ImportJob.objects.get()
+        self.assertRedirects(r, f"{reverse('update_till_import')}?job={job.pk}")
+        self.assertTrue((self.staged / 'PDITEM1.CSV').exists())
+        self.assertEqual((job.status, job.mode, job.requested_by), (ImportJob.STATUS_QUEUED, 'diff', 'office'))
+        # A second import waits for the first
+        r = self.client.post(reverse('update_till_import'), {'csv_dir': str(self.dir / 'csv')})
+        self.assertContains(r, f'Import #{job.pk} is still queued')
+        self.assertEqual(ImportJob.objects.count(), 1)
+        # Rejected input gives the slot back
+        job.delete()
+        r = self.client.post(reverse('update_till_import'), {'csv_dir': str(self.dir / 'missing')})
+        self.assertContains(r, 'Invalid directory')
+        self.assertFalse(ImportJob.objects.exists())
+
+    def test_reservation_holds_the_slot_while_staging(self):
+        from update_till import imports
+        from update_till.models import ImportJob
+        job = imports.reserve('replace', requested_by='office')
+        self.assertEqual(job.status, ImportJob.STATUS_STAGING)
+        with self.assertRaises(imports.ImportBusy) as busy:
+            imports.reserve('diff')
+        self.assertEqual(busy.exception.job.pk, job.pk)
+        r = self.client.post(reverse('update_till_import'), {'csv_dir': str(self.dir / 'csv')})
+        self.assertContains(r, f'Import #{job.pk} is still staging')
+        # A runner does not pick up a job whose CSVs are still being staged
+        self.assertIsNone(imports.claim())
+        self._stage(['1,Burger,300'])
+        with override_settings(EPOS_IMPORT_INLINE_DISPATCH=False):
+            imports.submit(job)
+        imports.cancel(job)
+        self.assertEqual(imports.claim().pk, job.pk)
+        self.assertEqual(ImportJob.objects.count(), 1)
+
+    def test_claim_checks_for_a_running_job_in_the_same_update(self):
+        from unittest import mock
+        from update_till import imports
+        from update_till.models import ImportJob
+        first, second = ImportJob.objects.create(), ImportJob.objects.create()
+        real_now = timezone.now
+
+        def other_runner_starts():
+            # Another runner claims `second` after this one picked `first` but before it writes
+            ImportJob.objects.filter(pk=second.pk).update(status=ImportJob.STATUS_RUNNING, started_at=real_now())
+            return real_now()
+        with mock.patch.object(imports, '_fail_stale'), \
+                mock.patch.object(imports, 'timezone', mock.Mock(now=other_runner_starts)):
+            self.assertIsNone(imports.claim())
+        first.refresh_from_db()
+        self.assertEqual(first.status, ImportJob.STATUS_QUEUED)
+
+    def test_running_job_reports_live_progress_and_blocks_claims(self):
+        import json as _json
+        from datetime import timedelta
+        from update_till import imports
+        from update_till.models import ImportJob
+        running = ImportJob.objects.create(status=ImportJob.STATUS_RUNNING, started_at=timezone.now())
+        queued = ImportJob.objects.create()
+        (imports.progress_dir() / f'import_{running.pk}.jsonl').write_text(
+            _json.dumps({'phase': 'table', 'index': 1, 'total': 25, 'table': 'update_till_PDITEM'}) + '\n{"phase": "ta',
+            encoding='utf-8')
+        data = self.client.get(reverse('update_till_import_job', args=[running.pk])).json()
+        self.assertEqual((data['status'], data['tables_done'], data['tables_total']), ('running', 1, 25))
+        self.assertIsNone(imports.claim())
+        # A runner that died long ago no longer holds the queue
+        ImportJob.objects.filter(pk=running.pk).update(started_at=timezone.now() - timedelta(hours=2))
+        self.assertEqual(imports.claim().pk, queued.pk)
+        running.refresh_from_db()
+        self.assertEqual(running.status, ImportJob.STATUS_FAILED)
+        self.assertEqual(len(running.progress), 1)
+
+    def test_concurrent_imports_keep_their_own_output(self):
+        import io
+        import shutil
+        import threading
+        from User_details.Scripts import insert_sql
+        self._stage(['1,Burger,300'])
+        other = self.dir / 'other.sqlite3'
+        shutil.copy(self.db, other)
+        outs = {self.db: io.StringIO(), other: io.StringIO()}
+        threads = [threading.Thread(target=insert_sql._run_import,
+                                    kwargs={'db_path': db, 'out': out, 'debug_dump': False}) for db, out in outs.items()]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        for db, out in outs.items():
+            self.assertIn(f'Using DB: {db}\n', out.getvalue())
+            self.assertEqual(out.getvalue().count('Using DB:'), 1)
@@ -4,4 +4,5 @@ from . import views
 urlpatterns = [
     path('', views.update_till_import, name='update_till_home'),
     path('import/', views.update_till_import, name='update_till_import'),
+    path('import/jobs/<int:job_id>/', views.update_till_import_job, name='update_till_import_job'),
 ]
\ No newline at end of file
@@ -1,17 +1,18 @@
 from pathlib import Path
 import shutil
-import io
-import sys
 import zipfile
 from typing import List, Tuple
 
-from django.http import HttpRequest, HttpResponse
-from django.shortcuts import render
+from django.http import HttpRequest, HttpResponse, JsonResponse
+from django.shortcuts import get_object_or_404, redirect, render
+from django.urls import reverse
 from django.views.decorators.http import require_http_methods
 from django.contrib.admin.views.decorators import staff_member_required
 
-# Import mapping and runner from the insert script (safe now due to __main__ guard)
-from User_details.Scripts.insert_sql import csv_to_table, downloaded_files_dir, main as run_insert
+# Import mapping from the insert script (safe now due to __main__ guard)
+from User_details.Scripts.insert_sql import IMPORT_MODE, csv_to_table, downloaded_files_dir
+from update_till import imports
+from update_till.models import ImportJob
 
 
 def _validate_source_dir(dir_path_str: str) -> Tuple[List[str], List[str]]:
@@ -60,11 +61,13 @@ def _extract_expected_from_zip(zf: zipfile.ZipFile, dest_dir: Path) -> Tuple[Lis
 @staff_member_required
 @require_http_methods(["GET", "POST"])
 def update_till_import(request: HttpRequest) -> HttpResponse:
-    """Simple form to accept a directory path and run the Update Till import.
+    """Simple form to accept a directory path and start the Update Till import.
 
-    - GET: show input form and current expected file list.
+    - GET: show input form and current expected file list; with ?job=<id>, that
+           job's progress (polled from update_till_import_job).
     - POST: validate all expected files exist in provided path; if any missing, show error.
-            if all present, copy them into downloaded_files_dir (overwriting), run insert, and show output.
+            if all present, copy them into downloaded_files_dir (overwriting), queue an
+            import job (update_till.imports) and redirect to its progress.
     """
     context = {
         'expected_files': list(csv_to_table.keys()),
@@ -72,76 +75,86 @@ def update_till_import(request: HttpRequest) -> HttpResponse:
         'missing': None,
         'provided_dir': '',
         'download_target': str(downloaded_files_dir),
+        'diff': IMPORT_MODE == 'diff',
+        'job': None,
     }
 
     if request.method == 'POST':
-        provided_dir = (request.POST.get('csv_dir') or '').strip()
-        context['provided_dir'] = provided_dir
-
-        # Ensure destination exists and clear old expected files to avoid stale data
-        downloaded_files_dir.mkdir(parents=True, exist_ok=True)
-        for fname in csv_to_table.keys():
-            try:
-                (downloaded_files_dir / fname).unlink(missing_ok=True)  # type: ignore[arg-type]
-            except TypeError:
-                # Python <3.8 compatibility: ignore if missing
-                p = downloaded_files_dir / fname
-                if p.exists():
-                    p.unlink()
-
-        missing = []
-        present = []
-
-        # Option A: ZIP upload
-        upload = request.FILES.get('csv_zip')
-        if upload and getattr(upload, 'size', 0) > 0:
-            try:
-                with zipfile.ZipFile(upload) as zf:
-                    missing, present = _extract_expected_from_zip(zf, downloaded_files_dir)
-            except zipfile.BadZipFile:
-                context['missing'] = ['Uploaded file is not a valid ZIP']
-                return render(request, 'update_till/import_form.html', context)
-        else:
-            # Option B: server directory
-            if not provided_dir:
-                context['missing'] = ['Provide a server directory path or upload a ZIP']
-                return render(request, 'update_till/import_form.html', context)
-            src = Path(provided_dir)
-            if not src.exists() or not src.is_dir():
-                context['missing'] = [f"Invalid directory: {provided_dir}"]
-                return render(request, 'update_till/import_form.html', context)
-            missing, present = _validate_source_dir(provided_dir)
+        # One import at a time: staging would overwrite the files a running job is reading,
+        # so take the slot before touching them
+        mode = 'diff' if request.POST.get('diff') else 'replace'
+        try:
+            job = imports.reserve(mode, requested_by=request.user.get_username())
+        except imports.ImportBusy as busy:
+            context['job'] = busy.job
+            context['missing'] = [f"{busy}; wait for it to finish"]
+            return render(request, 'update_till/import_form.html', context)
+
+        try:
+            provided_dir = (request.POST.get('csv_dir') or '').strip()
+            context['provided_dir'] = provided_dir
+
+            # Ensure destination exists and clear old expected files to avoid stale data
+            downloaded_files_dir.mkdir(parents=True, exist_ok=True)
+            for fname in csv_to_table.keys():
+                try:
+                    (downloaded_files_dir / fname).unlink(missing_ok=True)  # type: ignore[arg-type]
+                except TypeError:
+                    # Python <3.8 compatibility: ignore if missing
+                    p = downloaded_files_dir / fname
+                    if p.exists():
+                        p.unlink()
+
+            missing = []
+            present = []
+
+            # Option A: ZIP upload
+            upload = request.FILES.get('csv_zip')
+            if upload and getattr(upload, 'size', 0) > 0:
+                try:
+                    with zipfile.ZipFile(upload) as zf:
+                        missing, present = _extract_expected_from_zip(zf, downloaded_files_dir)
+                except zipfile.BadZipFile:
+                    context['missing'] = ['Uploaded file is not a valid ZIP']
+                    return render(request, 'update_till/import_form.html', context)
+            else:
+                # Option B: server directory
+                if not provided_dir:
+                    context['missing'] = ['Provide a server directory path or upload a ZIP']
+                    return render(request, 'update_till/import_form.html', context)
+                src = Path(provided_dir)
+                if not src.exists() or not src.is_dir():
+                    context['missing'] = [f"Invalid directory: {provided_dir}"]
+                    return render(request, 'update_till/import_form.html', context)
+                missing, present = _validate_source_dir(provided_dir)
+                if missing:
+                    context['missing'] = missing
+                    return render(request, 'update_till/import_form.html', context)
+                # Copy all expected files from source to destination
+                for fname in present:
+                    shutil.copy2(src / fname, downloaded_files_dir / fname)
+
             if missing:
                 context['missing'] = missing
                 return render(request, 'update_till/import_form.html', context)
-            # Copy all expected files from source to destination
-            for fname in present:
-                shutil.copy2(src / fname, downloaded_files_dir / fname)
-
-        if missing:
-            context['missing'] = missing
-            return render(request, 'update_till/import_form.html', context)
 
-        # Capture stdout/stderr while running insert (script performs validation first)
-        buf = io.StringIO()
-        old_out, old_err = sys.stdout, sys.stderr
-        sys.stdout = sys.stderr = buf
-        try:
-            run_insert()
+            # The import runs in the background; the page polls the job's progress
+            imports.submit(job)
+            return redirect(f"{reverse('update_till_import')}?job={job.pk}")
         finally:
-            sys.stdout, sys.stderr = old_out, old_err
-        output_text = buf.getvalue()
-        # Extract validation errors if any
-        validation_errors = []
-        for line in output_text.splitlines():
-            if line.startswith('[VALIDATION] '):
-                validation_errors.append(line.replace('[VALIDATION] ', '', 1))
-        if 'Validation failed. No changes applied.' in output_text:
-            context['validation_errors'] = validation_errors or ['Validation failed. See logs above.']
-            context['output'] = output_text
-            return render(request, 'update_till/import_form.html', context)
-        context['output'] = output_text
-        return render(request, 'update_till/import_form.html', context)
+            # Not submitted (rejected input or an error while staging): free the slot again
+            imports.cancel(job)
+
+    # GET: render form (and the requested job's progress)
+    job_id = request.GET.get('job')
+    if job_id and job_id.isdigit():
+        context['job'] = ImportJob.objects.filter(pk=int(job_id)).first()
+    return render(request, 'update_till/import_form.html', context)
 
-    # GET: render form
-    return render(request, 'update_till/import_form.html', context)
\ No newline at end of file
+
+@staff_member_required
+@require_http_methods(["GET"])
+def update_till_import_job(request: HttpRequest, job_id: int) -> JsonResponse:
+    """Progress of an import job as JSON (status, per-table steps, report, output)."""
+    job = get_object_or_404(ImportJob, pk=job_id)
+    return JsonResponse(imports.describe(job))
\ No newline at end of file